@@ -0,0 +1,30 @@
+# Fixed on-disk locations for state the tools keep between runs (caches,
+# registries, journals). Defaults to $XDG_DATA_HOME/cloud-management-system
+# (~/.local/share/...), overridable with CMS_DATA_DIR.
+
+import os
+
+APP_NAME = "cloud-management-system"
+
+
+def ensure_dir(path):
+    if path:
+        os.makedirs(path, exist_ok=True)
+
+
+def data_dir(create=True):
+    base = os.environ.get("CMS_DATA_DIR")
+    if not base:
+        xdg = os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share")
+        base = os.path.join(xdg, APP_NAME)
+    if create:
+        ensure_dir(base)
+    return base
+
+
+def data_path(*parts, create=True):
+    # Path inside the data directory; parent directories are created on demand.
+    path = os.path.join(data_dir(create=create), *parts)
+    if create:
+        ensure_dir(os.path.dirname(path))
+    return path
@@ -0,0 +1,238 @@
+# Benchmark suite: listing, search, bulk lifecycle and VM provisioning against
+# fake `docker`, `qemu-img` and `qemu-system-x86_64` executables (benchmarks/fakes/)
+# and a fake Engine API socket (fake_engine.py), at 10, 1k and 10k objects.
+# The real code paths run end to end: processes are spawned and their output
+# parsed, sockets are spoken to, and disks and pidfiles are written to a
+# temporary data directory. Only the tools at the far end are fake.
+#
+# Scenarios, timed per backend (cli, engine) and inventory size:
+#   list.inventory   full inventory load (images + containers)
+#   list.snapshot    one container listing as docker_bulk takes it
+#   search.build     image search index over the loaded images
+#   search.query     median of 50 mixed queries against that index
+#   bulk.stop/start  lifecycle on the bench=bulk containers (at most --bulk of them)
+#   vm.report        VM listing with disk usage for `size` registered VMs (cold cache)
+#   vm.provision     a fleet of --fleet VMs on top of `size` registered ones
+# Bulk and fleet batches are capped: every fake call is a real process, and
+# 10k sequential process spawns would measure the machine, not the code.
+#
+#   python benchmarks/bench_suite.py [--sizes 10,1000,10000] [--latency-ms 2] [--repeat 3]
+#   python benchmarks/bench_suite.py --save-baseline        # write benchmarks/baseline.json
+#   python benchmarks/bench_suite.py --compare [--tolerance 0.25]   # exit 1 on regression
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+import docker_bulk  # noqa: E402
+import docker_engine  # noqa: E402
+import docker_inventory  # noqa: E402
+import fake_engine  # noqa: E402
+import fake_tools  # noqa: E402
+import image_search  # noqa: E402
+import vm_disks  # noqa: E402
+import vm_fleet  # noqa: E402
+import vm_registry  # noqa: E402
+import vm_runtime  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(HERE, "baseline.json")
+BACKENDS = ("cli", "engine")
+# a regression must also be this much slower in absolute terms, so sub-millisecond noise never fails a run
+MIN_REGRESSION_MS = 2.0
+
+
+def _time(fn):
+    start = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - start) * 1000, result
+
+
+class Bench:
+    # One backend at one inventory size, in its own data directory and fake state.
+
+    def __init__(self, backend, size, latency_ms, bulk, fleet):
+        self.backend, self.size, self.bulk, self.fleet = backend, size, bulk, fleet
+        self.tmpdir = tempfile.mkdtemp(prefix="cms-bench-", dir="/tmp")
+        self.state_dir = os.path.join(self.tmpdir, "fake")
+        self.inventory = fake_tools.make_inventory(size, bulk=min(bulk, size))
+        fake_tools.write_inventory(self.state_dir, self.inventory)
+        self._environ = dict(os.environ)
+        os.environ.update(fake_tools.fake_env(self.state_dir, latency_ms))
+        os.environ["CMS_DATA_DIR"] = os.path.join(self.tmpdir, "data")
+        os.environ.pop("CMS_QEMU", None)
+        self.engine = None
+        if backend == "engine":
+            os.environ[docker_engine.BACKEND_ENV] = "auto"
+            sock = os.path.join(self.tmpdir, "docker.sock")
+            self.engine = fake_engine.FakeEngine(sock, fake_tools.make_inventory(size, bulk=min(bulk, size)),
+                                                 latency_ms).start()
+            docker_engine.set_client(docker_engine.EngineClient(sock))
+        else:
+            os.environ[docker_engine.BACKEND_ENV] = "cli"
+        self.disk_dir = os.path.join(self.tmpdir, "disks")
+        os.makedirs(self.disk_dir)
+
+    def close(self):
+        client = docker_engine.get_client()
+        docker_engine.set_client(None)
+        if client is not None:
+            client.close()
+        if self.engine is not None:
+            self.engine.close()
+        os.environ.clear()
+        os.environ.update(self._environ)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def docker_scenarios(self):
+        timings = {}
+        inventory = docker_inventory.Inventory(docker_inventory.default_source())
+        timings["list.inventory"], _ = _time(inventory.load)
+        timings["list.snapshot"], snapshot = _time(docker_bulk.container_snapshot)
+        assert len(snapshot) == self.size, f"listed {len(snapshot)} of {self.size} containers"
+
+        timings["search.build"], index = _time(lambda: image_search.ImageIndex(inventory.images()))
+        rng = random.Random(3)
+        queries = [rng.choice([w, f"{w}-{rng.randrange(500)}", f"repo:{w} tag:1", f"label:team={w}", w[:-1] + "x"])
+                   for w in (rng.choice(fake_tools.WORDS) for _ in range(50))]
+        timings["search.query"] = statistics.median(_time(lambda: index.search(q, limit=50))[0] for q in queries)
+
+        for action in ("stop", "start"):
+            timings[f"bulk.{action}"], report = _time(
+                lambda: docker_bulk.run_bulk(action, label="bench=bulk", concurrency=8))
+            assert not report.failed, f"bulk {action}: {report.failed[0].error}"
+        return timings
+
+    def _register_vms(self, registry):
+        # `size` stopped VMs with small qcow2 disks, inserted in one transaction
+        now = time.time()
+        records = []
+        for n in range(self.size):
+            disk = os.path.join(self.disk_dir, f"idle-{n}.qcow2")
+            fake_tools.write_qcow2(disk, 10 * 1024 ** 3)
+            records.append(vm_registry.VmRecord(f"idle-{n}", disk, 1024, 1, "10G", None, "bench", "stopped", now, now))
+        conn = registry._connect(create=True)
+        with conn:
+            conn.executemany(f"INSERT INTO vms ({vm_registry._COLUMNS}) VALUES "
+                             f"({', '.join('?' * len(vm_registry.VmRecord.__slots__))})",
+                             [tuple(getattr(r, slot) for slot in r.__slots__) for r in records])
+        conn.close()
+
+    def vm_scenarios(self, run):
+        timings = {}
+        registry = vm_registry.VmRegistry()
+        if run == 0:
+            self._register_vms(registry)
+        cache = vm_disks.DiskUsageCache(os.path.join(self.tmpdir, f"disk_usage-{run}.sqlite3"))
+        timings["vm.report"], rows = _time(lambda: vm_disks.report(registry, cache))
+        assert len(rows) == self.size
+
+        specs = [vm_fleet.VmSpec(f"bench-{run}-{n}", "512", "1", "8G", source="bench") for n in range(self.fleet)]
+        timings["vm.provision"], report = _time(
+            lambda: vm_fleet.provision(specs, concurrency=4, registry=registry, kvm=False, disk_dir=self.disk_dir))
+        failed = report.failed
+        for vm in report.vms:
+            vm_runtime.stop(vm.spec.name)
+            registry.remove(vm.spec.name)
+            if os.path.exists(vm.disk_file):
+                os.remove(vm.disk_file)
+        assert not failed, f"provision: {failed[0].error}"
+        return timings
+
+
+def run_suite(sizes, backends=BACKENDS, latency_ms=2.0, repeat=3, bulk=100, fleet=10, log=print):
+    # {"<backend>/<size>/<scenario>": {"median_ms", "min_ms"}}, median and min over `repeat` runs
+    results = {}
+    for size in sizes:
+        for backend in backends:
+            bench = Bench(backend, size, latency_ms, bulk, fleet)
+            samples = {}
+            try:
+                for run in range(repeat):
+                    timings = bench.docker_scenarios()
+                    if backend == BACKENDS[0]:
+                        # the VM scenarios do not depend on the Docker backend
+                        timings.update(bench.vm_scenarios(run))
+                    for name, ms in timings.items():
+                        samples.setdefault(name, []).append(ms)
+            finally:
+                bench.close()
+            for name, values in samples.items():
+                key = f"{backend}/{size}/{name}"
+                results[key] = {"median_ms": round(statistics.median(values), 3), "min_ms": round(min(values), 3)}
+                log(f"{key:<36}{results[key]['median_ms']:>12.2f}{results[key]['min_ms']:>12.2f}")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # [(key, baseline_ms, current_ms, regressed)] for every scenario present in both
+    rows = []
+    for key, current in results.items():
+        if key not in baseline:
+            continue
+        base, now = baseline[key]["median_ms"], current["median_ms"]
+        regressed = now > base * (1 + tolerance) and now - base > MIN_REGRESSION_MS
+        rows.append((key, base, now, regressed))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10,1000,10000", help="comma-separated inventory sizes")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="added to every fake docker/qemu call")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--bulk", type=int, default=100, help="containers per bulk action")
+    parser.add_argument("--fleet", type=int, default=10, help="VMs provisioned per run")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to --baseline")
+    parser.add_argument("--compare", action="store_true", help="compare against --baseline; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, as a fraction")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    backends = [b for b in args.backends.split(",") if b]
+    print(f"{'scenario':<36}{'median ms':>12}{'min ms':>12}")
+    results = run_suite(sizes, backends, args.latency_ms, args.repeat, args.bulk, args.fleet)
+    document = {"meta": {"python": platform.python_version(), "machine": platform.machine(),
+                         "cpus": os.cpu_count(), "latency_ms": args.latency_ms, "repeat": args.repeat,
+                         "bulk": args.bulk, "fleet": args.fleet,
+                         "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())},
+                "results": results}
+    for path in filter(None, (args.output, args.baseline if args.save_baseline else None)):
+        with open(path, "w") as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Results written to {path}")
+
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("latency_ms") != args.latency_ms:
+            print(f"Note: baseline was taken with --latency-ms {baseline['meta'].get('latency_ms')}")
+        rows = compare(results, baseline["results"], args.tolerance)
+        print(f"\n{'scenario':<36}{'baseline ms':>12}{'now ms':>12}{'change':>9}")
+        for key, base, now, regressed in rows:
+            change = (now - base) / base * 100 if base else 0.0
+            print(f"{key:<36}{base:>12.2f}{now:>12.2f}{change:>+8.0f}%" + ("  REGRESSION" if regressed else ""))
+        regressions = [row for row in rows if row[3]]
+        if regressions:
+            print(f"{len(regressions)} scenario(s) slower than baseline by more than {args.tolerance:.0%}.")
+            return 1
+        print("No regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
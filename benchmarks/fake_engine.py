@@ -0,0 +1,148 @@
+# Fake Docker Engine API on a Unix socket, serving a fake_tools inventory.
+# Covers the endpoints the listing, search and lifecycle code paths use. Each
+# request waits `latency_ms` before answering, like a daemon round trip.
+
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_tools  # noqa: E402
+
+
+class FakeEngineHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        return "fake-engine"
+
+    def _reply(self, status, body=b"", content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _route(self, method):
+        server = self.server
+        server.requests += 1
+        time.sleep(server.latency_ms / 1000)
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        with server.lock:
+            status, body = server.handle(method, parts, query)
+        if status == "stream":
+            self._idle_stream()
+        elif isinstance(body, bytes):
+            self._reply(status, body, "text/plain")
+        else:
+            self._reply(status, body)
+
+    def _idle_stream(self):
+        # /events: a daemon with nothing happening; hold the stream open until the client goes away
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.flush()
+        while not self.server.closing.wait(0.5):
+            pass
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+    def do_HEAD(self):
+        self._route("HEAD")
+
+
+class FakeEngine(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, inventory, latency_ms=0):
+        super().__init__(path, FakeEngineHandler)
+        self.images = inventory["images"]
+        self.containers = {c["Id"]: c for c in inventory["containers"]}
+        self.latency_ms = latency_ms
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.closing = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def close(self):
+        self.closing.set()
+        self.shutdown()
+        self.server_close()
+
+    def _find(self, ref):
+        for c in self.containers.values():
+            if c["Id"].startswith(ref) or c["Names"][0] == "/" + ref:
+                return c
+        return None
+
+    def handle(self, method, parts, query):
+        # Returns (status, body); status "stream" holds an idle event stream open.
+        if parts[0] == "_ping":
+            return 200, b"OK"
+        if parts[0] == "version":
+            return 200, {"Version": "24.0.0-fake", "ApiVersion": "1.43"}
+        if parts[0] == "events":
+            return "stream", None
+        if parts == ["images", "json"]:
+            return 200, self.images
+        if parts == ["images", "search"]:
+            term, limit = query.get("term", ""), int(query.get("limit", 25))
+            return 200, [{"name": f"{term}{s}", "description": f"{term} image", "star_count": 1000 - i,
+                          "is_official": i == 0, "is_automated": False}
+                         for i, s in enumerate(["", "-alpine", "-slim", "-exporter", "-operator"])][:limit]
+        if parts == ["containers", "json"]:
+            selected = [c for c in self.containers.values() if query.get("all") == "1" or c["State"] == "running"]
+            for key, values in json.loads(query.get("filters", "{}")).items():
+                selected = [c for c in selected if any(fake_tools.match_filter(c, f"{key}={v}") for v in values)]
+            return 200, selected
+        if parts[0] != "containers" or len(parts) < 2:
+            return 404, {"message": "page not found"}
+        c = self._find(parts[1])
+        if c is None:
+            return 404, {"message": f"No such container: {parts[1]}"}
+        if method == "DELETE":
+            if c["State"] == "running" and query.get("force") != "1":
+                return 409, {"message": f"cannot remove running container {parts[1]}: stop it first"}
+            del self.containers[c["Id"]]
+            return 204, b""
+        action = parts[2] if len(parts) > 2 else ""
+        if action == "json":
+            return 200, dict(c, Name=c["Names"][0], State={"Status": c["State"]})
+        if action in ("start", "stop", "restart"):
+            new_state = "exited" if action == "stop" else "running"
+            if action != "restart" and c["State"] == new_state:
+                return 304, b""
+            c["State"] = new_state
+            c["Status"] = "Up Less than a second" if new_state == "running" else "Exited (0) Less than a second ago"
+            return 204, b""
+        return 404, {"message": "page not found"}
@@ -0,0 +1,342 @@
+# Fake `docker`, `qemu-img` and `qemu-system-x86_64` for benchmarks.
+# The executables in benchmarks/fakes/ are shims that call main() here. Put that
+# directory first on PATH and the real code paths run end to end (process spawn,
+# output parsing, files on disk) without Docker or QEMU installed.
+#
+# State lives in $CMS_FAKE_STATE: inventory.json (engine-API-shaped images and
+# containers, written by write_inventory) plus an append-only journal of container
+# state changes, so concurrent `docker start/stop` calls need no lock.
+# $CMS_FAKE_LATENCY_MS adds a fixed delay to every invocation (daemon round trip,
+# disk I/O).
+
+import json
+import os
+import random
+import re
+import struct
+import subprocess
+import sys
+import time
+
+STATE_ENV = "CMS_FAKE_STATE"
+LATENCY_ENV = "CMS_FAKE_LATENCY_MS"
+FAKES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fakes")
+
+WORDS = ["nginx", "postgres", "redis", "python", "node", "golang", "alpine", "ubuntu", "api", "worker",
+         "frontend", "backend", "billing", "search", "auth", "gateway", "cache", "queue", "metrics", "proxy"]
+QCOW2_MAGIC = b"QFI\xfb"
+
+
+def make_inventory(count, bulk=100, seed=1):
+    # `count` images and `count` containers; the first `bulk` containers carry the label bench=bulk.
+    rng = random.Random(seed)
+    images, containers = [], []
+    for n in range(count):
+        repo = f"registry.local/{rng.choice(WORDS)}/{rng.choice(WORDS)}-{n % 500}"
+        images.append({"Id": f"sha256:{n:064x}", "RepoTags": [f"{repo}:{rng.randint(1, 9)}.{rng.randint(0, 30)}"],
+                       "Created": 1700000000 + n, "Size": rng.randint(5, 900) * 1000 * 1000,
+                       "Labels": {"team": rng.choice(WORDS)}})
+        running = rng.random() < 0.5
+        labels = {"team": rng.choice(WORDS)}
+        if n < bulk:
+            labels["bench"] = "bulk"
+        containers.append({"Id": f"{n + 1:064x}", "Names": [f"/{rng.choice(WORDS)}-{n}"], "Image": repo,
+                           "Command": "/entrypoint.sh serve", "Created": 1700000000 + n,
+                           "State": "running" if running else "exited",
+                           "Status": "Up 2 hours" if running else "Exited (0) 3 hours ago", "Labels": labels})
+    return {"images": images, "containers": containers}
+
+
+def write_inventory(state_dir, inventory):
+    os.makedirs(state_dir, exist_ok=True)
+    with open(os.path.join(state_dir, "inventory.json"), "w") as f:
+        json.dump(inventory, f)
+    open(os.path.join(state_dir, "journal"), "w").close()
+
+
+def fake_env(state_dir, latency_ms=0):
+    # Environment for running the real code against the fakes
+    env = dict(os.environ)
+    env["PATH"] = FAKES_DIR + os.pathsep + env.get("PATH", "")
+    env[STATE_ENV] = state_dir
+    env[LATENCY_ENV] = str(latency_ms)
+    return env
+
+
+def _latency():
+    time.sleep(float(os.environ.get(LATENCY_ENV, "0") or 0) / 1000)
+
+
+# --- docker ------------------------------------------------------------------
+
+def _load(state_dir):
+    with open(os.path.join(state_dir, "inventory.json")) as f:
+        inventory = json.load(f)
+    by_id = {c["Id"]: c for c in inventory["containers"]}
+    try:
+        with open(os.path.join(state_dir, "journal")) as f:
+            for line in f:
+                change = json.loads(line)
+                if change.get("removed"):
+                    by_id.pop(change["id"], None)
+                elif change["id"] in by_id:
+                    by_id[change["id"]]["State"] = change["state"]
+                    by_id[change["id"]]["Status"] = "Up Less than a second" if change["state"] == "running" \
+                        else "Exited (0) Less than a second ago"
+    except FileNotFoundError:
+        pass
+    inventory["containers"] = list(by_id.values())
+    return inventory
+
+
+def _journal(state_dir, change):
+    # one short O_APPEND write per change, so concurrent writers do not interleave
+    fd = os.open(os.path.join(state_dir, "journal"), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, (json.dumps(change) + "\n").encode())
+    finally:
+        os.close(fd)
+
+
+def _created_at(ts):
+    return time.strftime("%Y-%m-%d %H:%M:%S +0000 UTC", time.gmtime(ts))
+
+
+def image_rows(image, no_trunc):
+    rows = []
+    for ref in image["RepoTags"] or ["<none>:<none>"]:
+        repo, _, tag = ref.rpartition(":")
+        rows.append({"Containers": "N/A", "CreatedAt": _created_at(image["Created"]), "CreatedSince": "2 days ago",
+                     "Digest": "<none>", "ID": image["Id"] if no_trunc else image["Id"][7:19],
+                     "Repository": repo, "SharedSize": "N/A", "Size": f"{image['Size'] // 1000000}MB",
+                     "Tag": tag, "UniqueSize": "N/A", "VirtualSize": f"{image['Size'] // 1000000}MB"})
+    return rows
+
+
+def container_row(c, no_trunc):
+    return {"Command": f"\"{c['Command']}\"", "CreatedAt": _created_at(c["Created"]),
+            "ID": c["Id"] if no_trunc else c["Id"][:12], "Image": c["Image"],
+            "Labels": ",".join(f"{k}={v}" for k, v in c["Labels"].items()), "LocalVolumes": "0", "Mounts": "",
+            "Names": c["Names"][0].lstrip("/"), "Networks": "bridge", "Ports": "", "RunningFor": "2 hours ago",
+            "Size": "0B", "State": c["State"], "Status": c["Status"]}
+
+
+def render(template, row):
+    # The subset of Go templates the code uses: {{json .}} and {{.Field}}
+    if template.strip() == "{{json .}}":
+        return json.dumps(row)
+    return re.sub(r"\{\{\s*\.(\w+)\s*\}\}", lambda m: str(row.get(m.group(1), "")), template)
+
+
+def _table(rows, columns):
+    widths = [max([len(h)] + [len(str(r[k])) for r in rows]) for h, k in columns]
+    lines = ["   ".join(h.ljust(w) for (h, _), w in zip(columns, widths))]
+    lines += ["   ".join(str(r[k]).ljust(w) for (_, k), w in zip(columns, widths)) for r in rows]
+    return "\n".join(lines)
+
+
+def match_filter(c, selector):
+    key, _, value = selector.partition("=")
+    if key == "id":
+        return c["Id"].startswith(value)
+    if key == "name":
+        return value in c["Names"][0]
+    if key == "status":
+        return c["State"] == value
+    if key == "label":
+        k, sep, v = value.partition("=")
+        return k in c["Labels"] and (not sep or c["Labels"][k] == v)
+    return True
+
+
+def _find(inventory, ref):
+    for c in inventory["containers"]:
+        if c["Id"].startswith(ref) or c["Names"][0].lstrip("/") == ref:
+            return c
+    return None
+
+
+def _options(args, flags_with_value=("--format", "--filter", "-f", "--limit", "--since")):
+    opts, positional, i = {"filter": []}, [], 0
+    while i < len(args):
+        a = args[i]
+        if a in flags_with_value:
+            key = a.lstrip("-")
+            if key in ("filter", "f"):
+                opts["filter"].append(args[i + 1])
+            else:
+                opts[key] = args[i + 1]
+            i += 2
+            continue
+        if a.startswith("-"):
+            opts[a.lstrip("-")] = True
+        else:
+            positional.append(a)
+        i += 1
+    return opts, positional
+
+
+def docker(args):
+    _latency()
+    state_dir = os.environ.get(STATE_ENV)
+    if not args:
+        return 0
+    command, rest = args[0], args[1:]
+    if command == "image" and rest:
+        command, rest = "image " + rest[0], rest[1:]
+    opts, positional = _options(rest)
+    if command == "version":
+        print("24.0.0-fake")
+        return 0
+    inventory = _load(state_dir)
+    if command == "images":
+        rows = [r for image in inventory["images"] for r in image_rows(image, opts.get("no-trunc"))]
+        if "format" in opts:
+            print("\n".join(render(opts["format"], r) for r in rows))
+        else:
+            print(_table(rows, [("REPOSITORY", "Repository"), ("TAG", "Tag"), ("IMAGE ID", "ID"),
+                                ("CREATED", "CreatedSince"), ("SIZE", "Size")]))
+        return 0
+    if command == "ps":
+        selected = [c for c in inventory["containers"] if opts.get("a") or opts.get("all") or c["State"] == "running"]
+        for selector in opts["filter"]:
+            selected = [c for c in selected if match_filter(c, selector)]
+        rows = [container_row(c, opts.get("no-trunc")) for c in selected]
+        if "format" in opts:
+            print("\n".join(render(opts["format"], r) for r in rows))
+        else:
+            print(_table(rows, [("CONTAINER ID", "ID"), ("IMAGE", "Image"), ("COMMAND", "Command"),
+                                ("CREATED", "RunningFor"), ("STATUS", "Status"), ("NAMES", "Names")]))
+        return 0
+    if command in ("start", "stop", "restart", "rm"):
+        status = 0
+        for ref in positional:
+            c = _find(inventory, ref)
+            if c is None:
+                print(f"Error response from daemon: No such container: {ref}", file=sys.stderr)
+                status = 1
+                continue
+            if command == "rm":
+                if c["State"] == "running" and not opts.get("f") and not opts.get("force"):
+                    print(f"Error response from daemon: cannot remove running container {ref}", file=sys.stderr)
+                    status = 1
+                    continue
+                _journal(state_dir, {"id": c["Id"], "removed": True})
+            else:
+                _journal(state_dir, {"id": c["Id"], "state": "exited" if command == "stop" else "running"})
+            print(ref)
+        return status
+    if command == "search":
+        term = positional[0] if positional else ""
+        limit = int(opts.get("limit", 25))
+        rows = [{"Name": f"{term}{suffix}", "Description": f"{term} image", "StarCount": str(1000 - i),
+                 "IsOfficial": "[OK]" if i == 0 else "", "IsAutomated": ""}
+                for i, suffix in enumerate(["", "-alpine", "-slim", "-exporter", "-operator"] * 10)][:limit]
+        print("\n".join(render(opts.get("format", "{{json .}}"), r) for r in rows))
+        return 0
+    if command == "pull":
+        print(f"Using default tag: latest\nlatest: Pulling from {positional[0]}\nStatus: Image is up to date")
+        return 0
+    if command == "image inspect":
+        for image in inventory["images"]:
+            if positional and (image["Id"] == positional[0] or positional[0] in image["RepoTags"]):
+                print(json.dumps([{"Id": image["Id"], "RepoTags": image["RepoTags"], "RepoDigests": [],
+                                   "Created": _created_at(image["Created"]), "Size": image["Size"]}]))
+                return 0
+        print("Error: No such image", file=sys.stderr)
+        return 1
+    if command == "events":
+        # a quiet daemon: block until killed
+        while True:
+            time.sleep(3600)
+    print(f"fake docker: unsupported command {command!r}", file=sys.stderr)
+    return 1
+
+
+# --- qemu ----------------------------------------------------------------------
+
+def write_qcow2(path, size, backing=None):
+    header = bytearray(104)
+    header[0:4] = QCOW2_MAGIC
+    header[4:8] = struct.pack(">I", 3)
+    if backing:
+        header[8:20] = struct.pack(">QI", len(header), len(backing.encode()))
+    header[24:32] = struct.pack(">Q", size)
+    with open(path, "wb") as f:
+        f.write(bytes(header) + (backing.encode() if backing else b""))
+
+
+def _read_qcow2(path):
+    with open(path, "rb") as f:
+        head = f.read(32)
+        if head[:4] != QCOW2_MAGIC:
+            return "raw", os.fstat(f.fileno()).st_size, None
+        offset, length = struct.unpack(">QI", head[8:20])
+        size = struct.unpack(">Q", head[24:32])[0]
+        backing = None
+        if offset and length:
+            f.seek(offset)
+            backing = f.read(length).decode()
+    return "qcow2", size, backing
+
+
+def parse_size(text):
+    m = re.fullmatch(r"(\d+)([KMGT]?)", text.upper())
+    return int(m.group(1)) * 1024 ** " KMGT".index(m.group(2) or " ")
+
+
+def qemu_img(args):
+    _latency()
+    command, rest = args[0], args[1:]
+    opts, positional, i = {}, [], 0
+    while i < len(rest):
+        if rest[i] in ("-f", "-b", "-F", "-O", "-B", "-o", "-a", "-d", "-l") and i + 1 < len(rest):
+            opts[rest[i]] = rest[i + 1]
+            i += 2
+            continue
+        if not rest[i].startswith("-"):
+            positional.append(rest[i])
+        i += 1
+    if command == "create":
+        backing = opts.get("-b")
+        size = parse_size(positional[1]) if len(positional) > 1 else (_read_qcow2(backing)[1] if backing else 0)
+        write_qcow2(positional[0], size, backing)
+        return 0
+    if command == "info":
+        fmt, size, backing = _read_qcow2(positional[-1])
+        info = {"filename": positional[-1], "format": fmt, "virtual-size": size,
+                "actual-size": os.path.getsize(positional[-1]), "snapshots": []}
+        if backing:
+            info["backing-filename"] = backing
+        print(json.dumps(info))
+        return 0
+    if command == "convert":
+        _, size, _ = _read_qcow2(positional[0])
+        write_qcow2(positional[1], size, opts.get("-B"))
+        return 0
+    if command in ("snapshot", "check", "resize"):
+        return 0
+    print(f"qemu-img: unsupported command {command!r}", file=sys.stderr)
+    return 1
+
+
+def qemu_system(args):
+    # Daemonize like qemu: leave a long-running process named after the VM and write its pidfile.
+    _latency()
+    name = args[args.index("-name") + 1] if "-name" in args else "vm"
+    pidfile = args[args.index("-pidfile") + 1] if "-pidfile" in args else None
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(86400)", "-name", name],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+    if pidfile:
+        with open(pidfile, "w") as f:
+            f.write(str(proc.pid))
+    return 0
+
+
+def main(tool, args):
+    if tool == "docker":
+        return docker(args)
+    if tool == "qemu-img":
+        return qemu_img(args)
+    return qemu_system(args)
@@ -0,0 +1,204 @@
+# Content-addressed build skip.
+# A build is identified by a key hashed from the Dockerfile, every file the
+# context upload would contain (same .dockerignore rules) and the build args.
+# The key of the last successful build of each tag is stored with the image ID
+# it produced; when the key matches again and that image still exists, the
+# build (and its context upload) is skipped.
+#
+# File hashes are cached by (path, size, mtime), so a repeat check only reads
+# files that changed. The cache lives in a SQLite file in the data directory.
+
+import hashlib
+import json
+import os
+import sqlite3
+import stat
+import subprocess
+import time
+
+import app_paths
+import docker_engine
+import docker_health
+from docker_engine import EngineError, EngineUnavailable
+
+CHUNK = 1024 * 1024
+# Files modified this recently may change again within the same mtime tick; their
+# cached hash is stored without an mtime so the next check reads them again.
+RACY_SECONDS = 2.0
+
+
+def enabled():
+    return os.environ.get("CMS_BUILD_CACHE", "1").lower() not in ("0", "false", "no")
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class BuildKey:
+    # The computed key plus what it took to compute it.
+    __slots__ = ("key", "files", "hashed", "reused", "bytes_hashed", "elapsed", "_state", "_context")
+
+    def __init__(self, key, files, hashed, reused, bytes_hashed, elapsed, state, context):
+        self.key = key
+        self.files = files
+        self.hashed = hashed          # files whose content was read
+        self.reused = reused          # files whose cached hash was still valid
+        self.bytes_hashed = bytes_hashed
+        self.elapsed = elapsed
+        self._state = state           # relpath -> (size, mtime_ns, digest) to persist
+        self._context = context
+
+
+class BuildCache:
+    # SQLite-backed store of file hashes and the build key of the last build per tag.
+
+    def __init__(self, path=None, clock=time.time):
+        self.path = path or app_paths.data_path("build_cache.sqlite3", create=False)
+        self.clock = clock
+
+    def _connect(self, create):
+        if not create and not os.path.isfile(self.path):
+            return None
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " context TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL, PRIMARY KEY (context, path))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS builds ("
+            " tag TEXT PRIMARY KEY, key TEXT NOT NULL, image_id TEXT NOT NULL, built_at REAL NOT NULL)"
+        )
+        return conn
+
+    def _known_files(self, context):
+        conn = self._connect(create=False)
+        if conn is None:
+            return {}
+        rows = conn.execute("SELECT path, size, mtime_ns, digest FROM files WHERE context = ?", (context,))
+        known = {path: (size, mtime_ns, digest) for path, size, mtime_ns, digest in rows}
+        conn.close()
+        return known
+
+    def compute_key(self, context=".", dockerfile=None, buildargs=None, excludes=None):
+        # Hash everything that determines the build result; unchanged files are not read.
+        started = time.perf_counter()
+        context_abs = os.path.abspath(context)
+        dockerfile = dockerfile or os.path.join(context, "Dockerfile")
+        if excludes is None:
+            excludes = docker_engine.load_dockerignore(context)
+        prune = getattr(excludes, "prune", excludes)
+        known = self._known_files(context_abs)
+        now = self.clock()
+        state = {}
+        hashed = reused = bytes_hashed = 0
+        entries = []
+        for root, dirs, files in os.walk(context):
+            rel_root = os.path.relpath(root, context).replace(os.sep, "/")
+            rel_root = "" if rel_root == "." else rel_root
+            dirs[:] = sorted(d for d in dirs if not prune(f"{rel_root}/{d}" if rel_root else d))
+            for fname in sorted(files):
+                rel = f"{rel_root}/{fname}" if rel_root else fname
+                if rel != ".dockerignore" and excludes(rel):
+                    continue
+                full = os.path.join(root, fname)
+                try:
+                    st = os.lstat(full)
+                except OSError:
+                    continue
+                if stat.S_ISLNK(st.st_mode):
+                    digest = "link:" + os.readlink(full)
+                else:
+                    cached = known.get(rel)
+                    if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                        digest = cached[2]
+                        reused += 1
+                    else:
+                        try:
+                            digest = _file_digest(full)
+                        except OSError:
+                            continue
+                        hashed += 1
+                        bytes_hashed += st.st_size
+                racy = now - st.st_mtime_ns / 1e9 < RACY_SECONDS
+                state[rel] = (st.st_size, 0 if racy else st.st_mtime_ns, digest)
+                # the executable bit is part of what gets built
+                entries.append(f"{rel}\0{st.st_mode & 0o111:o}\0{digest}\n")
+        h = hashlib.sha256()
+        h.update(b"dockerfile\0" + _file_digest(dockerfile).encode() + b"\n")
+        h.update(b"buildargs\0" + json.dumps(buildargs or {}, sort_keys=True).encode() + b"\n")
+        for entry in entries:
+            h.update(entry.encode())
+        return BuildKey(h.hexdigest(), len(entries), hashed, reused, bytes_hashed,
+                        time.perf_counter() - started, state, context_abs)
+
+    def lookup(self, tag, key):
+        # Image ID of the last build of `tag` if it was built from exactly this key, else None.
+        conn = self._connect(create=False)
+        if conn is None:
+            return None
+        row = conn.execute("SELECT key, image_id FROM builds WHERE tag = ?", (tag,)).fetchone()
+        conn.close()
+        if row is None or row[0] != key.key:
+            return None
+        return row[1]
+
+    def save_state(self, key):
+        # Persist file hashes so the next check only reads changed files.
+        conn = self._connect(create=True)
+        with conn:
+            conn.execute("DELETE FROM files WHERE context = ?", (key._context,))
+            conn.executemany(
+                "INSERT INTO files (context, path, size, mtime_ns, digest) VALUES (?, ?, ?, ?, ?)",
+                ((key._context, path, size, mtime_ns, digest) for path, (size, mtime_ns, digest) in key._state.items())
+            )
+        conn.close()
+
+    def record(self, tag, key, image_id):
+        # Remember a successful build of `tag`.
+        self.save_state(key)
+        conn = self._connect(create=True)
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO builds (tag, key, image_id, built_at) VALUES (?, ?, ?, ?)",
+                         (tag, key.key, image_id, self.clock()))
+        conn.close()
+
+    def forget(self, tag):
+        conn = self._connect(create=False)
+        if conn is None:
+            return
+        with conn:
+            conn.execute("DELETE FROM builds WHERE tag = ?", (tag,))
+        conn.close()
+
+
+def image_exists(image_id, tag=None):
+    # True if the image is still present locally (and, if given, still carries `tag`).
+    engine = docker_engine.get_client()
+    if engine is not None:
+        try:
+            return _has_tag(engine.inspect_image(image_id).get("RepoTags") or [], tag)
+        except EngineUnavailable:
+            docker_health.monitor().mark_down()  # socket unreachable: fall back to the CLI
+        except EngineError:
+            return False
+    try:
+        result = subprocess.run(["docker", "image", "inspect", "--format", "{{json .RepoTags}}", image_id],
+                                check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    except FileNotFoundError:
+        return False
+    if result.returncode != 0:
+        return False
+    return _has_tag(json.loads(result.stdout or "[]") or [], tag)
+
+
+def _has_tag(tags, tag):
+    if tag is None:
+        return True
+    return tag in tags or (":" not in tag.rsplit("/", 1)[-1] and f"{tag}:latest" in tags)
@@ -0,0 +1,1095 @@
+# Command-line interface: a subcommand for every menu operation, plus the menu itself.
+#
+#   python main.py                         interactive menu (same as `python main.py menu`)
+#   python main.py ps -a --json            one command; JSON on stdout, exit status 1 on failure
+#   python main.py batch --json < cmds     one command per line, all in one process
+#
+# Commands never prompt. Subsystems are imported inside the commands that use
+# them, so a one-shot command only loads what it needs (`import cli` itself
+# pulls in nothing but the standard library). With --json, progress output
+# (build logs, pull boards) goes to stderr and stdout carries only JSON.
+
+import argparse
+import importlib
+import json
+import os
+import shlex
+import sys
+
+
+class CliError(Exception):
+    # An expected failure: printed as an error (or {"error": ...}) with exit status 1.
+    pass
+
+
+# Exceptions that mean "the operation failed" rather than a bug; only modules already loaded are checked
+_FAILURES = {"docker_engine": "EngineError", "hub_cache": "HubSearchError", "vm_registry": "RegistryError",
+             "vm_runtime": "LaunchError", "vm_images": "CatalogError", "vm_snapshots": "SnapshotError",
+             "vm_disks": "DiskError", "vm_fleet": "FleetError", "vm_qmp": "QmpError", "warm_pool": "PoolError",
+             "jobs": "JobError", "sqlite3": "Error"}
+
+
+class _Parser(argparse.ArgumentParser):
+    # Usage errors raise instead of exiting, so one bad line in a batch does not end the batch
+
+    def error(self, message):
+        raise CliError(f"{self.prog}: {message}")
+
+
+def _failures():
+    return (CliError, OSError, ValueError) + tuple(
+        getattr(sys.modules[module], name) for module, name in _FAILURES.items() if module in sys.modules)
+
+
+def _progress(args):
+    # Where progress output goes: stderr when stdout is reserved for JSON
+    return sys.stderr if args.json else sys.stdout
+
+
+def _submit(args, kind, params):
+    # Hand a long-running command to the job queue: this process's own (the menu's), or
+    # a `jobs worker` process started on demand. The command returns the queued job.
+    import jobs
+    args.text = _submitted_text
+    queue = jobs.shared()
+    if queue is not None:
+        return queue.submit(kind, params)
+    job = jobs.enqueue(kind, params)
+    jobs.ensure_worker()
+    return job
+
+
+def _submitted_text(job):
+    return [f"Job {job.id} queued: {job.describe()}", f"Follow it with `jobs tail {job.id} --follow`."]
+
+
+def _table(headers, rows):
+    widths = [len(h) for h in headers]
+    for row in rows:
+        widths = [max(w, len(str(c))) for w, c in zip(widths, row)]
+    fmt = "   ".join("{:<%d}" % w for w in widths)
+    return [fmt.format(*headers).rstrip()] + [fmt.format(*[str(c) for c in row]).rstrip() for row in rows]
+
+
+def _size(n):
+    for unit in ("B", "kB", "MB", "GB", "TB"):
+        if abs(n) < 1000 or unit == "TB":
+            return f"{n:.3g}{unit}" if unit != "B" else f"{int(n)}B"
+        n /= 1000.0
+
+
+def _plain(value):
+    # JSON-ready form of a result: reports via as_dict(), __slots__ records as objects
+    if hasattr(value, "as_dict"):
+        return value.as_dict()
+    if hasattr(value, "__slots__") and not isinstance(value, type):
+        return {slot: _plain(getattr(value, slot)) for slot in value.__slots__}
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [_plain(v) for v in value]
+    if isinstance(value, Exception):
+        return {"error": str(value)}
+    return value
+
+
+# --- Docker --------------------------------------------------------------------
+
+def _source():
+    # Inventory source for one listing: the engine socket if active, else the CLI
+    import docker_inventory
+    return docker_inventory.default_source()
+
+
+def _list(method):
+    # Records from the source's `method` iterator; if the engine socket turns out to be
+    # unreachable before the first record, the same listing is read from the CLI instead
+    import docker_engine
+    import docker_health
+    import docker_inventory
+    started = False
+    try:
+        for record in getattr(_source(), method)():
+            started = True
+            yield record
+    except docker_engine.EngineUnavailable:
+        if started or docker_engine.get_client() is None:
+            raise
+        docker_health.monitor().mark_down()  # socket unreachable: fall back to the CLI
+        yield from getattr(docker_inventory.CliSource(), method)()
+
+
+def _select(args, records, kind, where=None):
+    import listing
+    return listing.select(records, kind, where=where, sort=args.sort, reverse=args.reverse,
+                          offset=args.offset, limit=args.limit, columns=getattr(args, "columns", None))
+
+
+def _page_text(page):
+    return page.lines()
+
+
+def cmd_images(args):
+    return _select(args, _list("iter_images"), "images")
+
+
+def cmd_ps(args):
+    return _select(args, _list("iter_containers"), "containers",
+                   where=None if args.all else (lambda c: c.state == "running"))
+
+
+def cmd_search(args):
+    import image_search
+    return image_search.ImageIndex(list(_list("iter_images"))).search(args.query, limit=args.limit)
+
+
+def _search_text(results):
+    if not results:
+        return ["No local images found."]
+    return _table(["REPOSITORY", "TAG", "IMAGE ID", "SIZE"],
+                  [[r.repo, r.tag, r.image.short_id, _size(r.image.size)] for r in results])
+
+
+def cmd_hub_search(args):
+    import hub_cache
+    found = hub_cache.cache().search(args.term, limit=args.limit)
+    return {"results": found.results, "source": found.source, "age_s": round(found.age, 1)}
+
+
+def _hub_text(found):
+    return _table(["NAME", "DESCRIPTION", "STARS", "OFFICIAL"],
+                  [[r["name"], r["description"][:45], r["stars"], "[OK]" if r["official"] else ""]
+                   for r in found["results"]])
+
+
+def cmd_pull(args):
+    import docker_pull
+    refs = list(args.refs)
+    if args.manifest:
+        refs += docker_pull.load_manifest(args.manifest)
+    if not refs:
+        raise CliError("no images to pull")
+    if args.background:
+        return _submit(args, "pull", {"refs": refs, "concurrency": args.concurrency,
+                                      "skip_existing": args.skip_existing})
+    view = None if args.json else docker_pull.TerminalView()
+    return docker_pull.pull_images(refs, concurrency=args.concurrency, skip_existing=args.skip_existing,
+                                   on_update=view)
+
+
+def cmd_dockerfile(args):
+    import docker_build
+    import dockerfile_analyzer
+    import dockerfile_templates
+    if os.path.exists(args.path) and not args.force:
+        raise CliError(f"{args.path} already exists (use --force to overwrite)")
+    project = None
+    if args.source:
+        with open(args.source) as f:
+            text = f.read()
+    else:
+        project = dockerfile_templates.detect_project(os.path.dirname(args.path) or ".")
+        text = dockerfile_templates.render(project, args.base_image, args.start_cmd)
+    findings = dockerfile_analyzer.analyze(text)
+    applied = []
+    if args.fix:
+        text, applied = dockerfile_analyzer.fix(text, [f for f in findings if f.fixable])
+    directory = os.path.dirname(args.path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.path, "w") as f:
+        f.write(text)
+    ignored = []
+    if project is not None:
+        ignored = docker_build.write_dockerignore(directory or ".", dockerfile_templates.DOCKERIGNORE[project.kind])
+    return {"path": args.path, "project": project.kind if project else None,
+            "findings": [str(f) for f in findings], "fixed": len(applied), "dockerignore_added": ignored}
+
+
+def _dockerfile_text(result):
+    project = f" ({result['project']} project)" if result["project"] else ""
+    lines = [f"Dockerfile created at {result['path']}{project}"]
+    lines += [f"  {finding}" for finding in result["findings"]]
+    if result["fixed"]:
+        lines.append(f"Applied {result['fixed']} fix(es).")
+    if result["dockerignore_added"]:
+        lines.append(f"Added {len(result['dockerignore_added'])} pattern(s) to .dockerignore")
+    return lines
+
+
+def cmd_build(args):
+    # Like the menu's build, minus the prompts: unchanged Dockerfile and context skip the build.
+    import docker_build
+    if not os.path.exists(args.file):
+        raise CliError(f"{args.file} not found")
+    if args.background:
+        return _submit(args, "build", {"context": os.path.abspath(args.context), "tag": args.tag,
+                                       "dockerfile": os.path.abspath(args.file),
+                                       "cache_check": not args.no_cache_check})
+    out = _progress(args)
+    result = docker_build.build(args.context, args.tag, dockerfile=args.file,
+                                on_line=lambda line: print(line, file=out), cache_check=not args.no_cache_check)
+    if not result["ok"]:
+        raise CliError(f"build failed: {result['error']}")
+    return result
+
+
+def _build_text(result):
+    if result["cached"]:
+        return [f"{result['tag']} is already up to date: {result['image_id']}"]
+    return [f"Built {result['tag']} ({result['image_id'] or 'no image ID reported'}) in {result['elapsed_s']:.1f}s"]
+
+
+def cmd_run(args):
+    import subprocess
+
+    import docker_engine
+    import docker_health
+    import docker_manager
+    engine = docker_engine.get_client()
+    if engine is not None:
+        try:
+            return {"id": docker_manager._engine_run(engine, args.image, args.name)}
+        except docker_engine.EngineUnavailable:
+            docker_health.monitor().mark_down()  # socket unreachable: fall back to the CLI
+    cmd = ["docker", "run", "-d"] + (["--name", args.name] if args.name else []) + [args.image]
+    result = subprocess.run(cmd, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise CliError(result.stderr.strip() or f"docker run exited with {result.returncode}")
+    return {"id": result.stdout.strip()}
+
+
+def cmd_lifecycle(args):
+    import docker_bulk
+    import docker_engine
+    if not (args.targets or args.label or args.name_pattern):
+        raise CliError("give container IDs/names, --label or --name-pattern")
+    try:
+        report = docker_bulk.run_bulk(args.action, args.targets, label=args.label, name_pattern=args.name_pattern,
+                                      concurrency=args.concurrency)
+    except docker_engine.EngineUnavailable as e:
+        raise CliError(f"could not list containers: {e.message}")
+    if not report.results:
+        raise CliError("no containers matched")
+    return report
+
+
+def cmd_status(args):
+    import docker_health
+    monitor = docker_health.monitor()
+    monitor.refresh()
+    return monitor.status()
+
+
+def _status_text(status):
+    lines = [f"Docker daemon: {'running' if status['available'] else 'not reachable'}",
+             f"  probe latency: {status['latency_ms']} ms"]
+    if status["failures"]:
+        lines.append(f"  consecutive failures: {status['failures']}")
+    return lines
+
+
+def cmd_metrics(args):
+    import time
+
+    import docker_metrics
+    started_here = docker_metrics.shared() is None
+    collector = docker_metrics.start_shared()
+    try:
+        time.sleep(args.duration)
+        result = {"containers": collector.containers(), "samples": collector.samples}
+        if args.container:
+            stats = {m: collector.summary(args.container, m, args.window) for m in docker_metrics.METRICS}
+            if stats[docker_metrics.METRICS[0]] is None:
+                raise CliError(f"no metrics for container '{args.container}'")
+            result["window"] = {"container": args.container, "seconds": args.window, "metrics": stats}
+    finally:
+        if started_here:
+            docker_metrics.stop_shared()
+    return result
+
+
+def _metrics_text(result):
+    import docker_metrics
+    lines = docker_metrics.format_top(result["containers"])
+    for metric, stats in result.get("window", {}).get("metrics", {}).items():
+        if stats["count"]:
+            lines.append(f"{metric:<10} min {stats['min']:>12.2f}  avg {stats['avg']:>12.2f}  "
+                         f"max {stats['max']:>12.2f}  p95 {stats['p95']:>12.2f}  ({stats['count']} samples)")
+    return lines
+
+
+# --- Virtual machines ----------------------------------------------------------
+
+def _vm_rows(registry, records):
+    import vm_disks
+    import vm_images
+    import vm_qmp
+    import vm_runtime
+    registry.refresh_states(records)
+    bases = vm_images.BaseCatalog().by_path()
+    running = vm_runtime.states()
+    live = vm_qmp.statuses([r.name for r in records if r.state == "running"])
+    usage = vm_disks.DiskUsageCache().usage(r.disk for r in records)
+    rows = []
+    for record in records:
+        state = running.get(record.name) or vm_runtime.VmState(record.name)
+        uptime = state.uptime()
+        disk = usage.get(os.path.abspath(record.disk))
+        chain = vm_images.backing_chain(record.disk) if disk is not None else []
+        rows.append({"name": record.name, "state": live.get(record.name, record.state), "pid": state.pid,
+                     "uptime_s": None if uptime is None else round(uptime, 1), "ram_mb": record.ram_mb,
+                     "cpus": record.cpus, "disk": record.disk, "disk_missing": disk is None,
+                     "virtual_size": disk.virtual_size if disk else None, "allocated": disk.allocated if disk else None,
+                     "base_image": bases[record.disk].name if record.disk in bases else None,
+                     "backing": chain[1:], "origin": record.origin})
+    return rows
+
+
+def _vms_text(rows):
+    if not rows.total:
+        return ["No virtual machines found."]
+    lines = []
+    for r in rows:
+        line = f"- {r['name']}  {r['state']}" + (f" (PID {r['pid']})" if r["pid"] else "")
+        line += f"  {r['ram_mb']} MB, {r['cpus']} CPU(s)"
+        if r["disk_missing"]:
+            line += f"  [disk missing: {r['disk']}]"
+        else:
+            line += f"  {_size(r['virtual_size'])} disk, {_size(r['allocated'])} used"
+        if r["base_image"]:
+            line += f"  [base image '{r['base_image']}']"
+        if r["backing"]:
+            line += "  -> " + " -> ".join(os.path.basename(p) for p in r["backing"])
+        lines.append(line)
+    footer = rows.footer()
+    return lines + [footer] if footer else lines
+
+
+def cmd_vm_list(args):
+    import listing
+    import vm_registry
+    registry = vm_registry.VmRegistry()
+    filters = vm_registry.parse_filter(args.filter or "")
+    if "state" in filters or args.sort == "state":
+        # the stored state is what the state index filters on, so bring it up to date first
+        registry.refresh_states()
+    # disks, processes and QMP are only consulted for the VMs on the requested page
+    page = _select(args, registry.query(**filters), "vms")
+    return listing.Page(_vm_rows(registry, page), "vms", page.total, page.offset)
+
+
+def _provision(args, specs, config=None):
+    import vm_fleet
+    if not args.background:
+        return vm_fleet.provision(specs, concurrency=args.concurrency)
+    import vm_images
+    import vm_registry
+    # report mistakes now rather than in the job's log (the job validates again when it runs)
+    errors = vm_fleet.validate(specs, vm_registry.VmRegistry(), vm_images.BaseCatalog())
+    if errors:
+        raise vm_fleet.FleetError(errors)
+    params = {"disk_dir": os.getcwd(), "concurrency": args.concurrency}
+    if config:
+        params["config"] = os.path.abspath(config)
+    else:
+        params["specs"] = [{slot: getattr(spec, slot) for slot in spec.__slots__} for spec in specs]
+    return _submit(args, "vm", params)
+
+
+def cmd_vm_create(args):
+    import vm_fleet
+    if args.config:
+        return _provision(args, vm_fleet.load(args.config), args.config)
+    if not (args.name and args.ram and args.cpu and (args.disk or args.base)):
+        raise CliError("give NAME, --ram, --cpu and --disk (or --base), or --config")
+    return _provision(args, [vm_fleet.VmSpec(args.name, args.ram, args.cpu, args.disk or "", args.base or "",
+                                             source="cli")])
+
+
+def cmd_vm_fleet(args):
+    import vm_fleet
+    return _provision(args, vm_fleet.load(args.source), args.source)
+
+
+def cmd_vm_delete(args):
+    import vm_images
+    import vm_qmp
+    import vm_registry
+    import vm_runtime
+    import vm_snapshots
+    registry = vm_registry.VmRegistry()
+    record = registry.get(args.name)
+    if record is None:
+        raise CliError(f"VM '{args.name}' is not in the VM registry")
+    catalog = vm_images.BaseCatalog()
+    bases = catalog.by_path()
+    if os.path.abspath(record.disk) in bases:
+        raise CliError(f"'{record.disk}' is registered as base image '{bases[os.path.abspath(record.disk)].name}'")
+    dependents = catalog.dependents(record.disk, disks=[r.disk for r in registry.query()])
+    if dependents:
+        raise CliError(f"'{record.disk}' is the backing file of " + ", ".join(map(os.path.basename, dependents)))
+    if vm_runtime.state(args.name).running:
+        if not args.force:
+            raise CliError(f"VM '{args.name}' is running (use --force to shut it down first)")
+        if vm_qmp.shutdown(args.name) == "failed":
+            raise CliError(f"VM '{args.name}' did not stop; not deleting")
+    if os.path.exists(record.disk):
+        os.remove(record.disk)
+    snapshot_files = vm_snapshots.remove_all(args.name, registry, catalog)
+    registry.remove(args.name)
+    catalog.forget_overlay(record.disk)
+    vm_runtime.forget(args.name)
+    return {"name": args.name, "disk": record.disk, "snapshot_files": snapshot_files}
+
+
+def cmd_vm_start(args):
+    import vm_registry
+    import vm_runtime
+    registry = vm_registry.VmRegistry()
+    record = registry.get(args.name)
+    if record is None:
+        raise CliError(f"VM '{args.name}' is not in the VM registry")
+    if vm_runtime.state(args.name).running:
+        raise CliError(f"VM '{args.name}' is already running")
+    vm = vm_runtime.launch(args.name, record.ram_mb, record.cpus, record.disk, ephemeral=args.ephemeral)
+    registry.set_state(args.name, "running")
+    return vm
+
+
+def cmd_vm_stop(args):
+    import vm_qmp
+    import vm_registry
+    import vm_runtime
+    if not vm_runtime.state(args.name).running:
+        raise CliError(f"VM '{args.name}' is not running")
+    result = vm_qmp.shutdown(args.name)
+    if result == "failed":
+        raise CliError(f"VM '{args.name}' did not stop")
+    vm_registry.VmRegistry().set_state(args.name, "stopped")
+    return {"name": args.name, "result": result}
+
+
+def cmd_vm_reconcile(args):
+    import vm_images
+    import vm_registry
+    import vm_runtime
+    registry = vm_registry.VmRegistry()
+    catalog = vm_images.BaseCatalog()
+    report = vm_registry.reconcile(registry, catalog=catalog)
+    result = {"state_fixes": report.state_fixes, "missing": [r.name for r in report.missing],
+              "orphans": report.orphans, "removed": [], "imported": [], "skipped": {}}
+    if args.remove_missing:
+        for record in report.missing:
+            vm_runtime.stop(record.name)
+            registry.remove(record.name)
+            catalog.forget_overlay(record.disk)
+            result["removed"].append(record.name)
+    if args.import_orphans:
+        ram, cpus = vm_registry.parse_ram(args.ram), vm_registry.parse_cpus(args.cpu)
+        for path in report.orphans:
+            try:
+                result["imported"].append(vm_registry.adopt(registry, path, ram, cpus, catalog).name)
+            except vm_registry.RegistryError as e:
+                result["skipped"][path] = str(e)
+    return result
+
+
+def cmd_vm_control(args):
+    import vm_qmp
+    import vm_registry
+    import vm_runtime
+    names = []
+    for ref in args.names:
+        if any(c in ref for c in "*?["):
+            names += [r.name for r in vm_registry.VmRegistry().query(name=ref)]
+        else:
+            names.append(ref)
+    names = [n for n in dict.fromkeys(names) if vm_runtime.state(n).running]
+    if not names:
+        raise CliError("no running VMs matched")
+    results = vm_qmp.control(names, args.action)
+    if all(isinstance(r, Exception) for r in results.values()):
+        raise CliError("; ".join(f"{n}: {r}" for n, r in results.items()))
+    return results
+
+
+def cmd_vm_snapshot(args):
+    import vm_qmp
+    import vm_runtime
+    import vm_snapshots
+    if args.op == "list":
+        return vm_snapshots.list_snapshots(args.name)
+    if not args.tag:
+        raise CliError(f"snapshot {args.op} needs a TAG")
+    if args.op == "create":
+        vm_snapshots.create(args.name, args.tag)
+        return {"name": args.name, "tag": args.tag, "created": True}
+    if args.op == "delete":
+        vm_snapshots.delete(args.name, args.tag)
+        return {"name": args.name, "tag": args.tag, "deleted": True}
+    if vm_runtime.state(args.name).running:
+        if not args.force:
+            raise CliError(f"VM '{args.name}' is running (use --force to shut it down first)")
+        if vm_qmp.shutdown(args.name) == "failed":
+            raise CliError(f"VM '{args.name}' did not stop")
+    return {"name": args.name, "tag": args.tag, "restored_in_s": round(vm_snapshots.restore(args.name, args.tag), 3)}
+
+
+def cmd_vm_base(args):
+    import vm_images
+    catalog = vm_images.BaseCatalog()
+    if args.op == "list":
+        return [dict(_plain(base), users=len(catalog.dependents(base.path))) for base in catalog.list()]
+    if not args.name or (args.op == "add" and not args.path):
+        raise CliError("base add needs NAME and PATH; base remove needs NAME")
+    if args.op == "add":
+        return catalog.add(args.name, args.path)
+    catalog.remove(args.name, delete_file=args.delete_file)
+    return {"name": args.name, "removed": True}
+
+
+def cmd_vm_disks(args):
+    import vm_disks
+    result = {"vms": [], "compacted": {}}
+    for record, chain in vm_disks.report():
+        result["vms"].append({"name": record.name, "disk": record.disk, "chain": chain})
+    for name in args.compact:
+        try:
+            before, after = vm_disks.compact(name, args.compress)
+            result["compacted"][name] = {"before": before, "after": after}
+        except vm_disks.DiskError as e:
+            result["compacted"][name] = {"error": str(e)}
+    return result
+
+
+def _disks_text(result):
+    lines = []
+    for vm in result["vms"]:
+        chain = vm["chain"]
+        if chain is None:
+            lines.append(f"{vm['name']:<20} [disk missing: {vm['disk']}]")
+            continue
+        backing = " -> ".join(os.path.basename(u.path) for u in chain[1:])
+        lines.append(f"{vm['name']:<20} {chain[0].format:<7} {_size(chain[0].virtual_size):>10} "
+                     f"{_size(chain[0].allocated):>10}  {backing or '-'}")
+    for name, outcome in result["compacted"].items():
+        if "error" in outcome:
+            lines.append(f"{name}: {outcome['error']}")
+        else:
+            lines.append(f"{name}: {_size(outcome['before'])} -> {_size(outcome['after'])}")
+    return lines or ["No virtual machines found."]
+
+
+# --- Warm pools and instrumentation ------------------------------------------------
+
+def cmd_pool(args):
+    import warm_pool
+    pool = warm_pool.shared()
+    if args.op == "list":
+        if pool is not None:
+            return pool.stats()
+        return [{"template": t.name, "kind": t.kind, "size": t.size, "running": False}
+                for t in warm_pool.load_templates()]
+    if args.op == "add":
+        spec = {"base": args.base, "ram": args.ram, "cpu": args.cpu, "warmup": args.warmup} if args.kind == "vm" \
+            else {"image": args.image, "command": args.pool_command}
+        template = warm_pool.Template.from_dict({"name": args.name, "kind": args.kind, "size": args.size,
+                                                 **{k: v for k, v in spec.items() if v is not None}})
+        warm_pool.save_templates([t for t in warm_pool.load_templates() if t.name != template.name] + [template])
+        if pool is not None:
+            pool.set_template(template)
+        return template.as_dict()
+    if args.op == "remove":
+        warm_pool.save_templates([t for t in warm_pool.load_templates() if t.name != args.name])
+        if pool is not None:
+            pool.remove_template(args.name)
+        return {"template": args.name, "removed": True}
+    if args.op == "start":
+        warm_pool.start_shared()
+        return {"running": True}
+    if args.op == "stop":
+        warm_pool.stop_shared(drain=not args.keep)
+        return {"running": False}
+    if pool is None:
+        raise CliError("warm pools are not running in this process (run `pool start` first, e.g. in a batch)")
+    return pool.allocate(args.name)
+
+
+# --- Background jobs -----------------------------------------------------------------
+
+def _job(job_id):
+    import jobs
+    job = jobs.Journal().get(job_id)
+    if job is None:
+        raise CliError(f"no job {job_id}")
+    return job
+
+
+def cmd_jobs_list(args):
+    import jobs
+    return jobs.Journal().list(state=args.state, limit=args.limit)
+
+
+def _jobs_text(found):
+    import listing
+    if not found:
+        return ["No jobs."]
+    rows = [[j.id, j.state + (" (cancelling)" if j.cancel_requested and not j.finished else ""),
+             listing.human_age(j.submitted_at), "-" if j.elapsed() is None else f"{j.elapsed():.1f}s",
+             j.describe()] for j in found]
+    return _table(["ID", "STATE", "SUBMITTED", "ELAPSED", "JOB"], rows)
+
+
+def cmd_jobs_show(args):
+    return _job(args.id)
+
+
+def _job_text(job):
+    state = job.state + (" (cancel requested)" if job.cancel_requested and not job.finished else "")
+    lines = [f"Job {job.id}: {job.describe()}", f"  state: {state}" + (f" - {job.error}" if job.error else "")]
+    if job.elapsed() is not None:
+        lines.append(f"  elapsed: {job.elapsed():.1f}s" + (f", attempt {job.attempts}" if job.attempts > 1 else ""))
+    return lines
+
+
+def cmd_jobs_tail(args):
+    # The last --lines lines of a job's output; with --follow, its output as it arrives until it finishes
+    import jobs
+    journal = jobs.Journal()
+    job = _job(args.id)
+    after = max(0, journal.last_seq(job.id) - args.lines)
+    if not args.follow:
+        return [{"seq": seq, "at": at, "line": line} for seq, at, line in journal.log(job.id, after)]
+    out = _progress(args)
+    for _, _, line in jobs.follow(job.id, journal, after):
+        print(line, file=out, flush=True)
+    return journal.get(job.id)
+
+
+def _tail_text(result):
+    if isinstance(result, list):
+        return [entry["line"] for entry in result]
+    return [f"-- job {result.id} {result.state}" + (f": {result.error}" if result.error else "")]
+
+
+def cmd_jobs_cancel(args):
+    import jobs
+    queue = jobs.shared()
+    return (queue.cancel if queue is not None else jobs.cancel)(args.id)
+
+
+def cmd_jobs_wait(args):
+    import jobs
+    queue = jobs.shared()
+    job = (queue.wait if queue is not None else jobs.wait)(_job(args.id).id, args.timeout)
+    if not job.finished:
+        if job.state == "interrupted":
+            raise CliError(f"job {job.id} was interrupted; it resumes when a job queue next starts")
+        raise CliError(f"job {job.id} is still {job.state}")
+    if job.state != "succeeded":
+        raise CliError(f"job {job.id} {job.state}" + (f": {job.error}" if job.error else ""))
+    return job
+
+
+def cmd_jobs_worker(args):
+    import jobs
+    if not jobs.run_worker(args.idle):
+        raise CliError(f"a job worker is already running (PID {jobs.worker_pid()})")
+    return None
+
+
+def cmd_timings(args):
+    import instrumentation
+    return instrumentation.metrics.summary()
+
+
+# --- argument parsing ------------------------------------------------------------
+
+def _command(sub, name, handler, text=None, **kwargs):
+    parser = sub.add_parser(name, parents=[_COMMON], **kwargs)
+    parser.set_defaults(handler=handler, text=text)
+    return parser
+
+
+def _listing(parser, kind, columns=True):
+    # Sorting, paging and column options for a listing command (column names are in listing.COLUMNS)
+    parser.add_argument("--sort", metavar="COLUMN", help=f"sort {kind} by this column")
+    parser.add_argument("-r", "--reverse", action="store_true", help="sort in descending order")
+    parser.add_argument("--limit", type=int, help="show at most this many")
+    parser.add_argument("--offset", type=int, default=0, help="skip this many first")
+    if columns:
+        parser.add_argument("--columns", help="comma-separated columns, e.g. id,name,state")
+    return parser
+
+
+_COMMON = _Parser(add_help=False)
+# SUPPRESS: a --json given before the subcommand is not reset by the subcommand's default
+_COMMON.add_argument("--json", action="store_true", default=argparse.SUPPRESS, help="machine-readable output")
+
+
+def build_parser():
+    parser = _Parser(prog="cms", description="Cloud Management System: Docker and QEMU VMs.")
+    parser.add_argument("--json", action="store_true", help="machine-readable output")
+    sub = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    sub.add_parser("menu", help="interactive menu (the default)")
+    p = sub.add_parser("batch", parents=[_COMMON], help="run commands read from stdin, one per line")
+    p.add_argument("--stop-on-error", action="store_true")
+
+    # Docker
+    _command(sub, "status", cmd_status, _status_text, help="Docker daemon status")
+    _listing(_command(sub, "images", cmd_images, _page_text, help="list local images"), "images")
+    p = _listing(_command(sub, "ps", cmd_ps, _page_text, help="list containers"), "containers")
+    p.add_argument("-a", "--all", action="store_true", help="include stopped containers")
+    p = _command(sub, "search", cmd_search, _search_text, help="search local images")
+    p.add_argument("query", help="e.g. 'nginx tag:1.25', 'label:team=web', 'size>500MB'")
+    p.add_argument("--limit", type=int, default=50)
+    p = _command(sub, "hub-search", cmd_hub_search, _hub_text, help="search Docker Hub (cached)")
+    p.add_argument("term")
+    p.add_argument("--limit", type=int, default=25)
+    p = _command(sub, "pull", cmd_pull, help="pull images in parallel")
+    p.add_argument("refs", nargs="*")
+    p.add_argument("--manifest", help="file listing images to pull")
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--skip-existing", choices=("digest", "tag", "never"), default="digest")
+    p.add_argument("--background", action="store_true", help="queue as a background job")
+    p = _command(sub, "dockerfile", cmd_dockerfile, _dockerfile_text, help="create a Dockerfile")
+    p.add_argument("path", nargs="?", default="Dockerfile")
+    p.add_argument("--from", dest="source", help="copy this file instead of generating a template")
+    p.add_argument("--base-image")
+    p.add_argument("--start-cmd")
+    p.add_argument("--fix", action="store_true", help="apply the analyzer's safe fixes")
+    p.add_argument("--force", action="store_true", help="overwrite an existing file")
+    p = _command(sub, "build", cmd_build, _build_text, help="build and tag an image")
+    p.add_argument("tag")
+    p.add_argument("-f", "--file", default="Dockerfile")
+    p.add_argument("--context", default=".")
+    p.add_argument("--no-cache-check", action="store_true", help="build even if nothing changed")
+    p.add_argument("--background", action="store_true", help="queue as a background job")
+    p = _command(sub, "run", cmd_run, help="create and start a container")
+    p.add_argument("image")
+    p.add_argument("--name")
+    for action, name in (("start", "start"), ("stop", "stop"), ("restart", "restart"), ("remove", "rm")):
+        p = _command(sub, name, cmd_lifecycle, help=f"{action} containers")
+        p.set_defaults(action=action)
+        p.add_argument("targets", nargs="*", help="container IDs or names")
+        p.add_argument("--label", help="key or key=value")
+        p.add_argument("--name-pattern", help="glob over container names")
+        p.add_argument("--concurrency", type=int, default=8)
+    p = _command(sub, "metrics", cmd_metrics, _metrics_text, help="container CPU/memory/IO metrics")
+    p.add_argument("--duration", type=float, default=3.0, help="seconds to sample")
+    p.add_argument("--container", help="also summarize this container")
+    p.add_argument("--window", type=float, default=60.0)
+
+    # Virtual machines
+    vm = sub.add_parser("vm", help="QEMU virtual machines").add_subparsers(dest="vm_command", metavar="VM_COMMAND",
+                                                                           required=True)
+    p = _listing(_command(vm, "list", cmd_vm_list, _vms_text, help="list VMs"), "vms", columns=False)
+    p.add_argument("--filter", help="e.g. 'name=web-* state=running ram>=2048'")
+    p = _command(vm, "create", cmd_vm_create, help="create and start a VM")
+    p.add_argument("name", nargs="?")
+    p.add_argument("--ram")
+    p.add_argument("--cpu")
+    p.add_argument("--disk", help="disk size, e.g. 10G")
+    p.add_argument("--base", help="base image for a linked clone")
+    p.add_argument("--config", help="JSON config file instead of the options")
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--background", action="store_true", help="queue as a background job")
+    p = _command(vm, "fleet", cmd_vm_fleet, help="provision VMs from a config directory or manifest")
+    p.add_argument("source")
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--background", action="store_true", help="queue as a background job")
+    p = _command(vm, "delete", cmd_vm_delete, help="delete a VM and its disk")
+    p.add_argument("name")
+    p.add_argument("--force", action="store_true", help="shut a running VM down first")
+    p = _command(vm, "start", cmd_vm_start, help="start a registered VM")
+    p.add_argument("name")
+    p.add_argument("--ephemeral", action="store_true", help="discard disk writes when it stops")
+    p = _command(vm, "stop", cmd_vm_stop, help="shut a VM down")
+    p.add_argument("name")
+    p = _command(vm, "reconcile", cmd_vm_reconcile, help="compare the registry with the disks")
+    p.add_argument("--remove-missing", action="store_true", help="unregister VMs whose disk is gone")
+    p.add_argument("--import-orphans", action="store_true", help="register unknown disks as VMs")
+    p.add_argument("--ram", default="1024")
+    p.add_argument("--cpu", default="1")
+    p = _command(vm, "control", cmd_vm_control, help="QMP action on running VMs")
+    p.add_argument("action", help="pause, resume, powerdown, status, stats, ...")
+    p.add_argument("names", nargs="+", help="VM names or patterns (web-*)")
+    p = _command(vm, "snapshot", cmd_vm_snapshot, help="list/create/restore/delete snapshots")
+    p.add_argument("op", choices=("list", "create", "restore", "delete"))
+    p.add_argument("name")
+    p.add_argument("tag", nargs="?")
+    p.add_argument("--force", action="store_true", help="shut a running VM down before restoring")
+    p = _command(vm, "base", cmd_vm_base, help="base images for linked clones")
+    p.add_argument("op", choices=("list", "add", "remove"))
+    p.add_argument("name", nargs="?")
+    p.add_argument("path", nargs="?")
+    p.add_argument("--delete-file", action="store_true")
+    p = _command(vm, "disks", cmd_vm_disks, _disks_text, help="disk usage; compact stopped VMs")
+    p.add_argument("--compact", nargs="+", default=[], metavar="NAME")
+    p.add_argument("--compress", action="store_true")
+
+    # Background jobs
+    job = sub.add_parser("jobs", help="background jobs (pull/build/vm create --background)").add_subparsers(
+        dest="jobs_command", metavar="JOBS_COMMAND", required=True)
+    p = _command(job, "list", cmd_jobs_list, _jobs_text, help="list jobs, newest first")
+    p.add_argument("--state", choices=("queued", "running", "interrupted", "succeeded", "failed", "cancelled"))
+    p.add_argument("--limit", type=int, default=20)
+    p = _command(job, "show", cmd_jobs_show, _job_text, help="a job's state and result")
+    p.add_argument("id", type=int)
+    p = _command(job, "tail", cmd_jobs_tail, _tail_text, help="a job's output")
+    p.add_argument("id", type=int)
+    p.add_argument("-n", "--lines", type=int, default=20, help="show this many last lines")
+    p.add_argument("-f", "--follow", action="store_true", help="keep printing until the job finishes")
+    p = _command(job, "cancel", cmd_jobs_cancel, _job_text, help="cancel a queued or running job")
+    p.add_argument("id", type=int)
+    p = _command(job, "wait", cmd_jobs_wait, _job_text, help="wait for a job; exit status 1 unless it succeeded")
+    p.add_argument("id", type=int)
+    p.add_argument("--timeout", type=float)
+    p = _command(job, "worker", cmd_jobs_worker, help="run queued jobs until idle (started automatically)")
+    p.add_argument("--idle", type=float, default=10.0, help="exit after this many seconds with nothing to do")
+
+    # Warm pools and instrumentation
+    p = _command(sub, "pool", cmd_pool, help="warm pools of VMs and containers")
+    p.add_argument("op", choices=("list", "add", "remove", "start", "stop", "allocate"))
+    p.add_argument("name", nargs="?")
+    p.add_argument("--kind", choices=("vm", "container"))
+    p.add_argument("--size", type=int)
+    p.add_argument("--base")
+    p.add_argument("--ram")
+    p.add_argument("--cpu")
+    p.add_argument("--warmup", type=float)
+    p.add_argument("--image")
+    p.add_argument("--command", dest="pool_command")
+    p.add_argument("--keep", action="store_true", help="on stop, keep idle members")
+    _command(sub, "timings", cmd_timings, help="latency/error summary of this process")
+    return parser
+
+
+# --- running -------------------------------------------------------------------------
+
+def _cell(value):
+    return "-" if value is None else json.dumps(value) if isinstance(value, (dict, list)) else value
+
+
+def _show(args, value):
+    # Print a result for a human (the command's own renderer, a report's print(), or plain lines)
+    if args.text is not None:
+        print("\n".join(args.text(value)))
+    elif hasattr(value, "print"):
+        value.print()
+    elif isinstance(value, list):
+        rows = [_plain(item) for item in value]
+        if rows and all(isinstance(row, dict) for row in rows):
+            headers = list(rows[0])
+            table = _table([h.upper() for h in headers], [[_cell(row.get(h)) for h in headers] for row in rows])
+            print("\n".join(table))
+        elif rows:
+            print("\n".join(map(str, rows)))
+    elif value is not None:
+        for key, item in _plain(value).items():
+            print(f"{key}: {item}")
+
+
+def run(args):
+    # Run one parsed command; returns (ok, result or error message)
+    import instrumentation
+    try:
+        subcommand = getattr(args, "vm_command", None) or getattr(args, "jobs_command", None)
+        with instrumentation.operation(f"cli {args.command}" + (f" {subcommand}" if subcommand else "")):
+            value = args.handler(args)
+    except _failures() as e:
+        return False, str(e)
+    failed = getattr(value, "failed", None)
+    if failed:
+        return False, value
+    return True, value
+
+
+def _emit(args, ok, value):
+    if args.json:
+        print(json.dumps(_plain(value) if ok or not isinstance(value, str) else {"error": value}, default=str))
+    elif isinstance(value, str) and not ok:
+        print(f"Error: {value}", file=sys.stderr)
+    else:
+        _show(args, value)
+
+
+def batch(parser, args, lines):
+    # One command per line (blank lines and # comments skipped); returns the exit status
+    status = 0
+    for number, line in enumerate(lines, 1):
+        words = shlex.split(line, comments=True)
+        if not words:
+            continue
+        if words[0] in ("batch", "menu"):
+            ok, value = False, f"'{words[0]}' cannot be used inside a batch"
+        else:
+            try:
+                sub_args = parser.parse_args(words)
+            except CliError as e:
+                ok, value = False, str(e)
+            except SystemExit:  # --help
+                continue
+            else:
+                sub_args.json = sub_args.json or args.json
+                ok, value = run(sub_args)
+        if args.json:
+            print(json.dumps({"line": number, "command": line.strip(), "ok": ok,
+                              ("result" if ok or not isinstance(value, str) else "error"): _plain(value)},
+                             default=str), flush=True)
+        elif ok:
+            _show(sub_args, value)
+        else:
+            print(f"line {number}: {value}" if isinstance(value, str) else f"line {number}: failed", file=sys.stderr)
+        if not ok:
+            status = 1
+            if args.stop_on_error:
+                break
+    return status
+
+
+def main(argv=None):
+    parser = build_parser()
+    try:
+        args = parser.parse_args(argv)
+    except CliError as e:
+        parser.print_usage(sys.stderr)
+        print(e, file=sys.stderr)
+        return 2
+    if args.command in (None, "menu"):
+        interactive()
+        return 0
+    import instrumentation
+    instrumentation.install()
+    try:
+        if args.command == "batch":
+            return batch(parser, args, sys.stdin)
+        ok, value = run(args)
+        try:
+            _emit(args, ok, value)
+        except BrokenPipeError:
+            # the reader went away (`cms ps | head`); keep the interpreter from complaining at exit
+            sys.stdout = open(os.devnull, "w")
+        return 0 if ok else 1
+    finally:
+        if instrumentation.enabled():
+            try:
+                instrumentation.metrics.export()
+            except OSError:
+                pass
+
+
+# --- interactive menu ------------------------------------------------------------------
+
+MENU = [
+    ("Docker", [
+        ("1", "List Docker Images", "docker_manager", "list_images"),
+        ("2", "Search Local Images", "docker_manager", "search_local_images"),
+        ("3", "Search Image on DockerHub", "docker_manager", "search_dockerhub"),
+        ("4", "Pull Docker Image", "docker_manager", "pull_image"),
+        ("p", "Pull Multiple Images (parallel)", "docker_manager", "pull_multiple_images"),
+        ("5", "Create Dockerfile", "docker_manager", "create_dockerfile"),
+        ("6", "Build Docker Image", "docker_manager", "build_image"),
+        ("7", "Run Docker Image (create container)", "docker_manager", "run_image"),
+        ("8", "List Running Containers", "docker_manager", "list_running_containers"),
+        ("9", "List All Containers (running + stopped)", "docker_manager", "list_all_containers"),
+        ("10", "Start Container", "docker_manager", "start_container"),
+        ("11", "Stop Container", "docker_manager", "stop_container"),
+        ("b", "Bulk Start/Stop/Restart/Remove Containers", "docker_manager", "bulk_container_action"),
+        ("d", "Docker Daemon Status", "docker_manager", "daemon_status"),
+        ("m", "Container Metrics (live view)", "docker_manager", "container_metrics"),
+    ]),
+    ("Virtual Machines (QEMU)", [
+        ("12", "Create Virtual Machine (interactive)", "vm_manager", "create_vm"),
+        ("13", "Create VM from JSON config", "vm_manager", "create_vm_from_config"),
+        ("14", "List Virtual Machines (QEMU)", "vm_manager", "list_vms"),
+        ("15", "Delete Virtual Machine (QEMU)", "vm_manager", "delete_vm"),
+        ("16", "Base Images (linked clones)", "vm_manager", "manage_base_images"),
+        ("17", "Stop Virtual Machine", "vm_manager", "stop_vm"),
+        ("18", "Find Virtual Machines (filter)", "vm_manager", "find_vms"),
+        ("19", "Reconcile VM registry", "vm_manager", "reconcile_vms"),
+        ("20", "Provision VM Fleet (config directory or manifest)", "vm_manager", "provision_fleet"),
+        ("21", "VM Control (pause/resume/powerdown/status/stats)", "vm_manager", "control_vms"),
+        ("22", "Start Virtual Machine (optionally ephemeral)", "vm_manager", "start_vm"),
+        ("23", "VM Snapshots (create/restore/delete)", "vm_manager", "manage_snapshots"),
+        ("25", "VM Disk Usage & Compaction", "vm_manager", "disk_usage"),
+    ]),
+    ("Warm Pools", [
+        ("24", "Warm Pools (pre-created VMs/containers)", "pool_manager", "manage_warm_pools"),
+    ]),
+    ("Background Jobs", [
+        ("j", "Background Jobs (list/follow/cancel/wait)", "job_manager", "manage_jobs"),
+    ]),
+]
+
+
+def clear_screen():
+    os.system("cls" if os.name == "nt" else "clear")
+
+
+def print_menu():
+    print("\n=== Cloud Management System ===")
+    print("c. Clear Screen")
+    print("i. Instrumentation Summary (latency, errors)")
+    for section, entries in MENU:
+        print(f"\n--- {section} ---")
+        for key, label, _, _ in entries:
+            print(f"{key}. {label}")
+    print("0. Exit")
+
+
+def _finish_jobs():
+    # Leaving the menu: let background jobs finish, or on Ctrl+C hand them to a `jobs worker`
+    import jobs
+    queue = jobs.shared()
+    if queue is None:
+        return
+    if queue.active():
+        print(f"Waiting for {queue.active()} background job(s) to finish (Ctrl+C to leave them running)...")
+    try:
+        jobs.stop_shared(wait=True)
+    except KeyboardInterrupt:
+        jobs.stop_shared(wait=False)
+        jobs.ensure_worker()
+        print("\nThe remaining jobs continue in a background worker; interrupted pulls and builds start over.")
+
+
+def interactive():
+    import docker_inventory
+    import instrumentation
+    import jobs
+
+    # Keep an event-driven image/container inventory in the background (CMS_INVENTORY=0 disables it)
+    if os.environ.get("CMS_INVENTORY", "1") != "0":
+        docker_inventory.start_shared(wait=False)
+    # Pulls, builds and VM creation run as background jobs (CMS_JOBS=0 keeps them in the foreground)
+    if os.environ.get("CMS_JOBS", "1") != "0":
+        jobs.start_shared()
+    # Time subprocess calls too, and write metrics.prom / metrics.json after every action (CMS_METRICS=0 disables)
+    instrumentation.install()
+
+    actions = {key: (module, function) for _, entries in MENU for key, _, module, function in entries}
+    while True:
+        print_menu()
+        choice = input("Enter your choice: ").strip()
+        if choice == "0":
+            _finish_jobs()
+            print("Exiting...")
+            break
+        if choice == "c":
+            clear_screen()
+        elif choice == "i":
+            instrumentation.print_summary()
+        elif choice in actions:
+            module, function = actions[choice]
+            getattr(importlib.import_module(module), function)()
+        else:
+            print("Invalid choice!")
+
+        if instrumentation.enabled():
+            try:
+                instrumentation.metrics.export()
+            except OSError:
+                pass
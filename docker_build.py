@@ -0,0 +1,387 @@
+# Image build helpers: build-context analysis and streamed build output.
+# Before a build, the context directory is walked with the same .dockerignore
+# rules the upload uses, so the user sees what is about to be sent (total size,
+# largest files and directories) and can generate a .dockerignore for the heavy
+# paths. The build itself is followed line by line: output is printed as it
+# arrives, only a short tail is kept for error reports, and each build step is
+# timed.
+
+import heapq
+import os
+import re
+import subprocess
+import time
+from collections import deque
+
+import build_cache
+import docker_engine
+import docker_health
+
+LARGEST = 10
+# Offer a .dockerignore only when the suggested exclusions would save at least this much
+OFFER_MIN_BYTES = int(float(os.environ.get("CMS_BUILD_CONTEXT_WARN_MB", "10")) * 1000 * 1000)
+# A single included file this large is suggested for exclusion too
+LARGE_PATH_BYTES = 100 * 1000 * 1000
+TAIL_LINES = 200
+
+# Paths that are almost never needed inside an image
+JUNK_DIRS = (".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", "venv", ".tox", ".nox",
+             ".mypy_cache", ".pytest_cache", ".ruff_cache", ".idea", ".vscode", ".cache", "htmlcov")
+JUNK_FILES = ("*.pyc", "*.log", ".coverage", ".DS_Store", "*.swp")
+
+
+class ContextReport:
+    # What a build would upload from one context directory.
+
+    def __init__(self, path):
+        self.path = path
+        self.files = 0
+        self.bytes = 0
+        self.excluded_files = 0
+        self.excluded_bytes = 0
+        self.pruned_dirs = []    # excluded directories that were not walked
+        self.largest_files = []  # (size, relpath), biggest first
+        self.largest_dirs = []
+        self.dir_bytes = {}      # relpath -> included bytes below it
+        self.suggestions = {}    # .dockerignore pattern -> bytes it would remove
+        self.elapsed = 0.0
+
+    @property
+    def savings(self):
+        return sum(self.suggestions.values())
+
+    def as_dict(self):
+        return {
+            "path": self.path, "files": self.files, "bytes": self.bytes,
+            "excluded_files": self.excluded_files, "excluded_bytes": self.excluded_bytes,
+            "pruned_dirs": self.pruned_dirs,
+            "largest_files": [{"path": p, "bytes": s} for s, p in self.largest_files],
+            "largest_dirs": [{"path": p, "bytes": s} for s, p in self.largest_dirs],
+            "suggestions": self.suggestions,
+        }
+
+    def print(self):
+        print(f"Build context {os.path.abspath(self.path)}: {self.files} files, {_mb(self.bytes)}"
+              f" (excluded by .dockerignore: {self.excluded_files} files, {_mb(self.excluded_bytes)}"
+              + (f", {len(self.pruned_dirs)} directories skipped" if self.pruned_dirs else "") + ")")
+        if self.largest_dirs:
+            print("  Largest directories:")
+            for size, rel in self.largest_dirs:
+                print(f"    {_mb(size):>10}  {rel}/")
+        if self.largest_files:
+            print("  Largest files:")
+            for size, rel in self.largest_files:
+                print(f"    {_mb(size):>10}  {rel}")
+        if self.suggestions:
+            print("  Heavy paths that could be excluded:")
+            for pattern, size in sorted(self.suggestions.items(), key=lambda kv: -kv[1]):
+                print(f"    {_mb(size):>10}  {pattern}")
+
+
+def _mb(num):
+    return f"{num / 1e6:.1f} MB"
+
+
+def _junk_pattern(rel, is_dir):
+    name = rel.rsplit("/", 1)[-1]
+    if is_dir and name in JUNK_DIRS:
+        return f"**/{name}"
+    if not is_dir:
+        for pattern in JUNK_FILES:
+            if (pattern.startswith("*.") and name.endswith(pattern[1:])) or name == pattern:
+                return f"**/{pattern}"
+    return None
+
+
+def analyze_context(path=".", dockerfile=None, excludes=None):
+    # Walk the context as the upload would and collect sizes; excluded directories are not descended.
+    started = time.perf_counter()
+    report = ContextReport(path)
+    if excludes is None:
+        excludes = docker_engine.load_dockerignore(path)
+    prune = getattr(excludes, "prune", excludes)
+    keep = {".dockerignore"}  # always sent, like the Dockerfile
+    if dockerfile:
+        keep.add(os.path.relpath(os.path.abspath(dockerfile), os.path.abspath(path)).replace(os.sep, "/"))
+    files_heap = []
+    for root, dirs, files in os.walk(path):
+        rel_root = os.path.relpath(root, path).replace(os.sep, "/")
+        rel_root = "" if rel_root == "." else rel_root
+        walked = []
+        for d in sorted(dirs):
+            rel = f"{rel_root}/{d}" if rel_root else d
+            if os.path.islink(os.path.join(root, d)):
+                continue  # the upload does not follow directory symlinks either
+            if prune(rel):
+                report.pruned_dirs.append(rel)
+            else:
+                walked.append(d)
+        dirs[:] = walked
+        in_junk = any(part in JUNK_DIRS for part in rel_root.split("/"))
+        for fname in files:
+            rel = f"{rel_root}/{fname}" if rel_root else fname
+            try:
+                size = os.lstat(os.path.join(root, fname)).st_size
+            except OSError:
+                continue
+            if rel not in keep and excludes(rel):
+                report.excluded_files += 1
+                report.excluded_bytes += size
+                continue
+            report.files += 1
+            report.bytes += size
+            if len(files_heap) < LARGEST:
+                heapq.heappush(files_heap, (size, rel))
+            else:
+                heapq.heappushpop(files_heap, (size, rel))
+            # charge the file to every directory above it
+            parent = rel_root
+            while parent:
+                report.dir_bytes[parent] = report.dir_bytes.get(parent, 0) + size
+                parent = parent.rpartition("/")[0]
+            if in_junk:
+                continue  # covered by the directory's own suggestion
+            pattern = _junk_pattern(rel, False)
+            if pattern:
+                report.suggestions[pattern] = report.suggestions.get(pattern, 0) + size
+            elif size >= LARGE_PATH_BYTES and rel not in keep:
+                report.suggestions[rel] = size
+    report.largest_files = sorted(files_heap, reverse=True)
+    # top two levels only (deeper ones repeat their parents); on equal size the outer one wins
+    report.largest_dirs = heapq.nlargest(LARGEST, ((s, p) for p, s in report.dir_bytes.items() if p.count("/") < 2),
+                                         key=lambda sp: (sp[0], -sp[1].count("/")))
+    _suggest_dirs(report)
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def _suggest_dirs(report):
+    # Junk directories anywhere in the tree (an outer junk directory covers the ones inside it).
+    # Large source directories are only reported: whether they belong in the image is the user's call.
+    junk = {}
+    for rel, size in sorted(report.dir_bytes.items()):
+        pattern = _junk_pattern(rel, True)
+        if pattern and not any(rel.startswith(other + "/") for other in junk):
+            junk[rel] = pattern
+            report.suggestions[pattern] = report.suggestions.get(pattern, 0) + size
+
+
+def dockerignore_text(patterns, existing=""):
+    # Patterns not already present, as lines to append to a .dockerignore.
+    present = {line.strip() for line in existing.splitlines()}
+    new = [p for p in patterns if p not in present]
+    if not new:
+        return ""
+    header = "" if not existing or existing.endswith("\n") else "\n"
+    return header + "# Added by cloud-management-system: heavy paths not needed in the image\n" + \
+        "".join(f"{p}\n" for p in new)
+
+
+def write_dockerignore(path, patterns):
+    # Append suggested patterns to <path>/.dockerignore; returns the patterns actually added.
+    target = os.path.join(path, ".dockerignore")
+    try:
+        with open(target) as f:
+            existing = f.read()
+    except FileNotFoundError:
+        existing = ""
+    text = dockerignore_text(patterns, existing)
+    if text:
+        with open(target, "a") as f:
+            f.write(text)
+    return [line for line in text.splitlines() if line and not line.startswith("#")]
+
+
+_CLASSIC_STEP = re.compile(r"^Step (\d+)/(\d+) : (.*)")
+_BUILDKIT_STEP = re.compile(r"^#(\d+) (\[.*?\] .*)")
+_BUILDKIT_DONE = re.compile(r"^#(\d+) (DONE ([\d.]+)s|CACHED|ERROR)")
+
+
+class BuildStep:
+    __slots__ = ("name", "seconds", "cached")
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = None
+        self.cached = False
+
+
+class StepTimer:
+    # Derives per-step timings from build output lines (classic "Step N/M :" or BuildKit plain progress).
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.steps = []
+        self._current = None     # classic builder: the step still running, with its start time
+        self._buildkit = {}      # BuildKit vertex number -> BuildStep
+
+    def feed(self, line):
+        line = line.rstrip("\n")
+        now = self.clock()
+        m = _CLASSIC_STEP.match(line)
+        if m:
+            self._close(now)
+            step = BuildStep(f"{m.group(1)}/{m.group(2)} {m.group(3)}")
+            self.steps.append(step)
+            self._current = (step, now)
+            return step
+        if line.strip() == "---> Using cache" and self._current:
+            self._current[0].cached = True
+            return None
+        m = _BUILDKIT_STEP.match(line)
+        if m and m.group(1) not in self._buildkit:
+            step = BuildStep(m.group(2))
+            self._buildkit[m.group(1)] = step
+            self.steps.append(step)
+            return step
+        m = _BUILDKIT_DONE.match(line)
+        if m and m.group(1) in self._buildkit:
+            step = self._buildkit[m.group(1)]
+            if m.group(3):
+                step.seconds = float(m.group(3))
+            elif m.group(2) == "CACHED":
+                step.seconds, step.cached = 0.0, True
+        return None
+
+    def _close(self, now):
+        if self._current is not None:
+            step, started = self._current
+            step.seconds = now - started
+            self._current = None
+
+    def finish(self):
+        self._close(self.clock())
+        return self.steps
+
+
+class BuildResult:
+    def __init__(self, ok, steps, tail, elapsed, error="", image_id=""):
+        self.ok = ok
+        self.steps = steps
+        self.tail = tail      # last lines of output (bounded), for error reports
+        self.elapsed = elapsed
+        self.error = error
+        self.image_id = image_id
+
+
+_IMAGE_ID = re.compile(r"(?:Successfully built |writing image sha256:)([0-9a-f]{12,64})")
+
+
+def _follow_lines(lines, on_line, clock):
+    timer = StepTimer(clock)
+    tail = deque(maxlen=TAIL_LINES)
+    image_id = ""
+    for line in lines:
+        tail.append(line)
+        timer.feed(line)
+        m = _IMAGE_ID.search(line)
+        if m:
+            image_id = m.group(1)
+        if on_line is not None:
+            on_line(line)
+    return timer, tail, image_id
+
+
+def build_cli(context, tag, dockerfile=None, buildargs=None, on_line=print, clock=time.monotonic):
+    # `docker build`, streaming its combined output line by line.
+    started = clock()
+    cmd = ["docker", "build", "-t", tag]
+    if dockerfile:
+        cmd += ["-f", dockerfile]
+    for key, value in (buildargs or {}).items():
+        cmd += ["--build-arg", f"{key}={value}"]
+    cmd.append(context)
+    env = dict(os.environ, BUILDKIT_PROGRESS="plain")  # line-oriented output from BuildKit
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+                            env=env)
+    try:
+        lines = (line.rstrip("\n") for line in proc.stdout)
+        timer, tail, image_id = _follow_lines(lines, on_line, clock)
+    except BaseException:
+        # on_line gave up on the build (a cancelled job): do not leave `docker build` running
+        proc.kill()
+        proc.wait()
+        raise
+    code = proc.wait()
+    error = "" if code == 0 else (tail[-1] if tail else f"docker build exited with {code}")
+    return BuildResult(code == 0, timer.finish(), list(tail), clock() - started, error, image_id)
+
+
+def build_engine(engine, context, tag, dockerfile=None, buildargs=None, on_line=print, clock=time.monotonic):
+    # Engine API build; raises EngineUnavailable if the socket cannot be used.
+    started = clock()
+    error = []
+
+    def lines():
+        for msg in engine.build(context, tag, dockerfile=dockerfile, buildargs=buildargs):
+            if "error" in msg:
+                error.append(msg["error"].strip())
+                yield msg["error"].rstrip("\n")
+            elif "stream" in msg:
+                for line in msg["stream"].splitlines():
+                    yield line
+            elif "aux" in msg and isinstance(msg["aux"], dict) and msg["aux"].get("ID"):
+                yield f"writing image {msg['aux']['ID']}"
+
+    try:
+        timer, tail, image_id = _follow_lines(lines(), on_line, clock)
+    except docker_engine.EngineUnavailable:
+        raise  # the caller falls back to the CLI
+    except docker_engine.EngineError as e:
+        return BuildResult(False, [], [], clock() - started, e.message)
+    ok = not error
+    return BuildResult(ok, timer.finish(), list(tail), clock() - started, error[0] if error else "", image_id)
+
+
+def build(context, tag, dockerfile=None, on_line=print, cache_check=True):
+    # Build through the engine (the CLI if its socket is unreachable); an unchanged Dockerfile
+    # and context skip the build entirely. Returns a summary dict ("ok" False with "error" on failure;
+    # "cache" holds the build cache's key statistics, "cache_error" why it could not be used).
+    summary = {"tag": tag, "image_id": "", "cached": False, "ok": False, "error": "", "elapsed_s": 0.0,
+               "steps": [], "cache": None, "cache_error": ""}
+    cache = key = None
+    if cache_check and build_cache.enabled():
+        cache = build_cache.BuildCache()
+        try:
+            key = cache.compute_key(context, dockerfile)
+        except OSError as e:
+            summary["cache_error"] = str(e)
+    if key is not None:
+        summary["cache"] = {"files": key.files, "reused": key.reused, "hashed": key.hashed,
+                            "elapsed_ms": round(key.elapsed * 1000)}
+        image_id = cache.lookup(tag, key)
+        if image_id and build_cache.image_exists(image_id, tag):
+            if key.hashed:
+                cache.save_state(key)  # touched but unchanged files: remember their new mtimes
+            summary.update(image_id=image_id, cached=True, ok=True)
+            return summary
+
+    result = None
+    engine = docker_engine.get_client()
+    if engine is not None:
+        try:
+            result = build_engine(engine, context, tag, dockerfile=dockerfile, on_line=on_line)
+        except docker_engine.EngineUnavailable:
+            docker_health.monitor().mark_down()  # socket unreachable: fall back to the CLI
+    if result is None:
+        try:
+            result = build_cli(context, tag, dockerfile=dockerfile, on_line=on_line)
+        except FileNotFoundError:
+            summary["error"] = "Docker CLI not found. Please install Docker."
+            return summary
+    if result.ok and key is not None and result.image_id:
+        cache.record(tag, key, result.image_id)
+    summary.update(image_id=result.image_id, ok=result.ok, error=result.error, elapsed_s=round(result.elapsed, 3),
+                   steps=[{"name": s.name, "seconds": s.seconds, "cached": s.cached} for s in result.steps])
+    return summary
+
+
+def print_steps(summary):
+    # Per-step timings of a build() summary
+    timed = [s for s in summary["steps"] if s["seconds"] is not None]
+    if not timed:
+        return
+    print(f"Build {'finished' if summary['ok'] else 'failed'} in {summary['elapsed_s']:.1f}s; step timings:")
+    for step in timed:
+        note = " (cached)" if step["cached"] else ""
+        print(f"  {step['seconds']:7.2f}s  {step['name'][:70]}{note}")
@@ -0,0 +1,189 @@
+# Bulk container lifecycle operations.
+# Targets (IDs, names, ID prefixes, a label selector or a name pattern) are
+# resolved against ONE snapshot of `docker ps -a`, then the start/stop/restart/
+# remove calls run concurrently on a bounded thread pool. The result is a
+# single report with success, error and latency per container.
+
+import fnmatch
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import docker_engine
+import docker_health
+import docker_inventory
+from docker_engine import EngineError, EngineUnavailable
+
+ACTIONS = ("start", "stop", "restart", "remove")
+DEFAULT_CONCURRENCY = 8
+
+# CLI subcommand for each action
+_CLI_ACTIONS = {"start": "start", "stop": "stop", "restart": "restart", "remove": "rm"}
+
+
+def container_snapshot():
+    # One listing of all containers (live inventory, engine JSON, or a single `docker ps -a` call).
+    inventory = docker_inventory.shared()
+    if inventory is not None:
+        return inventory.containers()
+    engine = docker_engine.get_client()
+    if engine is not None:
+        try:
+            return docker_inventory.EngineSource(engine).list_containers()
+        except EngineUnavailable:
+            docker_health.monitor().mark_down()  # socket unreachable: fall back to the CLI
+    return docker_inventory.CliSource().list_containers()  # EngineUnavailable when `docker ps` fails
+
+
+def _match_label(container, selector):
+    key, sep, value = selector.partition("=")
+    if key not in container.labels:
+        return False
+    return not sep or container.labels[key] == value
+
+
+def resolve_targets(snapshot, ids=(), label=None, name_pattern=None, inventory=None):
+    # Return (matched containers, unknown references); IDs may be full IDs, unique prefixes or names.
+    # With a running inventory, IDs and labels resolve through its indexes instead of scanning `snapshot`.
+    if inventory is not None:
+        lookup = inventory.get_container
+        labelled = inventory.find_containers(label=label) if label else []
+        if name_pattern:
+            snapshot = inventory.containers() if snapshot is None else snapshot
+    else:
+        by_name = {c.name: c for c in snapshot}
+
+        def lookup(ref):
+            container = by_name.get(ref)
+            if container is None:
+                candidates = [c for c in snapshot if c.id.startswith(ref)]
+                container = candidates[0] if len(candidates) == 1 else None
+            return container
+        labelled = [c for c in snapshot if _match_label(c, label)] if label else []
+    matched = {}
+    missing = []
+    for ref in ids:
+        ref = ref.strip()
+        if not ref:
+            continue
+        container = lookup(ref)
+        if container is None:
+            missing.append(ref)
+        else:
+            matched[container.id] = container
+    for c in labelled:
+        matched[c.id] = c
+    if name_pattern:
+        for c in snapshot:
+            if fnmatch.fnmatchcase(c.name, name_pattern):
+                matched[c.id] = c
+    return list(matched.values()), missing
+
+
+class BulkResult:
+    __slots__ = ("target", "id", "ok", "error", "latency")
+
+    def __init__(self, target, id, ok, error="", latency=0.0):
+        self.target = target
+        self.id = id
+        self.ok = ok
+        self.error = error
+        self.latency = latency
+
+
+class BulkReport:
+    # Aggregated outcome of one bulk operation.
+
+    def __init__(self, action, results, elapsed):
+        self.action = action
+        self.results = results
+        self.elapsed = elapsed
+
+    @property
+    def succeeded(self):
+        return [r for r in self.results if r.ok]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if not r.ok]
+
+    def as_dict(self):
+        return {
+            "action": self.action,
+            "elapsed_s": round(self.elapsed, 4),
+            "succeeded": len(self.succeeded),
+            "failed": len(self.failed),
+            "results": [
+                {"target": r.target, "id": r.id, "ok": r.ok, "error": r.error,
+                 "latency_ms": round(r.latency * 1000, 2)}
+                for r in self.results
+            ],
+        }
+
+    def print(self):
+        print(f"{self.action}: {len(self.succeeded)} succeeded, {len(self.failed)} failed "
+              f"in {self.elapsed:.2f}s")
+        for r in self.results:
+            status = "ok" if r.ok else f"FAILED: {r.error}"
+            print(f"  {r.target:<30} {r.id[:12]:<12} {r.latency * 1000:8.1f} ms  {status}")
+
+
+def _run_one(action, container):
+    # Execute one lifecycle call; returns an error string ('' on success).
+    engine = docker_engine.get_client()
+    if engine is not None:
+        try:
+            if action == "remove":
+                engine.remove_container(container.id)
+            else:
+                getattr(engine, f"{action}_container")(container.id)
+            return ""
+        except EngineUnavailable:
+            docker_health.monitor().mark_down()  # socket unreachable: fall back to the CLI
+        except EngineError as e:
+            return e.message
+    try:
+        result = subprocess.run(["docker", _CLI_ACTIONS[action], container.id], check=False,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    except FileNotFoundError:
+        return "Docker CLI not found"
+    return "" if result.returncode == 0 else result.stderr.strip() or f"exit status {result.returncode}"
+
+
+def run_bulk(action, ids=(), label=None, name_pattern=None, concurrency=DEFAULT_CONCURRENCY, snapshot=None):
+    # Resolve targets against one snapshot, then apply `action` with at most `concurrency` calls in flight.
+    if action not in ACTIONS:
+        raise ValueError(f"unknown action: {action}")
+    started = time.perf_counter()
+    inventory = docker_inventory.shared() if snapshot is None else None
+    if snapshot is None and inventory is None:
+        snapshot = container_snapshot()
+    targets, missing = resolve_targets(snapshot, ids, label, name_pattern, inventory)
+    results = [BulkResult(ref, "", False, "No such container") for ref in missing]
+
+    def task(container):
+        t0 = time.perf_counter()
+        error = _run_one(action, container)
+        return BulkResult(container.name or container.id, container.id, not error, error,
+                          time.perf_counter() - t0)
+
+    if targets:
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(targets)))) as pool:
+            results.extend(pool.map(task, targets))
+    return BulkReport(action, results, time.perf_counter() - started)
+
+
+def start_containers(ids=(), **kwargs):
+    return run_bulk("start", ids, **kwargs)
+
+
+def stop_containers(ids=(), **kwargs):
+    return run_bulk("stop", ids, **kwargs)
+
+
+def restart_containers(ids=(), **kwargs):
+    return run_bulk("restart", ids, **kwargs)
+
+
+def remove_containers(ids=(), **kwargs):
+    return run_bulk("remove", ids, **kwargs)
@@ -0,0 +1,567 @@
+# Native Docker Engine API client.
+# Talks HTTP/1.1 to the daemon's Unix socket over a small pool of keep-alive
+# connections and returns parsed JSON, so an operation costs one request on an
+# already-open socket instead of a fork/exec of the docker CLI.
+
+import codecs
+import hashlib
+import http.client
+import io
+import json
+import os
+import queue
+import re
+import socket
+import tarfile
+import tempfile
+import threading
+from urllib.parse import quote, urlencode
+
+import instrumentation
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+
+# Bytes read at a time when a JSON array response is decoded incrementally
+READ_CHUNK = 64 * 1024
+
+# Backend selection: "auto" uses the engine socket when it exists and falls
+# back to the docker CLI, "engine" and "cli" force one or the other.
+BACKEND_ENV = "CMS_DOCKER_BACKEND"
+
+
+class EngineError(Exception):
+    # Raised when the daemon answers with an error status.
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class EngineUnavailable(EngineError):
+    # Raised when the socket cannot be reached at all (caller should fall back to the CLI).
+    def __init__(self, message):
+        super().__init__(0, message)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    # http.client connection bound to a Unix domain socket instead of TCP.
+
+    def __init__(self, socket_path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class ConnectionPool:
+    # Thread-safe LIFO pool of idle keep-alive connections.
+
+    def __init__(self, socket_path, size=4, timeout=60):
+        self.socket_path = socket_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self.created = 0
+
+    def get(self):
+        # Return (connection, reused) — reused connections may have been closed by the peer.
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            self.created += 1
+            return UnixHTTPConnection(self.socket_path, timeout=self.timeout), False
+
+    def put(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def discard(self, conn):
+        conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class EngineClient:
+    # Minimal Docker Engine API client covering the operations docker_manager uses.
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, pool_size=4, timeout=60):
+        self.socket_path = socket_path
+        self.pool = ConnectionPool(socket_path, size=pool_size, timeout=timeout)
+
+    # --- transport ---------------------------------------------------------
+
+    def _send(self, method, path, params=None, body=None, headers=None):
+        url = quote(path, safe="/:@")
+        if params:
+            url += "?" + urlencode({k: v for k, v in params.items() if v is not None})
+        headers = dict(headers or {})
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+            headers.setdefault("Content-Type", "application/json")
+
+        # A pooled connection may have been dropped by the daemon while idle;
+        # retry once on a fresh connection in that case.
+        for attempt in range(2):
+            conn, reused = self.pool.get()
+            try:
+                if hasattr(body, "seek"):
+                    body.seek(0)
+                conn.request(method, url, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as e:
+                self.pool.discard(conn)
+                if reused and attempt == 0:
+                    continue
+                raise EngineUnavailable(str(e))
+            except OSError as e:
+                self.pool.discard(conn)
+                raise EngineUnavailable(f"cannot reach {self.socket_path}: {e}")
+        raise EngineUnavailable(f"cannot reach {self.socket_path}")
+
+    def _release(self, conn, resp):
+        if conn.sock is not None:
+            conn.sock.settimeout(conn.timeout)  # streams lift the read timeout
+        if resp.will_close:
+            self.pool.discard(conn)
+        else:
+            self.pool.put(conn)
+
+    @staticmethod
+    def _raise_for_status(resp, data):
+        if resp.status < 400:
+            return
+        message = data.decode(errors="replace").strip()
+        try:
+            message = json.loads(message).get("message", message)
+        except (ValueError, AttributeError):
+            pass
+        raise EngineError(resp.status, message)
+
+    def request(self, method, path, params=None, body=None, headers=None):
+        # Perform a request and return the decoded JSON body (None for empty bodies).
+        with instrumentation.call("engine", f"{method} {api_route(path)}"):
+            conn, resp = self._send(method, path, params, body, headers)
+            try:
+                data = resp.read()
+            except OSError as e:
+                self.pool.discard(conn)
+                raise EngineUnavailable(str(e))
+            self._release(conn, resp)
+            self._raise_for_status(resp, data)
+        if not data:
+            return None
+        if resp.getheader("Content-Type", "").startswith("application/json"):
+            return json.loads(data)
+        return data.decode(errors="replace")
+
+    def stream(self, method, path, params=None, body=None, headers=None):
+        # Yield JSON objects from a streaming (newline-delimited) response.
+        # Only the time to the response headers is measured; streams stay open for as long as they are read.
+        with instrumentation.call("engine", f"{method} {api_route(path)} (stream)"):
+            conn, resp = self._send(method, path, params, body, headers)
+            if resp.status >= 400:
+                data = resp.read()
+                self._release(conn, resp)
+                self._raise_for_status(resp, data)
+        # Events, pulls and builds can stay silent for longer than the request
+        # timeout; a stream ends when the daemon closes it, not on a read timeout.
+        if conn.sock is not None:
+            conn.sock.settimeout(None)
+        finished = False
+        try:
+            while True:
+                try:
+                    line = resp.readline()
+                except OSError as e:
+                    raise EngineUnavailable(f"stream from {self.socket_path} broken: {e}")
+                if not line:
+                    break
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            finished = True
+        finally:
+            if finished:
+                self._release(conn, resp)
+            else:
+                # Abandoned mid-stream: the rest of the body is still on the wire.
+                self.pool.discard(conn)
+
+    def request_items(self, method, path, params=None):
+        # Yield the elements of a JSON array response as they are decoded, so a large
+        # listing is never held as one body plus one parsed list.
+        with instrumentation.call("engine", f"{method} {api_route(path)}"):
+            conn, resp = self._send(method, path, params)
+            if resp.status >= 400:
+                data = resp.read()
+                self._release(conn, resp)
+                self._raise_for_status(resp, data)
+
+        def chunks():
+            while True:
+                try:
+                    chunk = resp.read(READ_CHUNK)
+                except OSError as e:
+                    raise EngineUnavailable(f"response from {self.socket_path} broken: {e}")
+                if not chunk:
+                    return
+                yield chunk
+
+        finished = False
+        try:
+            reader = chunks()
+            yield from iter_json_array(reader)
+            for _ in reader:
+                pass  # trailing newline: the connection goes back to the pool at a clean boundary
+            finished = True
+        finally:
+            if finished:
+                self._release(conn, resp)
+            else:
+                self.pool.discard(conn)
+
+    def close(self):
+        self.pool.close()
+
+    # --- system ------------------------------------------------------------
+
+    def ping(self):
+        return self.request("GET", "/_ping") == "OK"
+
+    def version(self):
+        return self.request("GET", "/version")
+
+    def info(self):
+        return self.request("GET", "/info")
+
+    def events(self, since=None, filters=None):
+        params = {"since": since}
+        if filters:
+            params["filters"] = json.dumps(filters)
+        return self.stream("GET", "/events", params)
+
+    # --- images ------------------------------------------------------------
+
+    def images(self, all=False, filters=None):
+        params = {"all": "1" if all else None}
+        if filters:
+            params["filters"] = json.dumps(filters)
+        return self.request("GET", "/images/json", params)
+
+    def iter_images(self, all=False, filters=None):
+        params = {"all": "1" if all else None}
+        if filters:
+            params["filters"] = json.dumps(filters)
+        return self.request_items("GET", "/images/json", params)
+
+    def inspect_image(self, name):
+        return self.request("GET", f"/images/{name}/json")
+
+    def pull(self, image, tag=None):
+        # Stream pull progress messages for image[:tag].
+        if tag is None:
+            image, tag = split_image_tag(image)
+        return self.stream("POST", "/images/create", {"fromImage": image, "tag": tag})
+
+    def search(self, term, limit=None):
+        return self.request("GET", "/images/search", {"term": term, "limit": limit})
+
+    def build(self, context, tag, dockerfile=None, buildargs=None, excludes=None):
+        # Stream build output; `context` is a directory that gets tarred and uploaded.
+        # `dockerfile` is a path like `docker build -f` takes (default: <context>/Dockerfile);
+        # `excludes` defaults to the context's .dockerignore.
+        if excludes is None:
+            excludes = load_dockerignore(context)
+        elif not callable(excludes):
+            excludes = set(excludes).__contains__
+        dockerfile = dockerfile or os.path.join(context, "Dockerfile")
+        rel = os.path.relpath(os.path.abspath(dockerfile), os.path.abspath(context)).replace(os.sep, "/")
+        extra = ()
+        if rel == ".." or rel.startswith("../"):
+            # Outside the context: ship it alongside under a private name, as the CLI does.
+            rel = ".dockerfile." + hashlib.sha256(os.path.abspath(dockerfile).encode()).hexdigest()[:16]
+            extra = ((dockerfile, rel),)
+        # The daemon always needs the Dockerfile and .dockerignore, even when ignored.
+        always = {rel, ".dockerignore"}
+        skip = excludes
+
+        def keep_required(path):
+            return path not in always and skip(path)
+        keep_required.prune = getattr(skip, "prune", skip)
+
+        archive = make_context_tar(context, keep_required, extra=extra)
+        params = {"t": tag, "dockerfile": rel, "rm": "1"}
+        if buildargs:
+            params["buildargs"] = json.dumps(buildargs)
+        headers = {
+            "Content-Type": "application/x-tar",
+            "Content-Length": str(archive.seek(0, io.SEEK_END)),
+        }
+
+        def gen():
+            try:
+                yield from self.stream("POST", "/build", params, body=archive, headers=headers)
+            finally:
+                archive.close()
+        return gen()
+
+    # --- containers --------------------------------------------------------
+
+    def containers(self, all=False, filters=None):
+        params = {"all": "1" if all else None}
+        if filters:
+            params["filters"] = json.dumps(filters)
+        return self.request("GET", "/containers/json", params)
+
+    def iter_containers(self, all=False, filters=None):
+        params = {"all": "1" if all else None}
+        if filters:
+            params["filters"] = json.dumps(filters)
+        return self.request_items("GET", "/containers/json", params)
+
+    def inspect_container(self, cid):
+        return self.request("GET", f"/containers/{cid}/json")
+
+    def create_container(self, image, name=None, config=None):
+        body = dict(config or {})
+        body["Image"] = image
+        return self.request("POST", "/containers/create", {"name": name or None}, body=body)
+
+    def start_container(self, cid):
+        self._lifecycle(cid, "start")
+
+    def stop_container(self, cid, timeout=None):
+        self._lifecycle(cid, "stop", {"t": timeout})
+
+    def restart_container(self, cid, timeout=None):
+        self._lifecycle(cid, "restart", {"t": timeout})
+
+    def remove_container(self, cid, force=False):
+        self.request("DELETE", f"/containers/{cid}", {"force": "1" if force else None})
+
+    def _lifecycle(self, cid, action, params=None):
+        try:
+            self.request("POST", f"/containers/{cid}/{action}", params)
+        except EngineError as e:
+            # 304: container already in the requested state, same as the CLI treats it.
+            if e.status != 304:
+                raise
+
+    def stats(self, cid, stream=True):
+        if stream:
+            return self.stream("GET", f"/containers/{cid}/stats", {"stream": "1"})
+        return self.request("GET", f"/containers/{cid}/stats", {"stream": "0"})
+
+
+_CONTAINER_ROUTE = re.compile(r"^/containers/(?!json$|create$|prune$)[^/]+")
+_IMAGE_ROUTE = re.compile(r"^/images/(?!json$|create$|search$|prune$|load$|get$)(.+?)(/(json|history|push|tag))?$")
+
+
+def iter_json_array(chunks):
+    # Objects of a JSON array arriving as byte chunks, each yielded once it is complete.
+    decode = json.JSONDecoder().raw_decode
+    text = codecs.getincrementaldecoder("utf-8")()
+    buf, opened = "", False
+    for chunk in chunks:
+        buf += text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buf):
+                break
+            if not opened:
+                if buf[pos] != "[":
+                    raise ValueError("expected a JSON array")
+                opened, pos = True, pos + 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                item, pos = decode(buf, pos)
+            except ValueError:
+                break  # the element continues in the next chunk
+            yield item
+        buf = buf[pos:]
+    if opened or buf.strip():
+        raise ValueError("truncated JSON array")
+
+
+def api_route(path):
+    # "/containers/3f2a.../start" -> "/containers/{id}/start", so metrics are per endpoint, not per object
+    path = _CONTAINER_ROUTE.sub("/containers/{id}", path)
+    return _IMAGE_ROUTE.sub(lambda m: "/images/{name}" + (m.group(2) or ""), path)
+
+
+def split_image_tag(ref):
+    # "repo/name:tag" -> ("repo/name", "tag"); digests and registry ports are left intact.
+    if "@" in ref:
+        return ref, None
+    name, sep, tag = ref.rpartition(":")
+    if sep and "/" not in tag:
+        return name, tag
+    return ref, "latest"
+
+
+def _ignore_regex(pattern):
+    # .dockerignore glob -> regex: `*` and `?` stay within one path segment, `**` spans any depth.
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = end
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile("".join(out) + r"\Z")
+
+
+class DockerIgnore:
+    # Matcher for .dockerignore rules: later rules win, `!` re-includes, and a rule
+    # matching a directory also covers everything beneath it.
+
+    def __init__(self, lines=()):
+        self.rules = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            pattern = line[1:].strip() if negate else line
+            pattern = os.path.normpath(pattern).replace(os.sep, "/").lstrip("/")
+            if pattern and pattern != ".":
+                self.rules.append((negate, _ignore_regex(pattern)))
+        self.has_negations = any(negate for negate, _ in self.rules)
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def __call__(self, path):
+        # True if the context-relative `path` is excluded.
+        path = path.replace(os.sep, "/")
+        parts = path.split("/")
+        prefixes = ["/".join(parts[:n]) for n in range(1, len(parts) + 1)]
+        excluded = False
+        for negate, regex in self.rules:
+            if any(regex.match(p) for p in prefixes):
+                excluded = not negate
+        return excluded
+
+    def prune(self, path):
+        # Whether a directory can be skipped without walking it; a `!` rule may re-include something inside.
+        return not self.has_negations and self(path)
+
+
+def load_dockerignore(context):
+    path = os.path.join(context, ".dockerignore")
+    try:
+        with open(path) as f:
+            return DockerIgnore(f.read().splitlines())
+    except FileNotFoundError:
+        return DockerIgnore()
+
+
+def make_context_tar(path, excludes=(), extra=()):
+    # Tar a build context directory into a temporary file (kept off the heap for large trees).
+    # `excludes` is a callable(relpath) -> bool or an iterable of relative paths to skip; a
+    # callable may also provide prune(reldir) to decide whether a directory is walked at all.
+    # `extra` holds (source file, arcname) pairs added after the context (e.g. an outside Dockerfile).
+    if callable(excludes):
+        skip = excludes
+    else:
+        excluded = set(excludes)
+        skip = excluded.__contains__
+    prune = getattr(skip, "prune", skip)
+    archive = tempfile.TemporaryFile()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        for root, dirs, files in os.walk(path):
+            rel_root = os.path.relpath(root, path)
+            rel_root = "" if rel_root == "." else rel_root
+            dirs[:] = sorted(d for d in dirs if not prune(os.path.join(rel_root, d)))
+            for fname in sorted(files):
+                rel = os.path.join(rel_root, fname)
+                if not skip(rel):
+                    tar.add(os.path.join(root, fname), arcname=rel, recursive=False)
+        for source, arcname in extra:
+            tar.add(source, arcname=arcname, recursive=False)
+    archive.seek(0)
+    return archive
+
+
+def socket_path_from_env():
+    host = os.environ.get("DOCKER_HOST", "")
+    if host.startswith("unix://"):
+        return host[len("unix://"):]
+    return DEFAULT_SOCKET
+
+
+_client = None
+_override = None
+_client_lock = threading.Lock()
+
+
+def backend():
+    return os.environ.get(BACKEND_ENV, "auto").strip().lower() or "auto"
+
+
+def get_client():
+    # Return the shared EngineClient, or None when the CLI backend should be used.
+    global _client
+    mode = backend()
+    if mode == "cli":
+        return None
+    if _override is not None:
+        return _override
+    path = socket_path_from_env()
+    if mode == "auto" and not os.path.exists(path):
+        return None
+    with _client_lock:
+        if _client is None or _client.socket_path != path:
+            _client = EngineClient(path)
+        return _client
+
+
+def set_client(client):
+    # Override the shared client (used by tests and the benchmark harness); None restores auto-detection.
+    global _override
+    with _client_lock:
+        _override = client
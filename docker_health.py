@@ -0,0 +1,154 @@
+# Docker daemon liveness monitor.
+# Replaces the per-call `docker info` probe: the result is cached for a TTL,
+# refreshed in the background once stale (callers get the last known state
+# immediately), and re-probed with exponential backoff while the daemon is down.
+
+import os
+import subprocess
+import threading
+import time
+
+import docker_engine
+
+DEFAULT_TTL = float(os.environ.get("CMS_DOCKER_HEALTH_TTL", "5"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+
+def probe_daemon():
+    # Cheapest available check: engine `/_ping` on the socket, else `docker version`
+    # (which only asks the daemon for its version, unlike the much heavier `docker info`).
+    engine = docker_engine.get_client()
+    if engine is not None:
+        try:
+            return engine.ping()
+        except docker_engine.EngineError:
+            pass  # socket unusable, try the CLI
+    try:
+        subprocess.run(
+            ["docker", "version", "--format", "{{.Server.Version}}"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True
+        )
+        return True
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return False
+
+
+class DaemonMonitor:
+    # Cached, non-blocking view of whether the Docker daemon is reachable.
+
+    def __init__(self, probe=probe_daemon, ttl=DEFAULT_TTL, backoff_base=BACKOFF_BASE,
+                 backoff_max=BACKOFF_MAX, clock=time.monotonic):
+        self.probe = probe
+        self.ttl = ttl
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.clock = clock
+        self.available = None  # None until the first probe completes
+        self.latency = None
+        self.checked_at = None
+        self.expires_at = 0.0
+        self.failures = 0
+        self.probes = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._thread = None
+
+    def is_running(self):
+        # Known state is returned at once; only the very first call waits for a probe.
+        with self._lock:
+            available = self.available
+            stale = self.clock() >= self.expires_at
+            start_background = available is not None and stale and not self._refreshing
+            if start_background:
+                self._refreshing = True
+        if available is None:
+            return self.refresh()
+        if start_background:
+            self._thread = threading.Thread(target=self._background_refresh, daemon=True)
+            self._thread.start()
+        return available
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def refresh(self):
+        # Probe synchronously and record the outcome and its latency.
+        start = self.clock()
+        try:
+            ok = bool(self.probe())
+        except Exception:
+            ok = False
+        now = self.clock()
+        with self._lock:
+            self.probes += 1
+            self.latency = now - start
+            self.checked_at = now
+            self.available = ok
+            if ok:
+                self.failures = 0
+                self.expires_at = now + self.ttl
+            else:
+                self.failures += 1
+                delay = min(self.backoff_base * 2 ** (self.failures - 1), self.backoff_max)
+                self.expires_at = now + delay
+        return ok
+
+    def wait(self, timeout=None):
+        # Block until an in-flight background refresh (if any) has finished.
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def mark_down(self):
+        # Record a failure observed by an operation (e.g. the socket refused a connection).
+        with self._lock:
+            self.available = False
+            self.failures += 1
+            self.checked_at = self.clock()
+            self.expires_at = self.checked_at + min(self.backoff_base * 2 ** (self.failures - 1),
+                                                    self.backoff_max)
+
+    def invalidate(self):
+        # Forget the cached state; the next is_running() call probes synchronously.
+        with self._lock:
+            self.available = None
+            self.expires_at = 0.0
+
+    def status(self):
+        with self._lock:
+            now = self.clock()
+            return {
+                "available": self.available,
+                "latency_ms": None if self.latency is None else round(self.latency * 1000, 3),
+                "age_s": None if self.checked_at is None else round(now - self.checked_at, 3),
+                "next_probe_s": round(max(0.0, self.expires_at - now), 3),
+                "failures": self.failures,
+                "probes": self.probes,
+            }
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def monitor():
+    # Shared process-wide monitor.
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = DaemonMonitor()
+        return _monitor
+
+
+def reset(new_monitor=None):
+    # Replace the shared monitor (tests use this to start from an unknown state).
+    global _monitor
+    with _monitor_lock:
+        _monitor = new_monitor
@@ -0,0 +1,567 @@
+# Event-driven in-memory inventory of Docker images and containers.
+# Loaded once with a full listing, then kept current by following the
+# `docker events` stream (only the object named in an event is re-fetched).
+# Lookups by ID, ID prefix, name, repository, tag and label are dictionary or
+# bisect operations instead of a `docker images` / `docker ps -a` round trip.
+# If the event stream breaks, the inventory resyncs in full and reconnects.
+
+import bisect
+import json
+import re
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+
+import docker_engine
+import docker_health
+import instrumentation
+from docker_engine import EngineError, EngineUnavailable
+
+_SIZE_UNITS = {"B": 1, "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4,
+               "KIB": 1024, "MIB": 1024 ** 2, "GIB": 1024 ** 3}
+
+# Container events that do not change anything the inventory stores
+_IGNORED_ACTIONS = ("exec_", "attach", "resize", "top", "health_status", "copy", "archive-path", "export",
+                    "commit", "detach")
+
+
+def parse_size(text):
+    # "142MB" / "1.2GB" / "512kB" -> bytes (CLI output is human readable).
+    m = re.match(r"\s*([\d.]+)\s*([a-zA-Z]*)", str(text))
+    if not m:
+        return 0
+    unit = m.group(2).upper() or "B"
+    return int(float(m.group(1)) * _SIZE_UNITS.get(unit, 1))
+
+
+def parse_created(text):
+    # "2024-01-01 10:00:00 +0000 UTC" -> epoch seconds.
+    try:
+        return int(datetime.strptime(" ".join(str(text).split()[:3]), "%Y-%m-%d %H:%M:%S %z").timestamp())
+    except ValueError:
+        return 0
+
+
+def parse_labels(text):
+    if isinstance(text, dict):
+        return dict(text)
+    labels = {}
+    for part in (text or "").split(","):
+        if part:
+            key, _, value = part.partition("=")
+            labels[key] = value
+    return labels
+
+
+class ImageRecord:
+    __slots__ = ("id", "repo_tags", "created", "size", "labels")
+
+    def __init__(self, id, repo_tags=(), created=0, size=0, labels=None):
+        self.id = id
+        self.repo_tags = tuple(repo_tags)
+        self.created = created
+        self.size = size
+        self.labels = labels or {}
+
+    @property
+    def short_id(self):
+        return self.id.split(":")[-1][:12]
+
+    def refs(self):
+        # (repository, tag) pairs; untagged images yield ("<none>", "<none>").
+        if not self.repo_tags:
+            return [("<none>", "<none>")]
+        return [tuple(ref.rsplit(":", 1)) if ":" in ref.rsplit("/", 1)[-1] else (ref, "<none>")
+                for ref in self.repo_tags]
+
+    @classmethod
+    def from_engine(cls, data):
+        tags = [t for t in data.get("RepoTags") or [] if t != "<none>:<none>"]
+        return cls(data["Id"], tags, data.get("Created", 0), data.get("Size", 0), data.get("Labels"))
+
+    @classmethod
+    def from_inspect(cls, data):
+        created = data.get("Created", 0)
+        if isinstance(created, str):
+            try:
+                # "2024-05-01T12:00:00.123456789Z": always UTC; fractions beyond microseconds are dropped
+                created = int(datetime.fromisoformat(created[:19]).replace(tzinfo=timezone.utc).timestamp())
+            except ValueError:
+                created = 0
+        return cls(data["Id"], data.get("RepoTags") or [], created, data.get("Size", 0),
+                   (data.get("Config") or {}).get("Labels"))
+
+    @classmethod
+    def from_cli(cls, data):
+        # One `docker images --format '{{json .}}'` row (one repo:tag of an image).
+        tags = []
+        if data.get("Repository", "<none>") != "<none>":
+            tags.append(f"{data['Repository']}:{data.get('Tag', 'latest')}")
+        image_id = data.get("ID", "")
+        if not image_id.startswith("sha256:") and len(image_id) == 64:
+            image_id = "sha256:" + image_id
+        return cls(image_id, tags, parse_created(data.get("CreatedAt", "")), parse_size(data.get("Size", "0")))
+
+
+class ContainerRecord:
+    __slots__ = ("id", "name", "image", "command", "created", "state", "status", "labels")
+
+    def __init__(self, id, name, image="", command="", created=0, state="", status="", labels=None):
+        self.id = id
+        self.name = name
+        self.image = image
+        self.command = command
+        self.created = created
+        self.state = state
+        self.status = status
+        self.labels = labels or {}
+
+    @property
+    def short_id(self):
+        return self.id[:12]
+
+    @classmethod
+    def from_engine(cls, data):
+        names = data.get("Names") or ["/"]
+        return cls(data["Id"], names[0].lstrip("/"), data.get("Image", ""), data.get("Command", ""),
+                   data.get("Created", 0), data.get("State", ""), data.get("Status", ""), data.get("Labels"))
+
+    @classmethod
+    def from_cli(cls, data):
+        name = (data.get("Names") or "").split(",")[0]
+        return cls(data.get("ID", ""), name, data.get("Image", ""), (data.get("Command") or "").strip('"'),
+                   parse_created(data.get("CreatedAt", "")), data.get("State", ""), data.get("Status", ""),
+                   parse_labels(data.get("Labels")))
+
+
+class EngineSource:
+    # Inventory data source backed by the Engine API.
+
+    def __init__(self, client):
+        self.client = client
+
+    def iter_images(self):
+        return (ImageRecord.from_engine(i) for i in self.client.iter_images())
+
+    def iter_containers(self):
+        return (ContainerRecord.from_engine(c) for c in self.client.iter_containers(all=True))
+
+    def list_images(self):
+        return list(self.iter_images())
+
+    def list_containers(self):
+        return list(self.iter_containers())
+
+    def get_image(self, ref):
+        try:
+            return ImageRecord.from_inspect(self.client.inspect_image(ref))
+        except EngineError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def get_container(self, cid):
+        found = self.client.containers(all=True, filters={"id": [cid]})
+        return ContainerRecord.from_engine(found[0]) if found else None
+
+    def events(self, since):
+        return self.client.events(since=since)
+
+    def close(self):
+        pass
+
+
+class CliSource:
+    # Inventory data source backed by the docker CLI's JSON output.
+
+    def __init__(self):
+        self._proc = None
+
+    @staticmethod
+    def _json_lines(cmd):
+        # Rows of `--format '{{json .}}'` output, parsed as the CLI writes them
+        # (the timed call spans the whole read, which is what the listing waits for)
+        with instrumentation.call("subprocess", instrumentation.command_name(cmd)) as timer:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            try:
+                for line in proc.stdout:
+                    if line.strip():
+                        yield json.loads(line)
+                error = proc.stderr.read()
+                if proc.wait() != 0:
+                    timer.fail()
+                    raise EngineUnavailable(error.strip() or f"{' '.join(cmd)} failed")
+            finally:
+                if proc.poll() is None:  # abandoned part way through
+                    proc.kill()
+                    proc.wait()
+                proc.stdout.close()
+                proc.stderr.close()
+
+    def iter_images(self):
+        # One record per image: `docker images` prints a row per repo:tag, and a
+        # record already handed out gets the image's later tags added to it.
+        seen = {}
+        for row in self._json_lines(["docker", "images", "--no-trunc", "--format", "{{json .}}"]):
+            rec = ImageRecord.from_cli(row)
+            if rec.id in seen:
+                seen[rec.id].repo_tags += rec.repo_tags
+            else:
+                seen[rec.id] = rec
+                yield rec
+
+    def iter_containers(self):
+        return (ContainerRecord.from_cli(row)
+                for row in self._json_lines(["docker", "ps", "-a", "--no-trunc", "--format", "{{json .}}"]))
+
+    def list_images(self):
+        return list(self.iter_images())
+
+    def list_containers(self):
+        return list(self.iter_containers())
+
+    def get_image(self, ref):
+        result = subprocess.run(["docker", "image", "inspect", ref], check=False,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            return None
+        return ImageRecord.from_inspect(json.loads(result.stdout)[0])
+
+    def get_container(self, cid):
+        rows = list(self._json_lines(["docker", "ps", "-a", "--no-trunc", "--filter", f"id={cid}",
+                                      "--format", "{{json .}}"]))
+        return ContainerRecord.from_cli(rows[0]) if rows else None
+
+    def events(self, since):
+        self._proc = subprocess.Popen(["docker", "events", "--since", str(since), "--format", "{{json .}}"],
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        for line in self._proc.stdout:
+            if line.strip():
+                yield json.loads(line)
+        self._proc.wait()
+
+    def close(self):
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.terminate()
+
+
+def default_source():
+    engine = docker_engine.get_client()
+    return EngineSource(engine) if engine is not None else CliSource()
+
+
+class Inventory:
+    # Indexed, thread-safe store of image and container records.
+
+    def __init__(self, source=None, resync_backoff=docker_health.BACKOFF_BASE,
+                 resync_backoff_max=docker_health.BACKOFF_MAX, clock=time.time):
+        self.source = source or default_source()
+        self.resync_backoff = resync_backoff
+        self.resync_backoff_max = resync_backoff_max
+        self.failures = 0  # consecutive stream breaks without a delivered event
+        self.clock = clock
+        self._lock = threading.RLock()
+        self._images = {}
+        self._containers = {}
+        self._clear_indexes()
+        self.loaded_at = None
+        self.image_version = 0  # bumped on every image change so derived indexes know when to rebuild
+        self.resyncs = 0
+        self.events_applied = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._ready = threading.Event()
+
+    def _clear_indexes(self):
+        self._image_ids = []         # sorted, for prefix lookup
+        self._container_ids = []
+        self._by_name = {}           # container name -> id
+        self._by_repo = {}           # repository -> {image id}
+        self._by_tag = {}            # tag -> {image id}
+        self._image_labels = {}      # "key" and "key=value" -> {image id}
+        self._container_labels = {}  # "key" and "key=value" -> {container id}
+
+    # --- index maintenance -------------------------------------------------
+
+    @staticmethod
+    def _add(index, key, value):
+        index.setdefault(key, set()).add(value)
+
+    @staticmethod
+    def _discard(index, key, value):
+        members = index.get(key)
+        if members is not None:
+            members.discard(value)
+            if not members:
+                del index[key]
+
+    @staticmethod
+    def _label_keys(labels):
+        for key, value in (labels or {}).items():
+            yield key
+            yield f"{key}={value}"
+
+    def _index_image(self, rec, add=True):
+        op = self._add if add else self._discard
+        for repo, tag in rec.refs():
+            op(self._by_repo, repo, rec.id)
+            op(self._by_tag, tag, rec.id)
+        for key in self._label_keys(rec.labels):
+            op(self._image_labels, key, rec.id)
+
+    def _index_container(self, rec, add=True):
+        op = self._add if add else self._discard
+        for key in self._label_keys(rec.labels):
+            op(self._container_labels, key, rec.id)
+        if add:
+            self._by_name[rec.name] = rec.id
+        elif self._by_name.get(rec.name) == rec.id:
+            del self._by_name[rec.name]
+
+    @staticmethod
+    def _insert_sorted(ids, value):
+        i = bisect.bisect_left(ids, value)
+        if i == len(ids) or ids[i] != value:
+            ids.insert(i, value)
+
+    @staticmethod
+    def _remove_sorted(ids, value):
+        i = bisect.bisect_left(ids, value)
+        if i < len(ids) and ids[i] == value:
+            del ids[i]
+
+    def upsert_image(self, rec):
+        with self._lock:
+            old = self._images.get(rec.id)
+            if old is not None:
+                self._index_image(old, add=False)
+            else:
+                self._insert_sorted(self._image_ids, rec.id)
+            self._images[rec.id] = rec
+            self._index_image(rec)
+            self.image_version += 1
+
+    def remove_image(self, image_id):
+        with self._lock:
+            rec = self._images.pop(image_id, None)
+            if rec is not None:
+                self._index_image(rec, add=False)
+                self._remove_sorted(self._image_ids, image_id)
+                self.image_version += 1
+
+    def upsert_container(self, rec):
+        with self._lock:
+            old = self._containers.get(rec.id)
+            if old is not None:
+                self._index_container(old, add=False)
+            else:
+                self._insert_sorted(self._container_ids, rec.id)
+            self._containers[rec.id] = rec
+            self._index_container(rec)
+
+    def remove_container(self, cid):
+        with self._lock:
+            rec = self._containers.pop(cid, None)
+            if rec is not None:
+                self._index_container(rec, add=False)
+                self._remove_sorted(self._container_ids, cid)
+
+    # --- loading -----------------------------------------------------------
+
+    def load(self):
+        # Full resync from the source; replaces everything currently held.
+        images = self.source.list_images()
+        containers = self.source.list_containers()
+        with self._lock:
+            self._images = {}
+            self._containers = {}
+            self._clear_indexes()
+            for rec in images:
+                self.upsert_image(rec)
+            for rec in containers:
+                self.upsert_container(rec)
+            self.loaded_at = self.clock()
+        self._ready.set()
+
+    def apply_event(self, event):
+        # Update only the object an event refers to.
+        kind = event.get("Type")
+        action = event.get("Action") or event.get("status") or ""
+        actor = event.get("Actor") or {}
+        ref = actor.get("ID") or event.get("id", "")
+        if kind == "container":
+            if action.startswith(_IGNORED_ACTIONS):
+                return
+            if action == "destroy":
+                self.remove_container(ref)
+            else:
+                rec = self.source.get_container(ref)
+                if rec is None:
+                    self.remove_container(ref)
+                else:
+                    self.upsert_container(rec)
+        elif kind == "image":
+            if action == "delete":
+                image_id = self.resolve_image_id(ref) or ref
+                self.remove_image(image_id)
+            else:
+                rec = self.source.get_image(ref)
+                if rec is None:
+                    self.remove_image(self.resolve_image_id(ref) or ref)
+                else:
+                    # re-tagging may move a tag off another image
+                    with self._lock:
+                        refs = set(rec.refs())
+                        stale = {other for repo, _ in refs for other in self._by_repo.get(repo, ())
+                                 if other != rec.id and refs & set(self._images[other].refs())}
+                    for other in stale:
+                        refreshed = self.source.get_image(other)
+                        if refreshed is None:
+                            self.remove_image(other)
+                        else:
+                            self.upsert_image(refreshed)
+                    self.upsert_image(rec)
+        else:
+            return
+        self.events_applied += 1
+
+    def start(self, wait=True, timeout=30):
+        # Load and follow events on a background thread.
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._follow, name="docker-inventory", daemon=True)
+        self._thread.start()
+        if wait:
+            self._ready.wait(timeout)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.source.close()
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def _follow(self):
+        first = True
+        while not self._stop.is_set():
+            # Subscribe from a point before the listing so no event falls in the gap.
+            since = int(self.clock()) - 1
+            try:
+                if not first:
+                    self.resyncs += 1
+                first = False
+                self.load()
+                for event in self.source.events(since):
+                    if self._stop.is_set():
+                        return
+                    self.apply_event(event)
+                    self.failures = 0  # the stream is healthy again
+            except (EngineError, OSError, ValueError):
+                pass
+            if not self._stop.is_set():
+                # Back off exponentially while the stream keeps breaking (e.g. the daemon is down).
+                self.failures += 1
+                self._stop.wait(min(self.resync_backoff * 2 ** (self.failures - 1), self.resync_backoff_max))
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    # --- queries -----------------------------------------------------------
+
+    def images(self):
+        with self._lock:
+            return list(self._images.values())
+
+    def containers(self, all=True):
+        with self._lock:
+            found = list(self._containers.values())
+        return found if all else [c for c in found if c.state == "running"]
+
+    @staticmethod
+    def _prefix(ids, prefix):
+        i = bisect.bisect_left(ids, prefix)
+        out = []
+        while i < len(ids) and ids[i].startswith(prefix):
+            out.append(ids[i])
+            i += 1
+        return out
+
+    def resolve_image_id(self, ref):
+        # Full ID for an image ID / ID prefix (with or without "sha256:") or repo:tag.
+        with self._lock:
+            if ref in self._images:
+                return ref
+            repo, _, tag = ref.rpartition(":") if ":" in ref.rsplit("/", 1)[-1] else (ref, "", "latest")
+            for image_id in self._by_repo.get(repo, ()):
+                if (repo, tag) in self._images[image_id].refs():
+                    return image_id
+            prefix = ref if ref.startswith("sha256:") else "sha256:" + ref
+            matches = self._prefix(self._image_ids, prefix)
+            return matches[0] if len(matches) == 1 else None
+
+    def get_image(self, ref):
+        image_id = self.resolve_image_id(ref)
+        return self._images.get(image_id) if image_id else None
+
+    def get_container(self, ref):
+        # Container by full ID, unique ID prefix or name.
+        with self._lock:
+            if ref in self._containers:
+                return self._containers[ref]
+            cid = self._by_name.get(ref)
+            if cid is None:
+                matches = self._prefix(self._container_ids, ref)
+                cid = matches[0] if len(matches) == 1 else None
+            return self._containers.get(cid) if cid else None
+
+    def find_images(self, repo=None, tag=None, label=None):
+        with self._lock:
+            sets = []
+            if repo is not None:
+                sets.append(self._by_repo.get(repo, set()))
+            if tag is not None:
+                sets.append(self._by_tag.get(tag, set()))
+            if label is not None:
+                sets.append(self._image_labels.get(label, set()))
+            ids = set.intersection(*sets) if sets else set(self._images)
+            return [self._images[i] for i in ids]
+
+    def find_containers(self, label=None, state=None):
+        with self._lock:
+            ids = self._container_labels.get(label, set()) if label is not None else self._containers
+            found = [self._containers[i] for i in ids]
+        return found if state is None else [c for c in found if c.state == state]
+
+    def stats(self):
+        with self._lock:
+            return {"images": len(self._images), "containers": len(self._containers),
+                    "events_applied": self.events_applied, "resyncs": self.resyncs,
+                    "loaded_at": self.loaded_at}
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared():
+    # The running shared inventory, or None when the inventory has not been started.
+    inv = _shared
+    return inv if inv is not None and inv.ready else None
+
+
+def start_shared(source=None, wait=True):
+    # Start the process-wide inventory; until its first load completes, shared() returns None.
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Inventory(source).start(wait=wait)
+        return _shared
+
+
+def stop_shared():
+    global _shared
+    with _shared_lock:
+        if _shared is not None:
+            _shared.stop()
+            _shared = None
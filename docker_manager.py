@@ -1,44 +1,147 @@
 import subprocess
 import os
-import shlex
+import time
+
+import docker_build
+import dockerfile_analyzer
+import dockerfile_templates
+import docker_bulk
+import docker_engine
+import docker_health
+import docker_inventory
+import docker_metrics
+import docker_pull
+import hub_cache
+import image_search
+import instrumentation
+import job_manager
+import listing
+from docker_engine import EngineError, EngineUnavailable
 
 ERROR_MSG = "Docker Engine is not running. Please start Docker."
 
+
+def _engine():
+    # Engine API client when the socket backend is active, otherwise None (use the CLI).
+    return docker_engine.get_client()
+
+
+def _print_table(headers, rows):
+    # Print rows as left-aligned columns, like the docker CLI tables.
+    widths = [len(h) for h in headers]
+    for row in rows:
+        widths = [max(w, len(str(c))) for w, c in zip(widths, row)]
+    fmt = "   ".join("{:<%d}" % w for w in widths)
+    print(fmt.format(*headers).rstrip())
+    for row in rows:
+        print(fmt.format(*[str(c) for c in row]).rstrip())
+
+
+IMAGE_HEADERS = ["REPOSITORY", "TAG", "IMAGE ID", "CREATED", "SIZE"]
+
+
+def _print_listing(records, kind, where=None):
+    # Render typed records as one table; CLI-backed records are streamed from `{{json .}}` rows.
+    try:
+        page = listing.select(records, kind, where=where)
+    except EngineError as e:
+        _print_engine_error(f"Failed to list {kind}:", e)
+        return
+    except FileNotFoundError:
+        print("Docker CLI not found. Please install Docker.")
+        return
+    print("\n".join(page.lines()))
+
+
+def _local_images():
+    # Image records from the live inventory or the engine; None means "use the CLI".
+    inventory = docker_inventory.shared()
+    if inventory is not None:
+        return inventory.images()
+    engine = _engine()
+    if engine is not None:
+        try:
+            return list(docker_inventory.EngineSource(engine).iter_images())
+        except EngineUnavailable:
+            docker_health.monitor().mark_down()  # socket unreachable: fall back to the CLI
+    return None
+
+
+def _local_containers(all_containers=True):
+    # Container records from the live inventory or the engine; None means "use the CLI".
+    inventory = docker_inventory.shared()
+    if inventory is not None:
+        return inventory.containers(all=all_containers)
+    engine = _engine()
+    if engine is not None:
+        try:
+            return [docker_inventory.ContainerRecord.from_engine(c)
+                    for c in engine.iter_containers(all=all_containers)]
+        except EngineUnavailable:
+            docker_health.monitor().mark_down()  # socket unreachable: fall back to the CLI
+    return None
+
+
+def _print_engine_error(prefix, err):
+    print(prefix)
+    print(err.message)
+
 def check_docker_running():
     # Return True if Docker daemon is reachable on this host.
-    try:
-        subprocess.run(
-            ["docker", "info"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            check=True
-        )
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
-    
+    # Answered from the cached daemon monitor; a stale result is refreshed in the background.
+    return docker_health.monitor().is_running()
+
+
+@instrumentation.timed
+def daemon_status():
+    # Print the daemon monitor's last known state and measured probe latency.
+    status = docker_health.monitor().status()
+    if status["available"] is None:
+        docker_health.monitor().refresh()
+        status = docker_health.monitor().status()
+    state = "running" if status["available"] else "not reachable"
+    print(f"Docker daemon: {state}")
+    print(f"  probe latency: {status['latency_ms']} ms")
+    print(f"  checked: {status['age_s']} s ago, next probe in {status['next_probe_s']} s")
+    if status["failures"]:
+        print(f"  consecutive failures: {status['failures']}")
+
+@instrumentation.timed
 def list_images():
     # List available Docker images (prints output).
     if not check_docker_running():
         print(ERROR_MSG)
         return
-    subprocess.run(["docker", "images"]) 
+    images = _local_images()
+    _print_listing(docker_inventory.CliSource().iter_images() if images is None else images, "images")
+
+
+def _list_containers(all_containers):
+    containers = _local_containers(all_containers)
+    if containers is not None:
+        _print_listing(containers, "containers")
+        return
+    running = None if all_containers else (lambda c: c.state == "running")
+    _print_listing(docker_inventory.CliSource().iter_containers(), "containers", where=running)
 
 
+@instrumentation.timed
 def list_running_containers():
     # List running Docker containers (prints output).
     if not check_docker_running():
         print(ERROR_MSG)
         return
-    subprocess.run(["docker", "ps"]) 
+    _list_containers(False)
 
+@instrumentation.timed
 def list_all_containers():
     # List all Docker containers (running and stopped).
     if not check_docker_running():
         print(ERROR_MSG)
         return
-    subprocess.run(["docker", "ps","-a"]) 
+    _list_containers(True)
 
+@instrumentation.timed
 def run_image():
     # Run an image in detached mode; prompts for image and optional container name.
     if not check_docker_running():
@@ -52,6 +155,17 @@ def run_image():
 
     name = input("Enter container name (optional): ").strip()
 
+    engine = _engine()
+    if engine is not None:
+        try:
+            print(_engine_run(engine, image, name))
+            return
+        except EngineUnavailable:
+            docker_health.monitor().mark_down()  # socket unreachable: fall back to the CLI
+        except EngineError as e:
+            _print_engine_error("Failed to run image:", e)
+            return
+
     cmd = ["docker", "run", "-d"]
     if name:
         cmd += ["--name", name]
@@ -66,6 +180,23 @@ def run_image():
             print(result.stderr.strip())
     except FileNotFoundError:
         print("Docker CLI not found. Please install Docker.")
+
+
+def _engine_run(engine, image, name=None):
+    # Equivalent of `docker run -d`: create (pulling the image if missing) then start.
+    try:
+        created = engine.create_container(image, name)
+    except EngineError as e:
+        if e.status != 404:
+            raise
+        for _ in engine.pull(image):
+            pass
+        created = engine.create_container(image, name)
+    engine.start_container(created["Id"])
+    return created["Id"]
+
+
+@instrumentation.timed
 def stop_container():
     # Stop a running container given its ID or name.
     if not check_docker_running():
@@ -74,6 +205,17 @@ def stop_container():
 
     list_running_containers()
     cid = input("Enter container ID or name to stop: ").strip()
+    engine = _engine()
+    if engine is not None:
+        try:
+            engine.stop_container(cid)
+            print(cid)
+            return
+        except EngineUnavailable:
+            docker_health.monitor().mark_down()  # socket unreachable: fall back to the CLI
+        except EngineError as e:
+            _print_engine_error("Failed to stop container:", e)
+            return
     try:
         result = subprocess.run(["docker", "stop", cid], check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
         if result.returncode == 0:
@@ -85,17 +227,30 @@ def stop_container():
         print("Docker CLI not found. Please install Docker.")
 
 
+@instrumentation.timed
 def search_dockerhub():
     # Search Docker Hub for images (prints search results).
     # `docker search` doesn't require the daemon to be running, so skip the daemon check.
+    # Results are cached on disk (see hub_cache.py); CMS_OFFLINE=1 serves only cached results.
     name = input("Enter image name to search on DockerHub: ").strip()
     if not name:
         print("Image name cannot be empty.")
         return
-    subprocess.run(["docker", "search", name])
+    try:
+        found = hub_cache.cache().search(name)
+    except hub_cache.HubSearchError as e:
+        print("Failed to search Docker Hub:")
+        print(e)
+        return
+    rows = [[r["name"], r["description"][:45], r["stars"], "[OK]" if r["official"] else ""] for r in found.results]
+    _print_table(["NAME", "DESCRIPTION", "STARS", "OFFICIAL"], rows)
+    if found.source != "miss":
+        note = {"hit": "cached", "stale": "cached, refreshing in background", "offline": "offline, cached"}
+        print(f"({note[found.source]} result from {int(found.age)}s ago)")
 
 
 
+@instrumentation.timed
 def pull_image():
     # Pull an image from Docker Hub by name:tag.
     if not check_docker_running():
@@ -103,18 +258,78 @@ def pull_image():
         return
 
     name = input("Enter image name to pull: ").strip()
+    if job_manager.background("pull", {"refs": [name], "concurrency": 1, "skip_existing": "never"}):
+        return
+    engine = _engine()
+    if engine is not None:
+        try:
+            for msg in engine.pull(name):
+                if "error" in msg:
+                    raise EngineError(500, msg["error"])
+                if "status" in msg and "progress" not in msg:
+                    print(f"{msg['id']}: {msg['status']}" if msg.get("id") else msg["status"])
+            return
+        except EngineUnavailable:
+            docker_health.monitor().mark_down()  # socket unreachable: fall back to the CLI
+        except EngineError as e:
+            _print_engine_error("Failed to pull image:", e)
+            return
     try:
-        result = subprocess.run(["docker", "pull", name], check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if result.returncode == 0:
-            print(result.stdout)
-        else:
+        # stdout is not captured so progress shows up live instead of after the whole pull
+        result = subprocess.run(["docker", "pull", name], check=False, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
             print("Failed to pull image:")
             print(result.stderr)
     except FileNotFoundError:
         print("Docker CLI not found. Please install Docker.")
 
 
+@instrumentation.timed
+def pull_multiple_images():
+    # Pull several images in parallel from a comma-separated list or a manifest file.
+    if not check_docker_running():
+        print(ERROR_MSG)
+        return
+
+    source = input("Enter image names (comma-separated) or manifest file path: ").strip()
+    if not source:
+        print("Image list cannot be empty.")
+        return
+    if os.path.isfile(source):
+        try:
+            refs = docker_pull.load_manifest(source)
+        except (OSError, ValueError) as e:
+            print("Failed to read manifest:", e)
+            return
+    else:
+        refs = source.split(",")
+
+    concurrency = input(f"Max parallel pulls (default {docker_pull.DEFAULT_CONCURRENCY}): ").strip()
+    try:
+        concurrency = int(concurrency) if concurrency else docker_pull.DEFAULT_CONCURRENCY
+    except ValueError:
+        print("Concurrency must be a number.")
+        return
+
+    report = docker_pull.pull_images(refs, concurrency=concurrency, on_update=docker_pull.TerminalView())
+    report.print()
+
+
+
+def _review_dockerfile(text, path):
+    # Report cache-busting and image-bloat patterns; offer the safe rewrites. Returns the (possibly fixed) text.
+    findings = dockerfile_analyzer.analyze(text)
+    dockerfile_analyzer.print_report(findings, path)
+    fixable = [f for f in findings if f.fixable]
+    if fixable:
+        answer = input(f"Apply {len(fixable)} safe fix(es)? (y/n): ").strip().lower()
+        if answer == "y":
+            text, applied = dockerfile_analyzer.fix(text, fixable)
+            print(f"Applied {len(applied)} fix(es).")
+    return text
 
+
+@instrumentation.timed
 def create_dockerfile():
     # Create a Dockerfile using guided prompts, pasted content, or loading from a file.
     path = input("Enter path to save Dockerfile (default: ./Dockerfile): ").strip()
@@ -128,12 +343,13 @@ def create_dockerfile():
             return
 
     print("Choose Dockerfile input mode:")
-    print("1. Guided prompts (base image + start command)")
+    print("1. Guided prompts (detects Python/Node/Go projects; base image + start command)")
     print("2. Paste full multi-line Dockerfile (end with a single line containing a dot '.')")
     print("3. Load from existing file path")
     mode = input("Mode [1/2/3] (default 1): ").strip() or "1"
 
     dockerfile_content = ""
+    project = None
 
     if mode == "3":
         src = input("Enter source file path to load Dockerfile from: ").strip()
@@ -157,28 +373,18 @@ def create_dockerfile():
         dockerfile_content = "\n".join(lines) + "\n"
 
     else:
-        base_image = input("Enter base image (default: python:3.12-slim): ").strip()
-        if not base_image:
-            base_image = "python:3.12-slim"
-
-        start_cmd = input("Enter start command (default: python app.py): ").strip()
-        if not start_cmd:
-            start_cmd = "python app.py"
-
-        # split command safely
-        try:
-            cmd_parts = shlex.split(start_cmd)
-        except Exception:
-            cmd_parts = start_cmd.split()
+        # Detect the project next to the Dockerfile and generate a cache-friendly template for it
+        project = dockerfile_templates.detect_project(os.path.dirname(path) or ".")
+        if project is not None:
+            print(f"Detected {project.describe()}: dependencies are installed before the source is copied.")
+        default_image = project.base_image if project else dockerfile_templates.GENERIC_BASE
+        default_cmd = project.start_cmd if project else dockerfile_templates.GENERIC_CMD
 
-        cmd_array = ", ".join([f'"{p}"' for p in cmd_parts])
+        base_image = input(f"Enter base image (default: {default_image}): ").strip()
+        start_cmd = input(f"Enter start command (default: {default_cmd}): ").strip()
+        dockerfile_content = dockerfile_templates.render(project, base_image, start_cmd)
 
-        dockerfile_content = (
-            f"FROM {base_image}\n"
-            f"WORKDIR /app\n"
-            f"COPY . .\n"
-            f"CMD [{cmd_array}]\n"
-        )
+    dockerfile_content = _review_dockerfile(dockerfile_content, path)
 
     directory = os.path.dirname(path)
     if directory and not os.path.exists(directory):
@@ -188,38 +394,55 @@ def create_dockerfile():
         f.write(dockerfile_content)
 
     print(f"Dockerfile created successfully at {path}")
+    if project is not None:
+        # keep local dependency/cache directories out of `COPY . .`
+        added = docker_build.write_dockerignore(directory or ".", dockerfile_templates.DOCKERIGNORE[project.kind])
+        if added:
+            print(f"Added {len(added)} pattern(s) to .dockerignore")
 
 
+@instrumentation.timed
 def search_local_images():
-    # Search for local images matching a name or tag and display results.
+    # Search local images by name/tag with ranking and field filters (repo:, tag:, label:, id:, size>).
     if not check_docker_running():
         print(ERROR_MSG)
         return
 
     name = input("Enter image name or tag to search locally: ").strip()
-    # Use docker images with a simple filter and print matching lines
-    result = subprocess.run(["docker", "images"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if result.returncode != 0:
-        print("Failed to list local images:")
-        print(result.stderr)
-        return
-
-    lines = result.stdout.splitlines()
-    header = lines[0] if lines else ""
-    matches = [l for l in lines if name.lower() in l.lower()]
-
-    if not matches:
+    inventory = docker_inventory.shared()
+    if inventory is not None:
+        index = image_search.index_for(inventory)
+    else:
+        images = _local_images()
+        if images is None:
+            try:
+                images = docker_inventory.CliSource().list_images()
+            except (EngineError, ValueError) as e:
+                print("Failed to list local images:")
+                print(getattr(e, "message", e))
+                return
+            except FileNotFoundError:
+                print("Docker CLI not found. Please install Docker.")
+                return
+        index = image_search.ImageIndex(images)
+
+    results = index.search(name)
+    if not results:
         print("No local images found matching:", name)
         return
 
-    print(header)
-    for m in matches:
-        print(m)
+    _print_table(IMAGE_HEADERS, [
+        [r.repo, r.tag, r.image.short_id, listing.human_age(r.image.created), listing.human_size(r.image.size)]
+        for r in results
+    ])
 
 
 
+@instrumentation.timed
 def build_image():
     # Build a Docker image from a Dockerfile and tag it.
+    # The Dockerfile and build context are analyzed first; an unchanged Dockerfile/context skips the build,
+    # otherwise build output is streamed with per-step timings.
     if not check_docker_running():
         print(ERROR_MSG)
         return
@@ -238,48 +461,89 @@ def build_image():
         return
 
     try:
-        result = subprocess.run([
-            "docker", "build",
-            "-t", image_name,
-            "-f", dockerfile_path,
-            "."
-        ], check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if result.returncode == 0:
-            print(result.stdout)
-        else:
-            print("Failed to build image:")
-            print(result.stderr)
-    except FileNotFoundError:
-        print("Docker CLI not found. Please install Docker.")
+        with open(dockerfile_path) as f:
+            original = f.read()
+    except OSError:
+        original = None
+    if original is not None:
+        reviewed = _review_dockerfile(original, dockerfile_path)
+        if reviewed != original:
+            with open(dockerfile_path, "w") as f:
+                f.write(reviewed)
+
+    context = "."
+    # Show what is about to be uploaded before sending it
+    report = docker_build.analyze_context(context, dockerfile_path)
+    report.print()
+    if report.savings >= docker_build.OFFER_MIN_BYTES:
+        answer = input(f"Add these {len(report.suggestions)} pattern(s) to .dockerignore "
+                       f"(saves {report.savings / 1e6:.1f} MB)? (y/n): ").strip().lower()
+        if answer == "y":
+            added = docker_build.write_dockerignore(context, list(report.suggestions))
+            print(f"Added {len(added)} pattern(s) to .dockerignore")
+
+    # With the job queue running the build goes to the background (the job checks the build cache itself)
+    if job_manager.background("build", {"context": os.path.abspath(context), "tag": image_name,
+                                        "dockerfile": os.path.abspath(dockerfile_path)}):
+        return
+
+    # An unchanged Dockerfile/context skips the build (and the context upload)
+    result = docker_build.build(context, image_name, dockerfile=dockerfile_path)
+    cache = result["cache"]
+    if result["cache_error"]:
+        print(f"Build cache unavailable: {result['cache_error']}")
+    if result["cached"]:
+        print(f"Build cache hit: Dockerfile and {cache['files']} context files unchanged "
+              f"({cache['reused']} hashes reused, {cache['hashed']} files read in {cache['elapsed_ms']} ms).")
+        print(f"{image_name} is already up to date: {result['image_id']}")
+        return
+    if cache is not None:
+        print(f"Build cache miss ({cache['hashed']} of {cache['files']} files read, {cache['elapsed_ms']} ms).")
+
+    docker_build.print_steps(result)
+    if not result["ok"]:
+        print("Failed to build image:")
+        print(result["error"])
 
 
+
+@instrumentation.timed
 def start_container():
     # Start a stopped container by ID or name (prints result).
     if not check_docker_running():
         print(ERROR_MSG)
         return
 
-    # Show all containers so user can pick one to start
-    subprocess.run(["docker", "ps", "-a"])
+    # One listing both shows the containers and validates the choice
+    try:
+        snapshot = docker_bulk.container_snapshot()
+    except EngineUnavailable as e:
+        _print_engine_error("Failed to list containers:", e)
+        return
+    _print_table(["CONTAINER ID", "NAMES", "IMAGE", "STATE"],
+                 [[c.id[:12], c.name, c.image, c.state] for c in snapshot])
     cid = input("Enter container ID or name to start: ").strip()
     if not cid:
         print("Container ID/name cannot be empty.")
         return
 
-    # validate container exists
-    try:
-        ps = subprocess.run(["docker", "ps", "-a", "--format", "{{.ID}}\t{{.Names}}"], check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        entries = [line.split("\t") for line in ps.stdout.splitlines() if line.strip()]
-        ids = {e[0] for e in entries}
-        names = {e[1] for e in entries}
-    except Exception:
-        ids = set()
-        names = set()
-
-    if cid not in ids and cid not in names:
+    matched, missing = docker_bulk.resolve_targets(snapshot, [cid], inventory=docker_inventory.shared())
+    if missing:
         print(f"No such container: {cid}")
         return
 
+    engine = _engine()
+    if engine is not None:
+        try:
+            engine.start_container(matched[0].id)
+            print(cid)
+            return
+        except EngineUnavailable:
+            docker_health.monitor().mark_down()  # socket unreachable: fall back to the CLI
+        except EngineError as e:
+            _print_engine_error(f"Failed to start container: {cid}", e)
+            return
+
     try:
         result = subprocess.run(["docker", "start", cid], check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
         if result.returncode == 0:
@@ -289,3 +553,94 @@ def start_container():
             print(result.stderr.strip())
     except FileNotFoundError:
         print("Docker CLI not found. Please install Docker.")
+
+
+@instrumentation.timed
+def bulk_container_action():
+    # Start/stop/restart/remove many containers at once (IDs, label=key[=value] or name:pattern).
+    if not check_docker_running():
+        print(ERROR_MSG)
+        return
+
+    action = input(f"Action ({'/'.join(docker_bulk.ACTIONS)}): ").strip().lower()
+    if action not in docker_bulk.ACTIONS:
+        print("Invalid action.")
+        return
+    print("Targets: comma-separated IDs/names, 'label=key[=value]' or 'name:<glob pattern>'")
+    targets = input("Enter targets: ").strip()
+    if not targets:
+        print("Targets cannot be empty.")
+        return
+    concurrency = input(f"Max parallel operations (default {docker_bulk.DEFAULT_CONCURRENCY}): ").strip()
+    try:
+        concurrency = int(concurrency) if concurrency else docker_bulk.DEFAULT_CONCURRENCY
+    except ValueError:
+        print("Concurrency must be a number.")
+        return
+
+    ids, label, pattern = [], None, None
+    if targets.startswith("label="):
+        label = targets[len("label="):]
+    elif targets.startswith("name:"):
+        pattern = targets[len("name:"):]
+    else:
+        ids = targets.split(",")
+
+    if action == "remove":
+        confirm = input("Remove the selected containers? (y/n): ").lower()
+        if confirm != "y":
+            print("Operation cancelled.")
+            return
+
+    try:
+        report = docker_bulk.run_bulk(action, ids, label=label, name_pattern=pattern, concurrency=concurrency)
+    except EngineUnavailable as e:
+        _print_engine_error("Failed to list containers:", e)
+        return
+    if not report.results:
+        print("No containers matched.")
+        return
+    report.print()
+
+
+@instrumentation.timed
+def container_metrics(refresh=2.0, rounds=None):
+    # Live top-like view of running containers (Ctrl+C to stop), then optional window statistics.
+    if not check_docker_running():
+        print(ERROR_MSG)
+        return
+    collector = docker_metrics.start_shared()
+    print("Collecting container metrics... press Ctrl+C to stop the live view.")
+    shown = 0
+    try:
+        while rounds is None or shown < rounds:
+            time.sleep(refresh)
+            rows = collector.containers()
+            print("\033[2J\033[H", end="")
+            print(f"Containers: {len(rows)}   samples: {collector.samples}")
+            print("\n".join(docker_metrics.format_top(rows)))
+            shown += 1
+    except KeyboardInterrupt:
+        print()
+
+    ref = input("Container for window statistics (blank to skip): ").strip()
+    if not ref:
+        return
+    window = input("Window in seconds (default 60): ").strip()
+    try:
+        window = float(window) if window else 60.0
+    except ValueError:
+        print("Window must be a number.")
+        return
+    found = False
+    for metric in docker_metrics.METRICS:
+        stats = collector.summary(ref, metric, window)
+        if stats is None:
+            break
+        found = True
+        if not stats["count"]:
+            continue
+        print(f"{metric:<10} min {stats['min']:>12.2f}  avg {stats['avg']:>12.2f}  "
+              f"max {stats['max']:>12.2f}  p95 {stats['p95']:>12.2f}  ({stats['count']} samples)")
+    if not found:
+        print(f"No metrics for container '{ref}'.")
@@ -0,0 +1,375 @@
+# Streaming container resource metrics.
+# The CLI source keeps one `docker stats` process open; it streams every running
+# container and picks up new ones by itself. The Engine API has no all-container
+# stats endpoint, so the engine source holds one long-lived stats stream per running
+# container and checks for new containers every few seconds. Neither source polls
+# per sample.
+#
+# Samples go into a fixed-size ring buffer per container: one preallocated
+# array('d') per metric (CPU %, memory, net and block I/O rates), overwritten in
+# place once full. Containers that stop reporting are dropped after a grace
+# period, so memory use is bounded by capacity x running containers however long
+# the collector runs. summary() gives min/avg/max/p95 over a time window.
+
+import json
+import subprocess
+import threading
+import time
+from array import array
+
+import docker_engine
+import docker_health
+import docker_inventory
+from docker_engine import EngineError, EngineUnavailable
+
+DEFAULT_CAPACITY = 600          # samples per container (10 minutes at docker's 1/s)
+EXPIRE_SECONDS = 30.0           # drop a container this long after its last sample
+RESCAN_SECONDS = 5.0            # engine source: how often to look for new containers
+
+# Stored per sample; the I/O metrics are rates in bytes/s
+METRICS = ("cpu", "mem", "mem_pct", "net_rx", "net_tx", "blk_read", "blk_write")
+_COUNTERS = ("net_rx", "net_tx", "blk_read", "blk_write")
+
+
+class Sample:
+    # One reading; net/block values are the container's cumulative byte counters.
+    __slots__ = ("id", "name", "time", "cpu", "mem", "mem_limit", "net_rx", "net_tx", "blk_read", "blk_write")
+
+    def __init__(self, id, name, time, cpu=0.0, mem=0, mem_limit=0, net_rx=0, net_tx=0, blk_read=0, blk_write=0):
+        self.id = id
+        self.name = name
+        self.time = time
+        self.cpu = cpu
+        self.mem = mem
+        self.mem_limit = mem_limit
+        self.net_rx = net_rx
+        self.net_tx = net_tx
+        self.blk_read = blk_read
+        self.blk_write = blk_write
+
+    @classmethod
+    def from_cli(cls, row, now):
+        # A `docker stats --format '{{json .}}'` row: sizes are human readable ("1.2MiB / 7.7GiB").
+        def pair(text):
+            left, _, right = str(text or "").partition("/")
+            return docker_inventory.parse_size(left), docker_inventory.parse_size(right)
+
+        mem, limit = pair(row.get("MemUsage"))
+        net_rx, net_tx = pair(row.get("NetIO"))
+        blk_read, blk_write = pair(row.get("BlockIO"))
+        try:
+            cpu = float(str(row.get("CPUPerc", "0")).rstrip("%") or 0)
+        except ValueError:
+            cpu = 0.0
+        return cls(row.get("ID") or row.get("Container", ""), row.get("Name", ""), now, cpu, mem, limit,
+                   net_rx, net_tx, blk_read, blk_write)
+
+    @classmethod
+    def from_engine(cls, cid, data, now):
+        # One object from GET /containers/{id}/stats; CPU % as `docker stats` computes it.
+        cpu_stats, pre = data.get("cpu_stats") or {}, data.get("precpu_stats") or {}
+        cpu_delta = (cpu_stats.get("cpu_usage", {}).get("total_usage", 0)
+                     - pre.get("cpu_usage", {}).get("total_usage", 0))
+        system_delta = cpu_stats.get("system_cpu_usage", 0) - pre.get("system_cpu_usage", 0)
+        cpus = cpu_stats.get("online_cpus") or len(cpu_stats.get("cpu_usage", {}).get("percpu_usage") or ()) or 1
+        # the first object of a stream has no previous reading
+        cpu = 0.0
+        if pre.get("system_cpu_usage") and cpu_delta > 0 and system_delta > 0:
+            cpu = cpu_delta / system_delta * cpus * 100.0
+
+        memory = data.get("memory_stats") or {}
+        # page cache is reclaimable; cgroup v1 reports it as "cache", v2 as "inactive_file"
+        extra = memory.get("stats") or {}
+        mem = max(0, memory.get("usage", 0) - extra.get("inactive_file", extra.get("cache", 0)))
+
+        net_rx = net_tx = 0
+        for net in (data.get("networks") or {}).values():
+            net_rx += net.get("rx_bytes", 0)
+            net_tx += net.get("tx_bytes", 0)
+        blk_read = blk_write = 0
+        for entry in (data.get("blkio_stats") or {}).get("io_service_bytes_recursive") or ():
+            op = str(entry.get("op", "")).lower()
+            if op == "read":
+                blk_read += entry.get("value", 0)
+            elif op == "write":
+                blk_write += entry.get("value", 0)
+        return cls(cid, str(data.get("name", "")).lstrip("/"), now, cpu, mem, memory.get("limit", 0),
+                   net_rx, net_tx, blk_read, blk_write)
+
+
+class RingBuffer:
+    # Fixed-capacity time series: one preallocated array per column, oldest entries overwritten.
+    __slots__ = ("capacity", "columns", "_times", "_data", "_head", "_count")
+
+    def __init__(self, capacity, columns):
+        self.capacity = capacity
+        self.columns = tuple(columns)
+        self._times = array("d", bytes(8 * capacity))
+        self._data = {c: array("d", bytes(8 * capacity)) for c in self.columns}
+        self._head = 0   # next slot to write
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, t, values):
+        i = self._head
+        self._times[i] = t
+        for column in self.columns:
+            self._data[column][i] = values[column]
+        self._head = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def latest(self):
+        if not self._count:
+            return None
+        i = (self._head - 1) % self.capacity
+        return self._times[i], {c: self._data[c][i] for c in self.columns}
+
+    def window(self, column, since=None):
+        # Values of `column` with a timestamp >= since, oldest first.
+        values = []
+        data = self._data[column]
+        for k in range(self._count):
+            i = (self._head - 1 - k) % self.capacity
+            if since is not None and self._times[i] < since:
+                break
+            values.append(data[i])
+        values.reverse()
+        return values
+
+
+class _Series:
+    __slots__ = ("id", "name", "buffer", "last", "mem_limit")
+
+    def __init__(self, id, name, capacity):
+        self.id = id
+        self.name = name
+        self.buffer = RingBuffer(capacity, METRICS)
+        self.last = None   # previous Sample, for the I/O rates
+        self.mem_limit = 0
+
+
+def summarize(values):
+    # {"count", "min", "avg", "max", "p95"} (None values when there are no samples)
+    if not values:
+        return {"count": 0, "min": None, "avg": None, "max": None, "p95": None}
+    ordered = sorted(values)
+    return {"count": len(ordered), "min": ordered[0], "avg": sum(ordered) / len(ordered), "max": ordered[-1],
+            "p95": ordered[max(0, -(-len(ordered) * 95 // 100) - 1)]}
+
+
+class CliStatsSource:
+    # All running containers over one `docker stats` process.
+
+    def __init__(self):
+        self._proc = None
+
+    def run(self, emit, stopped, clock):
+        try:
+            self._proc = subprocess.Popen(["docker", "stats", "--no-trunc", "--format", "{{json .}}"],
+                                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        except FileNotFoundError:
+            raise EngineUnavailable("Docker CLI not found")
+        for line in self._proc.stdout:
+            if stopped():
+                break
+            # each refresh starts with clear-screen/cursor-home escapes
+            line = line.replace("\x1b[2J", "").replace("\x1b[H", "").strip()
+            if line.startswith("{"):
+                emit(Sample.from_cli(json.loads(line), clock()))
+        self.close()
+
+    def close(self):
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.terminate()
+            self._proc.wait()
+
+
+class EngineStatsSource:
+    # One long-lived Engine API stats stream per running container.
+
+    def __init__(self, client, rescan=RESCAN_SECONDS):
+        self.client = client
+        self.rescan = rescan
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def _follow(self, cid, emit, stopped, clock):
+        try:
+            for data in self.client.stats(cid, stream=True):
+                if stopped():
+                    break
+                emit(Sample.from_engine(cid, data, clock()))
+        except (EngineError, OSError, ValueError):
+            pass
+        finally:
+            with self._lock:
+                self._streams.pop(cid, None)
+
+    def run(self, emit, stopped, clock):
+        while not stopped():
+            running = [c["Id"] for c in self.client.containers()]
+            with self._lock:
+                new = [cid for cid in running if cid not in self._streams]
+                for cid in new:
+                    thread = threading.Thread(target=self._follow, args=(cid, emit, stopped, clock),
+                                              name=f"stats-{cid[:12]}", daemon=True)
+                    self._streams[cid] = thread
+                    thread.start()
+            deadline = time.monotonic() + self.rescan
+            while not stopped() and time.monotonic() < deadline:
+                time.sleep(0.1)
+
+    def close(self):
+        pass
+
+
+def default_source():
+    engine = docker_engine.get_client()
+    return EngineStatsSource(engine) if engine is not None else CliStatsSource()
+
+
+class MetricsCollector:
+    # Thread-safe per-container ring buffers fed by a stats source on a background thread.
+
+    def __init__(self, source=None, capacity=DEFAULT_CAPACITY, expire=EXPIRE_SECONDS,
+                 retry_backoff=docker_health.BACKOFF_BASE, retry_backoff_max=docker_health.BACKOFF_MAX,
+                 clock=time.time):
+        self.source = source or default_source()
+        self.capacity = capacity
+        self.expire = expire
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.clock = clock
+        self.samples = 0
+        self.failures = 0
+        self._series = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def ingest(self, sample):
+        # Add one sample; I/O counters become rates against the container's previous sample.
+        with self._lock:
+            series = self._series.get(sample.id)
+            if series is None:
+                series = self._series[sample.id] = _Series(sample.id, sample.name, self.capacity)
+            values = {"cpu": sample.cpu, "mem": sample.mem,
+                      "mem_pct": sample.mem / sample.mem_limit * 100.0 if sample.mem_limit else 0.0}
+            last = series.last
+            elapsed = sample.time - last.time if last is not None else 0
+            for counter in _COUNTERS:
+                delta = getattr(sample, counter) - getattr(last, counter) if last is not None else 0
+                # a counter going backwards means the container restarted
+                values[counter] = delta / elapsed if elapsed > 0 and delta > 0 else 0.0
+            series.buffer.append(sample.time, values)
+            series.last = sample
+            series.name = sample.name or series.name
+            series.mem_limit = sample.mem_limit
+            self.samples += 1
+            self._expire(sample.time)
+
+    def _expire(self, now):
+        for cid in [cid for cid, s in self._series.items() if now - s.last.time > self.expire]:
+            del self._series[cid]
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._follow, name="docker-metrics", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.source.close()
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def _follow(self):
+        while not self._stop.is_set():
+            try:
+                self.source.run(self.ingest, self._stop.is_set, self.clock)
+                self.failures = 0
+            except (EngineError, OSError, ValueError):
+                self.failures += 1
+                docker_health.monitor().mark_down()
+            if not self._stop.is_set():
+                # the stream ended (daemon restart, no containers); reconnect with a back-off
+                self._stop.wait(min(self.retry_backoff * 2 ** self.failures, self.retry_backoff_max))
+
+    def _find(self, ref):
+        series = self._series.get(ref)
+        if series is not None:
+            return series
+        matches = [s for s in self._series.values() if s.name == ref or s.id.startswith(ref)]
+        return matches[0] if len(matches) == 1 else None
+
+    def containers(self):
+        # Latest values per container: [{"id", "name", "time", <metric>...}], busiest CPU first.
+        with self._lock:
+            self._expire(self.clock())
+            rows = []
+            for series in self._series.values():
+                latest = series.buffer.latest()
+                if latest is None:
+                    continue
+                t, values = latest
+                rows.append({"id": series.id, "name": series.name, "time": t, "mem_limit": series.mem_limit,
+                             **values})
+        return sorted(rows, key=lambda r: -r["cpu"])
+
+    def summary(self, ref, metric, window=60.0):
+        # min/avg/max/p95 of one metric for a container (ID, ID prefix or name) over the last `window` seconds.
+        if metric not in METRICS:
+            raise ValueError(f"unknown metric '{metric}' (one of: {', '.join(METRICS)})")
+        with self._lock:
+            series = self._find(ref)
+            if series is None:
+                return None
+            since = self.clock() - window if window else None
+            return summarize(series.buffer.window(metric, since))
+
+
+def format_top(rows):
+    # Table lines for the live view
+    lines = [f"{'CONTAINER':<14} {'NAME':<24} {'CPU %':>7} {'MEM':>10} {'MEM %':>6} "
+             f"{'NET RX/s':>10} {'NET TX/s':>10} {'BLK R/s':>10} {'BLK W/s':>10}"]
+    for r in rows:
+        lines.append(f"{r['id'][:12]:<14} {r['name'][:24]:<24} {r['cpu']:>7.2f} {_size(r['mem']):>10} "
+                     f"{r['mem_pct']:>6.1f} {_size(r['net_rx']):>10} {_size(r['net_tx']):>10} "
+                     f"{_size(r['blk_read']):>10} {_size(r['blk_write']):>10}")
+    return lines
+
+
+def _size(n):
+    for unit in ("B", "kB", "MB", "GB"):
+        if n < 1000:
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1000
+    return f"{n:.1f}TB"
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared():
+    return _shared
+
+
+def start_shared(source=None):
+    # Start the process-wide collector (once); later calls return the running one.
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = MetricsCollector(source).start()
+        return _shared
+
+
+def stop_shared():
+    global _shared
+    with _shared_lock:
+        if _shared is not None:
+            _shared.stop()
+            _shared = None
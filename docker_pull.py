@@ -0,0 +1,353 @@
+# Parallel multi-image pull.
+# Takes a list (or manifest file) of image references, collapses duplicates
+# into one pull, skips images already present at a pinned digest, and pulls
+# the rest concurrently with a configurable limit. Layer progress from every
+# pull feeds one board that renders per-image state and total throughput;
+# the final report has per-image timing and bytes.
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import docker_engine
+import docker_health
+from docker_engine import EngineError, EngineUnavailable
+
+DEFAULT_CONCURRENCY = 4
+
+# Pulls in flight across all batches, so concurrent callers share one pull per reference
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def normalize_ref(ref):
+    # Canonical short form: "docker.io/library/nginx" -> "nginx:latest".
+    ref = ref.strip()
+    for prefix in ("docker.io/library/", "index.docker.io/library/", "docker.io/"):
+        if ref.startswith(prefix):
+            ref = ref[len(prefix):]
+            break
+    if "@" in ref:
+        return ref
+    if ":" not in ref.rsplit("/", 1)[-1]:
+        ref += ":latest"
+    return ref
+
+
+def load_manifest(path):
+    # One reference per line ('#' comments allowed), or JSON: ["a", "b"] / {"images": [...]}.
+    with open(path) as f:
+        text = f.read()
+    stripped = text.lstrip()
+    if stripped.startswith(("[", "{")):
+        data = json.loads(text)
+        return list(data.get("images", []) if isinstance(data, dict) else data)
+    refs = []
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line:
+            refs.append(line)
+    return refs
+
+
+class ImageProgress:
+    __slots__ = ("ref", "state", "layers", "started", "finished", "error", "duplicates")
+
+    def __init__(self, ref):
+        self.ref = ref
+        self.state = "queued"  # queued, pulling, done, skipped, failed
+        self.layers = {}       # layer id -> [status, current bytes, total bytes]
+        self.started = None
+        self.finished = None
+        self.error = ""
+        self.duplicates = 0
+
+    @property
+    def downloaded(self):
+        return sum(cur for _, cur, _ in self.layers.values())
+
+    @property
+    def total(self):
+        return sum(tot for _, _, tot in self.layers.values())
+
+    @property
+    def layers_done(self):
+        return sum(1 for status, _, _ in self.layers.values()
+                   if status in ("Pull complete", "Already exists", "Download complete"))
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+
+class PullBoard:
+    # Shared progress state for every image in a batch.
+
+    def __init__(self):
+        self.images = {}
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()  # set to abandon the batch (pulls stop at their next progress line)
+
+    def add(self, ref):
+        with self.lock:
+            if ref in self.images:
+                self.images[ref].duplicates += 1
+                return False
+            self.images[ref] = ImageProgress(ref)
+            return True
+
+    def layer(self, ref, layer_id, status, current=None, total=None):
+        with self.lock:
+            entry = self.images[ref].layers.setdefault(layer_id, [status, 0, 0])
+            entry[0] = status
+            if total:
+                entry[2] = total
+            if current is not None:
+                entry[1] = current
+            if status in ("Download complete", "Pull complete") and entry[2]:
+                entry[1] = entry[2]
+
+    def set_state(self, ref, state, error=""):
+        with self.lock:
+            img = self.images[ref]
+            if state == "pulling":
+                img.started = time.monotonic()
+            elif state in ("done", "failed", "skipped"):
+                img.finished = time.monotonic()
+                img.started = img.started or img.finished
+            img.state = state
+            img.error = error
+
+    def throughput(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        with self.lock:
+            return sum(i.downloaded for i in self.images.values()) / elapsed
+
+    def render(self):
+        # Lines for the combined progress view.
+        with self.lock:
+            images = list(self.images.values())
+        done = sum(1 for i in images if i.state in ("done", "skipped", "failed"))
+        lines = [f"[{done}/{len(images)}] {self.throughput() / 1e6:6.1f} MB/s total"]
+        for img in images:
+            if img.state == "pulling":
+                pct = f"{100 * img.downloaded / img.total:5.1f}%" if img.total else "     "
+                detail = f"{pct} layers {img.layers_done}/{len(img.layers)}"
+            else:
+                detail = img.error or img.state
+            lines.append(f"  {img.ref:<40} {img.state:<8} {detail}")
+        return lines
+
+
+class PullReport:
+    def __init__(self, board):
+        self.board = board
+        self.elapsed = time.monotonic() - board.started
+
+    @property
+    def failed(self):
+        return [i for i in self.board.images.values() if i.state == "failed"]
+
+    def as_dict(self):
+        return {
+            "elapsed_s": round(self.elapsed, 3),
+            "images": [
+                {"ref": i.ref, "state": i.state, "error": i.error, "seconds": round(i.elapsed, 3),
+                 "bytes": i.downloaded, "duplicates": i.duplicates}
+                for i in self.board.images.values()
+            ],
+        }
+
+    def print(self):
+        images = list(self.board.images.values())
+        pulled = sum(1 for i in images if i.state == "done")
+        skipped = sum(1 for i in images if i.state == "skipped")
+        print(f"Pulled {pulled}, skipped {skipped}, failed {len(self.failed)} in {self.elapsed:.1f}s")
+        for i in images:
+            extra = f" (+{i.duplicates} duplicate)" if i.duplicates else ""
+            size = f"{i.downloaded / 1e6:8.1f} MB" if i.downloaded else " " * 11
+            print(f"  {i.ref:<40} {i.state:<8} {i.elapsed:7.2f}s {size}{extra}"
+                  + (f"  {i.error}" if i.error else ""))
+
+
+def local_digests(ref):
+    # Repo digests of a local image, or None if it is not present.
+    engine = docker_engine.get_client()
+    if engine is not None:
+        try:
+            return engine.inspect_image(ref).get("RepoDigests") or []
+        except EngineError as e:
+            if e.status == 404:
+                return None
+            if not isinstance(e, EngineUnavailable):
+                raise
+            docker_health.monitor().mark_down()
+    result = subprocess.run(["docker", "image", "inspect", "--format", "{{json .RepoDigests}}", ref],
+                            check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        return None
+    return json.loads(result.stdout or "[]") or []
+
+
+def is_present(ref, skip_existing):
+    # "digest": skip pinned refs (repo@sha256:...) already present; "tag": skip any present ref; "never".
+    if skip_existing == "never":
+        return False
+    if "@" in ref:
+        name, digest = ref.split("@", 1)
+        digests = local_digests(ref)
+        return digests is not None and any(d.endswith("@" + digest) for d in digests)
+    if skip_existing == "tag":
+        return local_digests(ref) is not None
+    return False
+
+
+def _pull_engine(engine, ref, board):
+    for msg in engine.pull(ref):
+        if board.cancelled.is_set():
+            raise EngineError(499, "cancelled")  # closing the stream makes the daemon drop the pull
+        if "error" in msg:
+            raise EngineError(500, msg["error"])
+        if msg.get("id") and "progressDetail" in msg:
+            detail = msg.get("progressDetail") or {}
+            board.layer(ref, msg["id"], msg.get("status", ""), detail.get("current"), detail.get("total"))
+
+
+def _pull_cli(ref, board):
+    proc = subprocess.Popen(["docker", "pull", ref], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    for line in proc.stdout:
+        if board.cancelled.is_set():
+            proc.kill()
+            proc.wait()
+            raise EngineError(499, "cancelled")
+        layer, sep, status = line.strip().partition(": ")
+        # layer lines look like "a2abf6c4d29d: Pull complete"
+        if sep and len(layer) == 12 and all(c in "0123456789abcdef" for c in layer):
+            board.layer(ref, layer, status)
+    error = proc.stderr.read()
+    if proc.wait() != 0:
+        raise EngineError(500, error.strip() or f"docker pull exited with {proc.returncode}")
+
+
+def _pull_one(ref, board, skip_existing):
+    # Pull (or skip) one reference; returns (state, error) so followers in other batches see the outcome.
+    try:
+        if board.cancelled.is_set():
+            raise EngineError(499, "cancelled")
+        if is_present(ref, skip_existing):
+            board.set_state(ref, "skipped", "already present")
+            return "skipped", ""
+        board.set_state(ref, "pulling")
+        engine = docker_engine.get_client()
+        pulled = False
+        if engine is not None:
+            try:
+                _pull_engine(engine, ref, board)
+                pulled = True
+            except EngineUnavailable:
+                docker_health.monitor().mark_down()  # socket unreachable: fall back to the CLI
+        if not pulled:
+            _pull_cli(ref, board)
+    except EngineError as e:
+        board.set_state(ref, "failed", e.message)
+        return "failed", e.message
+    except FileNotFoundError:
+        board.set_state(ref, "failed", "Docker CLI not found")
+        return "failed", "Docker CLI not found"
+    except ValueError as e:
+        # unparseable `docker image inspect` output
+        board.set_state(ref, "failed", str(e))
+        return "failed", str(e)
+    board.set_state(ref, "done")
+    return "done", ""
+
+
+def pull_images(refs, concurrency=DEFAULT_CONCURRENCY, skip_existing="digest", board=None, on_update=None,
+                update_interval=0.5):
+    # Pull many images concurrently; returns a PullReport.
+    board = board or PullBoard()
+    unique = [ref for ref in (normalize_ref(r) for r in refs if r.strip()) if board.add(ref)]
+
+    stop = threading.Event()
+    ticker = None
+    if on_update is not None:
+        def tick():
+            while not stop.wait(update_interval):
+                on_update(board)
+        ticker = threading.Thread(target=tick, daemon=True)
+        ticker.start()
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        for ref in unique:
+            with _inflight_lock:
+                shared = _inflight.get(ref)
+                owner = shared is None
+                if owner:
+                    shared = pool.submit(_pull_one, ref, board, skip_existing)
+                    _inflight[ref] = shared
+            # Callbacks are registered outside the lock: an already finished future
+            # runs them immediately, and _forget takes the lock itself.
+            if owner:
+                shared.add_done_callback(lambda f, r=ref: _forget(r, f))
+            else:
+                # another batch is already pulling this reference: wait on its pull instead
+                board.set_state(ref, "pulling")
+                shared = _follow(shared, ref, board)
+            futures.append(shared)
+        for f in futures:
+            f.result()
+
+    stop.set()
+    if ticker is not None:
+        ticker.join()
+        on_update(board)
+    return PullReport(board)
+
+
+def _forget(ref, future):
+    with _inflight_lock:
+        if _inflight.get(ref) is future:
+            del _inflight[ref]
+
+
+def _follow(shared, ref, board):
+    done = Future()
+
+    def finish(f):
+        if f.exception() is not None:
+            state, error = "failed", str(f.exception())
+        else:
+            state, error = f.result()
+        board.set_state(ref, state, error)
+        done.set_result((state, error))
+
+    shared.add_done_callback(finish)
+    return done
+
+
+class TerminalView:
+    # Redraws the board in place on a TTY; prints occasional snapshots otherwise.
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.tty = hasattr(self.stream, "isatty") and self.stream.isatty()
+        self.lines = 0
+
+    def __call__(self, board):
+        lines = board.render()
+        if self.tty:
+            if self.lines:
+                self.stream.write(f"\x1b[{self.lines}F")
+            self.stream.write("".join(f"\x1b[2K{line}\n" for line in lines))
+            self.lines = len(lines)
+        else:
+            self.stream.write(lines[0] + "\n")
+        self.stream.flush()
@@ -0,0 +1,362 @@
+# Dockerfile static analysis.
+# A Dockerfile is parsed into instructions (line continuations, comments, parser
+# directives and heredocs handled), then checked for patterns that invalidate the
+# layer cache on every build or leave avoidable data in image layers. Each finding
+# carries the line it refers to; the ones with a mechanical, behaviour-preserving
+# rewrite can be applied with fix().
+
+import json
+import re
+
+CACHE = "cache"        # invalidates the layer cache more often than needed
+BLOAT = "bloat"        # leaves avoidable data in a layer
+PINNING = "pinning"    # build result depends on when it runs
+
+# Rough sizes of what the bloat findings leave behind, for the report
+APT_LISTS_BYTES = 30 * 1000 * 1000
+APT_RECOMMENDS_BYTES = 50 * 1000 * 1000
+APK_INDEX_BYTES = 2 * 1000 * 1000
+DNF_CACHE_BYTES = 60 * 1000 * 1000
+
+_DIRECTIVE = re.compile(r"^#\s*([A-Za-z]+)\s*=\s*(\S+)\s*$")
+_HEREDOC = re.compile(r"<<(-?)([\"']?)([A-Za-z_][A-Za-z0-9_]*)\2")
+_ARCHIVE = re.compile(r"\.(tar|tar\.gz|tgz|tar\.bz2|tbz2?|tar\.xz|txz|tar\.zst)$")
+_URL = re.compile(r"^(https?|git)://|^git@|\.git(#.*)?$")
+
+# Dependency installs that only need the manifest files, and the manifests to copy first
+_INSTALLS = (
+    (re.compile(r"\bpip3?\s+install\b(?P<args>[^&;|]*)"), None),
+    (re.compile(r"\bnpm\s+(ci|install)\b(?P<args>[^&;|]*)"), ["package*.json"]),
+    (re.compile(r"\byarn(?:\s+install\b|\s*(?=$|&&|;|\|))(?P<args>[^&;|]*)"), ["package.json", "yarn.lock"]),
+    (re.compile(r"\bpnpm\s+install\b(?P<args>[^&;|]*)"), ["package.json", "pnpm-lock.yaml"]),
+    (re.compile(r"\bgo\s+mod\s+download\b(?P<args>[^&;|]*)"), ["go.mod", "go.sum"]),
+    (re.compile(r"\bbundle\s+install\b(?P<args>[^&;|]*)"), ["Gemfile", "Gemfile.lock"]),
+    (re.compile(r"\bcomposer\s+install\b(?P<args>[^&;|]*)"), ["composer.json", "composer.lock"]),
+)
+_APT_INSTALL = re.compile(r"\bapt-get\s+(?:-\S+\s+)*install\b")
+_APT_UPDATE_ONLY = re.compile(r"^\s*apt-get\s+(?:-\S+\s+)*update(\s+-\S+)*\s*$")
+
+
+class Instruction:
+    # One Dockerfile instruction; `line`/`end` are 1-based physical line numbers.
+    __slots__ = ("op", "args", "flags", "line", "end", "raw", "heredocs", "json_form")
+
+    def __init__(self, op, args, flags, line, end, raw, heredocs):
+        self.op = op
+        self.args = args              # text after the flags, continuations joined
+        self.flags = flags            # {"from": "build", "mount": [...]}
+        self.line = line
+        self.end = end
+        self.raw = raw                # original text of lines line..end
+        self.heredocs = heredocs
+        self.json_form = args.startswith("[")
+
+    def words(self):
+        if self.json_form:
+            try:
+                return [str(w) for w in json.loads(self.args)]
+            except ValueError:
+                pass
+        return self.args.split()
+
+
+class Finding:
+    __slots__ = ("line", "code", "kind", "message", "bytes", "fix")
+
+    def __init__(self, line, code, kind, message, bytes=None, fix=None):
+        self.line = line
+        self.code = code
+        self.kind = kind
+        self.message = message
+        self.bytes = bytes            # estimated size left in the image, when known
+        self.fix = fix                # callable(edits) applying the rewrite, or None
+
+    @property
+    def fixable(self):
+        return self.fix is not None
+
+    def __str__(self):
+        size = f" (~{self.bytes / 1e6:.0f} MB)" if self.bytes else ""
+        note = " [auto-fix]" if self.fixable else ""
+        return f"line {self.line}: {self.code}: {self.message}{size}{note}"
+
+
+def parse(text):
+    # Instructions of a Dockerfile, in order.
+    lines = text.splitlines()
+    escape = "\\"
+    i = 0
+    # parser directives are only recognised before anything else
+    while i < len(lines):
+        m = _DIRECTIVE.match(lines[i])
+        if not m:
+            break
+        if m.group(1).lower() == "escape" and m.group(2) in ("\\", "`"):
+            escape = m.group(2)
+        i += 1
+
+    instructions = []
+    while i < len(lines):
+        stripped = lines[i].strip()
+        if not stripped or stripped.startswith("#"):
+            i += 1
+            continue
+        start = i
+        parts = []
+        while True:
+            line = lines[i].rstrip()
+            if line.endswith(escape) and i + 1 < len(lines):
+                parts.append(line[:-1])
+                i += 1
+                # blank and comment lines inside a continuation are dropped by the builder
+                while i + 1 < len(lines) and (not lines[i].strip() or lines[i].lstrip().startswith("#")):
+                    i += 1
+                continue
+            parts.append(line)
+            break
+        logical = " ".join(p.strip() for p in parts).strip()
+        heredocs = []
+        for m in _HEREDOC.finditer(logical):
+            body = []
+            i += 1
+            while i < len(lines):
+                candidate = lines[i].lstrip("\t") if m.group(1) else lines[i]
+                if candidate == m.group(3):
+                    break
+                body.append(lines[i])
+                i += 1
+            heredocs.append("\n".join(body))
+        op, _, rest = logical.partition(" ")
+        flags = {}
+        rest = rest.strip()
+        while rest.startswith("--"):
+            flag, _, rest = rest.partition(" ")
+            name, _, value = flag[2:].partition("=")
+            if name == "mount":
+                flags.setdefault("mount", []).append(value)
+            else:
+                flags[name] = value
+            rest = rest.strip()
+        raw = "\n".join(lines[start:i + 1])
+        instructions.append(Instruction(op.upper(), rest, flags, start + 1, i + 1, raw, heredocs))
+        i += 1
+    return instructions
+
+
+def _cache_mounted(inst, target):
+    return any(f"target={target}" in mount or f"dst={target}" in mount for mount in inst.flags.get("mount", []))
+
+
+def _command_start(inst):
+    # Offset in inst.raw where the shell command of a RUN begins (after the op and flags)
+    m = re.match(r"\s*RUN(?:\s+|\\\n|`\n)+(?:--\S+(?:\s+|\\\n|`\n)+)*", inst.raw, re.I)
+    return m.end() if m else None
+
+
+class _Edits:
+    # Pending rewrites keyed by instruction index: replacement text (None deletes) and insertions after.
+
+    def __init__(self, instructions):
+        self.text = {n: inst.raw for n, inst in enumerate(instructions)}
+        self.after = {}
+
+    def sub(self, n, pattern, repl, flags=0):
+        self.text[n] = re.sub(pattern, repl, self.text[n], count=1, flags=flags)
+
+
+def _whole_context(inst):
+    return any(s in (".", "./", "*") for s in inst.words()[:-1])
+
+
+def _install_manifests(command):
+    # For a dependency install in a shell command: the manifests it needs ([] if it needs more
+    # than manifests, e.g. `pip install .`). None when the command installs nothing.
+    for pattern, manifests in _INSTALLS:
+        m = pattern.search(command)
+        if not m:
+            continue
+        args = m.group("args").split()
+        if manifests is None:
+            # pip: only `-r <file>` installs are independent of the source tree
+            if "-e" in args or "." in args or "-r" not in args and "--requirement" not in args:
+                return []
+            return [args[k + 1] for k, a in enumerate(args[:-1]) if a in ("-r", "--requirement")]
+        positional = [a for a in args if not a.startswith("-")]
+        return [] if positional else manifests
+    return None
+
+
+def analyze(text):
+    # Findings for a Dockerfile, ordered by line.
+    instructions = parse(text)
+    findings = []
+    stages = set()
+    pip_env_off = False
+    whole_copy = None     # index of the first COPY/ADD of the whole context in the current stage
+
+    for n, inst in enumerate(instructions):
+        op = inst.op
+        if op == "FROM":
+            words = inst.words()
+            image = words[0] if words else ""
+            if len(words) >= 3 and words[1].lower() == "as":
+                stages.add(words[2].lower())
+            findings.extend(_check_base(inst, image, stages))
+            whole_copy, pip_env_off = None, False
+            continue
+        if op == "ENV" and "PIP_NO_CACHE_DIR" in inst.args:
+            pip_env_off = True
+        if op in ("COPY", "ADD") and whole_copy is None and "from" not in inst.flags and _whole_context(inst):
+            whole_copy = n
+        if op == "ADD":
+            findings.extend(_check_add(n, inst))
+        if op != "RUN":
+            continue
+
+        command = " ".join([inst.args] + inst.heredocs)
+        manifests = _install_manifests(command)
+        if manifests is not None and whole_copy is not None:
+            findings.append(_copy_before_install(instructions, whole_copy, n, manifests))
+            whole_copy = None  # one finding per copy
+        findings.extend(_check_packages(instructions, n, inst, command, pip_env_off))
+
+    findings.sort(key=lambda f: f.line)
+    return findings
+
+
+def _check_base(inst, image, stages):
+    if not image or image.lower() in stages or image == "scratch" or "$" in image or "@" in image:
+        return []
+    name = image.rsplit("/", 1)[-1]
+    if ":" not in name:
+        return [Finding(inst.line, "unpinned-base", PINNING,
+                        f"base image '{image}' has no tag (implies :latest); pin a version or digest")]
+    if name.endswith(":latest"):
+        return [Finding(inst.line, "unpinned-base", PINNING,
+                        f"base image '{image}' uses :latest; pin a version or digest")]
+    return []
+
+
+def _check_add(n, inst):
+    words = inst.words()
+    sources = words[:-1]
+    if any(_URL.search(s) for s in sources):
+        return [Finding(inst.line, "add-remote-url", CACHE,
+                        "ADD of a remote URL is re-downloaded to check the cache and the file stays in its "
+                        "layer; use RUN curl/wget with a checksum and remove it in the same step")]
+    if sources and not any(_ARCHIVE.search(s) for s in sources) and not inst.json_form:
+        def fix(edits):
+            edits.sub(n, r"^(\s*)ADD\b", r"\1COPY", re.I)
+        return [Finding(inst.line, "add-local-file", CACHE,
+                        "ADD of local files: COPY does the same without archive extraction surprises", fix=fix)]
+    return []
+
+
+def _copy_before_install(instructions, copy_n, install_n, manifests):
+    copy, install = instructions[copy_n], instructions[install_n]
+    message = (f"COPY of the whole context comes before the dependency install at line {install.line}: "
+               f"every source edit re-runs the install; copy the manifests first")
+    between = instructions[copy_n + 1:install_n]
+    safe = (manifests and not copy.json_form and not install.heredocs
+            and all(i.op in ("ENV", "ARG", "LABEL") for i in between))
+    if not safe:
+        return Finding(copy.line, "copy-before-install", CACHE, message)
+
+    def fix(edits):
+        dest = copy.words()[-1]
+        flags = "".join(f"--{k}={v} " for k, v in copy.flags.items() if k in ("chown", "chmod"))
+        edits.text[copy_n] = f"COPY {flags}{' '.join(manifests)} {dest if dest.endswith('/') else dest + '/'}"
+        edits.after.setdefault(install_n, []).append(copy.raw.strip())
+    return Finding(copy.line, "copy-before-install", CACHE, message, fix=fix)
+
+
+def _check_packages(instructions, n, inst, command, pip_env_off):
+    findings = []
+    fixable = not inst.json_form and not inst.heredocs
+    if "apt-get" in command:
+        installs = _APT_INSTALL.search(command)
+        if "update" in command and not installs:
+            nxt = instructions[n + 1] if n + 1 < len(instructions) else None
+            merge = (fixable and _APT_UPDATE_ONLY.match(inst.args) and nxt is not None and nxt.op == "RUN"
+                     and not nxt.json_form and not nxt.heredocs and _APT_INSTALL.search(nxt.args))
+
+            def fix(edits, nxt_n=n + 1, update=inst.args.strip()):
+                start = _command_start(instructions[nxt_n])
+                text = edits.text[nxt_n]
+                edits.text[nxt_n] = text[:start] + f"{update} && " + text[start:]
+                edits.text[n] = None
+            findings.append(Finding(inst.line, "apt-update-alone", CACHE,
+                                    "apt-get update in its own layer is cached indefinitely, so later installs use "
+                                    "stale package lists; run it in the same RUN as apt-get install",
+                                    fix=fix if merge else None))
+        if installs:
+            if "--no-install-recommends" not in command:
+                def fix(edits):
+                    edits.sub(n, r"(apt-get\s+(?:-\S+\s+)*install)\b", r"\1 --no-install-recommends")
+                findings.append(Finding(inst.line, "apt-recommends", BLOAT,
+                                        "apt-get install without --no-install-recommends pulls in optional packages",
+                                        APT_RECOMMENDS_BYTES, fix if fixable else None))
+            if "/var/lib/apt/lists" not in command and not _cache_mounted(inst, "/var/lib/apt"):
+                def fix(edits):
+                    edits.text[n] = edits.text[n].rstrip() + " && rm -rf /var/lib/apt/lists/*"
+                findings.append(Finding(inst.line, "apt-lists-kept", BLOAT,
+                                        "apt package lists are left in the layer; remove /var/lib/apt/lists/* "
+                                        "in the same RUN", APT_LISTS_BYTES, fix if fixable else None))
+    if re.search(r"\bapk\s+add\b", command) and "--no-cache" not in command \
+            and not _cache_mounted(inst, "/var/cache/apk"):
+        def fix(edits):
+            edits.sub(n, r"\b(apk\s+add)\b", r"\1 --no-cache")
+        findings.append(Finding(inst.line, "apk-cache", BLOAT, "apk add without --no-cache keeps the package index",
+                                APK_INDEX_BYTES, fix if fixable else None))
+    m = re.search(r"\b(dnf|yum|microdnf)\s+(?:-\S+\s+)*install\b", command)
+    if m and "clean all" not in command and not _cache_mounted(inst, "/var/cache/" + m.group(1)):
+        def fix(edits, tool=m.group(1)):
+            edits.text[n] = edits.text[n].rstrip() + f" && {tool} clean all"
+        findings.append(Finding(inst.line, "dnf-cache", BLOAT,
+                                f"{m.group(1)} install without '{m.group(1)} clean all' keeps the metadata cache",
+                                DNF_CACHE_BYTES, fix if fixable else None))
+    if re.search(r"\bpip3?\s+install\b", command) and "--no-cache-dir" not in command and not pip_env_off \
+            and not _cache_mounted(inst, "/root/.cache/pip"):
+        def fix(edits):
+            edits.sub(n, r"\b(pip3?\s+install)\b", r"\1 --no-cache-dir")
+        findings.append(Finding(inst.line, "pip-cache", BLOAT,
+                                "pip install keeps downloaded wheels in /root/.cache/pip; use --no-cache-dir "
+                                "or a cache mount", fix=fix if fixable else None))
+    return findings
+
+
+def fix(text, findings=None):
+    # Apply the auto-fixes of `findings` (default: all fixable findings); returns (new_text, applied).
+    instructions = parse(text)
+    if findings is None:
+        findings = analyze(text)
+    applied = [f for f in findings if f.fixable]
+    if not applied:
+        return text, []
+    edits = _Edits(instructions)
+    for finding in applied:
+        finding.fix(edits)
+
+    lines = text.splitlines()
+    out = []
+    by_start = {inst.line: (n, inst) for n, inst in enumerate(instructions)}
+    i = 1
+    while i <= len(lines):
+        if i not in by_start:
+            out.append(lines[i - 1])
+            i += 1
+            continue
+        n, inst = by_start[i]
+        if edits.text[n] is not None:
+            out.append(edits.text[n])
+        out.extend(edits.after.get(n, []))
+        i = inst.end + 1
+    return "\n".join(out) + ("\n" if text.endswith("\n") else ""), applied
+
+
+def print_report(findings, path="Dockerfile"):
+    if not findings:
+        return
+    print(f"{path}: {len(findings)} finding(s)")
+    for finding in findings:
+        print(f"  {finding}")
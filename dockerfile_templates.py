@@ -0,0 +1,224 @@
+# Layer-cache-aware Dockerfile templates for guided mode.
+# The project type is detected from its dependency manifests (Python
+# requirements.txt / pyproject.toml, Node package.json, Go go.mod). The generated
+# Dockerfiles copy only those manifests before installing dependencies, so a
+# source-only edit reuses the dependency layers; package-manager downloads live
+# in BuildKit cache mounts, and the runtime stage is a slim image that receives
+# the installed dependencies (or the compiled binary) from a build stage.
+
+import json
+import os
+import re
+import shlex
+
+SYNTAX = "# syntax=docker/dockerfile:1\n"
+GENERIC_BASE = "python:3.12-slim"
+GENERIC_CMD = "python app.py"
+
+# Patterns that must stay out of the context so `COPY . .` cannot overwrite
+# the dependencies installed in the image
+DOCKERIGNORE = {
+    "python": [".git", "**/__pycache__", "**/*.pyc", ".venv", "venv"],
+    "node": [".git", "**/node_modules", "npm-debug.log*"],
+    "go": [".git", "bin"],
+}
+
+
+class Project:
+    # What guided mode detected in the build directory.
+
+    def __init__(self, kind, manifests, base_image, start_cmd, **details):
+        self.kind = kind                # "python", "node" or "go"
+        self.manifests = manifests      # files copied before the source
+        self.base_image = base_image    # default build-stage image
+        self.start_cmd = start_cmd      # default start command
+        self.details = details
+
+    def describe(self):
+        return f"{self.kind.capitalize()} project ({', '.join(self.manifests)})"
+
+
+def _exists(root, name):
+    return os.path.exists(os.path.join(root, name))
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def detect_project(root="."):
+    # Return a Project for the first recognised manifest set in root, or None.
+    if _exists(root, "go.mod"):
+        version = "1.22"
+        try:
+            with open(os.path.join(root, "go.mod")) as f:
+                m = re.search(r"^go (\d+\.\d+)", f.read(), re.M)
+            if m:
+                version = m.group(1)
+        except OSError:
+            pass
+        manifests = ["go.mod"] + (["go.sum"] if _exists(root, "go.sum") else [])
+        return Project("go", manifests, f"golang:{version}", "/app")
+
+    if _exists(root, "package.json"):
+        package = _read_json(os.path.join(root, "package.json"))
+        scripts = package.get("scripts") or {}
+        if _exists(root, "pnpm-lock.yaml"):
+            manager, lockfile = "pnpm", "pnpm-lock.yaml"
+        elif _exists(root, "yarn.lock"):
+            manager, lockfile = "yarn", "yarn.lock"
+        elif _exists(root, "package-lock.json"):
+            manager, lockfile = "npm", "package-lock.json"
+        else:
+            manager, lockfile = "npm", None
+        if "start" in scripts:
+            start = f"{manager} start"
+        else:
+            start = f"node {package.get('main') or 'index.js'}"
+        manifests = ["package.json"] + ([lockfile] if lockfile else [])
+        return Project("node", manifests, "node:20-slim", start,
+                       manager=manager, lockfile=lockfile, build="build" in scripts)
+
+    if _exists(root, "requirements.txt"):
+        return Project("python", ["requirements.txt"], GENERIC_BASE, GENERIC_CMD, source="requirements")
+    if _exists(root, "pyproject.toml"):
+        return Project("python", ["pyproject.toml"], GENERIC_BASE, GENERIC_CMD, source="pyproject")
+    return None
+
+
+def cmd_array(start_cmd):
+    # Exec-form CMD array for a shell-style command line.
+    try:
+        parts = shlex.split(start_cmd)
+    except ValueError:
+        parts = start_cmd.split()
+    return "[" + ", ".join(json.dumps(p) for p in parts) + "]"
+
+
+def generic(base_image=GENERIC_BASE, start_cmd=GENERIC_CMD):
+    # Single-stage template used when no project type is recognised.
+    return (
+        f"FROM {base_image}\n"
+        f"WORKDIR /app\n"
+        f"COPY . .\n"
+        f"CMD {cmd_array(start_cmd)}\n"
+    )
+
+
+def _python(project, base_image, start_cmd):
+    if project.details.get("source") == "requirements":
+        install = (
+            "COPY requirements.txt ./\n"
+            "RUN --mount=type=cache,target=/root/.cache/pip \\\n"
+            "    pip install -r requirements.txt\n"
+        )
+    else:
+        # Only the dependency list is installed here; the project source is copied later
+        install = (
+            "COPY pyproject.toml ./\n"
+            "RUN python -c \"import tomllib; print('\\n'.join(tomllib.load(open('pyproject.toml', 'rb'))"
+            ".get('project', {}).get('dependencies', [])))\" > /tmp/requirements.txt\n"
+            "RUN --mount=type=cache,target=/root/.cache/pip \\\n"
+            "    pip install -r /tmp/requirements.txt\n"
+        )
+    return (
+        SYNTAX +
+        f"FROM {base_image} AS deps\n"
+        "ENV PIP_DISABLE_PIP_VERSION_CHECK=1\n"
+        "RUN python -m venv /opt/venv\n"
+        "ENV PATH=\"/opt/venv/bin:$PATH\"\n"
+        "WORKDIR /app\n"
+        + install +
+        "\n"
+        f"FROM {base_image}\n"
+        "ENV PATH=\"/opt/venv/bin:$PATH\" PYTHONDONTWRITEBYTECODE=1 PYTHONUNBUFFERED=1\n"
+        "WORKDIR /app\n"
+        "COPY --from=deps /opt/venv /opt/venv\n"
+        "COPY . .\n"
+        f"CMD {cmd_array(start_cmd)}\n"
+    )
+
+
+_NODE_INSTALL = {
+    # manager: (cache mount target, install command, production-only install command)
+    "npm": ("/root/.npm", "npm ci", "npm ci --omit=dev"),
+    "yarn": ("/usr/local/share/.cache/yarn", "yarn install --frozen-lockfile",
+             "yarn install --frozen-lockfile --production"),
+    "pnpm": ("/root/.local/share/pnpm/store", "corepack enable && pnpm install --frozen-lockfile",
+             "corepack enable && pnpm install --frozen-lockfile --prod"),
+}
+
+
+def _node(project, base_image, start_cmd):
+    manager = project.details["manager"]
+    target, install, install_prod = _NODE_INSTALL[manager]
+    if manager == "npm" and not project.details.get("lockfile"):
+        # `npm ci` needs a lockfile
+        install, install_prod = "npm install", "npm install --omit=dev"
+    copy = "COPY " + " ".join(project.manifests) + " ./\n"
+    mount = f"RUN --mount=type=cache,target={target} \\\n    "
+    text = (
+        SYNTAX +
+        f"FROM {base_image} AS deps\n"
+        "WORKDIR /app\n"
+        + copy + mount + install_prod + "\n"
+    )
+    if project.details.get("build"):
+        text += (
+            "\n"
+            f"FROM {base_image} AS build\n"
+            "WORKDIR /app\n"
+            + copy + mount + install + "\n"
+            "COPY . .\n"
+            # dev dependencies stay behind; the runtime gets the production set from deps
+            f"RUN {manager} run build && rm -rf node_modules\n"
+            "\n"
+            f"FROM {base_image}\n"
+            "ENV NODE_ENV=production\n"
+            "WORKDIR /app\n"
+            "COPY --from=deps /app/node_modules ./node_modules\n"
+            "COPY --from=build /app .\n"
+        )
+    else:
+        text += (
+            "\n"
+            f"FROM {base_image}\n"
+            "ENV NODE_ENV=production\n"
+            "WORKDIR /app\n"
+            "COPY --from=deps /app/node_modules ./node_modules\n"
+            "COPY . .\n"
+        )
+    return text + f"CMD {cmd_array(start_cmd)}\n"
+
+
+def _go(project, base_image, start_cmd):
+    return (
+        SYNTAX +
+        f"FROM {base_image} AS build\n"
+        "WORKDIR /src\n"
+        "COPY " + " ".join(project.manifests) + " ./\n"
+        "RUN --mount=type=cache,target=/go/pkg/mod \\\n"
+        "    go mod download\n"
+        "COPY . .\n"
+        "RUN --mount=type=cache,target=/go/pkg/mod \\\n"
+        "    --mount=type=cache,target=/root/.cache/go-build \\\n"
+        "    CGO_ENABLED=0 go build -o /out/app .\n"
+        "\n"
+        "FROM gcr.io/distroless/static-debian12:nonroot\n"
+        "COPY --from=build /out/app /app\n"
+        f"CMD {cmd_array(start_cmd)}\n"
+    )
+
+
+_RENDERERS = {"python": _python, "node": _node, "go": _go}
+
+
+def render(project, base_image=None, start_cmd=None):
+    # Dockerfile text for a detected project (or the generic template when project is None).
+    if project is None:
+        return generic(base_image or GENERIC_BASE, start_cmd or GENERIC_CMD)
+    return _RENDERERS[project.kind](project, base_image or project.base_image, start_cmd or project.start_cmd)
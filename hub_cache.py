@@ -0,0 +1,208 @@
+# Persistent cache for Docker Hub search results.
+# `docker search` goes to the registry on every call and takes seconds. Parsed
+# results are kept in a small SQLite file keyed by the normalized query:
+#   - fresh entries (younger than the TTL) are served directly
+#   - stale entries are served immediately while a background refresh runs
+#   - the cache is capped at a number of entries, evicting least recently used
+#   - offline mode serves only what is cached and never contacts the registry
+
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+
+import app_paths
+import docker_engine
+import docker_health
+from docker_engine import EngineError, EngineUnavailable
+
+DEFAULT_TTL = float(os.environ.get("CMS_HUB_CACHE_TTL", "3600"))
+DEFAULT_MAX_ENTRIES = int(os.environ.get("CMS_HUB_CACHE_SIZE", "500"))
+DEFAULT_LIMIT = 25
+
+
+class HubSearchError(Exception):
+    pass
+
+
+def normalize_query(query, limit=DEFAULT_LIMIT):
+    return f"{' '.join(query.lower().split())}|{limit}"
+
+
+def offline_mode():
+    return os.environ.get("CMS_OFFLINE", "").lower() in ("1", "true", "yes")
+
+
+def fetch_results(query, limit=DEFAULT_LIMIT):
+    # Query the registry (engine API if available, else `docker search`) and return parsed rows.
+    engine = docker_engine.get_client()
+    if engine is not None:
+        try:
+            return [
+                {"name": r.get("name", ""), "description": r.get("description") or "",
+                 "stars": r.get("star_count", 0), "official": bool(r.get("is_official"))}
+                for r in engine.search(query, limit=limit)
+            ]
+        except EngineUnavailable:
+            docker_health.monitor().mark_down()  # socket unreachable: fall back to the CLI
+        except EngineError:
+            pass  # fall back to the CLI
+    try:
+        result = subprocess.run(
+            ["docker", "search", "--no-trunc", "--limit", str(limit), "--format", "{{json .}}", query],
+            check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+    except FileNotFoundError:
+        raise HubSearchError("Docker CLI not found. Please install Docker.")
+    if result.returncode != 0:
+        raise HubSearchError((result.stderr or "docker search failed").strip())
+    rows = []
+    for line in result.stdout.splitlines():
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            raise HubSearchError(f"unexpected docker search output: {line[:80]}")
+        rows.append({
+            "name": data.get("Name", ""),
+            "description": data.get("Description", ""),
+            "stars": int(data.get("StarCount") or 0),
+            "official": data.get("IsOfficial") in (True, "[OK]", "true"),
+        })
+    return rows
+
+
+class CachedResult:
+    __slots__ = ("results", "source", "age")
+
+    def __init__(self, results, source, age=0.0):
+        self.results = results
+        self.source = source  # "hit", "stale", "miss" or "offline"
+        self.age = age
+
+
+class HubCache:
+    # SQLite-backed TTL + LRU cache of search results.
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, fetch=fetch_results,
+                 clock=time.time):
+        self.path = path or app_paths.data_path("hub_search_cache.sqlite3", create=False)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.fetch = fetch
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._threads = []
+
+    def _connect(self, create):
+        if not create and not os.path.exists(self.path):
+            return None
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS searches ("
+            " key TEXT PRIMARY KEY, results TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS searches_last_used ON searches (last_used)")
+        return conn
+
+    def _lookup(self, key):
+        # Reads never create the cache file; it appears with the first stored result.
+        conn = self._connect(create=False)
+        if conn is None:
+            return None
+        with conn:
+            row = conn.execute("SELECT results, fetched_at FROM searches WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE searches SET last_used = ? WHERE key = ?", (self.clock(), key))
+        conn.close()
+        return None if row is None else (json.loads(row[0]), row[1])
+
+    def _store(self, key, results):
+        now = self.clock()
+        with self._lock:
+            conn = self._connect(create=True)
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO searches (key, results, fetched_at, last_used) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(results), now, now)
+                )
+                conn.execute(
+                    "DELETE FROM searches WHERE key IN ("
+                    " SELECT key FROM searches ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+            conn.close()
+
+    def search(self, query, limit=DEFAULT_LIMIT, offline=None):
+        # Return a CachedResult; raises HubSearchError when nothing can be served.
+        offline = offline_mode() if offline is None else offline
+        key = normalize_query(query, limit)
+        cached = self._lookup(key)
+        if cached is not None:
+            results, fetched_at = cached
+            age = self.clock() - fetched_at
+            if offline:
+                return CachedResult(results, "offline", age)
+            if age < self.ttl:
+                return CachedResult(results, "hit", age)
+            self._refresh_in_background(key, query, limit)
+            return CachedResult(results, "stale", age)
+        if offline:
+            raise HubSearchError(f"offline mode: no cached results for '{query}'")
+        results = self.fetch(query, limit)
+        self._store(key, results)
+        return CachedResult(results, "miss")
+
+    def _refresh_in_background(self, key, query, limit):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._store(key, self.fetch(query, limit))
+            except HubSearchError:
+                pass  # keep serving the stale entry
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        thread = threading.Thread(target=refresh, daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def wait(self, timeout=None):
+        # Wait for background refreshes to finish (used by tests and before exit).
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = [t for t in self._threads if t.is_alive()]
+
+    def entries(self):
+        conn = self._connect(create=False)
+        if conn is None:
+            return 0
+        count = conn.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+        conn.close()
+        return count
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+_cache = None
+
+
+def cache():
+    # Shared cache in the application data directory.
+    global _cache
+    if _cache is None:
+        _cache = HubCache()
+    return _cache
@@ -0,0 +1,314 @@
+# Indexed search over local image records.
+# Replaces the substring scan over `docker images` text (which matched sizes,
+# dates and IDs) with an index over repository and tag terms: exact and prefix
+# matches come from a sorted term list, substring candidates from a trigram
+# index and fuzzy (typo) candidates from a single-deletion index, and results
+# are ranked. Queries may be scoped to fields:
+#
+#   nginx                 free text over repository and tag
+#   nginx:1.25            repository and tag together
+#   repo:postgres tag:16  field-scoped terms
+#   label:team=web        label key or key=value
+#   size>100MB size<=1GB  size filters
+#   id:3f2a               image ID prefix
+#
+# An index is built once per inventory snapshot and reused until it changes.
+
+import bisect
+import heapq
+import re
+import threading
+from itertools import chain
+
+from docker_inventory import parse_size
+
+EXACT, PREFIX, SUBSTRING = 1.0, 0.8, 0.6
+FUZZY_WEIGHT = 0.5
+FUZZY_CUTOFF = 0.7
+
+_SPLIT = re.compile(r"[/\-_.]+")
+_SIZE_FILTER = re.compile(r"^size(<=|>=|<|>|=)(.+)$")
+_EMPTY = frozenset()
+
+
+def _trigrams(term):
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+
+def _deletions(term):
+    # The term plus every variant with one character removed. Two words within one
+    # substitution, insertion, deletion or transposition share at least one variant.
+    return {term, *(term[:i] + term[i + 1:] for i in range(len(term)))}
+
+
+def _components(value):
+    # Path segments and their words ("team/api-server" -> team, api-server, api, server).
+    parts = {t for t in value.split("/") if t}
+    parts.update(t for t in _SPLIT.split(value) if t)
+    return parts
+
+
+class _FieldIndex:
+    # Term -> document index for one field. Full values and their components
+    # support exact/prefix lookup; only components (short, few distinct values)
+    # go into the trigram and deletion indexes used for substring and fuzzy matching.
+
+    def __init__(self):
+        self.postings = {}
+        self.sorted_terms = []
+        self.components = set()
+        self.grams = {}
+        self.deletions = {}
+
+    def add(self, doc, value):
+        value = value.lower()
+        parts = _components(value)
+        self.components.update(parts)
+        for term in parts | {value}:
+            self.postings.setdefault(term, set()).add(doc)
+
+    def finish(self):
+        self.sorted_terms = sorted(self.postings)
+        for term in self.components:
+            for gram in _trigrams(term):
+                self.grams.setdefault(gram, set()).add(term)
+            for variant in _deletions(term):
+                self.deletions.setdefault(variant, set()).add(term)
+
+    def terms(self, word, fuzzy=True):
+        # term -> score for `word`: exact, prefix and substring matches; fuzzy only when none of those hit.
+        found = {}
+        if word in self.postings:
+            found[word] = EXACT
+        i = bisect.bisect_left(self.sorted_terms, word)
+        while i < len(self.sorted_terms) and self.sorted_terms[i].startswith(word):
+            found.setdefault(self.sorted_terms[i], PREFIX)
+            i += 1
+        grams = _trigrams(word)
+        if grams:
+            # terms containing every trigram of the word (smallest sets first), then verify
+            sets = sorted((self.grams.get(g, _EMPTY) for g in grams), key=len)
+            for term in sets[0].intersection(*sets[1:]):
+                if word in term:
+                    found.setdefault(term, SUBSTRING)
+        # Fuzzy matching is the fallback for words with no exact/prefix/substring hit (typos).
+        if fuzzy and not found and len(word) >= 3:
+            # Similarity 2*M/T, with M the length of the longest deletion variant both share.
+            for variant in _deletions(word):
+                for term in self.deletions.get(variant, _EMPTY):
+                    if len(term) < 3:
+                        continue
+                    score = FUZZY_WEIGHT * 2 * len(variant) / (len(word) + len(term))
+                    if score >= FUZZY_WEIGHT * FUZZY_CUTOFF and found.get(term, 0) < score:
+                        found[term] = score
+        return found
+
+    def clause(self, word, fuzzy=True):
+        # (score, postings) pairs for `word`, ready for _evaluate.
+        return [(score, self.postings[term]) for term, score in self.terms(word, fuzzy).items()]
+
+    def match(self, word, fuzzy=True):
+        # doc -> best score for `word` in this field.
+        scores = {}
+        for score, docs in _evaluate(self.clause(word, fuzzy)):
+            scores.update(dict.fromkeys(docs, score))
+        return scores
+
+
+def _evaluate(clause, within=None):
+    # Disjoint (score, docs) tiers, best first: each doc gets its best score over the
+    # clause's (score, postings) pairs, optionally restricted to `within`. Postings are
+    # merged with set operations, so per-document work happens in C rather than in a
+    # Python loop over every matching doc.
+    grouped = {}
+    for score, postings in clause:
+        if within is not None:
+            postings = within.intersection(postings)  # iterates the smaller side
+        grouped.setdefault(score, []).append(postings)
+    tiers = []
+    seen = set()
+    for score in sorted(grouped, reverse=True):
+        docs = set().union(*grouped[score])
+        if seen:
+            docs -= seen
+        if docs:
+            tiers.append((score, docs))
+            seen |= docs
+    return tiers
+
+
+class SearchResult:
+    __slots__ = ("score", "image", "repo", "tag")
+
+    def __init__(self, score, image, repo, tag):
+        self.score = score
+        self.image = image
+        self.repo = repo
+        self.tag = tag
+
+
+def parse_query(query):
+    # Split a query string into free words and field filters.
+    parsed = {"words": [], "repo": [], "tag": [], "label": [], "id": [], "size": []}
+    for token in query.split():
+        m = _SIZE_FILTER.match(token.lower())
+        if m:
+            parsed["size"].append((m.group(1), parse_size(m.group(2))))
+            continue
+        field, sep, value = token.partition(":")
+        if sep and field.lower() in ("repo", "tag", "label", "id") and value:
+            parsed[field.lower()].append(value if field.lower() == "label" else value.lower())
+        elif sep and value and "/" not in value:
+            # bare "name:tag"
+            parsed["repo"].append(field.lower())
+            parsed["tag"].append(value.lower())
+        else:
+            parsed["words"].append(token.lower())
+    return parsed
+
+
+_SIZE_OPS = {
+    "<": lambda a, b: a < b, "<=": lambda a, b: a <= b, ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b, "=": lambda a, b: a == b,
+}
+
+
+class ImageIndex:
+    # Search index over (image, repository, tag) documents.
+
+    def __init__(self, images):
+        self.docs = []
+        self.repo = _FieldIndex()
+        self.tag = _FieldIndex()
+        self.labels = {}  # "key" and "key=value" -> {doc}
+        for image in images:
+            label_keys = [k for key, value in (image.labels or {}).items() for k in (key, f"{key}={value}")]
+            for repo, tag in image.refs():
+                doc = len(self.docs)
+                self.docs.append((image, repo, tag))
+                self.repo.add(doc, repo)
+                self.tag.add(doc, tag)
+                for key in label_keys:
+                    self.labels.setdefault(key, set()).add(doc)
+        self.repo.finish()
+        self.tag.finish()
+        # Display order (repository, tag) as a rank per doc, used to break score ties.
+        self.by_name = sorted(range(len(self.docs)), key=lambda d: self.docs[d][1:])
+        self.order = [0] * len(self.docs)
+        for rank, doc in enumerate(self.by_name):
+            self.order[doc] = rank
+        # Sorted size and short-ID columns for filters applied to the whole index.
+        self.by_size = sorted(range(len(self.docs)), key=lambda d: self.docs[d][0].size)
+        self.sizes = [self.docs[d][0].size for d in self.by_size]
+        self.by_id = sorted(range(len(self.docs)), key=lambda d: self._hex_id(self.docs[d][0]))
+        self.ids = [self._hex_id(self.docs[d][0]) for d in self.by_id]
+
+    def __len__(self):
+        return len(self.docs)
+
+    @staticmethod
+    def _hex_id(image):
+        return image.id.split(":")[-1]
+
+    def search(self, query, limit=None, fuzzy=True):
+        parsed = parse_query(query)
+        clauses = []  # every clause must match; each is a list of (score, postings)
+        for word in parsed["words"]:
+            clauses.append(self.repo.clause(word, fuzzy) + self.tag.clause(word, fuzzy))
+        for word in parsed["repo"]:
+            clauses.append(self.repo.clause(word, fuzzy))
+        for word in parsed["tag"]:
+            clauses.append(self.tag.clause(word, fuzzy=False))
+        for selector in parsed["label"]:
+            clauses.append([(0.0, self.labels.get(selector, _EMPTY))])
+
+        # Most selective clause first; later ones only look at the surviving candidates.
+        clauses.sort(key=lambda c: sum(len(postings) for _, postings in c))
+        candidates = None  # None = every document
+        clause_tiers = []
+        for clause in clauses:
+            tiers = _evaluate(clause, candidates)
+            if not tiers:
+                return []
+            clause_tiers.append(tiers)
+            candidates = set().union(*(docs for _, docs in tiers))
+
+        prefixes = tuple(parsed["id"])
+        if prefixes:
+            candidates = self._filter(candidates, chain.from_iterable(map(self._id_range, prefixes)),
+                                      lambda image: self._hex_id(image).startswith(prefixes))
+        for op, size in parsed["size"]:
+            candidates = self._filter(candidates, self._size_range(op, size),
+                                      lambda image, f=_SIZE_OPS[op], n=size: f(image.size, n))
+
+        if candidates is None:
+            ordered = self.by_name[:limit] if limit else self.by_name
+            return [SearchResult(0.0, *self.docs[d]) for d in ordered]
+        if not clause_tiers:
+            tiers = [(0.0, candidates)]
+        elif len(clause_tiers) == 1:
+            tiers = [(score, docs & candidates) for score, docs in clause_tiers[0]]
+        else:
+            # several clauses: a doc's score is the sum of its scores in each
+            buckets = {}
+            for tiers in clause_tiers:
+                for score, docs in tiers:
+                    for doc in docs & candidates:
+                        buckets[doc] = buckets.get(doc, 0.0) + score
+            grouped = {}
+            for doc, score in buckets.items():
+                grouped.setdefault(score, []).append(doc)
+            tiers = sorted(grouped.items(), reverse=True)
+        return [SearchResult(score, *self.docs[d]) for score, d in self._rank(tiers, limit)]
+
+    def _rank(self, tiers, limit):
+        # Best score first, then repository and tag; only the top `limit` are ordered.
+        ordered = []
+        for score, docs in tiers:
+            need = limit - len(ordered) if limit else len(docs)
+            if need < len(docs):
+                top = heapq.nsmallest(need, docs, key=self.order.__getitem__)
+            else:
+                top = sorted(docs, key=self.order.__getitem__)
+            ordered.extend((score, d) for d in top)
+            if limit and len(ordered) >= limit:
+                break
+        return ordered
+
+    def _filter(self, candidates, indexed, keep):
+        # Narrow candidates with a filter: from its sorted column when nothing narrowed them yet.
+        if candidates is None:
+            return set(indexed)
+        return {d for d in candidates if keep(self.docs[d][0])}
+
+    def _id_range(self, prefix):
+        lo = bisect.bisect_left(self.ids, prefix)
+        hi = bisect.bisect_right(self.ids, prefix + "\x7f")
+        return self.by_id[lo:hi]
+
+    def _size_range(self, op, size):
+        lo = bisect.bisect_left(self.sizes, size)
+        hi = bisect.bisect_right(self.sizes, size)
+        if op == "<":
+            return self.by_size[:lo]
+        if op == "<=":
+            return self.by_size[:hi]
+        if op == ">":
+            return self.by_size[hi:]
+        if op == ">=":
+            return self.by_size[lo:]
+        return self.by_size[lo:hi]
+
+
+_cache_lock = threading.Lock()
+_cache = {"key": None, "index": None}
+
+
+def index_for(inventory):
+    # Reuse the index built for this inventory until its images change.
+    key = (id(inventory), inventory.image_version)
+    with _cache_lock:
+        if _cache["key"] != key:
+            _cache["index"] = ImageIndex(inventory.images())
+            _cache["key"] = key
+        return _cache["index"]
@@ -0,0 +1,345 @@
+# Operation and call instrumentation.
+# Every menu operation is timed (@timed), and so is every external call it makes:
+# `subprocess.run` (once install() has wrapped it), Engine API requests and QMP
+# commands (call()). Each metric is a fixed-bucket latency histogram plus an error
+# counter. An observation is a bisect and a few integer increments under a lock,
+# so the layer can stay on all the time. Calls are also charged to the operation
+# running on the same thread. That shows whether an operation's time goes to the
+# daemon, to CLI processes or to QEMU, or to its own code.
+#
+# export() writes a Prometheus text-format file (for node_exporter's textfile
+# collector) and a JSON summary to the data directory. When CMS_PROFILE_SLOW_MS
+# is set, operations run under cProfile, and the profiles of those slower than
+# the threshold are kept in <data dir>/profiles.
+
+import bisect
+import cProfile
+import functools
+import json
+import os
+import subprocess
+import threading
+import time
+
+import app_paths
+
+# Upper bounds in seconds; the last bucket is +Inf
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+PROM_FILE = "metrics.prom"
+JSON_FILE = "metrics.json"
+PROFILE_DIR = "profiles"
+KEEP_PROFILES = 20
+
+
+def enabled():
+    return os.environ.get("CMS_METRICS", "1").lower() not in ("0", "false", "no")
+
+
+def profile_threshold():
+    # Seconds from CMS_PROFILE_SLOW_MS, or None when profiling is off
+    value = os.environ.get("CMS_PROFILE_SLOW_MS", "").strip()
+    try:
+        return float(value) / 1000 if value else None
+    except ValueError:
+        return None
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum", "max", "errors")
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if error:
+            self.errors += 1
+
+    def quantile(self, q):
+        # Estimated from the buckets (linear within a bucket), as Prometheus' histogram_quantile does
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = self.buckets[i - 1] if i else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(low + (high - low) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "errors": self.errors, "sum_s": round(self.sum, 6),
+                "avg_ms": round(self.sum / self.count * 1000, 3) if self.count else None,
+                "p50_ms": _ms(self.quantile(0.5)), "p95_ms": _ms(self.quantile(0.95)),
+                "max_ms": _ms(self.max if self.count else None)}
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Metrics:
+    # Histograms per operation and per (kind, call), and the call time spent inside each operation.
+
+    def __init__(self, buckets=BUCKETS, clock=time.perf_counter):
+        self.buckets = buckets
+        self.clock = clock
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._operations = {}
+        self._calls = {}
+        self._breakdown = {}   # (operation, kind) -> [seconds, calls]
+        self._local = threading.local()
+        self._profiling = False
+
+    def _histogram(self, table, key):
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram(self.buckets)
+        return histogram
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def observe_operation(self, name, seconds, error=False):
+        with self._lock:
+            self._histogram(self._operations, name).observe(seconds, error)
+
+    def observe_call(self, kind, name, seconds, error=False):
+        stack = self._stack()
+        with self._lock:
+            self._histogram(self._calls, (kind, name)).observe(seconds, error)
+            if stack:
+                entry = self._breakdown.setdefault((stack[-1], kind), [0.0, 0])
+                entry[0] += seconds
+                entry[1] += 1
+
+    def operation(self, name):
+        return _Timer(self, name, None)
+
+    def call(self, kind, name):
+        return _Timer(self, name, kind)
+
+    def timed(self, func=None, name=None):
+        # Decorator: @metrics.timed or @metrics.timed(name="...")
+        if func is None:
+            return lambda f: self.timed(f, name)
+        op = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.operation(op):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+            self._calls.clear()
+            self._breakdown.clear()
+            self.started_at = time.time()
+
+    def summary(self):
+        # JSON-ready snapshot: per operation (with its call breakdown) and per call
+        with self._lock:
+            operations = {}
+            for name, h in sorted(self._operations.items()):
+                operations[name] = h.summary()
+                operations[name]["calls"] = {kind: {"count": n, "sum_s": round(s, 6)}
+                                             for (op, kind), (s, n) in sorted(self._breakdown.items()) if op == name}
+            calls = {f"{kind}:{name}": {"kind": kind, "call": name, **h.summary()}
+                     for (kind, name), h in sorted(self._calls.items())}
+        return {"started_at": self.started_at, "operations": operations, "calls": calls}
+
+    def prometheus(self):
+        # Prometheus text exposition format (version 0.0.4)
+        lines = []
+        with self._lock:
+            series = [("cms_operation", "Menu operation", [({"operation": n}, h)
+                                                             for n, h in sorted(self._operations.items())]),
+                      ("cms_call", "External call (subprocess, engine API, QMP)",
+                       [({"kind": k, "call": n}, h) for (k, n), h in sorted(self._calls.items())])]
+            for prefix, help_text, rows in series:
+                lines.append(f"# HELP {prefix}_duration_seconds {help_text} latency.")
+                lines.append(f"# TYPE {prefix}_duration_seconds histogram")
+                for labels, h in rows:
+                    base = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+                    cumulative = 0
+                    for bound, n in zip(self.buckets + (None,), h.counts):
+                        cumulative += n
+                        le = "+Inf" if bound is None else repr(bound)
+                        lines.append(f'{prefix}_duration_seconds_bucket{{{base},le="{le}"}} {cumulative}')
+                    lines.append(f"{prefix}_duration_seconds_sum{{{base}}} {h.sum!r}")
+                    lines.append(f"{prefix}_duration_seconds_count{{{base}}} {h.count}")
+                lines.append(f"# HELP {prefix}_errors_total {help_text} failures.")
+                lines.append(f"# TYPE {prefix}_errors_total counter")
+                for labels, h in rows:
+                    base = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+                    lines.append(f"{prefix}_errors_total{{{base}}} {h.errors}")
+            lines.append("# HELP cms_operation_call_seconds_total Time operations spent waiting on external calls.")
+            lines.append("# TYPE cms_operation_call_seconds_total counter")
+            for (op, kind), (seconds, _) in sorted(self._breakdown.items()):
+                lines.append(f'cms_operation_call_seconds_total{{operation="{_label(op)}",kind="{_label(kind)}"}}'
+                             f" {seconds!r}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, directory=None):
+        # Write metrics.prom and metrics.json atomically; returns their paths.
+        directory = directory or app_paths.data_dir()
+        app_paths.ensure_dir(directory)
+        paths = []
+        for fname, text in ((PROM_FILE, self.prometheus()), (JSON_FILE, json.dumps(self.summary(), indent=2))):
+            path = os.path.join(directory, fname)
+            with open(path + ".tmp", "w") as f:
+                f.write(text)
+            os.replace(path + ".tmp", path)
+            paths.append(path)
+        return paths
+
+
+class _Timer:
+    # Context manager behind operation()/call(); a call has a kind, an operation does not.
+    __slots__ = ("metrics", "name", "kind", "started", "error", "profiler")
+
+    def __init__(self, metrics, name, kind):
+        self.metrics = metrics
+        self.name = name
+        self.kind = kind
+        self.error = False
+        self.profiler = None
+
+    def fail(self):
+        # Count this run as an error without raising (e.g. a non-zero exit status)
+        self.error = True
+
+    def __enter__(self):
+        if self.kind is None:
+            self.metrics._stack().append(self.name)
+            threshold = profile_threshold()
+            if threshold is not None and not self.metrics._profiling:
+                # cProfile cannot nest; only the outermost operation is profiled
+                self.metrics._profiling = True
+                self.profiler = cProfile.Profile()
+                try:
+                    self.profiler.enable()
+                except ValueError:
+                    self.profiler = None
+                    self.metrics._profiling = False
+        self.started = self.metrics.clock()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = self.metrics.clock() - self.started
+        error = self.error or (exc_type is not None and issubclass(exc_type, Exception))
+        if self.kind is not None:
+            self.metrics.observe_call(self.kind, self.name, elapsed, error)
+            return False
+        self.metrics._stack().pop()
+        self.metrics.observe_operation(self.name, elapsed, error)
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.metrics._profiling = False
+            threshold = profile_threshold()
+            if threshold is not None and elapsed >= threshold:
+                _save_profile(self.profiler, self.name, elapsed)
+        return False
+
+
+def _save_profile(profiler, name, elapsed):
+    # <data dir>/profiles/<operation>-<epoch ms>-<duration ms>.prof; only the newest KEEP_PROFILES are kept
+    try:
+        directory = app_paths.data_path(PROFILE_DIR)
+        app_paths.ensure_dir(directory)
+        safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+        profiler.dump_stats(os.path.join(directory, f"{safe}-{int(time.time() * 1000)}-{int(elapsed * 1000)}ms.prof"))
+        profiles = sorted((os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".prof")),
+                          key=os.path.getmtime)
+        for old in profiles[:-KEEP_PROFILES]:
+            os.remove(old)
+    except OSError:
+        pass
+
+
+def print_summary(m=None):
+    # Slowest operations first, each with the time it spent in external calls, then the calls themselves.
+    summary = (m or metrics).summary()
+    if not summary["operations"] and not summary["calls"]:
+        print("No operations recorded yet.")
+        return
+    print(f"{'OPERATION':<28} {'COUNT':>6} {'ERRORS':>6} {'AVG ms':>9} {'P95 ms':>9} {'MAX ms':>9}  CALL TIME")
+    for name, s in sorted(summary["operations"].items(), key=lambda kv: -kv[1]["sum_s"]):
+        calls = ", ".join(f"{kind} {c['sum_s']:.3f}s/{c['count']}" for kind, c in s["calls"].items())
+        print(f"{name:<28} {s['count']:>6} {s['errors']:>6} {s['avg_ms']:>9.1f} {s['p95_ms']:>9.1f} "
+              f"{s['max_ms']:>9.1f}  {calls or '-'}")
+    print(f"\n{'CALL':<40} {'COUNT':>6} {'ERRORS':>6} {'AVG ms':>9} {'P95 ms':>9} {'MAX ms':>9}")
+    for s in sorted(summary["calls"].values(), key=lambda c: -c["sum_s"]):
+        label = f"{s['kind']}: {s['call']}"
+        print(f"{label[:40]:<40} {s['count']:>6} {s['errors']:>6} {s['avg_ms']:>9.1f} {s['p95_ms']:>9.1f} "
+              f"{s['max_ms']:>9.1f}")
+
+
+def command_name(args):
+    # "docker ps", "qemu-img create": the program and its first non-option argument
+    if isinstance(args, str):
+        args = args.split()
+    args = [str(a) for a in args or ()]
+    if not args:
+        return "?"
+    name = os.path.basename(args[0])
+    sub = next((a for a in args[1:] if not a.startswith("-")), None)
+    return f"{name} {sub}" if sub and name in ("docker", "qemu-img", "git") else name
+
+
+metrics = Metrics()
+operation = metrics.operation
+call = metrics.call
+timed = metrics.timed
+_installed = None
+_install_lock = threading.Lock()
+
+
+def install():
+    # Time every subprocess.run() (looked up by callers at call time, so patching it still works).
+    global _installed
+    with _install_lock:
+        if _installed is not None or not enabled():
+            return
+        original = subprocess.run
+
+        @functools.wraps(original)
+        def run(*args, **kwargs):
+            cmd = args[0] if args else kwargs.get("args")
+            with call("subprocess", command_name(cmd)) as timer:
+                result = original(*args, **kwargs)
+                if getattr(result, "returncode", 0) != 0:
+                    timer.fail()
+                return result
+
+        _installed = original
+        subprocess.run = run
+
+
+def uninstall():
+    global _installed
+    with _install_lock:
+        if _installed is not None:
+            subprocess.run = _installed
+            _installed = None
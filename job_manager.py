@@ -0,0 +1,84 @@
+# Menu for background jobs (see jobs.py), and the hand-off used by the long-running menu actions.
+import instrumentation
+import jobs
+import listing
+
+
+def background(kind, params):
+    # Queue the action on the menu's job queue; False when the queue is off (CMS_JOBS=0) so it runs in the foreground
+    queue = jobs.shared()
+    if queue is None:
+        return False
+    job = queue.submit(kind, params)
+    print(f"Job {job.id} queued: {job.describe()}. Follow it under 'j. Background Jobs'.")
+    return True
+
+
+def print_jobs(found):
+    if not found:
+        print("No jobs.")
+        return
+    print(f"{'ID':>5}  {'STATE':<13} {'SUBMITTED':<18} {'ELAPSED':>8}  JOB")
+    for job in found:
+        elapsed = "-" if job.elapsed() is None else f"{job.elapsed():.1f}s"
+        state = job.state + ("*" if job.cancel_requested and not job.finished else "")
+        print(f"{job.id:>5}  {state:<13} {listing.human_age(job.submitted_at):<18} {elapsed:>8}  {job.describe()}")
+        if job.error and job.state != "cancelled":
+            print(f"       {job.error}")
+
+
+def _ask_id():
+    text = input("Job ID: ").strip()
+    if not text.isdigit():
+        print("Enter a job number.")
+        return None
+    return int(text)
+
+
+def _follow(journal, job_id):
+    # Print the job's output until it finishes; Ctrl+C stops following (the job carries on)
+    after = max(0, journal.last_seq(job_id) - 20)
+    try:
+        for _, _, line in jobs.follow(job_id, journal, after):
+            print(line)
+    except KeyboardInterrupt:
+        print("\nStopped following; the job carries on.")
+        return
+    job = journal.get(job_id)
+    print(f"-- job {job.id} {job.state}" + (f": {job.error}" if job.error else ""))
+
+
+@instrumentation.timed
+def manage_jobs():
+    print("\n=== Background Jobs ===")
+    queue = jobs.shared()
+    journal = queue.journal if queue is not None else jobs.Journal()
+    print_jobs(journal.list(limit=15))
+    if queue is None:
+        print("The job queue is off in this session (CMS_JOBS=0); long-running actions run in the foreground.")
+    print("1. Follow a job's output")
+    print("2. Cancel a job")
+    print("3. Wait for a job")
+    print("0. Back")
+    choice = input("Choice: ").strip()
+    if choice not in ("1", "2", "3"):
+        return
+    job_id = _ask_id()
+    if job_id is None:
+        return
+
+    try:
+        if choice == "1":
+            _follow(journal, job_id)
+        elif choice == "2":
+            job = (queue.cancel if queue is not None else jobs.cancel)(job_id)
+            print(f"Job {job.id} cancelled." if job.finished else f"Cancel requested for job {job.id}.")
+        else:
+            try:
+                job = (queue.wait if queue is not None else jobs.wait)(job_id)
+            except KeyboardInterrupt:
+                print("\nStopped waiting; the job carries on.")
+                return
+            print(f"Job {job.id} {job.state}" + (f": {job.error}" if job.error else "."))
+    except jobs.JobError as e:
+        print(f"Job operation failed: {e}")
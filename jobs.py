@@ -0,0 +1,813 @@
+# Background jobs for long-running operations: image pulls, image builds and VM creation.
+# A JobQueue runs an asyncio scheduler on its own thread. Each job's blocking work runs
+# on a worker thread, and every kind has its own limit on jobs in flight (resource
+# class), so a ten-minute build holds up neither the menu nor the pulls behind it.
+#
+# Jobs are kept in a SQLite journal (<data dir>/jobs.sqlite3). It stores each job's
+# state, owner process and result, plus an append-only log of its output lines. Any
+# process can list, tail, cancel or wait on any job. A cancel for a job owned by
+# another process is recorded in the journal, and the owner picks it up on its next
+# poll. The menu runs a queue for its session. A one-shot command journals the job
+# without an owner and starts a `jobs worker` process if none is running.
+#
+# Every queue adopts unowned jobs and the jobs of processes that have gone away:
+# queued jobs run again, and pulls and builds that were interrupted mid-way run
+# again from the start. Docker keeps the layers a pull already fetched and a build hits
+# the build cache, so the rerun is cheap. A VM creation that was cut short is marked
+# failed instead; vm_fleet rolls back on errors but not on a crash, so the user
+# has to check it.
+
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app_paths
+import docker_build
+import docker_pull
+import vm_fleet
+import vm_runtime
+
+JOURNAL_FILE = "jobs.sqlite3"
+# PID of the process whose queue picks up jobs submitted by one-shot commands
+WORKER_FILE = "jobs-worker.pid"
+# A `jobs worker` exits after this many seconds with nothing to do
+WORKER_IDLE_EXIT = 10.0
+KINDS = ("pull", "build", "vm")
+# Jobs of each kind allowed to run at once; CMS_JOB_LIMITS="pull=4,build=2" overrides
+DEFAULT_LIMITS = {"pull": 3, "build": 1, "vm": 2}
+STATES = ("queued", "running", "interrupted", "succeeded", "failed", "cancelled")
+FINISHED = ("succeeded", "failed", "cancelled")
+# How often a queue looks for cancel requests from other processes, and waiters for state changes
+POLL_INTERVAL = 0.5
+# Output lines are written to the journal in batches, at least this often
+LOG_FLUSH_INTERVAL = 0.25
+LOG_FLUSH_LINES = 100
+# An interrupted job is resumed at most this many times in total
+MAX_ATTEMPTS = 3
+# Finished jobs kept in the journal (oldest are pruned when a queue starts)
+KEEP_FINISHED = 500
+
+
+class JobError(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    # Raised inside a job's work once it has been asked to stop
+    pass
+
+
+class Job:
+    __slots__ = ("id", "kind", "params", "state", "owner", "attempts", "cancel_requested", "submitted_at",
+                 "started_at", "finished_at", "result", "error")
+
+    def __init__(self, id, kind, params, state="queued", owner=None, attempts=0, cancel_requested=False,
+                 submitted_at=None, started_at=None, finished_at=None, result=None, error=""):
+        self.id = id
+        self.kind = kind
+        self.params = params
+        self.state = state
+        self.owner = owner                  # PID of the process running (or queueing) the job
+        self.attempts = attempts
+        self.cancel_requested = bool(cancel_requested)
+        self.submitted_at = submitted_at
+        self.started_at = started_at
+        self.finished_at = finished_at
+        self.result = result
+        self.error = error or ""
+
+    @property
+    def finished(self):
+        return self.state in FINISHED
+
+    def describe(self):
+        # "pull nginx:latest, redis:7", "build myapp:1.0", "vm web-1, web-2"
+        if self.kind == "pull":
+            target = ", ".join(self.params.get("refs", []))
+        elif self.kind == "build":
+            target = self.params.get("tag", "")
+        else:
+            target = self.params.get("config") or ", ".join(s.get("name", "") for s in self.params.get("specs", []))
+        return f"{self.kind} {target}"
+
+    def elapsed(self, now=None):
+        if self.started_at is None:
+            return None
+        return (self.finished_at or now or time.time()) - self.started_at
+
+    def as_dict(self):
+        data = {slot: getattr(self, slot) for slot in self.__slots__}
+        data["description"] = self.describe()
+        return data
+
+
+_COLUMNS = ", ".join(Job.__slots__)
+
+
+def _job(row):
+    values = list(row)
+    values[2] = json.loads(values[2])
+    values[10] = json.loads(values[10]) if values[10] else None
+    return Job(*values)
+
+
+def limits_from_env(text=None):
+    # "pull=4,build=2" -> {"pull": 4, "build": 2, "vm": 2}; unknown kinds and bad numbers raise JobError
+    limits = dict(DEFAULT_LIMITS)
+    text = os.environ.get("CMS_JOB_LIMITS", "") if text is None else text
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        kind, _, value = part.partition("=")
+        if kind not in KINDS or not value.strip().isdigit() or int(value) < 1:
+            raise JobError(f"invalid job limit {part!r} (use e.g. pull=4,build=1,vm=2)")
+        limits[kind] = int(value)
+    return limits
+
+
+def owner_alive(pid):
+    # A job's owner counts as gone once its PID has exited (zombies included)
+    return pid is not None and (pid == os.getpid() or vm_runtime.pid_alive(pid))
+
+
+class Journal:
+    # Job records and their output lines in SQLite; safe to share between processes.
+
+    def __init__(self, path=None, clock=time.time):
+        self.path = path or app_paths.data_path(JOURNAL_FILE, create=False)
+        self.clock = clock
+
+    def _connect(self, create):
+        if not create and not os.path.isfile(self.path):
+            return None
+        app_paths.ensure_dir(os.path.dirname(os.path.abspath(self.path)))
+        conn = sqlite3.connect(self.path, timeout=10)
+        # WAL: a `jobs tail` in another process reads while the owner appends
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, params TEXT NOT NULL, state TEXT NOT NULL,"
+            " owner INTEGER, attempts INTEGER NOT NULL DEFAULT 0, cancel_requested INTEGER NOT NULL DEFAULT 0,"
+            " submitted_at REAL NOT NULL, started_at REAL, finished_at REAL, result TEXT, error TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_log ("
+            " job INTEGER NOT NULL, seq INTEGER NOT NULL, at REAL NOT NULL, line TEXT NOT NULL,"
+            " PRIMARY KEY (job, seq))"
+        )
+        return conn
+
+    def _select(self, where="", args=(), order="ORDER BY id"):
+        conn = self._connect(create=False)
+        if conn is None:
+            return []
+        rows = conn.execute(f"SELECT {_COLUMNS} FROM jobs {where} {order}", args).fetchall()
+        conn.close()
+        return [_job(row) for row in rows]
+
+    def add(self, kind, params, owner):
+        now = self.clock()
+        conn = self._connect(create=True)
+        with conn:
+            cur = conn.execute("INSERT INTO jobs (kind, params, state, owner, submitted_at) VALUES (?, ?, ?, ?, ?)",
+                               (kind, json.dumps(params), "queued", owner, now))
+        conn.close()
+        return Job(cur.lastrowid, kind, params, "queued", owner, submitted_at=now)
+
+    def get(self, job_id):
+        rows = self._select("WHERE id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    def list(self, state=None, limit=None):
+        # Newest first
+        where, args = ("WHERE state = ?", [state]) if state else ("", [])
+        order = "ORDER BY id DESC" + (" LIMIT ?" if limit else "")
+        return self._select(where, args + ([limit] if limit else []), order)
+
+    def unfinished(self):
+        return self._select("WHERE state IN ('queued', 'running', 'interrupted')")
+
+    def update(self, job_id, **fields):
+        if "result" in fields:
+            fields["result"] = None if fields["result"] is None else json.dumps(fields["result"], default=str)
+        conn = self._connect(create=True)
+        with conn:
+            conn.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                         [*fields.values(), job_id])
+        conn.close()
+
+    def claim(self, job_id, old_owner, owner):
+        # Take over a job from a process that is gone; False if another process got there first
+        conn = self._connect(create=True)
+        with conn:
+            claimed = conn.execute("UPDATE jobs SET owner = ? WHERE id = ? AND owner IS ?",
+                                   (owner, job_id, old_owner)).rowcount
+        conn.close()
+        return claimed == 1
+
+    def request_cancel(self, job_id):
+        self.update(job_id, cancel_requested=1)
+
+    def cancel_requests(self, owner):
+        # IDs of this owner's unfinished jobs that someone asked to cancel
+        conn = self._connect(create=False)
+        if conn is None:
+            return []
+        rows = conn.execute("SELECT id FROM jobs WHERE owner = ? AND cancel_requested = 1"
+                            " AND state IN ('queued', 'running')", (owner,)).fetchall()
+        conn.close()
+        return [row[0] for row in rows]
+
+    def append(self, job_id, entries):
+        # entries: (seq, at, line) tuples
+        conn = self._connect(create=True)
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO job_log (job, seq, at, line) VALUES (?, ?, ?, ?)",
+                             [(job_id, *entry) for entry in entries])
+        conn.close()
+
+    def log(self, job_id, after=0, limit=None):
+        # Output lines with seq > after, oldest first: [(seq, at, line)]
+        conn = self._connect(create=False)
+        if conn is None:
+            return []
+        sql = "SELECT seq, at, line FROM job_log WHERE job = ? AND seq > ? ORDER BY seq"
+        rows = conn.execute(sql + (" LIMIT ?" if limit else ""), (job_id, after, *([limit] if limit else []))).fetchall()
+        conn.close()
+        return rows
+
+    def last_seq(self, job_id):
+        conn = self._connect(create=False)
+        if conn is None:
+            return 0
+        row = conn.execute("SELECT MAX(seq) FROM job_log WHERE job = ?", (job_id,)).fetchone()
+        conn.close()
+        return row[0] or 0
+
+    def prune(self, keep=KEEP_FINISHED):
+        # Drop all but the newest `keep` finished jobs and their output
+        conn = self._connect(create=False)
+        if conn is None:
+            return 0
+        with conn:
+            old = [row[0] for row in conn.execute(
+                "SELECT id FROM jobs WHERE state IN ('succeeded', 'failed', 'cancelled') ORDER BY id DESC"
+                " LIMIT -1 OFFSET ?", (keep,))]
+            conn.executemany("DELETE FROM job_log WHERE job = ?", [(i,) for i in old])
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in old])
+        conn.close()
+        return len(old)
+
+
+class JobContext:
+    # What a job's work sees: its parameters, a log for its output and the cancel flag.
+    # log() may be called from any thread; lines reach the journal in batches.
+    __slots__ = ("job", "journal", "cancelled", "clock", "_lock", "_pending", "_seq", "_flushed")
+
+    def __init__(self, job, journal, cancelled, clock=time.monotonic):
+        self.job = job
+        self.journal = journal
+        self.cancelled = cancelled
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._pending = []
+        self._seq = journal.last_seq(job.id)  # a resumed job's log continues after its earlier output
+        self._flushed = clock()
+
+    @property
+    def params(self):
+        return self.job.params
+
+    def log(self, line):
+        with self._lock:
+            self._seq += 1
+            self._pending.append((self._seq, time.time(), str(line)))
+            due = len(self._pending) >= LOG_FLUSH_LINES or self.clock() - self._flushed >= LOG_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._flushed = self.clock()
+        if pending:
+            self.journal.append(self.job.id, pending)
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+
+# --- the work behind each kind ----------------------------------------------------
+
+def run_pull(ctx):
+    # params: refs, concurrency, skip_existing. Logs each image's state changes.
+    board = docker_pull.PullBoard()
+    board.cancelled = ctx.cancelled
+    seen = {}
+
+    def on_update(board):
+        with board.lock:
+            images = [(i.ref, i.state, i.error) for i in board.images.values()]
+        for ref, state, error in images:
+            if seen.get(ref) != state:
+                seen[ref] = state
+                ctx.log(f"{ref}: {state}" + (f" ({error})" if error else ""))
+
+    report = docker_pull.pull_images(ctx.params["refs"], concurrency=ctx.params.get("concurrency", 4),
+                                     skip_existing=ctx.params.get("skip_existing", "digest"), board=board,
+                                     on_update=on_update, update_interval=LOG_FLUSH_INTERVAL)
+    ctx.check()
+    return report
+
+
+def run_build(ctx):
+    # params: context, tag, dockerfile, cache_check. Logs the build output.
+    p = ctx.params
+
+    def on_line(line):
+        ctx.check()
+        ctx.log(line)
+
+    result = docker_build.build(p["context"], p["tag"], dockerfile=p.get("dockerfile"), on_line=on_line,
+                                cache_check=p.get("cache_check", True))
+    if not result["ok"]:
+        raise JobError(f"build failed: {result['error']}")
+    return result
+
+
+def run_vm(ctx):
+    # params: specs (name/ram/cpu/disk/base dicts) or config (file or directory), disk_dir, concurrency.
+    p = ctx.params
+    if p.get("config"):
+        specs = vm_fleet.load(p["config"])
+    else:
+        specs = [vm_fleet.VmSpec(s["name"], s["ram"], s["cpu"], s.get("disk", ""), s.get("base", ""),
+                                 s.get("source", "job")) for s in p["specs"]]
+
+    def on_result(vm):
+        ctx.log(f"{vm.spec.name}: {vm.status}" + (f" ({vm.error})" if vm.error else ""))
+
+    return vm_fleet.provision(specs, concurrency=p.get("concurrency", vm_fleet.DEFAULT_CONCURRENCY),
+                              disk_dir=p.get("disk_dir", "."), on_result=on_result)
+
+
+class Runner:
+    __slots__ = ("work", "resumable", "cancellable")
+
+    def __init__(self, work, resumable, cancellable):
+        self.work = work
+        self.resumable = resumable        # safe to start again after a crash
+        self.cancellable = cancellable    # stops part way when cancelled while running
+
+
+RUNNERS = {
+    "pull": Runner(run_pull, resumable=True, cancellable=True),
+    "build": Runner(run_build, resumable=True, cancellable=True),
+    # a fleet run rolls back on failure; stopping it half way would leave VMs and disks behind
+    "vm": Runner(run_vm, resumable=False, cancellable=False),
+}
+
+
+def _outcome(result):
+    # (state, JSON-ready result, error) for whatever a job's work returned
+    data = result.as_dict() if hasattr(result, "as_dict") else result
+    failed = getattr(result, "failed", None)
+    if failed:
+        return "failed", data, f"{len(failed)} item(s) failed"
+    return "succeeded", data, ""
+
+
+class JobQueue:
+    # Runs submitted jobs in the background; one per process is enough (see shared()).
+
+    def __init__(self, journal=None, limits=None, runners=None, poll_interval=POLL_INTERVAL):
+        self.journal = journal or Journal()
+        self.limits = limits or limits_from_env()
+        self.runners = runners or RUNNERS
+        self.poll_interval = poll_interval
+        self.owner = os.getpid()
+        self._loop = None
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=sum(self.limits.values()), thread_name_prefix="job")
+        self._slots = {}
+        self._tasks = {}         # job id -> asyncio task (loop thread only)
+        self._running = set()    # job ids whose work has started (loop thread only)
+        self._cancels = {}       # job id -> threading.Event, for every job this queue holds
+        self._requested = set()  # jobs cancelled by a user (not by stop())
+        self._cond = threading.Condition()
+        self._adopt_lock = threading.Lock()
+        self._stopping = False
+
+    # --- scheduler thread ----------------------------------------------------
+
+    def start(self, resume=True):
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(ready,), name="jobs", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if resume:
+            self.journal.prune()
+            self.resume()
+        return self
+
+    def _serve(self, ready):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._slots = {kind: asyncio.Semaphore(limit) for kind, limit in self.limits.items()}
+        poller = self._loop.create_task(self._poll())
+        ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            poller.cancel()
+            pending = [poller, *self._tasks.values()]
+            self._loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            self._loop.run_until_complete(self._loop.shutdown_default_executor())
+            self._loop.close()
+
+    async def _poll(self):
+        # The journal reads run on the loop's default executor, not the job executor, so a
+        # queue whose every slot is busy still sees cancel requests
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if self._stopping:
+                continue
+            try:
+                await self._loop.run_in_executor(None, self._sync)
+            except sqlite3.Error:
+                continue
+
+    def _sync(self):
+        # Cancel requests written to the journal by other processes, and jobs nobody holds
+        for job_id in self.journal.cancel_requests(self.owner):
+            if job_id in self._cancels:
+                self._cancel_local(job_id)
+        if not self._stopping:
+            self.resume()
+
+    def _schedule(self, job):
+        with self._cond:
+            # adopted while stop() was flagging the others: it stays queued for the next queue
+            self._cancels[job.id] = event = threading.Event()
+            if self._stopping:
+                event.set()
+        self._loop.call_soon_threadsafe(self._create_task, job)
+
+    def _create_task(self, job):
+        task = self._loop.create_task(self._run(job))
+        task.add_done_callback(lambda task: self._settle(job, task))
+        self._tasks[job.id] = task
+
+    def _settle(self, job, task):
+        # A done callback rather than a finally: a task cancelled before its first step never runs its body.
+        # Any journal write goes to the default executor; the job is forgotten once it is recorded.
+        if task.cancelled():
+            # cancelled while waiting for a slot: by a user, or by stop() (then it stays queued for the next queue)
+            if job.id in self._requested or not self._stopping:
+                record = (self._finish, job, "cancelled", None, "cancelled before it started")
+            else:
+                record = (self._release, job)
+        elif task.exception() is not None and job.id in self._cancels:
+            record = (self._finish, job, "failed", None, f"job queue error: {task.exception()}")
+        else:
+            self._forget(job)
+            return
+        self._loop.run_in_executor(None, *record).add_done_callback(lambda done: self._recorded(job, done))
+
+    def _recorded(self, job, done):
+        # A failed write leaves the job to whichever queue adopts it next
+        if not done.cancelled():
+            done.exception()
+        self._forget(job)
+
+    async def _run(self, job):
+        runner = self.runners[job.kind]
+        cancelled = self._cancels[job.id]
+        async with self._slots[job.kind]:
+            if cancelled.is_set():
+                raise asyncio.CancelledError()
+            self._running.add(job.id)
+            await self._loop.run_in_executor(self._executor, self._execute, job, runner, cancelled)
+
+    def _execute(self, job, runner, cancelled):
+        # Job thread: the work, with the journal writes that start and finish it
+        job.attempts += 1
+        job.started_at = time.time()
+        self.journal.update(job.id, state="running", started_at=job.started_at, attempts=job.attempts)
+        ctx = JobContext(job, self.journal, cancelled)
+        try:
+            result = runner.work(ctx)
+        except JobCancelled:
+            state, data, error = ("cancelled", None, "cancelled") if job.id in self._requested \
+                else ("interrupted", None, "interrupted by shutdown")
+        except Exception as e:
+            state, data, error = "failed", None, str(e) or type(e).__name__
+        else:
+            state, data, error = _outcome(result)
+        ctx.flush()
+        self._finish(job, state, data, error)
+
+    def _finish(self, job, state, result, error):
+        owner = None if state == "interrupted" else self.owner
+        finished_at = None if state == "interrupted" else time.time()
+        self.journal.update(job.id, state=state, result=result, error=error, finished_at=finished_at, owner=owner)
+
+    def _release(self, job):
+        self.journal.update(job.id, owner=None)
+
+    def _forget(self, job):
+        self._tasks.pop(job.id, None)
+        self._running.discard(job.id)
+        with self._cond:
+            self._cancels.pop(job.id, None)
+            self._requested.discard(job.id)
+            self._cond.notify_all()
+
+    def _cancel_local(self, job_id):
+        # Loop thread or any other: flag the work, and wake the task if it is still queued
+        with self._cond:
+            event = self._cancels.get(job_id)
+            if event is None:
+                return
+            self._requested.add(job_id)
+            event.set()
+
+        def wake():
+            if job_id in self._tasks and job_id not in self._running:
+                self._tasks[job_id].cancel()
+        self._loop.call_soon_threadsafe(wake)
+
+    # --- API -------------------------------------------------------------------
+
+    def submit(self, kind, params):
+        # Journal the job and queue it; returns the Job (its id is what list/tail/cancel/wait take)
+        _check_kind(kind, self.runners)
+        if self._stopping or self._thread is None:
+            raise JobError("the job queue is not running")
+        job = self.journal.add(kind, params, self.owner)
+        self._schedule(job)
+        return job
+
+    def resume(self):
+        # Adopt unfinished jobs of processes that are gone; returns the jobs queued again
+        with self._adopt_lock:
+            return self._adopt()
+
+    def _adopt(self):
+        resumed = []
+        for job in self.journal.unfinished():
+            if job.owner == self.owner or owner_alive(job.owner):
+                continue
+            if not self.journal.claim(job.id, job.owner, self.owner):
+                continue  # another process adopted it first
+            runner = self.runners[job.kind]
+            if job.cancel_requested:
+                self.journal.update(job.id, state="cancelled", finished_at=time.time(), error="cancelled")
+                continue
+            if job.state != "queued":
+                if not runner.resumable or job.attempts >= MAX_ATTEMPTS:
+                    reason = "interrupted; not resumed after a restart (check the VMs it was creating)" \
+                        if not runner.resumable else f"interrupted {job.attempts} times; not resumed again"
+                    self.journal.update(job.id, state="failed", finished_at=time.time(), error=reason)
+                    continue
+                ctx = JobContext(job, self.journal, threading.Event())
+                ctx.log("-- resumed after an interruption --")
+                ctx.flush()
+                self.journal.update(job.id, state="queued")
+            job.state, job.owner = "queued", self.owner
+            self._schedule(job)
+            resumed.append(job)
+        return resumed
+
+    def cancel(self, job_id):
+        # Cancel a queued or running job, whichever process holds it; returns the updated Job
+        job = self.journal.get(job_id)
+        if job is not None and job.id in self._cancels:
+            if job.state == "running" and not self.runners[job.kind].cancellable:
+                raise JobError(f"a running {job.kind} job cannot be cancelled")
+            self._cancel_local(job.id)
+            return self.journal.get(job_id)
+        return cancel(job_id, self.journal, self.runners)
+
+    def wait(self, job_id, timeout=None):
+        # Block until the job has finished; returns it (still unfinished if the timeout passed)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while job_id in self._cancels:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        if job_id in self._cancels:
+            return self.journal.get(job_id)
+        return wait(job_id, None if deadline is None else max(0.0, deadline - time.monotonic()), self.journal)
+
+    def active(self):
+        with self._cond:
+            return len(self._cancels)
+
+    def stop(self, wait=False, timeout=None):
+        # With wait=True, let every job finish first. Otherwise queued jobs stay queued and
+        # running pulls/builds are stopped as "interrupted"; the next queue resumes both.
+        if wait:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            with self._cond:
+                while self._cancels:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+        self._stopping = True
+        if self._thread is None:
+            return
+
+        def halt():
+            for job_id, task in self._tasks.items():
+                if job_id not in self._running:
+                    task.cancel()
+        with self._cond:
+            for event in self._cancels.values():
+                event.set()
+        self._loop.call_soon_threadsafe(halt)
+        # a running VM job is not interruptible, so this waits for it to finish
+        with self._cond:
+            while self._cancels:
+                self._cond.wait(1)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        self._executor.shutdown(wait=True)
+        self._thread = None
+
+
+# --- any process: the journal is the source of truth ---------------------------------
+
+def _check_kind(kind, runners=RUNNERS):
+    if kind not in runners:
+        raise JobError(f"unknown job kind '{kind}' (choose from {', '.join(runners)})")
+
+
+def _abandoned(job):
+    # Unfinished, and no live process will carry it on (an unowned queued job waits for a worker)
+    return job.state == "interrupted" or (job.owner is not None and not owner_alive(job.owner))
+
+
+def enqueue(kind, params, journal=None):
+    # Journal a job without an owner; the next queue to poll (see ensure_worker()) runs it
+    _check_kind(kind)
+    return (journal or Journal()).add(kind, params, None)
+
+
+def cancel(job_id, journal=None, runners=RUNNERS):
+    # Ask whichever process holds the job to cancel it; a job nobody holds is cancelled on the spot
+    journal = journal or Journal()
+    job = journal.get(job_id)
+    if job is None:
+        raise JobError(f"no job {job_id}")
+    if job.finished:
+        raise JobError(f"job {job_id} has already {job.state}")
+    if job.state == "running" and not runners[job.kind].cancellable:
+        raise JobError(f"a running {job.kind} job cannot be cancelled")
+    if owner_alive(job.owner):
+        journal.request_cancel(job_id)
+    else:
+        journal.update(job_id, state="cancelled", finished_at=time.time(), error="cancelled", cancel_requested=1)
+    return journal.get(job_id)
+
+
+def wait(job_id, timeout=None, journal=None, interval=POLL_INTERVAL):
+    # Poll the journal until the job has finished; returns the job (unfinished if the timeout passed)
+    journal = journal or Journal()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        job = journal.get(job_id)
+        if job is None:
+            raise JobError(f"no job {job_id}")
+        if job.finished or _abandoned(job):
+            return job
+        if deadline is not None and time.monotonic() >= deadline:
+            return job
+        time.sleep(interval if deadline is None else max(0.0, min(interval, deadline - time.monotonic())))
+
+
+def follow(job_id, journal=None, after=0, interval=POLL_INTERVAL):
+    # Yield (seq, at, line) output as it is journaled, until the job has finished
+    journal = journal or Journal()
+    while True:
+        job = journal.get(job_id)
+        if job is None:
+            raise JobError(f"no job {job_id}")
+        for entry in journal.log(job_id, after):
+            after = entry[0]
+            yield entry
+        if job.finished or _abandoned(job):
+            for entry in journal.log(job_id, after):
+                yield entry
+            return
+        time.sleep(interval)
+
+
+# --- the worker process for one-shot commands ----------------------------------------
+
+def worker_pid():
+    # PID of the live process that owns the worker file, or None
+    try:
+        with open(app_paths.data_path(WORKER_FILE, create=False)) as f:
+            pid = int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return None
+    return pid if pid and owner_alive(pid) else None
+
+
+def _claim_worker_file():
+    # Become the worker unless a live process already is; True on success
+    path = app_paths.data_path(WORKER_FILE)
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if worker_pid() is not None:
+                return False
+            try:
+                os.remove(path)  # left behind by a worker that is gone
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        return True
+    return False
+
+
+def _release_worker_file():
+    path = app_paths.data_path(WORKER_FILE, create=False)
+    try:
+        with open(path) as f:
+            mine = f.read().strip() == str(os.getpid())
+        if mine:
+            os.remove(path)
+    except (OSError, ValueError):
+        pass
+
+
+def ensure_worker():
+    # Start a detached `jobs worker` unless some process already picks up unowned jobs; returns its PID
+    pid = worker_pid()
+    if pid is not None:
+        return pid
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    options = {"start_new_session": True} if os.name != "nt" else \
+        {"creationflags": getattr(subprocess, "DETACHED_PROCESS", 0)}
+    proc = subprocess.Popen([sys.executable, main, "jobs", "worker"], stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **options)
+    return proc.pid
+
+
+def run_worker(idle_exit=WORKER_IDLE_EXIT, journal=None, limits=None):
+    # Run a queue until nothing has been left to do for `idle_exit` seconds; False if another worker is running
+    if not _claim_worker_file():
+        return False
+    queue = None
+    try:
+        queue = start_shared(journal, limits)
+        idle_since = time.monotonic()
+        while time.monotonic() - idle_since < idle_exit or queue.resume():
+            time.sleep(queue.poll_interval)
+            if queue.active():
+                idle_since = time.monotonic()
+    finally:
+        if queue is not None:
+            stop_shared(wait=True)
+        _release_worker_file()
+    return True
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared():
+    # The running process-wide queue, or None if it has not been started.
+    return _shared
+
+
+def start_shared(journal=None, limits=None):
+    # Start the process-wide queue, adopting jobs left behind by processes that are gone.
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = JobQueue(journal, limits).start()
+        return _shared
+
+
+def stop_shared(wait=False, timeout=None):
+    global _shared
+    with _shared_lock:
+        if _shared is not None:
+            _shared.stop(wait, timeout)
+            _shared = None
@@ -0,0 +1,193 @@
+# Listings of typed records: filter, sort, paginate and pick columns, then render once.
+# Sources hand over iterators of __slots__ records (ImageRecord, ContainerRecord,
+# VmRecord) that are parsed as the JSON arrives. select() consumes the iterator
+# and keeps only the requested page. A sorted page is picked with a bounded heap
+# of offset + limit records, so listing 10k containers does not keep 10k records
+# alive. The page is then formatted as a single block of lines; nothing is printed
+# row by row.
+#
+#   page = listing.select(source.iter_containers(), "containers", sort="created", reverse=True, limit=50)
+#   print("\n".join(page.lines()))
+
+import heapq
+import itertools
+import time
+
+
+def human_size(num):
+    # 142000000 -> "142MB", like the docker CLI (decimal units)
+    for unit in ("B", "kB", "MB", "GB"):
+        if abs(num) < 1000:
+            return f"{num:.3g}{unit}" if unit != "B" else f"{int(num)}B"
+        num /= 1000.0
+    return f"{num:.3g}TB"
+
+
+def human_age(ts):
+    if not ts:
+        return "-"
+    delta = max(0, int(time.time() - ts))
+    for seconds, unit in ((86400 * 365, "year"), (86400 * 30, "month"), (86400 * 7, "week"),
+                          (86400, "day"), (3600, "hour"), (60, "minute")):
+        if delta >= seconds:
+            n = delta // seconds
+            return f"{n} {unit}{'s' if n != 1 else ''} ago"
+    return "Less than a minute ago"
+
+
+class Column:
+    # `key` is the raw value (sorting and JSON); `text` is what a table cell shows
+    __slots__ = ("name", "header", "key", "text")
+
+    def __init__(self, name, header, key, text=None):
+        self.name = name
+        self.header = header
+        self.key = key
+        self.text = text or (lambda record: "-" if key(record) is None else str(key(record)))
+
+
+def _command(record):
+    command = record.command if len(record.command) <= 20 else record.command[:19] + "…"
+    return f'"{command}"'
+
+
+def _first_ref(record, part):
+    refs = record.refs()
+    return refs[0][part] + (f" (+{len(refs) - 1})" if part == 1 and len(refs) > 1 else "")
+
+
+def _labels(record):
+    return ",".join(f"{k}={v}" for k, v in sorted(record.labels.items())) or "-"
+
+
+COLUMNS = {
+    "images": [
+        Column("id", "IMAGE ID", lambda r: r.id, lambda r: r.short_id),
+        Column("repository", "REPOSITORY", lambda r: r.refs()[0][0], lambda r: _first_ref(r, 0)),
+        Column("tag", "TAG", lambda r: r.refs()[0][1], lambda r: _first_ref(r, 1)),
+        Column("tags", "TAGS", lambda r: list(r.repo_tags), lambda r: ", ".join(r.repo_tags) or "<none>"),
+        Column("created", "CREATED", lambda r: r.created, lambda r: human_age(r.created)),
+        Column("size", "SIZE", lambda r: r.size, lambda r: human_size(r.size)),
+        Column("labels", "LABELS", lambda r: r.labels, _labels),
+    ],
+    "containers": [
+        Column("id", "CONTAINER ID", lambda r: r.id, lambda r: r.short_id),
+        Column("image", "IMAGE", lambda r: r.image),
+        Column("command", "COMMAND", lambda r: r.command, _command),
+        Column("created", "CREATED", lambda r: r.created, lambda r: human_age(r.created)),
+        Column("status", "STATUS", lambda r: r.status, lambda r: r.status or r.state),
+        Column("state", "STATE", lambda r: r.state),
+        Column("name", "NAMES", lambda r: r.name),
+        Column("labels", "LABELS", lambda r: r.labels, _labels),
+    ],
+    "vms": [
+        Column("name", "NAME", lambda r: r.name),
+        Column("state", "STATE", lambda r: r.state),
+        Column("ram", "RAM (MB)", lambda r: r.ram_mb),
+        Column("cpus", "CPUS", lambda r: r.cpus),
+        Column("disk", "DISK", lambda r: r.disk),
+        Column("disk_size", "DISK SIZE", lambda r: r.disk_size),
+        Column("base", "BASE", lambda r: r.base),
+        Column("origin", "ORIGIN", lambda r: r.origin),
+        Column("created", "CREATED", lambda r: r.created_at, lambda r: human_age(r.created_at)),
+    ],
+}
+
+# Table columns when none are asked for (JSON output gets every column)
+DEFAULT_COLUMNS = {
+    "images": ("repository", "tag", "id", "created", "size"),
+    "containers": ("id", "image", "command", "created", "status", "name"),
+    "vms": ("name", "state", "ram", "cpus", "disk", "base"),
+}
+
+
+def parse_columns(kind, names=None):
+    # Column objects for "a,b,c" (or a list of names); raises ValueError for unknown names
+    available = {c.name: c for c in COLUMNS[kind]}
+    if isinstance(names, str):
+        names = [n.strip() for n in names.split(",") if n.strip()]
+    unknown = [n for n in names or () if n not in available]
+    if unknown:
+        raise ValueError(f"unknown {kind} column(s): {', '.join(unknown)} (choose from {', '.join(available)})")
+    return [available[n] for n in names] if names else None
+
+
+def _sort_key(column, reverse):
+    # Missing values sort last in either direction
+    missing = (0,) if reverse else (1,)
+
+    def key(record):
+        value = column.key(record)
+        return missing if value is None else (1 if reverse else 0, value)
+    return key
+
+
+class Page(list):
+    # One page of records plus where it sits in the full listing
+    __slots__ = ("kind", "total", "offset", "columns")
+
+    def __init__(self, records, kind, total, offset=0, columns=None):
+        super().__init__(records)
+        self.kind = kind
+        self.total = total
+        self.offset = offset
+        self.columns = columns  # None: the kind's defaults (tables) or every column (JSON)
+
+    def as_dict(self):
+        # JSON form: one object per record with the selected columns' raw values
+        # (rows that are already dicts, such as enriched VM rows, pass through)
+        chosen = self.columns or COLUMNS[self.kind]
+        return [record if isinstance(record, dict) else {c.name: c.key(record) for c in chosen} for record in self]
+
+    def footer(self):
+        # "Showing 51-100 of 10000" when the page is not the whole listing
+        if len(self) == self.total:
+            return None
+        if not self:
+            return f"Showing 0 of {self.total}"
+        return f"Showing {self.offset + 1}-{self.offset + len(self)} of {self.total}"
+
+    def lines(self):
+        # The page as table lines, with widths measured over this page only
+        chosen = self.columns or parse_columns(self.kind, DEFAULT_COLUMNS[self.kind])
+        rows = [[c.text(record) for c in chosen] for record in self]
+        widths = [len(c.header) for c in chosen]
+        for row in rows:
+            widths = [max(w, len(cell)) for w, cell in zip(widths, row)]
+        fmt = "   ".join("{:<%d}" % w for w in widths)
+        lines = [fmt.format(*[c.header for c in chosen]).rstrip()]
+        lines.extend(fmt.format(*row).rstrip() for row in rows)
+        footer = self.footer()
+        return lines + [footer] if footer else lines
+
+
+def select(records, kind, where=None, sort=None, reverse=False, offset=0, limit=None, columns=None):
+    # Page of `records` (any iterable, consumed once) matching `where`.
+    # Sorted pages keep at most offset + limit records; the rest are only counted.
+    if kind not in COLUMNS:
+        raise ValueError(f"unknown listing kind {kind!r}")
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("offset and limit must not be negative")
+    chosen = parse_columns(kind, columns)
+    total = 0
+
+    def counted():
+        nonlocal total
+        for record in records:
+            if where is None or where(record):
+                total += 1
+                yield record
+
+    if sort:
+        key = _sort_key(parse_columns(kind, [sort])[0], reverse)
+        if limit is None:
+            found = sorted(counted(), key=key, reverse=reverse)[offset:]
+        else:
+            pick = heapq.nlargest if reverse else heapq.nsmallest
+            found = pick(offset + limit, counted(), key=key)[offset:]
+    else:
+        stream = counted()
+        found = list(itertools.islice(stream, offset, None if limit is None else offset + limit))
+        for _ in stream:
+            pass
+    return Page(found, kind, total, offset, chosen)
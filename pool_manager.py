@@ -0,0 +1,96 @@
+# Menu for warm pools (see warm_pool.py).
+import instrumentation
+import warm_pool
+
+
+def _fmt(value, spec):
+    return "-" if value is None else format(value, spec)
+
+
+def print_pool_stats(pool):
+    rows = pool.stats()
+    if not rows:
+        print("No warm pool templates.")
+        return
+    print(f"{'TEMPLATE':<16} {'KIND':<10} {'READY':>7} {'HITS':>6} {'MISSES':>6} {'HIT%':>6} "
+          f"{'P50 ms':>8} {'P95 ms':>8} {'FILL s':>7}")
+    for row in rows:
+        hit_rate = None if row["hit_rate"] is None else row["hit_rate"] * 100
+        ready = f"{row['ready']}/{row['size']}"
+        print(f"{row['template']:<16} {row['kind']:<10} {ready:>7} {row['hits']:>6} {row['misses']:>6} "
+              f"{_fmt(hit_rate, '.0f'):>6} {_fmt(row['p50_ms'], '.1f'):>8} {_fmt(row['p95_ms'], '.1f'):>8} "
+              f"{_fmt(row['avg_fill_s'], '.1f'):>7}")
+        if row["errors"]:
+            print(f"  {row['errors']} refill error(s), last: {row['last_error']}")
+
+
+def _ask_template():
+    name = input("Template name: ").strip()
+    kind = input("Kind (vm/container): ").strip().lower()
+    size = input("Pool size: ").strip()
+    spec = {}
+    if kind == "vm":
+        spec["base"] = input("Base image name: ").strip()
+        spec["ram"] = input("RAM (MB) [1024]: ").strip() or "1024"
+        spec["cpu"] = input("CPUs [1]: ").strip() or "1"
+        spec["warmup"] = float(input("Seconds to boot before pausing [0]: ").strip() or 0)
+    else:
+        spec["image"] = input("Image: ").strip()
+        command = input("Command (blank for the image default): ").strip()
+        if command:
+            spec["command"] = command
+    return warm_pool.Template.from_dict({"name": name, "kind": kind, "size": size, **spec})
+
+
+@instrumentation.timed
+def manage_warm_pools():
+    print("\n=== Warm Pools ===")
+    pool = warm_pool.shared()
+    if pool is None:
+        print("Warm pools are not running (templates are kept in warm_pools.json).")
+        try:
+            templates = warm_pool.load_templates()
+        except (warm_pool.PoolError, ValueError) as e:
+            print(f"Invalid warm pool config: {e}")
+            return
+        for t in templates:
+            print(f"- {t.name:<16} {t.kind:<10} size {t.size}")
+    else:
+        print_pool_stats(pool)
+    print("1. Add or resize a template")
+    print("2. Remove a template")
+    print("3. Allocate from a pool")
+    print("4. Start pools in the background" if pool is None else "4. Stop pools (destroy idle members)")
+    print("0. Back")
+    choice = input("Choice: ").strip()
+
+    try:
+        if choice == "1":
+            template = _ask_template()
+            templates = [t for t in warm_pool.load_templates() if t.name != template.name] + [template]
+            warm_pool.save_templates(templates)
+            if pool is not None:
+                pool.set_template(template)
+            print(f"Template '{template.name}' saved (size {template.size}).")
+        elif choice == "2":
+            name = input("Template name: ").strip()
+            warm_pool.save_templates([t for t in warm_pool.load_templates() if t.name != name])
+            if pool is not None:
+                pool.remove_template(name)
+            print(f"Template '{name}' removed.")
+        elif choice == "3":
+            if pool is None:
+                print("Start the pools first.")
+                return
+            allocation = pool.allocate(input("Template name: ").strip())
+            source = "from the pool" if allocation.hit else "cold (pool empty)"
+            print(f"Allocated {allocation.member} {source} in {allocation.latency * 1000:.1f} ms.")
+        elif choice == "4":
+            if pool is None:
+                warm_pool.start_shared()
+                print("Warm pools started; members are prepared in the background.")
+            else:
+                warm_pool.stop_shared(drain=True)
+                print("Warm pools stopped.")
+    except (warm_pool.PoolError, ValueError, OSError) as e:
+        print(f"Warm pool operation failed: {e}")
@@ -0,0 +1,76 @@
+# Unit Tests for the benchmark harness: the fake tools must keep parsing like the real ones
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+
+import bench_suite  # noqa: E402
+import docker_engine  # noqa: E402
+import docker_inventory  # noqa: E402
+import fake_engine  # noqa: E402
+import fake_tools  # noqa: E402
+import vm_images  # noqa: E402
+
+
+class TestBenchmarkHarness(unittest.TestCase):
+    # The fakes are driven through the real parsers; the suite runs at a tiny size
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(dir="/tmp")
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        self.inventory = fake_tools.make_inventory(20, bulk=5)
+        fake_tools.write_inventory(self.tmpdir, self.inventory)
+        env = patch.dict(os.environ, fake_tools.fake_env(self.tmpdir))
+        env.start()
+        self.addCleanup(env.stop)
+
+    def testFakeDockerCliParses(self):
+        # Test: `docker images`/`docker ps` output from the fake loads into an inventory, and stop is journaled
+        source = docker_inventory.CliSource()
+        images = source.list_images()
+        containers = source.list_containers()
+        self.assertEqual(sorted(i.id for i in images), sorted(i["Id"] for i in self.inventory["images"]))
+        self.assertEqual(len(containers), 20)
+        web = self.inventory["containers"][0]
+        self.assertEqual(containers[0].labels, web["Labels"])
+        fake_tools.main("docker", ["stop", web["Id"][:12]])
+        self.assertEqual(source.get_container(web["Id"]).state, "exited")
+
+    def testFakeEngineAndQemuImg(self):
+        # Test: the fake engine answers the client; fake qemu-img overlays carry their backing file
+        sock = os.path.join(self.tmpdir, "docker.sock")
+        engine = fake_engine.FakeEngine(sock, self.inventory).start()
+        self.addCleanup(engine.close)
+        client = docker_engine.EngineClient(sock)
+        self.addCleanup(client.close)
+        bulk = client.containers(all=True, filters={"label": ["bench=bulk"]})
+        self.assertEqual(len(bulk), 5)
+        client.stop_container(bulk[0]["Id"])
+        client.stop_container(bulk[0]["Id"])  # already stopped: 304 is not an error
+        self.assertEqual(engine.containers[bulk[0]["Id"]]["State"], "exited")
+
+        base, overlay = os.path.join(self.tmpdir, "base.qcow2"), os.path.join(self.tmpdir, "web.qcow2")
+        fake_tools.main("qemu-img", ["create", "-f", "qcow2", base, "2G"])
+        fake_tools.main("qemu-img", ["create", "-f", "qcow2", "-b", base, "-F", "qcow2", overlay])
+        self.assertEqual(vm_images.read_header(overlay),
+                         {"format": "qcow2", "virtual_size": 2 * 1024 ** 3, "backing_file": base})
+
+    def testSuiteAndCompare(self):
+        # Test: every scenario runs at a tiny size; only slowdowns beyond tolerance and the floor regress
+        results = bench_suite.run_suite([3], ("cli",), latency_ms=0, repeat=1, bulk=2, fleet=1, log=lambda _: None)
+        self.assertEqual(sorted(k.rsplit("/", 1)[1] for k in results),
+                         ["bulk.start", "bulk.stop", "list.inventory", "list.snapshot", "search.build",
+                          "search.query", "vm.provision", "vm.report"])
+        baseline = {"a": {"median_ms": 10.0}, "b": {"median_ms": 0.1}, "c": {"median_ms": 10.0}}
+        current = {"a": {"median_ms": 20.0}, "b": {"median_ms": 0.5}, "c": {"median_ms": 11.0}, "new": {"median_ms": 1}}
+        self.assertEqual([(k, r) for k, _, _, r in bench_suite.compare(current, baseline, 0.25)],
+                         [("a", True), ("b", False), ("c", False)])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,137 @@
+ # Unit Tests for the content-addressed build skip
+ # Hashes temporary context directories; the engine is a small fake
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+import build_cache
+import docker_engine
+import docker_manager
+
+
+def write(root, rel, text):
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+    # age the file so its mtime is trusted by the cache
+    old = time.time() - 60
+    os.utime(path, (old, old))
+
+
+class FakeEngine:
+    def __init__(self):
+        self.images = {}
+
+    def inspect_image(self, ref):
+        # like the daemon, accept the ID with or without its "sha256:" prefix
+        ref = ref if ref.startswith("sha256:") else "sha256:" + ref
+        if ref not in self.images:
+            raise docker_engine.EngineError(404, f"No such image: {ref}")
+        return {"Id": ref, "RepoTags": self.images[ref]}
+
+
+class TestBuildCache(unittest.TestCase):
+    # Tests for key computation, incremental hashing and skipping unchanged builds
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        self.ctx = os.path.join(self.tmpdir, "ctx")
+        write(self.ctx, "Dockerfile", "FROM python:3.12-slim\nCOPY . /app\n")
+        write(self.ctx, "app/main.py", "print('hi')\n")
+        write(self.ctx, "requirements.txt", "flask\n")
+        write(self.ctx, "notes.log", "scratch\n")
+        write(self.ctx, ".dockerignore", "*.log\n")
+        self.cache = build_cache.BuildCache(os.path.join(self.tmpdir, "cache.sqlite3"))
+
+    def key(self, **kwargs):
+        return self.cache.compute_key(self.ctx, os.path.join(self.ctx, "Dockerfile"), **kwargs)
+
+    def testUnchangedTreeReusesHashes(self):
+        # Test: after the state is saved, a repeat check reads no file contents
+        first = self.key()
+        self.assertEqual(first.hashed, 4)  # Dockerfile, .dockerignore, main.py, requirements.txt
+        self.cache.save_state(first)
+        second = self.key()
+        self.assertEqual((second.hashed, second.reused), (0, 4))
+        self.assertEqual(second.key, first.key)
+
+    def testChangedFileRehashedAndChangesKey(self):
+        # Test: only the modified file is read again and the key changes
+        first = self.key()
+        self.cache.save_state(first)
+        write(self.ctx, "app/main.py", "print('bye')\n")
+        second = self.key()
+        self.assertEqual(second.hashed, 1)
+        self.assertNotEqual(second.key, first.key)
+
+    def testIgnoredFilesAndBuildArgs(self):
+        # Test: .dockerignore'd files do not affect the key; build args do
+        first = self.key()
+        write(self.ctx, "notes.log", "more scratch\n")
+        self.assertEqual(self.key().key, first.key)
+        self.assertNotEqual(self.key(buildargs={"VERSION": "2"}).key, first.key)
+        write(self.ctx, "Dockerfile", "FROM python:3.13-slim\nCOPY . /app\n")
+        self.assertNotEqual(self.key().key, first.key)
+
+    def testRecentlyModifiedFilesAreNotTrusted(self):
+        # Test: a file written within the racy window is hashed again next time
+        first = self.key()
+        with open(os.path.join(self.ctx, "app", "main.py"), "w") as f:
+            f.write("print('now')\n")
+        racy = self.key()
+        self.cache.save_state(racy)
+        self.assertEqual(self.key().hashed, 1)
+
+    def testLookupMatchesOnlyTheRecordedKey(self):
+        # Test: the recorded image is returned for the same key only
+        key = self.key()
+        self.assertIsNone(self.cache.lookup("app:1", key))
+        self.cache.record("app:1", key, "sha256:abc")
+        self.assertEqual(self.cache.lookup("app:1", key), "sha256:abc")
+        self.assertIsNone(self.cache.lookup("app:2", key))
+        write(self.ctx, "requirements.txt", "flask\nredis\n")
+        self.assertIsNone(self.cache.lookup("app:1", self.key()))
+
+    def testBuildImageSkipsUnchangedBuild(self):
+        # Test: build_image records a build, then skips the next one while the image still exists
+        cwd = os.getcwd()
+        os.chdir(self.ctx)
+        self.addCleanup(os.chdir, cwd)
+        engine = FakeEngine()
+        docker_engine.set_client(engine)
+        self.addCleanup(docker_engine.set_client, None)
+        env = {"CMS_DATA_DIR": os.path.join(self.tmpdir, "data"), "CMS_DOCKER_BACKEND": "engine"}
+
+        def build(*args, **kwargs):
+            engine.images["sha256:" + "f" * 64] = ["app:1"]
+            return iter([{"stream": "Step 1/1 : FROM python:3.12-slim\n"}, {"aux": {"ID": "sha256:" + "f" * 64}}])
+
+        engine.build = MagicMock(side_effect=build)
+        with patch.dict(os.environ, env):
+            with patch.object(docker_manager, 'check_docker_running', return_value=True):
+                with patch('builtins.print') as mock_print:
+                    for _ in range(2):
+                        with patch('builtins.input', side_effect=["Dockerfile", "app:1"]):
+                            docker_manager.build_image()
+        self.assertEqual(engine.build.call_count, 1)
+        printed = " ".join(str(c.args[0]) for c in mock_print.call_args_list if c.args)
+        self.assertIn("Build cache hit", printed)
+
+        # the image was removed: the next request builds again
+        engine.images.clear()
+        with patch.dict(os.environ, env):
+            with patch.object(docker_manager, 'check_docker_running', return_value=True):
+                with patch('builtins.print'):
+                    with patch('builtins.input', side_effect=["Dockerfile", "app:1"]):
+                        docker_manager.build_image()
+        self.assertEqual(engine.build.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
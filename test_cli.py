@@ -0,0 +1,122 @@
+# Unit Tests for the non-interactive CLI (cli.py): JSON output, exit codes, batches and the menu mode
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from unittest.mock import patch
+
+import cli
+import docker_inventory
+import instrumentation
+import vm_registry
+from docker_inventory import ContainerRecord
+
+
+def run_cli(argv, stdin=""):
+    # (exit status, stdout, stderr) of cli.main(argv)
+    out, err = io.StringIO(), io.StringIO()
+    with redirect_stdout(out), redirect_stderr(err), patch('sys.stdin', io.StringIO(stdin)):
+        status = cli.main(argv)
+    return status, out.getvalue(), err.getvalue()
+
+
+class TestCli(unittest.TestCase):
+    # Subcommands run against patched sources; nothing reaches Docker or QEMU
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        env = patch.dict(os.environ, {"CMS_DATA_DIR": self.tmpdir, "CMS_DOCKER_BACKEND": "cli", "CMS_INVENTORY": "0"})
+        env.start()
+        self.addCleanup(env.stop)
+        self.addCleanup(instrumentation.uninstall)
+        containers = [ContainerRecord("a" * 64, "web", "nginx", state="running", status="Up 1 hour"),
+                      ContainerRecord("b" * 64, "db", "postgres", state="exited", status="Exited (0)")]
+        rows = patch.object(docker_inventory.CliSource, 'iter_containers', side_effect=lambda: iter(containers))
+        rows.start()
+        self.addCleanup(rows.stop)
+
+    def testJsonOutputAndFilters(self):
+        # Test: `ps --json` prints one JSON document of records; -a includes stopped containers; --json works first too
+        status, out, _ = run_cli(["ps", "--json"])
+        self.assertEqual(status, 0)
+        self.assertEqual([c["name"] for c in json.loads(out)], ["web"])
+        status, out, _ = run_cli(["--json", "ps", "-a"])
+        self.assertEqual([c["state"] for c in json.loads(out)], ["running", "exited"])
+        status, out, _ = run_cli(["ps", "-a"])
+        self.assertEqual(out.splitlines()[0].split(), ["CONTAINER", "ID", "IMAGE", "COMMAND", "CREATED", "STATUS", "NAMES"])
+        self.assertIn("db", out)
+
+    def testSortPageAndColumns(self):
+        # Test: listings sort, page and pick columns; the table notes where the page sits
+        status, out, _ = run_cli(["ps", "-a", "--sort", "name", "--limit", "1", "--columns", "name,state", "--json"])
+        self.assertEqual((status, json.loads(out)), (0, [{"name": "db", "state": "exited"}]))
+        status, out, _ = run_cli(["ps", "-a", "--sort", "name", "-r", "--offset", "1", "--columns", "name"])
+        self.assertEqual(out.splitlines(), ["NAMES", "db", "Showing 2-2 of 2"])
+        status, out, _ = run_cli(["ps", "--columns", "bogus", "--json"])
+        self.assertEqual(status, 1)
+        self.assertIn("unknown containers column(s): bogus", json.loads(out)["error"])
+
+    def testFailuresAndUsageErrors(self):
+        # Test: an operation failure is exit 1 with {"error"}; a usage error is exit 2 with the usage line
+        status, out, _ = run_cli(["vm", "start", "ghost", "--json"])
+        self.assertEqual(status, 1)
+        self.assertEqual(json.loads(out), {"error": "VM 'ghost' is not in the VM registry"})
+        status, out, err = run_cli(["vm", "snapshot"])
+        self.assertEqual((status, out), (2, ""))
+        self.assertIn("usage:", err)
+        failed = docker_inventory.EngineUnavailable("permission denied")
+        with patch.object(docker_inventory.CliSource, 'iter_containers', side_effect=failed):
+            status, out, _ = run_cli(["stop", "db", "--json"])
+        self.assertEqual((status, json.loads(out)), (1, {"error": "could not list containers: permission denied"}))
+
+    def testVmListReportsMissingDisks(self):
+        # Test: registered VMs are listed with their resources; a missing disk is flagged instead of failing
+        disk = os.path.join(self.tmpdir, "web1.qcow2")
+        vm_registry.VmRegistry().add(vm_registry.VmRecord("web1", disk, 2048, 2))
+        status, out, _ = run_cli(["vm", "list", "--json", "--filter", "ram>=1024"])
+        rows = json.loads(out)
+        self.assertEqual((status, len(rows)), (0, 1))
+        self.assertEqual((rows[0]["name"], rows[0]["ram_mb"], rows[0]["disk_missing"]), ("web1", 2048, True))
+        self.assertEqual(json.loads(run_cli(["vm", "list", "--json", "--filter", "ram>=4096"])[1]), [])
+
+    def testBatchRunsEveryLine(self):
+        # Test: a batch runs each line in one process, reports bad lines and carries on; comments are skipped
+        lines = "ps\n# comment\n\nbogus\nvm start ghost\npool list\n"
+        status, out, _ = run_cli(["batch", "--json"], lines)
+        results = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(status, 1)
+        self.assertEqual([(r["line"], r["ok"]) for r in results], [(1, True), (4, False), (5, False), (6, True)])
+        self.assertIn("invalid choice: 'bogus'", results[1]["error"])
+        self.assertEqual(results[0]["result"][0]["name"], "web")
+
+        status, out, _ = run_cli(["batch", "--json", "--stop-on-error"], "bogus\nps\n")
+        self.assertEqual((status, len(out.splitlines())), (1, 1))
+
+    def testMenuMode(self):
+        # Test: no arguments opens the menu; entries load their module on demand, and clear works on Linux
+        with patch('builtins.input', side_effect=["14", "c", "zz", "0"]), \
+                patch('vm_manager.list_vms') as list_vms, patch('os.system') as system:
+            status, out, _ = run_cli([])
+        self.assertEqual(status, 0)
+        list_vms.assert_called_once_with()
+        system.assert_called_once_with("cls" if os.name == "nt" else "clear")
+        self.assertIn("Invalid choice!", out)
+
+    def testImportIsLight(self):
+        # Test: importing the CLI loads no subsystem, so one-shot commands only pay for what they use
+        code = ("import sys, cli; heavy = {'docker_engine', 'docker_manager', 'vm_manager', 'vm_qmp', 'asyncio',"
+                " 'sqlite3', 'http.client', 'subprocess'}; print(sorted(heavy & set(sys.modules)))")
+        result = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.strip(), "[]")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,155 @@
+ # Unit Tests for build-context analysis and streamed builds
+ # Uses temporary context directories and a fake `docker build` process
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import docker_build
+import docker_manager
+
+
+def write(root, rel, size=1):
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+
+
+class FakeBuild:
+    # Stand-in for `docker build`: yields output lines and records how far the caller had read
+
+    def __init__(self, lines, code=0):
+        self.lines = lines
+        self.code = code
+        self.read = 0
+
+    def __call__(self, cmd, **kwargs):
+        self.cmd = cmd
+        self.env = kwargs.get("env")
+        proc = MagicMock()
+        proc.stdout = self._stream()
+        proc.wait.return_value = self.code
+        return proc
+
+    def _stream(self):
+        for line in self.lines:
+            self.read += 1
+            yield line + "\n"
+
+
+class TestDockerBuild(unittest.TestCase):
+    # Tests for context analysis, .dockerignore generation and step timing
+
+    def setUp(self):
+        self.ctx = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.ctx, True)
+        write(self.ctx, "Dockerfile", 20)
+        write(self.ctx, "app/main.py", 300)
+        write(self.ctx, "app/__pycache__/main.cpython-312.pyc", 500)
+        write(self.ctx, "node_modules/lib/index.js", 4000)
+        write(self.ctx, "data/dump.sql", 2000)
+        write(self.ctx, "build.log", 100)
+
+    def testAnalyzeContextSizesAndSuggestions(self):
+        # Test: totals, largest paths and junk suggestions reflect what would be uploaded
+        report = docker_build.analyze_context(self.ctx, os.path.join(self.ctx, "Dockerfile"))
+        self.assertEqual(report.files, 6)
+        self.assertEqual(report.bytes, 6920)
+        self.assertEqual(report.largest_files[0], (4000, "node_modules/lib/index.js"))
+        self.assertEqual(report.largest_dirs[0], (4000, "node_modules"))
+        self.assertEqual(report.suggestions, {"**/node_modules": 4000, "**/__pycache__": 500, "**/*.log": 100})
+
+    def testDockerignoreRespectedAndNotWalked(self):
+        # Test: ignored directories are skipped without walking them and ignored files are counted
+        with open(os.path.join(self.ctx, ".dockerignore"), "w") as f:
+            f.write("node_modules\n*.log\n")
+        report = docker_build.analyze_context(self.ctx)
+        self.assertEqual(report.pruned_dirs, ["node_modules"])
+        self.assertEqual(report.excluded_files, 1)
+        self.assertNotIn("**/node_modules", report.suggestions)
+        self.assertEqual(report.files, 5)  # .dockerignore itself is always sent
+
+    def testWriteDockerignoreAppendsOnlyNewPatterns(self):
+        # Test: generated patterns are appended once and then exclude the heavy paths
+        with open(os.path.join(self.ctx, ".dockerignore"), "w") as f:
+            f.write("node_modules")
+        added = docker_build.write_dockerignore(self.ctx, ["node_modules", "**/__pycache__"])
+        self.assertEqual(added, ["**/__pycache__"])
+        self.assertEqual(docker_build.write_dockerignore(self.ctx, ["**/__pycache__"]), [])
+        report = docker_build.analyze_context(self.ctx)
+        self.assertEqual(sorted(report.pruned_dirs), ["app/__pycache__", "node_modules"])
+
+    def testClassicStepTimings(self):
+        # Test: "Step N/M" lines are timed from one step start to the next
+        ticks = iter([0.0, 1.0, 2.0, 2.5, 2.5])
+        timer = docker_build.StepTimer(clock=lambda: next(ticks))
+        for line in ["Step 1/2 : FROM python:3.12-slim", " ---> abc", "Step 2/2 : RUN pip install x",
+                     " ---> Using cache"]:
+            timer.feed(line)
+        steps = timer.finish()
+        self.assertEqual([(s.name, s.seconds, s.cached) for s in steps],
+                         [("1/2 FROM python:3.12-slim", 2.0, False), ("2/2 RUN pip install x", 0.5, True)])
+
+    def testBuildkitStepTimings(self):
+        # Test: BuildKit plain progress reports DONE/CACHED durations per vertex
+        timer = docker_build.StepTimer()
+        for line in ["#5 [1/3] FROM docker.io/library/python", "#6 [2/3] RUN pip install -r req.txt",
+                     "#5 CACHED", "#6 12.1 Collecting x", "#6 DONE 14.2s"]:
+            timer.feed(line)
+        steps = timer.finish()
+        self.assertEqual([(s.seconds, s.cached) for s in steps], [(0.0, True), (14.2, False)])
+
+    def testBuildCliStreamsWithBoundedTail(self):
+        # Test: lines reach the caller while the build runs and only a bounded tail is kept
+        lines = ["Step 1/1 : FROM scratch"] + [f"line {n}" for n in range(500)] + ["Successfully built 0123456789ab"]
+        fake = FakeBuild(lines)
+        seen = []
+        with patch('docker_build.subprocess.Popen', fake):
+            result = docker_build.build_cli(".", "app:1", on_line=lambda l: seen.append((l, fake.read)))
+        self.assertTrue(result.ok)
+        self.assertEqual(seen[0], ("Step 1/1 : FROM scratch", 1))  # printed before the rest was read
+        self.assertEqual(len(result.tail), docker_build.TAIL_LINES)
+        self.assertEqual(result.image_id, "0123456789ab")
+        self.assertEqual(fake.env["BUILDKIT_PROGRESS"], "plain")
+
+    def testBuildCliFailureReportsLastLine(self):
+        # Test: a failed build returns the last output line as the error
+        fake = FakeBuild(["Step 1/1 : RUN false", "The command '/bin/sh -c false' returned a non-zero code: 1"], 1)
+        with patch('docker_build.subprocess.Popen', fake):
+            result = docker_build.build_cli(".", "app:1", on_line=None)
+        self.assertFalse(result.ok)
+        self.assertIn("non-zero code", result.error)
+
+    def testBuildReportsMissingCliAndUnreadableContext(self):
+        # Test: build() returns a failed summary when docker is missing, and builds without the cache
+        # when the context cannot be hashed
+        with patch.dict(os.environ, {"CMS_DOCKER_BACKEND": "cli", "CMS_DATA_DIR": self.ctx}):
+            with patch('docker_build.subprocess.Popen', side_effect=FileNotFoundError):
+                with patch('build_cache.BuildCache.compute_key', side_effect=PermissionError("denied")):
+                    result = docker_build.build(self.ctx, "app:1", on_line=None)
+        self.assertEqual((result["ok"], result["cache"], result["cache_error"]), (False, None, "denied"))
+        self.assertIn("Docker CLI not found", result["error"])
+
+    def testBuildImageOffersDockerignore(self):
+        # Test: build_image offers to exclude heavy paths and writes the .dockerignore on "y"
+        cwd = os.getcwd()
+        os.chdir(self.ctx)
+        self.addCleanup(os.chdir, cwd)
+        fake = FakeBuild(["Successfully built 0123456789ab"])
+        with patch.dict(os.environ, {"CMS_DOCKER_BACKEND": "cli", "CMS_BUILD_CACHE": "0"}):
+            with patch.object(docker_build, "OFFER_MIN_BYTES", 1000):
+                with patch('builtins.input', side_effect=["Dockerfile", "app:1", "y"]):
+                    with patch.object(docker_manager, 'check_docker_running', return_value=True):
+                        with patch('docker_build.subprocess.Popen', fake):
+                            with patch('builtins.print'):
+                                docker_manager.build_image()
+        with open(os.path.join(self.ctx, ".dockerignore")) as f:
+            self.assertIn("**/node_modules\n", f.read())
+        self.assertEqual(fake.cmd, ["docker", "build", "-t", "app:1", "-f", "Dockerfile", "."])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
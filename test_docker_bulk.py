@@ -0,0 +1,188 @@
+ # Unit Tests for bulk container lifecycle operations
+ # Patches subprocess.run/Popen with a fake docker CLI so no daemon is needed
+
+import io
+import json
+import os
+import threading
+import time
+import unittest
+from contextlib import contextmanager, redirect_stdout
+from unittest.mock import patch, MagicMock
+
+import docker_bulk
+import docker_engine
+import docker_health
+import docker_manager
+
+PS_ROWS = [
+    {"ID": "aaaa1111", "Names": "web-1", "State": "running", "Labels": "tier=web,env=prod", "Image": "nginx"},
+    {"ID": "aaaa2222", "Names": "web-2", "State": "exited", "Labels": "tier=web", "Image": "nginx"},
+    {"ID": "bbbb3333", "Names": "db", "State": "running", "Labels": "tier=db", "Image": "postgres"},
+]
+
+
+class FakeDocker:
+    # Stand-in for subprocess.run that records concurrency of lifecycle calls
+
+    def __init__(self, delay=0.0, fail=(), ps_error=None):
+        self.delay = delay
+        self.fail = set(fail)
+        self.ps_error = ps_error
+        self.calls = []
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def popen(self, cmd, **kwargs):
+        # `docker ps -a --format '{{json .}}'`, streamed by the inventory's CLI source
+        self.calls.append(cmd)
+        proc = MagicMock()
+        if self.ps_error:
+            proc.stdout, proc.stderr = io.StringIO(""), io.StringIO(self.ps_error)
+            proc.wait.return_value = proc.poll.return_value = 1
+            return proc
+        proc.stdout = io.StringIO("".join(json.dumps(row) + "\n" for row in PS_ROWS))
+        proc.stderr = io.StringIO("")
+        proc.wait.return_value = proc.poll.return_value = 0
+        return proc
+
+    def __call__(self, cmd, **kwargs):
+        self.calls.append(cmd)
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if cmd[2] in self.fail:
+            return MagicMock(returncode=1, stdout="", stderr="boom")
+        return MagicMock(returncode=0, stdout=cmd[2], stderr="")
+
+
+@contextmanager
+def fake_docker(fake):
+    # Route lifecycle calls (subprocess.run) and the `docker ps` listing (subprocess.Popen) to `fake`
+    with patch('docker_bulk.subprocess.run', fake), patch('docker_inventory.subprocess.Popen', fake.popen):
+        yield fake
+
+
+class TestDockerBulk(unittest.TestCase):
+    # Tests for target resolution, concurrency and the aggregated report
+
+    def setUp(self):
+        env = patch.dict(os.environ, {'CMS_DOCKER_BACKEND': 'cli'})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def testResolveByIdPrefixNameAndMissing(self):
+        # Test: references resolve by unique ID prefix or name; unknown ones are reported
+        with fake_docker(FakeDocker()):
+            snapshot = docker_bulk.container_snapshot()
+        matched, missing = docker_bulk.resolve_targets(snapshot, ["bbbb", "web-1", "aaaa", "ghost"])
+        self.assertEqual({c.name for c in matched}, {"db", "web-1"})
+        self.assertEqual(missing, ["aaaa", "ghost"])
+
+    def testResolveByLabelAndPattern(self):
+        # Test: label and glob selectors pick matching containers
+        with fake_docker(FakeDocker()):
+            snapshot = docker_bulk.container_snapshot()
+        by_label, _ = docker_bulk.resolve_targets(snapshot, label="tier=web")
+        by_key, _ = docker_bulk.resolve_targets(snapshot, label="env")
+        by_name, _ = docker_bulk.resolve_targets(snapshot, name_pattern="web-*")
+        self.assertEqual(len(by_label), 2)
+        self.assertEqual([c.name for c in by_key], ["web-1"])
+        self.assertEqual(len(by_name), 2)
+
+    def testBulkUsesSingleSnapshot(self):
+        # Test: one docker ps call validates every target
+        fake = FakeDocker()
+        with fake_docker(fake):
+            report = docker_bulk.restart_containers(["web-1", "web-2", "db"])
+        self.assertEqual(sum(1 for c in fake.calls if c[1] == "ps"), 1)
+        self.assertEqual(len(report.succeeded), 3)
+
+    def testConcurrencyIsBounded(self):
+        # Test: no more than `concurrency` operations run at once, and they do overlap
+        fake = FakeDocker(delay=0.05)
+        with fake_docker(fake):
+            docker_bulk.stop_containers(name_pattern="*", concurrency=2)
+        self.assertEqual(fake.peak, 2)
+
+    def testReportRecordsFailuresAndLatency(self):
+        # Test: per-container errors and latencies are captured in the report
+        fake = FakeDocker(fail={"bbbb3333"})
+        with fake_docker(fake):
+            report = docker_bulk.start_containers(["db", "web-1", "nope"])
+        summary = report.as_dict()
+        self.assertEqual(summary["succeeded"], 1)
+        self.assertEqual(summary["failed"], 2)
+        errors = {r["target"]: r["error"] for r in summary["results"]}
+        self.assertEqual(errors["db"], "boom")
+        self.assertEqual(errors["nope"], "No such container")
+        self.assertTrue(all(r.latency >= 0 for r in report.results))
+
+    def testRemoveUsesDockerRm(self):
+        # Test: the remove action maps to `docker rm`
+        fake = FakeDocker()
+        with fake_docker(fake):
+            docker_bulk.remove_containers(["db"])
+        self.assertIn(["docker", "rm", "bbbb3333"], fake.calls)
+
+    def testUnknownActionRejected(self):
+        # Test: only start/stop/restart/remove are accepted
+        with self.assertRaises(ValueError):
+            docker_bulk.run_bulk("kill", ["db"], snapshot=[])
+
+    def testStartContainerListsOnce(self):
+        # Test: start_container shows and validates containers with a single listing
+        fake = FakeDocker()
+        with patch('builtins.input', return_value="web-2"):
+            with fake_docker(fake):
+                with patch.object(docker_manager, 'check_docker_running', return_value=True):
+                    docker_manager.start_container()
+        self.assertEqual([c[1] for c in fake.calls], ["ps", "start"])
+
+    def testBulkMenuActionByLabel(self):
+        # Test: the interactive bulk action runs against a label selector
+        fake = FakeDocker()
+        with patch('builtins.input', side_effect=["stop", "label=tier=web", "4"]):
+            with fake_docker(fake):
+                with patch.object(docker_manager, 'check_docker_running', return_value=True):
+                    docker_manager.bulk_container_action()
+        stopped = sorted(c[2] for c in fake.calls if c[1] == "stop")
+        self.assertEqual(stopped, ["aaaa1111", "aaaa2222"])
+
+    def testListingFailureIsReported(self):
+        # Test: a failed `docker ps` is an error, not a report of missing containers
+        fake = FakeDocker(ps_error="permission denied")
+        with fake_docker(fake):
+            with self.assertRaises(docker_engine.EngineUnavailable):
+                docker_bulk.stop_containers(["db"])
+            out = io.StringIO()
+            with patch('builtins.input', side_effect=["stop", "db", ""]), redirect_stdout(out):
+                with patch.object(docker_manager, 'check_docker_running', return_value=True):
+                    docker_manager.bulk_container_action()
+            self.assertIn("Failed to list containers:\npermission denied", out.getvalue())
+        self.assertEqual([c[1] for c in fake.calls], ["ps", "ps"])
+
+    def testUnreachableSocketMarksDaemonDown(self):
+        # Test: an engine fallback records the failure in the daemon monitor
+        class DeadEngine:
+            def iter_containers(self, all=False):
+                raise docker_engine.EngineUnavailable("connection refused")
+
+        docker_health.reset(docker_health.DaemonMonitor(probe=lambda: True))
+        self.addCleanup(docker_health.reset)
+        docker_engine.set_client(DeadEngine())
+        self.addCleanup(docker_engine.set_client, None)
+        with patch.dict(os.environ, {'CMS_DOCKER_BACKEND': 'engine'}):
+            with fake_docker(FakeDocker()):
+                snapshot = docker_bulk.container_snapshot()
+        self.assertEqual(len(snapshot), 3)
+        self.assertFalse(docker_health.monitor().available)
+        self.assertEqual(docker_health.monitor().failures, 1)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,275 @@
+ # Unit Tests for the Docker Engine API client
+ # Runs docker_engine.py against a local fake dockerd on a Unix socket
+
+import io
+import json
+import os
+import shutil
+import socketserver
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler
+from unittest.mock import patch
+
+import docker_engine
+import docker_manager
+
+
+class FakeDockerdHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        return "fake-dockerd"
+
+    def _reply(self, status, body=b"", content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, messages):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for msg in messages:
+            chunk = json.dumps(msg).encode() + b"\r\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        state = self.server.state
+        state["requests"].append(("GET", self.path))
+        path = self.path.split("?")[0]
+        if path == "/_ping":
+            self._reply(200, b"OK", "text/plain")
+        elif path == "/events":
+            # quiet for a while before the first event, like an idle daemon
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self.wfile.flush()
+            time.sleep(state["events_delay"])
+            chunk = json.dumps({"Type": "container", "Action": "start"}).encode() + b"\r\n"
+            self.wfile.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(chunk), chunk))
+        elif path == "/images/json":
+            self._reply(200, state["images"])
+        elif path == "/containers/json":
+            self._reply(200, state["containers"])
+        elif path.startswith("/containers/") and path.endswith("/json"):
+            cid = path.split("/")[2]
+            if any(c["Id"].startswith(cid) or "/" + cid in c["Names"] for c in state["containers"]):
+                self._reply(200, {"Id": cid})
+            else:
+                self._reply(404, {"message": f"No such container: {cid}"})
+        else:
+            self._reply(404, {"message": "page not found"})
+
+    def do_POST(self):
+        state = self.server.state
+        body = self._body()
+        state["requests"].append(("POST", self.path))
+        path = self.path.split("?")[0]
+        if path == "/images/create":
+            self._stream([{"status": "Pulling from library/nginx", "id": "latest"},
+                          {"status": "Downloading", "progress": "[=>  ]", "id": "abc"},
+                          {"status": "Status: Downloaded newer image for nginx:latest"}])
+        elif path == "/containers/create":
+            state["created"].append(json.loads(body))
+            self._reply(201, {"Id": "f00dfeed", "Warnings": []})
+        elif path.endswith("/start") or path.endswith("/stop"):
+            self._reply(204)
+        elif path == "/build":
+            state["build_context_size"] = len(body)
+            state["build_context"] = body
+            self._stream([{"stream": "Step 1/1 : FROM scratch\n"}, {"stream": "Successfully built 123\n"}])
+        else:
+            self._reply(404, {"message": "page not found"})
+
+
+class FakeDockerd(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(path, FakeDockerdHandler)
+        self.connections = 0
+        self.state = {
+            "requests": [],
+            "created": [],
+            "events_delay": 0.3,
+            "images": [{"Id": "sha256:" + "a" * 64, "RepoTags": ["nginx:latest"], "Created": 0, "Size": 142000000}],
+            "containers": [{"Id": "c" * 64, "Names": ["/web"], "Image": "nginx", "Command": "nginx -g",
+                            "Created": 0, "Status": "Exited (0)"}],
+        }
+
+    def get_request(self):
+        self.connections += 1
+        return super().get_request()
+
+
+class TestDockerEngineClient(unittest.TestCase):
+    # Exercise the engine client and the engine code paths in docker_manager
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.sock = os.path.join(self.tmpdir, "docker.sock")
+        self.server = FakeDockerd(self.sock)
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.client = docker_engine.EngineClient(self.sock)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        docker_engine.set_client(None)
+
+    def testPingOverUnixSocket(self):
+        # Test: ping returns True when the daemon answers "OK"
+        self.assertTrue(self.client.ping())
+
+    def testKeepAliveReusesConnection(self):
+        # Test: consecutive requests share one pooled connection
+        for _ in range(5):
+            self.client.images()
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.client.pool.created, 1)
+
+    def testImagesReturnsParsedJson(self):
+        # Test: JSON bodies are decoded into Python objects
+        images = self.client.images()
+        self.assertEqual(images[0]["RepoTags"], ["nginx:latest"])
+
+    def testErrorStatusRaisesEngineError(self):
+        # Test: 4xx responses raise EngineError with the daemon's message
+        with self.assertRaises(docker_engine.EngineError) as ctx:
+            self.client.inspect_container("missing")
+        self.assertEqual(ctx.exception.status, 404)
+        self.assertIn("No such container", ctx.exception.message)
+
+    def testPullStreamsProgress(self):
+        # Test: pull yields each progress message from the chunked stream
+        messages = list(self.client.pull("nginx"))
+        self.assertEqual(len(messages), 3)
+        self.assertIn(("POST", "/images/create?fromImage=nginx&tag=latest"), self.server.state["requests"])
+
+    def testBuildUploadsContextTar(self):
+        # Test: build tars the context directory and streams build output
+        ctx = os.path.join(self.tmpdir, "ctx")
+        os.makedirs(ctx)
+        with open(os.path.join(ctx, "Dockerfile"), "w") as f:
+            f.write("FROM scratch\n")
+        output = [m["stream"] for m in self.client.build(ctx, "app:1")]
+        self.assertIn("Successfully built 123\n", output)
+        self.assertGreater(self.server.state["build_context_size"], 0)
+
+    def _built_names(self):
+        with tarfile.open(fileobj=io.BytesIO(self.server.state["build_context"])) as tar:
+            return sorted(tar.getnames())
+
+    def testBuildHonoursDockerignore(self):
+        # Test: .dockerignore rules (globs, directories, `!` re-includes) shape the uploaded context
+        ctx = os.path.join(self.tmpdir, "ctx")
+        for rel in ("Dockerfile", "app.py", "debug.log", "keep.log", "node_modules/x/index.js",
+                    "src/main.py", "src/deep/cache.pyc"):
+            os.makedirs(os.path.dirname(os.path.join(ctx, rel)), exist_ok=True)
+            with open(os.path.join(ctx, rel), "w") as f:
+                f.write("x\n")
+        with open(os.path.join(ctx, ".dockerignore"), "w") as f:
+            f.write("# local junk\nnode_modules\n*.log\n!keep.log\n**/*.pyc\nDockerfile\n")
+        list(self.client.build(ctx, "app:1"))
+        self.assertEqual(self._built_names(),
+                         [".dockerignore", "Dockerfile", "app.py", "keep.log", "src/main.py"])
+
+    def testBuildAddsDockerfileOutsideContext(self):
+        # Test: a Dockerfile outside the context is shipped under a private name
+        ctx = os.path.join(self.tmpdir, "ctx")
+        os.makedirs(ctx)
+        with open(os.path.join(ctx, "app.py"), "w") as f:
+            f.write("print()\n")
+        dockerfile = os.path.join(self.tmpdir, "build.Dockerfile")
+        with open(dockerfile, "w") as f:
+            f.write("FROM scratch\n")
+        list(self.client.build(ctx, "app:1", dockerfile=dockerfile))
+        names = self._built_names()
+        shipped = [n for n in names if n.startswith(".dockerfile.")]
+        self.assertEqual(len(shipped), 1)
+        build_path = [p for m, p in self.server.state["requests"] if p.startswith("/build")][0]
+        self.assertIn("dockerfile=" + shipped[0], build_path)
+
+    def testSilentStreamOutlivesRequestTimeout(self):
+        # Test: a stream that is quiet for longer than the request timeout keeps waiting
+        client = docker_engine.EngineClient(self.sock, timeout=0.1)
+        self.addCleanup(client.close)
+        events = list(client.events())
+        self.assertEqual(events[0]["Action"], "start")
+        self.assertTrue(client.ping())
+
+    def testMissingSocketRaisesUnavailable(self):
+        # Test: an unreachable socket raises EngineUnavailable
+        client = docker_engine.EngineClient(os.path.join(self.tmpdir, "nope.sock"))
+        with self.assertRaises(docker_engine.EngineUnavailable):
+            client.ping()
+
+    def testSplitImageTag(self):
+        # Test: image references split into repository and tag
+        self.assertEqual(docker_engine.split_image_tag("nginx"), ("nginx", "latest"))
+        self.assertEqual(docker_engine.split_image_tag("reg:5000/app:1.2"), ("reg:5000/app", "1.2"))
+        self.assertEqual(docker_engine.split_image_tag("reg:5000/app"), ("reg:5000/app", "latest"))
+
+    def testListImagesUsesEngineWithoutSubprocess(self):
+        # Test: list_images uses the engine and never spawns the CLI
+        docker_engine.set_client(self.client)
+        with patch('docker_manager.subprocess.run') as mock_run:
+            with patch.object(docker_manager, 'check_docker_running', return_value=True):
+                with patch('builtins.print') as mock_print:
+                    docker_manager.list_images()
+        mock_run.assert_not_called()
+        printed = " ".join(str(c.args[0]) for c in mock_print.call_args_list)
+        self.assertIn("nginx", printed)
+
+    def testRunImageCreatesAndStartsContainer(self):
+        # Test: run_image creates then starts the container through the engine
+        docker_engine.set_client(self.client)
+        with patch('builtins.input', side_effect=["nginx", "web"]):
+            with patch('docker_manager.subprocess.run') as mock_run:
+                with patch.object(docker_manager, 'check_docker_running', return_value=True):
+                    docker_manager.run_image()
+        mock_run.assert_not_called()
+        self.assertEqual(self.server.state["created"][0]["Image"], "nginx")
+        self.assertIn(("POST", "/containers/f00dfeed/start"), self.server.state["requests"])
+
+    def testStartContainerValidatesWithInspect(self):
+        # Test: start_container rejects unknown containers via a single inspect call
+        docker_engine.set_client(self.client)
+        with patch('builtins.input', return_value="ghost"):
+            with patch('docker_manager.subprocess.run') as mock_run:
+                with patch.object(docker_manager, 'check_docker_running', return_value=True):
+                    with patch('builtins.print') as mock_print:
+                        docker_manager.start_container()
+        mock_run.assert_not_called()
+        mock_print.assert_any_call("No such container: ghost")
+
+    def testCliBackendDisablesEngine(self):
+        # Test: CMS_DOCKER_BACKEND=cli forces the subprocess fallback
+        docker_engine.set_client(self.client)
+        with patch.dict(os.environ, {docker_engine.BACKEND_ENV: "cli"}):
+            self.assertIsNone(docker_engine.get_client())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,97 @@
+ # Unit Tests for the Docker daemon health monitor
+ # Uses a fake clock and probe so caching and backoff are deterministic
+
+import unittest
+from unittest.mock import patch, MagicMock
+
+import docker_health
+import docker_manager
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDaemonMonitor(unittest.TestCase):
+    # Tests for DaemonMonitor caching, backoff and latency reporting
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.results = [True]
+        self.calls = 0
+
+    def probe(self):
+        self.calls += 1
+        self.clock.now += 0.002
+        return self.results[-1]
+
+    def makeMonitor(self, **kwargs):
+        return docker_health.DaemonMonitor(probe=self.probe, ttl=5, clock=self.clock, **kwargs)
+
+    def testResultCachedWithinTtl(self):
+        # Test: 1000 checks inside the TTL probe the daemon once
+        monitor = self.makeMonitor()
+        for _ in range(1000):
+            self.assertTrue(monitor.is_running())
+        self.assertEqual(self.calls, 1)
+
+    def testStaleStateReturnedImmediatelyAndRefreshed(self):
+        # Test: after the TTL the cached state is returned and a background probe runs
+        monitor = self.makeMonitor()
+        monitor.is_running()
+        self.results.append(False)
+        self.clock.now += 10
+        self.assertTrue(monitor.is_running())
+        monitor.wait(1)
+        self.assertEqual(self.calls, 2)
+        self.assertFalse(monitor.is_running())
+
+    def testBackoffGrowsWhileDown(self):
+        # Test: consecutive failures double the re-probe delay up to the cap
+        self.results = [False]
+        monitor = self.makeMonitor(backoff_base=1, backoff_max=4)
+        delays = []
+        for _ in range(4):
+            monitor.refresh()
+            delays.append(round(monitor.expires_at - self.clock.now))
+        self.assertEqual(delays, [1, 2, 4, 4])
+        self.assertEqual(monitor.status()["failures"], 4)
+
+    def testRecoveryResetsFailures(self):
+        # Test: a successful probe clears the failure count and uses the TTL again
+        self.results = [False]
+        monitor = self.makeMonitor()
+        monitor.refresh()
+        self.results.append(True)
+        monitor.refresh()
+        self.assertEqual(monitor.failures, 0)
+        self.assertEqual(round(monitor.expires_at - self.clock.now), 5)
+
+    def testStatusReportsProbeLatency(self):
+        # Test: status exposes the measured probe latency in milliseconds
+        monitor = self.makeMonitor()
+        monitor.refresh()
+        self.assertAlmostEqual(monitor.status()["latency_ms"], 2.0, places=3)
+
+    def testProbeExceptionCountsAsDown(self):
+        # Test: a probe that raises is treated as an unreachable daemon
+        monitor = docker_health.DaemonMonitor(probe=MagicMock(side_effect=OSError()), clock=self.clock)
+        self.assertFalse(monitor.is_running())
+
+    def testCheckDockerRunningUsesSharedMonitor(self):
+        # Test: check_docker_running consults the shared monitor instead of spawning docker info
+        docker_health.reset(self.makeMonitor())
+        self.addCleanup(docker_health.reset)
+        with patch('docker_manager.subprocess.run') as mock_run:
+            for _ in range(50):
+                self.assertTrue(docker_manager.check_docker_running())
+            mock_run.assert_not_called()
+        self.assertEqual(self.calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,204 @@
+ # Unit Tests for the event-driven Docker inventory
+ # Uses an in-memory fake source that stands in for the daemon and its event stream
+
+import os
+import queue
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+import docker_bulk
+import docker_inventory
+import docker_manager
+from docker_inventory import ContainerRecord, ImageRecord
+
+
+class FakeSource:
+    # Fake daemon: mutable object tables plus a controllable event stream
+
+    def __init__(self):
+        self.images = {
+            "sha256:aaa111": ImageRecord("sha256:aaa111", ["nginx:latest", "nginx:1.25"], 0, 100, {"team": "web"}),
+            "sha256:bbb222": ImageRecord("sha256:bbb222", ["postgres:16"], 0, 200),
+        }
+        self.containers = {
+            "c1" + "0" * 62: ContainerRecord("c1" + "0" * 62, "web", "nginx", state="running", labels={"tier": "web"}),
+            "c2" + "0" * 62: ContainerRecord("c2" + "0" * 62, "db", "postgres", state="exited"),
+        }
+        self.queue = queue.Queue()
+        self.list_calls = 0
+        self.fetches = 0
+
+    def list_images(self):
+        self.list_calls += 1
+        return list(self.images.values())
+
+    def list_containers(self):
+        return list(self.containers.values())
+
+    def get_image(self, ref):
+        self.fetches += 1
+        for rec in self.images.values():
+            if rec.id == ref or ref in rec.repo_tags:
+                return rec
+        return None
+
+    def get_container(self, cid):
+        self.fetches += 1
+        return self.containers.get(cid)
+
+    def events(self, since):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                raise OSError("stream broken")
+            if event == "close":
+                return
+            yield event
+
+    def close(self):
+        self.queue.put("close")
+
+
+def waitFor(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+class TestDockerInventory(unittest.TestCase):
+    # Tests for indexing, event application and resync
+
+    def setUp(self):
+        self.source = FakeSource()
+        self.inventory = docker_inventory.Inventory(self.source, resync_backoff=0.01)
+        self.inventory.load()
+
+    def testLookupByIdPrefixAndName(self):
+        # Test: containers resolve by full ID, unique prefix and name
+        self.assertEqual(self.inventory.get_container("web").name, "web")
+        self.assertEqual(self.inventory.get_container("c2").name, "db")
+        self.assertIsNone(self.inventory.get_container("c"))  # ambiguous prefix
+
+    def testImageIndexes(self):
+        # Test: images are indexed by repository, tag, label and ID prefix
+        self.assertEqual([i.id for i in self.inventory.find_images(repo="nginx")], ["sha256:aaa111"])
+        self.assertEqual([i.id for i in self.inventory.find_images(tag="16")], ["sha256:bbb222"])
+        self.assertEqual(len(self.inventory.find_images(label="team=web")), 1)
+        self.assertEqual(self.inventory.get_image("bbb").id, "sha256:bbb222")
+        self.assertEqual(self.inventory.get_image("nginx:1.25").id, "sha256:aaa111")
+
+    def testContainerEventRefetchesOnlyThatContainer(self):
+        # Test: a start event updates one container without a full listing
+        cid = "c2" + "0" * 62
+        self.source.containers[cid] = ContainerRecord(cid, "db", "postgres", state="running")
+        self.inventory.apply_event({"Type": "container", "Action": "start", "Actor": {"ID": cid}})
+        self.assertEqual(self.inventory.get_container("db").state, "running")
+        self.assertEqual(self.source.list_calls, 1)
+        self.assertEqual(self.source.fetches, 1)
+
+    def testDestroyAndDeleteEventsRemoveRecords(self):
+        # Test: destroy/delete events drop containers and images and their index entries
+        self.inventory.apply_event({"Type": "container", "Action": "destroy", "Actor": {"ID": "c1" + "0" * 62}})
+        self.inventory.apply_event({"Type": "image", "Action": "delete", "Actor": {"ID": "sha256:bbb222"}})
+        self.assertIsNone(self.inventory.get_container("web"))
+        self.assertEqual(self.inventory.find_containers(label="tier"), [])
+        self.assertEqual(self.inventory.find_images(repo="postgres"), [])
+
+    def testRetagMovesTagBetweenImages(self):
+        # Test: tagging a new image drops the tag from the image that previously held it
+        self.source.images["sha256:ccc333"] = ImageRecord("sha256:ccc333", ["nginx:latest"])
+        self.source.images["sha256:aaa111"] = ImageRecord("sha256:aaa111", ["nginx:1.25"])
+        self.inventory.apply_event({"Type": "image", "Action": "tag", "Actor": {"ID": "sha256:ccc333"}})
+        self.assertEqual([i.id for i in self.inventory.find_images(repo="nginx", tag="latest")], ["sha256:ccc333"])
+
+    def testExecEventsIgnored(self):
+        # Test: exec/attach noise does not trigger fetches
+        self.inventory.apply_event({"Type": "container", "Action": "exec_start: sh", "Actor": {"ID": "c1"}})
+        self.assertEqual(self.source.fetches, 0)
+
+    def testLookupIsSubMillisecondAtScale(self):
+        # Test: lookups stay well under a millisecond with thousands of records
+        for n in range(5000):
+            cid = f"{n:064x}"
+            self.inventory.upsert_container(ContainerRecord(cid, f"svc-{n}", labels={"shard": str(n % 10)}))
+        start = time.perf_counter()
+        for n in range(1000):
+            self.inventory.get_container(f"svc-{n}")
+            self.inventory.get_container(f"{n:064x}"[:60])
+        per_lookup = (time.perf_counter() - start) / 2000
+        self.assertLess(per_lookup, 0.001)
+
+    def testFollowerAppliesEventsAndResyncsAfterBreak(self):
+        # Test: the follower thread applies events and resyncs fully when the stream breaks
+        inventory = docker_inventory.Inventory(self.source, resync_backoff=0.01).start()
+        self.addCleanup(inventory.stop)
+        cid = "c3" + "0" * 62
+        self.source.containers[cid] = ContainerRecord(cid, "cache", "redis")
+        self.source.queue.put({"Type": "container", "Action": "create", "Actor": {"ID": cid}})
+        self.assertTrue(waitFor(lambda: inventory.get_container("cache") is not None))
+
+        del self.source.images["sha256:bbb222"]  # change missed while the stream is down
+        self.source.queue.put(None)
+        self.assertTrue(waitFor(lambda: inventory.resyncs == 1 and not inventory.find_images(repo="postgres")))
+
+    def testResyncBacksOffExponentially(self):
+        # Test: repeated stream breaks space resyncs out exponentially up to the cap
+        waits = []
+        inventory = docker_inventory.Inventory(self.source, resync_backoff=1.0, resync_backoff_max=4.0)
+
+        def wait(timeout):
+            waits.append(timeout)
+            if len(waits) == 5:
+                inventory._stop.set()
+            self.source.queue.put(None)  # the next subscription breaks immediately
+            return inventory._stop.is_set()
+
+        inventory._stop.wait = wait
+        self.source.queue.put(None)
+        inventory._follow()
+        self.assertEqual(waits, [1.0, 2.0, 4.0, 4.0, 4.0])
+
+    def testInspectTimestampIsUtc(self):
+        # Test: engine inspect timestamps are read as UTC regardless of local time zone
+        with patch.dict(os.environ, {"TZ": "America/New_York"}):
+            time.tzset()
+            img = ImageRecord.from_inspect({"Id": "sha256:abc", "Created": "2024-01-01T10:00:00.123456789Z"})
+        time.tzset()
+        self.assertEqual(img.created, 1704103200)
+
+    def testBulkTargetsResolvedThroughIndexes(self):
+        # Test: with a running inventory, IDs and labels resolve without a snapshot scan
+        matched, missing = docker_bulk.resolve_targets(None, ["db", "c1", "ghost"], label="tier=web",
+                                                       inventory=self.inventory)
+        self.assertEqual({c.name for c in matched}, {"web", "db"})
+        self.assertEqual(missing, ["ghost"])
+        matched, _ = docker_bulk.resolve_targets(None, name_pattern="d*", inventory=self.inventory)
+        self.assertEqual([c.name for c in matched], ["db"])
+
+    def testCliRowsParsed(self):
+        # Test: docker CLI JSON rows convert into records
+        img = ImageRecord.from_cli({"ID": "sha256:abc", "Repository": "nginx", "Tag": "latest", "Size": "142MB",
+                                    "CreatedAt": "2024-01-01 10:00:00 +0000 UTC"})
+        ctr = ContainerRecord.from_cli({"ID": "c1", "Names": "web", "Labels": "a=1,b=2", "State": "running"})
+        self.assertEqual(img.size, 142000000)
+        self.assertEqual(img.created, 1704103200)
+        self.assertEqual(ctr.labels, {"a": "1", "b": "2"})
+
+    def testListImagesServedFromInventory(self):
+        # Test: list_images renders from the live inventory without any docker call
+        with patch.object(docker_inventory, 'shared', return_value=self.inventory):
+            with patch('docker_manager.subprocess.run') as mock_run:
+                with patch.object(docker_manager, 'check_docker_running', return_value=True):
+                    with patch('builtins.print') as mock_print:
+                        docker_manager.list_images()
+        mock_run.assert_not_called()
+        printed = " ".join(str(c.args[0]) for c in mock_print.call_args_list)
+        self.assertIn("postgres", printed)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -1,14 +1,34 @@
  # Simple Unit Tests for Docker Manager
  # Tests basic functionality of docker_manager.py
 
+import io
+import json
 import unittest
 from unittest.mock import patch, MagicMock
+import docker_health
 import docker_manager
 
 
+def fake_popen(rows, returncode=0):
+    # A finished `docker ... --format '{{json .}}'` process whose stdout holds `rows`
+    proc = MagicMock(returncode=returncode)
+    proc.stdout = io.StringIO("".join(json.dumps(row) + "\n" for row in rows))
+    proc.stderr = io.StringIO("")
+    proc.wait.return_value = proc.poll.return_value = returncode
+    return proc
+
+
 class TestDockerManagerBasic(unittest.TestCase):
     # Simple tests for docker_manager functions
 
+    def setUp(self):
+        # Pin the CLI backend so these subprocess-level tests never reach a real engine socket
+        env = patch.dict('os.environ', {'CMS_DOCKER_BACKEND': 'cli'})
+        env.start()
+        self.addCleanup(env.stop)
+        # Daemon state is cached by the health monitor; start every test from an unknown state
+        docker_health.reset()
+
     def testCheckDockerRunningWhenAvailable(self):
         # Test: check_docker_running returns True when Docker is available
         with patch('docker_manager.subprocess.run') as mock_run:
@@ -24,25 +44,41 @@ class TestDockerManagerBasic(unittest.TestCase):
             self.assertFalse(result)
 
     def testListImagesCallsDocker(self):
-        # Test: list_images calls docker images command
-        with patch('docker_manager.subprocess.run') as mock_run:
+        # Test: list_images reads `docker images` JSON rows and prints one table, one row per image
+        rows = [{"ID": "a" * 64, "Repository": "nginx", "Tag": "latest", "Size": "142MB"},
+                {"ID": "a" * 64, "Repository": "nginx", "Tag": "1.25", "Size": "142MB"}]
+        with patch('docker_inventory.subprocess.Popen', return_value=fake_popen(rows)) as popen:
             with patch.object(docker_manager, 'check_docker_running', return_value=True):
-                docker_manager.list_images()
-                mock_run.assert_called_once_with(["docker", "images"])
+                with patch('builtins.print') as mock_print:
+                    docker_manager.list_images()
+        self.assertEqual(popen.call_args[0][0][:2], ["docker", "images"])
+        self.assertIn("{{json .}}", popen.call_args[0][0])
+        mock_print.assert_called_once()
+        lines = mock_print.call_args[0][0].splitlines()
+        self.assertEqual(lines[0].split()[:2], ["REPOSITORY", "TAG"])
+        self.assertEqual(lines[1].split()[:4], ["nginx", "latest", "(+1)", "aaaaaaaaaaaa"])
 
     def testListRunningContainersCallsDocker(self):
-        # Test: list_running_containers calls docker ps command
-        with patch('docker_manager.subprocess.run') as mock_run:
+        # Test: list_running_containers shows only running containers from `docker ps -a` JSON rows
+        rows = [{"ID": "c1", "Names": "web", "Image": "nginx", "State": "running", "Status": "Up 1 hour"},
+                {"ID": "c2", "Names": "db", "Image": "postgres", "State": "exited", "Status": "Exited (0)"}]
+        with patch('docker_inventory.subprocess.Popen', return_value=fake_popen(rows)) as popen:
             with patch.object(docker_manager, 'check_docker_running', return_value=True):
-                docker_manager.list_running_containers()
-                mock_run.assert_called_once_with(["docker", "ps"])
+                with patch('builtins.print') as mock_print:
+                    docker_manager.list_running_containers()
+        self.assertEqual(popen.call_args[0][0][:3], ["docker", "ps", "-a"])
+        printed = mock_print.call_args[0][0]
+        self.assertIn("web", printed)
+        self.assertNotIn("db", printed)
 
     def testListAllContainersCallsDocker(self):
-        # Test: list_all_containers calls docker ps -a command
-        with patch('docker_manager.subprocess.run') as mock_run:
+        # Test: list_all_containers includes stopped containers
+        rows = [{"ID": "c1", "Names": "web", "State": "running"}, {"ID": "c2", "Names": "db", "State": "exited"}]
+        with patch('docker_inventory.subprocess.Popen', return_value=fake_popen(rows)):
             with patch.object(docker_manager, 'check_docker_running', return_value=True):
-                docker_manager.list_all_containers()
-                mock_run.assert_called_once_with(["docker", "ps", "-a"])
+                with patch('builtins.print') as mock_print:
+                    docker_manager.list_all_containers()
+        self.assertEqual(len(mock_print.call_args[0][0].splitlines()), 3)
 
     def testRunImageWithValidInput(self):
         # Test: run_image accepts image name and creates container
@@ -92,27 +128,29 @@ class TestDockerManagerBasic(unittest.TestCase):
                     self.assertTrue(mock_run.called)
 
     def testSearchLocalImagesWithValidInput(self):
-        # Test: search_local_images filters local images
+        # Test: search_local_images filters local images read from `docker images` JSON rows
+        rows = [{"ID": "a" * 64, "Repository": "nginx", "Tag": "latest", "Size": "250MB"},
+                {"ID": "b" * 64, "Repository": "redis", "Tag": "7", "Size": "40MB"}]
         with patch('builtins.input', return_value="nginx"):
-            with patch('docker_manager.subprocess.run') as mock_run:
+            with patch('docker_inventory.subprocess.Popen', return_value=fake_popen(rows)) as popen:
                 with patch.object(docker_manager, 'check_docker_running', return_value=True):
-                    mock_run.return_value = MagicMock(
-                        returncode=0,
-                        stdout="nginx:latest\timgid\t250MB",
-                        stderr=""
-                    )
-                    docker_manager.search_local_images()
-                    self.assertTrue(mock_run.called)
+                    with patch('builtins.print') as mock_print:
+                        docker_manager.search_local_images()
+        self.assertTrue(popen.called)
+        printed = " ".join(str(c.args[0]) for c in mock_print.call_args_list)
+        self.assertIn("nginx", printed)
+        self.assertNotIn("redis", printed)
 
     def testBuildImageWithValidInputs(self):
         # Test: build_image calls docker build command
         with patch('builtins.input', side_effect=["Dockerfile", "myapp:1.0"]):
             with patch('os.path.exists', return_value=True):
-                with patch('docker_manager.subprocess.run') as mock_run:
+                with patch('docker_manager.subprocess.Popen') as mock_popen:
                     with patch.object(docker_manager, 'check_docker_running', return_value=True):
-                        mock_run.return_value = MagicMock(returncode=0, stdout="Built", stderr="")
+                        mock_popen.return_value = MagicMock(stdout=iter(["Built\n"]))
+                        mock_popen.return_value.wait.return_value = 0
                         docker_manager.build_image()
-                        self.assertTrue(mock_run.called)
+                        self.assertTrue(mock_popen.called)
 
     def testCreateDockerfileCreatesFile(self):
         # Test: create_dockerfile creates a file
@@ -126,14 +164,12 @@ class TestDockerManagerBasic(unittest.TestCase):
     def testStartContainerWithValidInput(self):
         # Test: start_container calls docker start command
         with patch('builtins.input', return_value="container123"):
-            with patch('docker_manager.subprocess.run') as mock_run:
+            with patch('docker_manager.subprocess.run') as mock_run, \
+                    patch('docker_inventory.subprocess.Popen', return_value=fake_popen([{"ID": "container123"}])):
                 with patch.object(docker_manager, 'check_docker_running', return_value=True):
-                    mock_run.side_effect = [
-                        MagicMock(returncode=0, stdout="container123\t", stderr=""),
-                        MagicMock(returncode=0, stdout="Started", stderr="")
-                    ]
+                    mock_run.return_value = MagicMock(returncode=0, stdout="Started", stderr="")
                     docker_manager.start_container()
-                    self.assertTrue(mock_run.called)
+                    self.assertEqual(mock_run.call_args[0][0], ["docker", "start", "container123"])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,139 @@
+# Unit Tests for streaming container metrics
+# Sources are faked; samples are fed with explicit timestamps
+
+import os
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+import docker_manager
+import docker_metrics
+
+
+def sample(cid, t, cpu=0.0, mem=0, net_rx=0, blk_write=0, name=None):
+    return docker_metrics.Sample(cid, name or f"c-{cid}", t, cpu, mem, 1000, net_rx, 0, 0, blk_write)
+
+
+class FakeSource:
+    # Emits the given samples once, then ends the stream
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.runs = 0
+
+    def run(self, emit, stopped, clock):
+        self.runs += 1
+        if self.runs == 1:
+            for s in self.samples:
+                emit(s)
+
+    def close(self):
+        pass
+
+
+class TestDockerMetrics(unittest.TestCase):
+    # Tests for parsing, ring buffers, window statistics and the collector
+
+    def testParseCliAndEngine(self):
+        # Test: both the CLI's human-readable row and the engine's raw counters become a Sample
+        row = {"ID": "abc123", "Name": "web", "CPUPerc": "12.50%", "MemUsage": "100MiB / 1GiB",
+               "NetIO": "1.5kB / 648B", "BlockIO": "2MB / 0B", "PIDs": "3"}
+        s = docker_metrics.Sample.from_cli(row, 10.0)
+        self.assertEqual((s.id, s.name, s.cpu, s.mem, s.mem_limit), ("abc123", "web", 12.5, 100 * 2**20, 2**30))
+        self.assertEqual((s.net_rx, s.net_tx, s.blk_read, s.blk_write), (1500, 648, 2_000_000, 0))
+
+        data = {"name": "/web",
+                "cpu_stats": {"cpu_usage": {"total_usage": 300}, "system_cpu_usage": 2000, "online_cpus": 2},
+                "precpu_stats": {"cpu_usage": {"total_usage": 100}, "system_cpu_usage": 1000},
+                "memory_stats": {"usage": 5000, "limit": 10000, "stats": {"inactive_file": 1000}},
+                "networks": {"eth0": {"rx_bytes": 10, "tx_bytes": 20}, "eth1": {"rx_bytes": 5, "tx_bytes": 0}},
+                "blkio_stats": {"io_service_bytes_recursive": [{"op": "Read", "value": 7}, {"op": "write", "value": 9}]}}
+        s = docker_metrics.Sample.from_engine("abc", data, 10.0)
+        self.assertEqual((s.name, s.cpu, s.mem, s.mem_limit), ("web", 40.0, 4000, 10000))
+        self.assertEqual((s.net_rx, s.net_tx, s.blk_read, s.blk_write), (15, 20, 7, 9))
+        data["precpu_stats"] = {}
+        self.assertEqual(docker_metrics.Sample.from_engine("abc", data, 10.0).cpu, 0.0)
+
+    def testRingBufferWrapsAround(self):
+        # Test: the buffer keeps only the newest `capacity` samples in its preallocated arrays
+        ring = docker_metrics.RingBuffer(4, ("v",))
+        arrays = (ring._times, ring._data["v"])
+        for t in range(10):
+            ring.append(float(t), {"v": t * 10.0})
+        self.assertEqual(len(ring), 4)
+        self.assertEqual(ring.window("v"), [60.0, 70.0, 80.0, 90.0])
+        self.assertEqual(ring.window("v", since=8.0), [80.0, 90.0])
+        self.assertEqual(ring.latest(), (9.0, {"v": 90.0}))
+        self.assertIs(ring._times, arrays[0])
+        self.assertEqual(len(ring._data["v"]), 4)
+
+    def testSummaryOverWindowAndRates(self):
+        # Test: min/avg/max/p95 over a window; cumulative I/O counters become per-second rates
+        now = [100.0]
+        collector = docker_metrics.MetricsCollector(FakeSource([]), capacity=50, clock=lambda: now[0])
+        for t in range(20):
+            collector.ingest(sample("a", 80.0 + t, cpu=float(t + 1), mem=500, net_rx=1000 * t, blk_write=0))
+        stats = collector.summary("a", "cpu", window=10)
+        self.assertEqual((stats["count"], stats["min"], stats["max"], stats["avg"]), (10, 11.0, 20.0, 15.5))
+        self.assertEqual(stats["p95"], 20.0)
+        self.assertEqual(collector.summary("c-a", "net_rx", window=5)["avg"], 1000.0)
+        self.assertEqual(collector.summary("a", "mem_pct", window=5)["max"], 50.0)
+        # a restarted container's counters start again from zero
+        collector.ingest(sample("a", 100.0, net_rx=0))
+        self.assertEqual(collector.containers()[0]["net_rx"], 0.0)
+        self.assertIsNone(collector.summary("zzz", "cpu"))
+        with self.assertRaises(ValueError):
+            collector.summary("a", "disk")
+
+    def testMemoryStaysBounded(self):
+        # Test: a long run keeps `capacity` samples per container and forgets containers that stopped
+        now = [0.0]
+        collector = docker_metrics.MetricsCollector(FakeSource([]), capacity=10, expire=30, clock=lambda: now[0])
+        for t in range(1000):
+            now[0] = float(t)
+            collector.ingest(sample("long", now[0], cpu=1.0))
+            if t < 100:
+                collector.ingest(sample("short", now[0], cpu=2.0))
+        self.assertEqual([r["id"] for r in collector.containers()], ["long"])
+        self.assertEqual(len(collector._series["long"].buffer), 10)
+        self.assertEqual(collector.samples, 1100)
+
+    def testCollectorThreadAndLiveView(self):
+        # Test: the collector follows its source on a thread; the menu view prints a top-like table
+        source = FakeSource([sample("a", time.time(), cpu=5.0, name="web"),
+                             sample("b", time.time(), cpu=50.0, name="db")])
+        collector = docker_metrics.MetricsCollector(source, retry_backoff=0.05).start()
+        self.addCleanup(collector.stop)
+        deadline = time.time() + 5
+        while collector.samples < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([r["name"] for r in collector.containers()], ["db", "web"])
+
+        with patch('docker_metrics.start_shared', return_value=collector), \
+                patch('docker_manager.check_docker_running', return_value=True), \
+                patch('builtins.input', side_effect=["web", "60"]), \
+                patch('builtins.print') as mock_print:
+            docker_manager.container_metrics(refresh=0, rounds=1)
+        output = str(mock_print.call_args_list)
+        self.assertIn("CPU %", output)
+        self.assertIn("db", output)
+        self.assertIn("cpu        min         5.00", output)
+
+    def testCliSourceSingleStream(self):
+        # Test: one `docker stats` process serves every container; screen-clearing escapes are skipped
+        lines = ['\x1b[2J\x1b[H{"ID":"a","Name":"web","CPUPerc":"1%","MemUsage":"1MiB / 1GiB",'
+                 '"NetIO":"0B / 0B","BlockIO":"0B / 0B"}\n',
+                 '{"ID":"b","Name":"db","CPUPerc":"2%","MemUsage":"2MiB / 1GiB","NetIO":"0B / 0B","BlockIO":"0B / 0B"}\n']
+        proc = MagicMock(stdout=iter(lines))
+        proc.poll.return_value = 0
+        emitted = []
+        with patch('subprocess.Popen', return_value=proc) as popen:
+            docker_metrics.CliStatsSource().run(emitted.append, lambda: False, lambda: 1.0)
+        self.assertEqual(popen.call_count, 1)
+        self.assertEqual(popen.call_args.args[0][:2], ["docker", "stats"])
+        self.assertEqual([(s.name, s.cpu) for s in emitted], [("web", 1.0), ("db", 2.0)])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
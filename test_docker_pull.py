@@ -0,0 +1,162 @@
+ # Unit Tests for parallel multi-image pulls
+ # Uses a fake engine client (and a fake `docker pull` process) instead of a registry
+
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+import docker_engine
+import docker_pull
+
+
+class FakeEngine:
+    # Streams layer progress for each pull and tracks concurrency
+
+    def __init__(self, local=None, delay=0.02, fail=()):
+        self.local = local or {}
+        self.delay = delay
+        self.fail = set(fail)
+        self.pulled = []
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def inspect_image(self, ref):
+        if ref not in self.local:
+            raise docker_engine.EngineError(404, f"No such image: {ref}")
+        return {"RepoDigests": self.local[ref]}
+
+    def pull(self, ref):
+        with self.lock:
+            self.pulled.append(ref)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            if ref in self.fail:
+                time.sleep(self.delay)
+                yield {"error": "manifest unknown"}
+                return
+            for layer in ("aaa", "bbb"):
+                yield {"status": "Pulling fs layer", "id": layer, "progressDetail": {}}
+                time.sleep(self.delay)
+                yield {"status": "Downloading", "id": layer, "progressDetail": {"current": 500, "total": 1000}}
+                yield {"status": "Download complete", "id": layer, "progressDetail": {}}
+                yield {"status": "Pull complete", "id": layer, "progressDetail": {}}
+            yield {"status": f"Status: Downloaded newer image for {ref}"}
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class TestDockerPull(unittest.TestCase):
+    # Tests for dedup, digest skipping, bounded concurrency and reporting
+
+    def setUp(self):
+        self.engine = FakeEngine()
+        docker_engine.set_client(self.engine)
+        self.addCleanup(docker_engine.set_client, None)
+
+    def testNormalizeRef(self):
+        # Test: references are canonicalized before deduplication
+        self.assertEqual(docker_pull.normalize_ref("nginx"), "nginx:latest")
+        self.assertEqual(docker_pull.normalize_ref("docker.io/library/nginx:1.25"), "nginx:1.25")
+        self.assertEqual(docker_pull.normalize_ref("reg:5000/app"), "reg:5000/app:latest")
+        self.assertEqual(docker_pull.normalize_ref("app@sha256:abc"), "app@sha256:abc")
+
+    def testDuplicatesCollapseIntoOnePull(self):
+        # Test: equivalent references are pulled once
+        report = docker_pull.pull_images(["nginx", "nginx:latest", "docker.io/library/nginx", "redis"])
+        self.assertEqual(sorted(self.engine.pulled), ["nginx:latest", "redis:latest"])
+        nginx = report.board.images["nginx:latest"]
+        self.assertEqual(nginx.duplicates, 2)
+
+    def testSkipsImagePresentAtDigest(self):
+        # Test: pinned references already present locally are not pulled
+        ref = "app@sha256:abc"
+        self.engine.local[ref] = ["app@sha256:abc"]
+        report = docker_pull.pull_images([ref, "redis"])
+        self.assertEqual(self.engine.pulled, ["redis:latest"])
+        self.assertEqual(report.board.images[ref].state, "skipped")
+
+    def testConcurrencyLimit(self):
+        # Test: at most `concurrency` pulls run at once and they overlap
+        docker_pull.pull_images([f"img{n}" for n in range(6)], concurrency=3)
+        self.assertEqual(self.engine.peak, 3)
+
+    def testProgressAggregated(self):
+        # Test: layer bytes and completion feed the board and report
+        updates = []
+        report = docker_pull.pull_images(["nginx"], on_update=updates.append, update_interval=0.005)
+        entry = report.as_dict()["images"][0]
+        self.assertEqual(entry["state"], "done")
+        self.assertEqual(entry["bytes"], 2000)
+        self.assertGreater(entry["seconds"], 0)
+        self.assertTrue(updates)
+        self.assertIn("MB/s", report.board.render()[0])
+
+    def testFailuresReported(self):
+        # Test: a failing pull is reported without stopping the others
+        self.engine.fail.add("bad:latest")
+        report = docker_pull.pull_images(["bad", "good"])
+        self.assertEqual([i.ref for i in report.failed], ["bad:latest"])
+        self.assertEqual(report.board.images["bad:latest"].error, "manifest unknown")
+        self.assertEqual(report.board.images["good:latest"].state, "done")
+
+    def testPresenceCheckFailureIsPerImage(self):
+        # Test: an inspect error marks that image failed instead of aborting the batch
+        def inspect(ref):
+            raise docker_engine.EngineError(500, "inspect exploded")
+        self.engine.inspect_image = inspect
+        report = docker_pull.pull_images(["app@sha256:abc", "redis"])
+        self.assertEqual(report.board.images["app@sha256:abc"].state, "failed")
+        self.assertEqual(report.board.images["app@sha256:abc"].error, "inspect exploded")
+        self.assertEqual(report.board.images["redis:latest"].state, "done")
+
+    def testConcurrentBatchesShareOnePull(self):
+        # Test: a second batch waits on the in-flight pull and reports its outcome
+        self.engine.delay = 0.1
+        self.engine.fail.add("bad:latest")
+        reports = {}
+        first = threading.Thread(target=lambda: reports.setdefault(1, docker_pull.pull_images(["bad", "nginx"])))
+        first.start()
+        time.sleep(0.03)
+        reports[2] = docker_pull.pull_images(["bad", "nginx"])
+        first.join()
+        self.assertEqual(sorted(self.engine.pulled), ["bad:latest", "nginx:latest"])
+        self.assertEqual(reports[2].board.images["bad:latest"].state, "failed")
+        self.assertEqual(reports[2].board.images["bad:latest"].error, "manifest unknown")
+        self.assertEqual(reports[2].board.images["nginx:latest"].state, "done")
+
+    def testLoadManifestFormats(self):
+        # Test: manifests may be plain text with comments or JSON
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("# base images\nnginx\n\npostgres:16  # db\n")
+        self.addCleanup(os.remove, f.name)
+        self.assertEqual(docker_pull.load_manifest(f.name), ["nginx", "postgres:16"])
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            f.write('{"images": ["redis", "alpine"]}')
+        self.addCleanup(os.remove, f.name)
+        self.assertEqual(docker_pull.load_manifest(f.name), ["redis", "alpine"])
+
+    def testCliPullParsesLayerLines(self):
+        # Test: the CLI fallback turns `docker pull` output into layer progress
+        docker_engine.set_client(None)
+        proc = MagicMock()
+        proc.stdout = io.StringIO("latest: Pulling from library/nginx\na2abf6c4d29d: Pulling fs layer\n"
+                                  "a2abf6c4d29d: Pull complete\nDigest: sha256:1\n")
+        proc.stderr = io.StringIO("")
+        proc.wait.return_value = 0
+        with patch.dict(os.environ, {"CMS_DOCKER_BACKEND": "cli"}):
+            with patch('docker_pull.subprocess.Popen', return_value=proc):
+                report = docker_pull.pull_images(["nginx"], skip_existing="never")
+        img = report.board.images["nginx:latest"]
+        self.assertEqual(img.state, "done")
+        self.assertEqual(img.layers_done, 1)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
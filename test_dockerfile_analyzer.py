@@ -0,0 +1,144 @@
+ # Unit Tests for the Dockerfile analyzer
+ # Parses Dockerfile text directly; create_dockerfile/build_image use temporary files
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import docker_manager
+import dockerfile_analyzer
+import dockerfile_templates
+
+SLOW = """\
+# syntax=docker/dockerfile:1
+FROM ubuntu
+RUN apt-get update
+RUN apt-get install -y \\
+    # tools
+    curl git
+WORKDIR /app
+COPY . .
+ENV APP_ENV=prod
+RUN pip install -r requirements.txt
+ADD https://example.com/tool.tar.gz /tmp/
+ADD config.yml /etc/app/
+CMD ["python", "app.py"]
+"""
+
+
+def codes(findings):
+    return [(f.line, f.code) for f in findings]
+
+
+class TestDockerfileAnalyzer(unittest.TestCase):
+    # Tests for parsing, findings and auto-fixes
+
+    def testParseContinuationsHeredocsAndFlags(self):
+        # Test: instructions keep their first/last physical line; comments and heredoc bodies are not instructions
+        text = ("# escape=`\nFROM python:3.12 AS build\nRUN --mount=type=cache,target=/root/.cache/pip `\n"
+                "    pip install x\nRUN <<EOF\n# not an instruction\nEOF\nCOPY --from=build /a /b\n")
+        insts = dockerfile_analyzer.parse(text)
+        self.assertEqual([(i.op, i.line, i.end) for i in insts],
+                         [("FROM", 2, 2), ("RUN", 3, 4), ("RUN", 5, 7), ("COPY", 8, 8)])
+        self.assertEqual(insts[1].flags, {"mount": ["type=cache,target=/root/.cache/pip"]})
+        self.assertEqual(insts[1].args, "pip install x")
+        self.assertEqual(insts[2].heredocs, ["# not an instruction"])
+        self.assertEqual(insts[3].flags["from"], "build")
+
+    def testFindingsWithLineNumbers(self):
+        # Test: each anti-pattern is reported on the line it starts
+        findings = dockerfile_analyzer.analyze(SLOW)
+        self.assertEqual(codes(findings), [
+            (2, "unpinned-base"), (3, "apt-update-alone"), (4, "apt-recommends"), (4, "apt-lists-kept"),
+            (8, "copy-before-install"), (10, "pip-cache"), (11, "add-remote-url"), (12, "add-local-file"),
+        ])
+        self.assertEqual(findings[3].bytes, dockerfile_analyzer.APT_LISTS_BYTES)
+        self.assertFalse(findings[0].fixable)
+        self.assertFalse(findings[6].fixable)
+
+    def testFixRewritesSafePatterns(self):
+        # Test: auto-fixes merge apt layers, move the source copy after the install and add cleanup flags
+        text, applied = dockerfile_analyzer.fix(SLOW)
+        self.assertEqual(len(applied), 6)
+        self.assertEqual(text, """\
+# syntax=docker/dockerfile:1
+FROM ubuntu
+RUN apt-get update && apt-get install --no-install-recommends -y \\
+    # tools
+    curl git && rm -rf /var/lib/apt/lists/*
+WORKDIR /app
+COPY requirements.txt ./
+ENV APP_ENV=prod
+RUN pip install --no-cache-dir -r requirements.txt
+COPY . .
+ADD https://example.com/tool.tar.gz /tmp/
+COPY config.yml /etc/app/
+CMD ["python", "app.py"]
+""")
+        self.assertEqual(codes(dockerfile_analyzer.analyze(text)), [(2, "unpinned-base"), (11, "add-remote-url")])
+
+    def testUnsafeRewritesAreOnlyReported(self):
+        # Test: installs that need the source tree, or with steps in between, are not rewritten
+        text = "FROM node:20\nCOPY . .\nRUN npm install express\n"
+        self.assertFalse(dockerfile_analyzer.analyze(text)[0].fixable)
+        text = "FROM python:3.12\nCOPY . .\nRUN make gen\nRUN pip install -r requirements.txt\n"
+        finding = [f for f in dockerfile_analyzer.analyze(text) if f.code == "copy-before-install"][0]
+        self.assertFalse(finding.fixable)
+
+    def testCleanDockerfilesHaveNoFindings(self):
+        # Test: stage references, digests, cache mounts and the guided templates are not flagged
+        text = ("FROM golang:1.22 AS build\nFROM build\nFROM alpine@sha256:abc\nRUN apk add --no-cache git\n"
+                "FROM debian:12\nRUN --mount=type=cache,target=/var/lib/apt apt-get update && "
+                "apt-get install -y --no-install-recommends curl\n")
+        self.assertEqual(dockerfile_analyzer.analyze(text), [])
+        ctx = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, ctx, True)
+        for manifest in ("requirements.txt", "package.json", "go.mod"):
+            with open(os.path.join(ctx, manifest), "w") as f:
+                f.write("{}")
+            project = dockerfile_templates.detect_project(ctx)
+            self.assertEqual(dockerfile_analyzer.analyze(dockerfile_templates.render(project)), [])
+
+    def testCreateDockerfileOffersFixes(self):
+        # Test: loading a Dockerfile (mode 3) reports findings and writes the fixed text on "y"
+        ctx = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, ctx, True)
+        src, path = os.path.join(ctx, "src.Dockerfile"), os.path.join(ctx, "Dockerfile")
+        with open(src, "w") as f:
+            f.write("FROM debian:12\nRUN apt-get install -y curl\n")
+        with patch('builtins.input', side_effect=[path, "3", src, "y"]):
+            with patch('builtins.print') as mock_print:
+                docker_manager.create_dockerfile()
+        with open(path) as f:
+            self.assertEqual(f.read(), "FROM debian:12\n"
+                             "RUN apt-get install --no-install-recommends -y curl && rm -rf /var/lib/apt/lists/*\n")
+        printed = [str(c.args[0]) for c in mock_print.call_args_list if c.args]
+        self.assertIn("Applied 2 fix(es).", printed)
+
+    def testBuildImageReportsBeforeBuilding(self):
+        # Test: build_image checks the Dockerfile and leaves it unchanged when fixes are declined
+        ctx = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, ctx, True)
+        cwd = os.getcwd()
+        os.chdir(ctx)
+        self.addCleanup(os.chdir, cwd)
+        original = "FROM python:3.12\nRUN pip install flask\n"
+        with open("Dockerfile", "w") as f:
+            f.write(original)
+        with patch.dict(os.environ, {"CMS_DOCKER_BACKEND": "cli", "CMS_BUILD_CACHE": "0"}):
+            with patch('builtins.input', side_effect=["Dockerfile", "app:1", "n"]):
+                with patch.object(docker_manager, 'check_docker_running', return_value=True):
+                    with patch('docker_build.build_cli') as build:
+                        with patch('builtins.print') as mock_print:
+                            docker_manager.build_image()
+        self.assertTrue(build.called)
+        printed = " ".join(str(c.args[0]) for c in mock_print.call_args_list if c.args)
+        self.assertIn("line 2: pip-cache", printed)
+        with open("Dockerfile") as f:
+            self.assertEqual(f.read(), original)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
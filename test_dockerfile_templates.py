@@ -0,0 +1,188 @@
+ # Unit Tests for the layer-cache-aware Dockerfile templates
+ # Rebuilds are simulated with the layer cache rules the builder applies: an instruction
+ # is reused while its parent layer, its text and (for COPY) the copied files are unchanged
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import docker_build
+import docker_engine
+import docker_manager
+import dockerfile_templates
+
+
+def write(root, rel, text):
+    path = os.path.join(root, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def instructions(text):
+    # Dockerfile instructions with line continuations joined and comments dropped
+    joined, pending = [], ""
+    for line in text.splitlines():
+        if not pending and (not line.strip() or line.lstrip().startswith("#")):
+            continue
+        if line.endswith("\\"):
+            pending += line[:-1] + " "
+            continue
+        joined.append(pending + line)
+        pending = ""
+    return joined
+
+
+class LayerCache:
+    # Just enough of the builder's cache to tell which RUN steps a build executes
+
+    def __init__(self, context):
+        self.context = context
+        self.layers = set()
+
+    def _files_digest(self, sources):
+        excludes = docker_engine.load_dockerignore(self.context)
+        h = hashlib.sha256()
+        for root, dirs, files in os.walk(self.context):
+            dirs.sort()
+            for name in sorted(files):
+                rel = os.path.relpath(os.path.join(root, name), self.context).replace(os.sep, "/")
+                if excludes(rel) or not any(src == "." or rel == src for src in sources):
+                    continue
+                with open(os.path.join(root, name), "rb") as f:
+                    h.update(rel.encode() + b"\0" + f.read())
+        return h.hexdigest()
+
+    def build(self, dockerfile):
+        # Returns the RUN instructions that were executed (cache misses)
+        executed, stages, stage, key = [], {}, None, ""
+        for inst in instructions(dockerfile):
+            words = inst.split()
+            op = words[0].upper()
+            if op == "FROM":
+                key = hashlib.sha256(inst.encode()).hexdigest()
+                stage = words[3] if len(words) == 4 else None
+            else:
+                extra = ""
+                if op == "COPY":
+                    source = [w[7:] for w in words[1:] if w.startswith("--from=")]
+                    paths = [w for w in words[1:] if not w.startswith("--")][:-1]
+                    extra = stages[source[0]] if source else self._files_digest(paths)
+                key = hashlib.sha256(f"{key}\0{inst}\0{extra}".encode()).hexdigest()
+                if key not in self.layers:
+                    self.layers.add(key)
+                    if op == "RUN":
+                        executed.append(inst)
+            if stage:
+                stages[stage] = key  # what COPY --from=<stage> sees
+        return executed
+
+
+class TestDockerfileTemplates(unittest.TestCase):
+    # Tests for project detection, template structure and rebuild behaviour
+
+    def setUp(self):
+        self.ctx = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.ctx, True)
+
+    def builds(self, change, dockerfile=None):
+        # RUN steps executed by a first build and by a rebuild after `change` edits the context
+        project = dockerfile_templates.detect_project(self.ctx)
+        dockerfile = dockerfile or dockerfile_templates.render(project)
+        docker_build.write_dockerignore(self.ctx, dockerfile_templates.DOCKERIGNORE[project.kind])
+        cache = LayerCache(self.ctx)
+        first = cache.build(dockerfile)
+        change()
+        return first, cache.build(dockerfile)
+
+    def testDetectProjects(self):
+        # Test: manifests select the project type, package manager and defaults
+        self.assertIsNone(dockerfile_templates.detect_project(self.ctx))
+        write(self.ctx, "pyproject.toml", "[project]\nname = 'x'\n")
+        self.assertEqual(dockerfile_templates.detect_project(self.ctx).details["source"], "pyproject")
+        write(self.ctx, "requirements.txt", "flask\n")
+        self.assertEqual(dockerfile_templates.detect_project(self.ctx).manifests, ["requirements.txt"])
+        write(self.ctx, "package.json", '{"scripts": {"start": "node server.js", "build": "tsc"}}')
+        write(self.ctx, "yarn.lock", "")
+        node = dockerfile_templates.detect_project(self.ctx)
+        self.assertEqual((node.kind, node.details["manager"], node.start_cmd), ("node", "yarn", "yarn start"))
+        self.assertEqual(node.manifests, ["package.json", "yarn.lock"])
+        write(self.ctx, "go.mod", "module example.com/x\n\ngo 1.21\n")
+        go = dockerfile_templates.detect_project(self.ctx)
+        self.assertEqual((go.kind, go.base_image), ("go", "golang:1.21"))
+
+    def testPythonSourceEditReusesDependencyLayers(self):
+        # Test: after a source-only change no RUN step executes; a requirements change reinstalls
+        write(self.ctx, "requirements.txt", "flask\n")
+        write(self.ctx, "app.py", "print('v1')\n")
+        first, rebuild = self.builds(lambda: write(self.ctx, "app.py", "print('v2')\n"))
+        self.assertTrue(any("pip install -r requirements.txt" in step for step in first))
+        self.assertEqual(rebuild, [])
+        _, rebuild = self.builds(lambda: write(self.ctx, "requirements.txt", "flask\nredis\n"))
+        self.assertTrue(any("pip install" in step for step in rebuild))
+
+    def testNaiveTemplateReinstallsOnEveryEdit(self):
+        # Test: the copy-everything-first layout reruns the install after any edit (the problem being fixed)
+        write(self.ctx, "requirements.txt", "flask\n")
+        write(self.ctx, "app.py", "print('v1')\n")
+        naive = "FROM python:3.12-slim\nWORKDIR /app\nCOPY . .\nRUN pip install -r requirements.txt\n"
+        _, rebuild = self.builds(lambda: write(self.ctx, "app.py", "print('v2')\n"), naive)
+        self.assertEqual(len(rebuild), 1)
+
+    def testNodeSourceEditOnlyRerunsBuildScript(self):
+        # Test: installs are cached; only the project's own build step runs again
+        write(self.ctx, "package.json", '{"scripts": {"start": "node dist/index.js", "build": "tsc"}}')
+        write(self.ctx, "package-lock.json", "{}")
+        write(self.ctx, "src/index.ts", "console.log(1)\n")
+        write(self.ctx, "node_modules/left-pad/index.js", "local\n")
+        first, rebuild = self.builds(lambda: write(self.ctx, "src/index.ts", "console.log(2)\n"))
+        self.assertEqual(len(first), 3)  # prod install, full install, build
+        self.assertEqual(rebuild, ["RUN npm run build && rm -rf node_modules"])
+        # local node_modules are excluded, so touching them changes nothing
+        _, rebuild = self.builds(lambda: write(self.ctx, "node_modules/left-pad/index.js", "changed\n"))
+        self.assertEqual(rebuild, [])
+
+    def testGoModulesCachedAcrossSourceEdits(self):
+        # Test: `go mod download` is reused; the compile step uses cache mounts and a distroless runtime
+        write(self.ctx, "go.mod", "module example.com/x\n\ngo 1.22\n")
+        write(self.ctx, "go.sum", "")
+        write(self.ctx, "main.go", "package main\n")
+        text = dockerfile_templates.render(dockerfile_templates.detect_project(self.ctx))
+        self.assertIn("--mount=type=cache,target=/root/.cache/go-build", text)
+        self.assertIn("FROM gcr.io/distroless/static-debian12", text)
+        _, rebuild = self.builds(lambda: write(self.ctx, "main.go", "package main\n// v2\n"), text)
+        self.assertEqual(len(rebuild), 1)
+        self.assertIn("go build", rebuild[0])
+
+    def testCreateDockerfileGuidedModeUsesDetectedProject(self):
+        # Test: guided mode writes the multi-stage template and a matching .dockerignore
+        write(self.ctx, "requirements.txt", "flask\n")
+        path = os.path.join(self.ctx, "Dockerfile")
+        with patch('builtins.input', side_effect=[path, "1", "", "gunicorn app:app"]):
+            with patch('builtins.print'):
+                docker_manager.create_dockerfile()
+        with open(path) as f:
+            text = f.read()
+        self.assertLess(text.index("COPY requirements.txt ./"), text.index("COPY . ."))
+        self.assertIn("--mount=type=cache,target=/root/.cache/pip", text)
+        self.assertEqual(text.count("FROM python:3.12-slim"), 2)
+        self.assertTrue(text.endswith('CMD ["gunicorn", "app:app"]\n'))
+        with open(os.path.join(self.ctx, ".dockerignore")) as f:
+            self.assertIn(".venv\n", f.read())
+
+    def testCreateDockerfileGuidedModeFallsBackToGenericTemplate(self):
+        # Test: without a recognised manifest the single-stage template is kept
+        path = os.path.join(self.ctx, "Dockerfile")
+        with patch('builtins.input', side_effect=[path, "1", "python:3.9", "python app.py"]):
+            with patch('builtins.print'):
+                docker_manager.create_dockerfile()
+        with open(path) as f:
+            self.assertEqual(f.read(), 'FROM python:3.9\nWORKDIR /app\nCOPY . .\nCMD ["python", "app.py"]\n')
+        self.assertFalse(os.path.exists(os.path.join(self.ctx, ".dockerignore")))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
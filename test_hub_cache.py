@@ -0,0 +1,141 @@
+ # Unit Tests for the Docker Hub search cache
+ # Substitutes a fake `docker` executable on PATH that answers `docker search`
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import docker_manager
+import hub_cache
+
+FAKE_DOCKER = """#!{python}
+import json, os, sys
+with open(os.environ["FAKE_DOCKER_LOG"], "a") as log:
+    log.write(" ".join(sys.argv[1:]) + "\\n")
+if os.environ.get("FAKE_DOCKER_FAIL"):
+    sys.stderr.write("registry unreachable\\n")
+    sys.exit(1)
+term = sys.argv[-1]
+generation = os.environ.get("FAKE_DOCKER_GENERATION", "1")
+for n in range(3):
+    print(json.dumps({{"Name": f"{{term}}-{{n}}", "Description": f"gen {{generation}}",
+                      "StarCount": str(10 - n), "IsOfficial": "[OK]" if n == 0 else "", "IsAutomated": ""}}))
+"""
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestHubCache(unittest.TestCase):
+    # Tests for TTL, stale-while-revalidate, LRU eviction and offline mode
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        bindir = os.path.join(self.tmpdir, "bin")
+        os.makedirs(bindir)
+        docker = os.path.join(bindir, "docker")
+        with open(docker, "w") as f:
+            f.write(FAKE_DOCKER.format(python=sys.executable))
+        os.chmod(docker, os.stat(docker).st_mode | stat.S_IEXEC)
+        self.log = os.path.join(self.tmpdir, "calls.log")
+        env = patch.dict(os.environ, {
+            "PATH": bindir + os.pathsep + os.environ.get("PATH", ""),
+            "FAKE_DOCKER_LOG": self.log,
+            "CMS_DOCKER_BACKEND": "cli",
+            "CMS_DATA_DIR": os.path.join(self.tmpdir, "data"),
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        self.clock = FakeClock()
+        self.cache = hub_cache.HubCache(os.path.join(self.tmpdir, "cache.sqlite3"), ttl=60, max_entries=2,
+                                        clock=self.clock)
+
+    def calls(self):
+        if not os.path.exists(self.log):
+            return 0
+        with open(self.log) as f:
+            return len(f.readlines())
+
+    def testMissThenHit(self):
+        # Test: the second identical query is served from disk without running docker
+        first = self.cache.search("nginx")
+        second = self.cache.search("nginx")
+        self.assertEqual(first.source, "miss")
+        self.assertEqual(second.source, "hit")
+        self.assertEqual(second.results[0], {"name": "nginx-0", "description": "gen 1", "stars": 10, "official": True})
+        self.assertEqual(self.calls(), 1)
+
+    def testQueryNormalized(self):
+        # Test: case and whitespace differences share one cache entry
+        self.cache.search("Python")
+        self.assertEqual(self.cache.search("  python ").source, "hit")
+
+    def testStaleServedWhileRefreshing(self):
+        # Test: after the TTL the stale result is returned and refreshed in the background
+        self.cache.search("redis")
+        self.clock.now += 120
+        with patch.dict(os.environ, {"FAKE_DOCKER_GENERATION": "2"}):
+            stale = self.cache.search("redis")
+            self.cache.wait(10)
+        self.assertEqual(stale.source, "stale")
+        self.assertEqual(stale.results[0]["description"], "gen 1")
+        fresh = self.cache.search("redis")
+        self.assertEqual(fresh.source, "hit")
+        self.assertEqual(fresh.results[0]["description"], "gen 2")
+
+    def testLruEviction(self):
+        # Test: the least recently used entry is evicted beyond max_entries
+        self.cache.search("a")
+        self.clock.now += 1
+        self.cache.search("b")
+        self.clock.now += 1
+        self.cache.search("a")  # touch a
+        self.clock.now += 1
+        self.cache.search("c")  # evicts b
+        self.assertEqual(self.cache.entries(), 2)
+        self.assertEqual(self.cache.search("a").source, "hit")
+        self.assertEqual(self.cache.search("b").source, "miss")
+
+    def testOfflineServesOnlyCache(self):
+        # Test: offline mode never runs docker and serves even expired entries
+        self.cache.search("alpine")
+        self.clock.now += 10000
+        result = self.cache.search("alpine", offline=True)
+        self.assertEqual(result.source, "offline")
+        with self.assertRaises(hub_cache.HubSearchError):
+            self.cache.search("ubuntu", offline=True)
+        self.assertEqual(self.calls(), 1)
+
+    def testFailedFetchNotCached(self):
+        # Test: registry errors are raised and nothing is written
+        with patch.dict(os.environ, {"FAKE_DOCKER_FAIL": "1"}):
+            with self.assertRaises(hub_cache.HubSearchError) as ctx:
+                self.cache.search("nginx")
+        self.assertIn("registry unreachable", str(ctx.exception))
+        self.assertEqual(self.cache.entries(), 0)
+
+    def testSearchDockerhubPrintsCachedResults(self):
+        # Test: search_dockerhub renders parsed results through the cache
+        with patch.object(hub_cache, '_cache', self.cache):
+            with patch('builtins.input', return_value="nginx"):
+                with patch('builtins.print') as mock_print:
+                    docker_manager.search_dockerhub()
+                    docker_manager.search_dockerhub()
+        printed = [str(c.args[0]) for c in mock_print.call_args_list]
+        self.assertTrue(any("nginx-0" in line for line in printed))
+        self.assertTrue(any("cached result" in line for line in printed))
+        self.assertEqual(self.calls(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
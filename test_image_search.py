@@ -0,0 +1,94 @@
+ # Unit Tests for indexed local image search
+ # Builds indexes over in-memory ImageRecords (no Docker needed)
+
+import unittest
+from unittest.mock import patch, MagicMock
+
+import docker_inventory
+import docker_manager
+import image_search
+from docker_inventory import ImageRecord
+
+IMAGES = [
+    ImageRecord("sha256:1111aaaa", ["nginx:latest", "nginx:1.25"], 0, 142000000, {"team": "web"}),
+    ImageRecord("sha256:2222bbbb", ["postgres:16"], 0, 400000000, {"team": "data"}),
+    ImageRecord("sha256:3333cccc", ["registry.local:5000/team/api-server:2.1"], 0, 80000000),
+    ImageRecord("sha256:4444dddd", ["python:3.12-slim"], 0, 130000000),
+    ImageRecord("sha256:5555eeee", [], 0, 10000000),
+]
+
+
+class TestImageSearch(unittest.TestCase):
+    # Tests for ranking, field scopes and index reuse
+
+    def setUp(self):
+        self.index = image_search.ImageIndex(IMAGES)
+
+    def refs(self, query):
+        return [f"{r.repo}:{r.tag}" for r in self.index.search(query)]
+
+    def testDoesNotMatchSizesOrIds(self):
+        # Test: numbers only match tags, never sizes or image IDs
+        self.assertEqual(self.refs("142"), [])
+        self.assertEqual(self.refs("1111"), [])
+        self.assertEqual(self.refs("16"), ["postgres:16"])
+
+    def testExactRanksAbovePrefixAndFuzzy(self):
+        # Test: exact term beats prefix matches
+        results = self.index.search("post")
+        self.assertEqual(results[0].repo, "postgres")
+        self.assertEqual(self.index.search("postgres")[0].score, image_search.EXACT)
+
+    def testFuzzyMatchesTypos(self):
+        # Test: a misspelled repository still finds the image
+        self.assertIn("nginx:latest", self.refs("ngnix"))
+        self.assertIn("postgres:16", self.refs("postgress"))
+
+    def testPathComponentsAndSubstring(self):
+        # Test: registry/namespace components and substrings are searchable
+        self.assertEqual(self.refs("api-server"), ["registry.local:5000/team/api-server:2.1"])
+        self.assertEqual(self.refs("server"), ["registry.local:5000/team/api-server:2.1"])
+        self.assertEqual(self.refs("gres"), ["postgres:16"])
+
+    def testFieldScopedQueries(self):
+        # Test: repo:, tag:, name:tag and label: scope the search
+        self.assertEqual(self.refs("tag:16"), ["postgres:16"])
+        self.assertEqual(self.refs("repo:nginx tag:1.25"), ["nginx:1.25"])
+        self.assertEqual(self.refs("nginx:latest"), ["nginx:latest"])
+        self.assertEqual(sorted(self.refs("label:team")), ["nginx:1.25", "nginx:latest", "postgres:16"])
+        self.assertEqual(self.refs("label:team=data"), ["postgres:16"])
+
+    def testSizeAndIdFilters(self):
+        # Test: size comparisons and ID prefixes filter results
+        self.assertEqual(sorted(self.refs("size>200MB")), ["postgres:16"])
+        self.assertEqual(self.refs("python size<=130MB"), ["python:3.12-slim"])
+        self.assertEqual(self.refs("id:3333"), ["registry.local:5000/team/api-server:2.1"])
+
+    def testIndexReusedUntilInventoryChanges(self):
+        # Test: index_for rebuilds only after the inventory's images change
+        source = MagicMock()
+        source.list_images.return_value = IMAGES
+        source.list_containers.return_value = []
+        inventory = docker_inventory.Inventory(source)
+        inventory.load()
+        first = image_search.index_for(inventory)
+        self.assertIs(image_search.index_for(inventory), first)
+        inventory.upsert_image(ImageRecord("sha256:6666ffff", ["redis:7"]))
+        second = image_search.index_for(inventory)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.search("redis")[0].repo, "redis")
+
+    def testSearchLocalImagesUsesIndex(self):
+        # Test: search_local_images prints ranked results from the index
+        with patch('builtins.input', return_value="repo:postgres"):
+            with patch.object(docker_manager, '_local_images', return_value=IMAGES):
+                with patch.object(docker_manager, 'check_docker_running', return_value=True):
+                    with patch('builtins.print') as mock_print:
+                        docker_manager.search_local_images()
+        printed = " ".join(str(c.args[0]) for c in mock_print.call_args_list)
+        self.assertIn("postgres", printed)
+        self.assertNotIn("nginx", printed)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
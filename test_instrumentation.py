@@ -0,0 +1,143 @@
+# Unit Tests for operation/call instrumentation and its Prometheus/JSON export
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+import docker_engine
+import docker_manager
+import instrumentation
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class TestInstrumentation(unittest.TestCase):
+    # Tests for histograms, per-operation call breakdown, exports, the subprocess hook and slow-op profiles
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        env = patch.dict(os.environ, {"CMS_DATA_DIR": self.tmpdir, "CMS_DOCKER_BACKEND": "cli"})
+        env.start()
+        self.addCleanup(env.stop)
+        self.clock = FakeClock()
+        self.metrics = instrumentation.Metrics(clock=self.clock)
+
+    def testHistogramQuantiles(self):
+        # Test: observations land in fixed buckets; quantiles are interpolated and capped at the max
+        h = instrumentation.Histogram()
+        for ms in (2, 3, 4, 40, 45, 300):
+            h.observe(ms / 1000, error=ms == 300)
+        self.assertEqual(sum(h.counts), 6)
+        self.assertEqual((h.count, h.errors, h.max), (6, 1, 0.3))
+        self.assertEqual(h.counts[instrumentation.BUCKETS.index(0.05)], 2)
+        self.assertTrue(0.0025 <= h.quantile(0.5) <= 0.005)
+        self.assertEqual(h.quantile(1.0), 0.3)
+        self.assertIsNone(instrumentation.Histogram().quantile(0.5))
+
+    def testOperationsChargeTheirCalls(self):
+        # Test: calls made inside an operation are attributed to it; exceptions and fail() count as errors
+        with self.metrics.operation("pull_image"):
+            self.clock.advance(0.01)
+            with self.metrics.call("subprocess", "docker pull") as timer:
+                self.clock.advance(2.0)
+                timer.fail()
+            with self.metrics.call("engine", "GET /images/{name}/json"):
+                self.clock.advance(0.005)
+        with self.assertRaises(RuntimeError):
+            with self.metrics.operation("pull_image"):
+                raise RuntimeError("boom")
+        with self.metrics.call("qmp", "query-status"):
+            self.clock.advance(0.002)
+
+        summary = self.metrics.summary()
+        op = summary["operations"]["pull_image"]
+        self.assertEqual((op["count"], op["errors"], op["max_ms"]), (2, 1, 2015.0))
+        self.assertEqual(op["calls"], {"engine": {"count": 1, "sum_s": 0.005},
+                                       "subprocess": {"count": 1, "sum_s": 2.0}})
+        self.assertEqual(summary["calls"]["subprocess:docker pull"]["errors"], 1)
+        self.assertEqual(summary["calls"]["qmp:query-status"]["count"], 1)
+
+    def testPrometheusAndJsonExport(self):
+        # Test: the text format has cumulative buckets ending in +Inf == count, escaped labels and counters
+        with self.metrics.operation('odd "name"'):
+            with self.metrics.call("subprocess", "docker ps"):
+                self.clock.advance(0.03)
+        text = self.metrics.prometheus()
+        self.assertIn("# TYPE cms_operation_duration_seconds histogram", text)
+        self.assertIn('cms_operation_duration_seconds_bucket{operation="odd \\"name\\"",le="0.025"} 0', text)
+        self.assertIn('cms_operation_duration_seconds_bucket{operation="odd \\"name\\"",le="0.05"} 1', text)
+        self.assertIn('cms_call_duration_seconds_bucket{kind="subprocess",call="docker ps",le="+Inf"} 1', text)
+        self.assertIn('cms_call_errors_total{kind="subprocess",call="docker ps"} 0', text)
+        self.assertIn('cms_operation_call_seconds_total{operation="odd \\"name\\"",kind="subprocess"} 0.03', text)
+        for line in text.splitlines():
+            self.assertTrue(line.startswith("#") or line.startswith("cms_"), line)
+
+        prom, summary = self.metrics.export()
+        self.assertEqual(prom, os.path.join(self.tmpdir, "metrics.prom"))
+        with open(summary) as f:
+            data = json.load(f)
+        self.assertEqual(data["operations"]['odd "name"']["count"], 1)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ["metrics.json", "metrics.prom"])
+
+    def testSubprocessHookAndMenuOperations(self):
+        # Test: install() times real subprocess runs (non-zero exit = error); menu functions are operations
+        instrumentation.metrics.reset()
+        instrumentation.install()
+        self.addCleanup(instrumentation.uninstall)
+        with instrumentation.operation("check"):
+            subprocess.run([sys.executable, "-c", "pass"])
+            subprocess.run([sys.executable, "-c", "raise SystemExit(3)"])
+        calls = instrumentation.metrics.summary()["calls"]
+        name = "subprocess:" + os.path.basename(sys.executable)
+        self.assertEqual((calls[name]["count"], calls[name]["errors"]), (2, 1))
+        self.assertEqual(instrumentation.command_name(["docker", "ps", "-a", "--format", "{{json .}}"]), "docker ps")
+        self.assertEqual(instrumentation.command_name(["qemu-img", "create", "-f", "qcow2"]), "qemu-img create")
+
+        with patch('docker_manager.subprocess.run', return_value=MagicMock(returncode=0, stdout="", stderr="")):
+            with patch.object(docker_manager, 'check_docker_running', return_value=True):
+                with patch('builtins.print'):
+                    docker_manager.list_images()
+        self.assertEqual(instrumentation.metrics.summary()["operations"]["list_images"]["count"], 1)
+        instrumentation.uninstall()
+        self.assertNotEqual(subprocess.run.__module__, "instrumentation")
+
+    def testEngineRoutes(self):
+        # Test: engine calls are grouped per endpoint, not per container or image
+        self.assertEqual(docker_engine.api_route("/containers/3f2a9c/start"), "/containers/{id}/start")
+        self.assertEqual(docker_engine.api_route("/containers/json"), "/containers/json")
+        self.assertEqual(docker_engine.api_route("/images/library/nginx:1.25/json"), "/images/{name}/json")
+        self.assertEqual(docker_engine.api_route("/images/json"), "/images/json")
+
+    def testSlowOperationProfiles(self):
+        # Test: with CMS_PROFILE_SLOW_MS set, only operations over the threshold leave a cProfile dump
+        metrics = instrumentation.Metrics()
+        with patch.dict(os.environ, {"CMS_PROFILE_SLOW_MS": "50"}):
+            with metrics.operation("fast"):
+                pass
+            with metrics.operation("slow"):
+                with metrics.operation("nested"):
+                    time.sleep(0.06)
+        profiles = os.listdir(os.path.join(self.tmpdir, "profiles"))
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].startswith("slow-"))
+        self.assertFalse(metrics._profiling)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,241 @@
+# Unit Tests for background jobs (jobs.py): limits per kind, cancelling, the journal, resuming and the CLI
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from unittest.mock import patch
+
+import cli
+import jobs
+
+
+class Work:
+    # Fake job work: logs `steps` lines, pausing between them, and records how many run at once per kind
+    def __init__(self, steps=5, pause=0.02):
+        self.steps = steps
+        self.pause = pause
+        self.lock = threading.Lock()
+        self.running = {}
+        self.peak = {}
+
+    def __call__(self, ctx):
+        kind = ctx.job.kind
+        with self.lock:
+            self.running[kind] = self.running.get(kind, 0) + 1
+            self.peak[kind] = max(self.peak.get(kind, 0), self.running[kind])
+        try:
+            for n in range(ctx.params.get("steps", self.steps)):
+                ctx.check()
+                ctx.log(f"step {n}")
+                time.sleep(self.pause)
+            if ctx.params.get("fail"):
+                raise jobs.JobError("it broke")
+            return {"steps": ctx.params.get("steps", self.steps)}
+        finally:
+            with self.lock:
+                self.running[kind] -= 1
+
+    def runners(self):
+        return {"pull": jobs.Runner(self, True, True), "build": jobs.Runner(self, True, True),
+                "vm": jobs.Runner(self, False, False)}
+
+
+def dead_pid():
+    # The PID of a process that has exited
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+class TestJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        env = patch.dict(os.environ, {"CMS_DATA_DIR": self.tmpdir})
+        env.start()
+        self.addCleanup(env.stop)
+        self.work = Work()
+        self.journal = jobs.Journal()
+
+    def queue(self, limits=None):
+        queue = jobs.JobQueue(self.journal, limits or dict(jobs.DEFAULT_LIMITS), self.work.runners(),
+                              poll_interval=0.02).start()
+        self.addCleanup(queue.stop)
+        return queue
+
+    def testLimitsPerKind(self):
+        # Test: each kind runs at most its limit at once, and a busy kind does not hold up the others
+        queue = self.queue({"pull": 2, "build": 1, "vm": 1})
+        submitted = [queue.submit("build", {}) for _ in range(3)] + [queue.submit("pull", {}) for _ in range(4)]
+        states = [queue.wait(job.id, 10).state for job in submitted]
+        self.assertEqual(states, ["succeeded"] * 7)
+        self.assertEqual(self.work.peak, {"build": 1, "pull": 2})
+        pulls_done = max(self.journal.get(j.id).finished_at for j in submitted[3:])
+        self.assertLess(pulls_done, self.journal.get(submitted[2].id).finished_at)
+        self.assertEqual(self.journal.get(submitted[0].id).result, {"steps": 5})
+        with self.assertRaises(jobs.JobError):
+            queue.submit("deploy", {})
+
+    def testCancelQueuedAndRunning(self):
+        # Test: a queued job is cancelled before it starts, a running one at its next check; running VM jobs refuse
+        queue = self.queue({"pull": 1, "build": 1, "vm": 1})
+        running = queue.submit("build", {"steps": 200})
+        waiting = queue.submit("build", {})
+        while self.journal.get(running.id).state != "running":
+            time.sleep(0.01)
+        queue.cancel(waiting.id)
+        queue.cancel(running.id)
+        self.assertEqual(queue.wait(waiting.id, 5).error, "cancelled before it started")
+        self.assertEqual(queue.wait(running.id, 5).state, "cancelled")
+        self.assertLess(len(self.journal.log(running.id)), 200)
+
+        vm = queue.submit("vm", {"steps": 20})
+        while self.journal.get(vm.id).state != "running":
+            time.sleep(0.01)
+        with self.assertRaises(jobs.JobError):
+            queue.cancel(vm.id)
+        self.assertEqual(queue.wait(vm.id, 5).state, "succeeded")
+        with self.assertRaises(jobs.JobError):
+            jobs.cancel(vm.id, self.journal)  # already finished
+
+    def testOtherProcessesSeeAndCancelJobs(self):
+        # Test: another reader follows a job's output through the journal, and its cancel reaches the owner
+        queue = self.queue()
+        job = queue.submit("pull", {"steps": 300})
+        reader = jobs.Journal(self.journal.path)
+        lines = []
+        for _, _, line in jobs.follow(job.id, reader, interval=0.01):
+            lines.append(line)
+            if len(lines) == 3:
+                self.assertTrue(jobs.cancel(job.id, reader).cancel_requested)
+        self.assertEqual(lines[:3], ["step 0", "step 1", "step 2"])
+        finished = jobs.wait(job.id, 5, reader, interval=0.01)
+        self.assertEqual(finished.state, "cancelled")
+        self.assertEqual(len(lines), len(reader.log(job.id)))
+
+    def testCancelReachesABusyQueue(self):
+        # Test: with every job thread busy, the queue still picks up a cancel written by another process
+        queue = self.queue({"pull": 2, "build": 1, "vm": 1})
+        busy = [queue.submit(kind, {"steps": 300}) for kind in ("pull", "pull", "build")]
+        vm = queue.submit("vm", {"steps": 30})
+        while any(self.journal.get(job.id).state != "running" for job in busy + [vm]):
+            time.sleep(0.01)
+        reader = jobs.Journal(self.journal.path)
+        for job in busy:
+            jobs.cancel(job.id, reader)
+        self.assertEqual([queue.wait(job.id, 5).state for job in busy], ["cancelled"] * 3)
+        self.assertEqual(self.journal.get(vm.id).state, "running")
+        self.assertEqual(queue.wait(vm.id, 5).state, "succeeded")
+
+    def testResumeAfterOwnerDied(self):
+        # Test: a new queue adopts a dead process's jobs: queued and interrupted pulls/builds run again;
+        # a half-done VM job, a job out of attempts and a cancelled one are closed instead
+        gone = dead_pid()
+        queued = self.journal.add("pull", {}, gone)
+        building = self.journal.add("build", {}, gone)
+        self.journal.update(building.id, state="running", attempts=1)
+        self.journal.append(building.id, [(1, time.time(), "step 0")])
+        creating = self.journal.add("vm", {}, gone)
+        self.journal.update(creating.id, state="running", attempts=1)
+        tired = self.journal.add("build", {}, gone)
+        self.journal.update(tired.id, state="running", attempts=jobs.MAX_ATTEMPTS)
+        dropped = self.journal.add("pull", {}, gone)
+        self.journal.request_cancel(dropped.id)
+        unowned = jobs.enqueue("pull", {}, self.journal)
+
+        queue = self.queue()
+        self.assertEqual(queue.wait(queued.id, 5).state, "succeeded")
+        self.assertEqual(queue.wait(unowned.id, 5).state, "succeeded")
+        resumed = queue.wait(building.id, 5)
+        self.assertEqual((resumed.state, resumed.attempts, resumed.owner), ("succeeded", 2, os.getpid()))
+        self.assertEqual([line for _, _, line in self.journal.log(building.id)][:3],
+                         ["step 0", "-- resumed after an interruption --", "step 0"])
+        self.assertEqual(self.journal.get(creating.id).state, "failed")
+        self.assertIn("check the VMs", self.journal.get(creating.id).error)
+        self.assertEqual(self.journal.get(tired.id).state, "failed")
+        self.assertEqual(self.journal.get(dropped.id).state, "cancelled")
+
+    def testStopLeavesJobsForTheNextQueue(self):
+        # Test: stopping without waiting interrupts running work and releases queued jobs; the next queue finishes both
+        first = jobs.JobQueue(self.journal, {"pull": 1, "build": 1, "vm": 1}, self.work.runners(),
+                              poll_interval=0.02).start()
+        running = first.submit("build", {"steps": 200})
+        waiting = first.submit("build", {})
+        while self.journal.get(running.id).state != "running":
+            time.sleep(0.01)
+        first.stop()
+        self.assertEqual((self.journal.get(running.id).state, self.journal.get(running.id).owner), ("interrupted", None))
+        self.assertEqual((self.journal.get(waiting.id).state, self.journal.get(waiting.id).owner), ("queued", None))
+        self.assertEqual(jobs.wait(running.id, 0, self.journal).state, "interrupted")
+
+        self.work.pause = 0
+        second = self.queue()
+        self.assertEqual(second.wait(waiting.id, 5).state, "succeeded")
+        self.assertEqual(second.wait(running.id, 5).attempts, 2)
+
+    def testFailuresAndLimitsFromEnv(self):
+        # Test: an exception fails the job with its message; CMS_JOB_LIMITS overrides the defaults
+        queue = self.queue()
+        job = queue.wait(queue.submit("pull", {"fail": True}).id, 5)
+        self.assertEqual((job.state, job.error), ("failed", "it broke"))
+        self.assertEqual(jobs.limits_from_env("pull=6, vm=1"), {"pull": 6, "build": 1, "vm": 1})
+        for bad in ("pull=0", "gpu=2", "pull"):
+            with self.assertRaises(jobs.JobError):
+                jobs.limits_from_env(bad)
+
+
+class TestJobsCli(unittest.TestCase):
+    # `--background` and the `jobs` subcommands against a queue running fake work in this process
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        env = patch.dict(os.environ, {"CMS_DATA_DIR": self.tmpdir, "CMS_DOCKER_BACKEND": "cli"})
+        env.start()
+        self.addCleanup(env.stop)
+        runners = patch.dict(jobs.RUNNERS, Work(steps=3, pause=0.01).runners())
+        runners.start()
+        self.addCleanup(runners.stop)
+        jobs.start_shared()
+        self.addCleanup(jobs.stop_shared, True)
+
+    def run_cli(self, argv):
+        out, err = io.StringIO(), io.StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            status = cli.main(argv)
+        return status, out.getvalue()
+
+    def testBackgroundAndJobCommands(self):
+        # Test: --background returns the queued job; jobs wait/list/tail/show report on it
+        dockerfile = os.path.join(self.tmpdir, "Dockerfile")
+        with open(dockerfile, "w") as f:
+            f.write("FROM scratch\n")
+        status, out = self.run_cli(["build", "app:1", "-f", dockerfile, "--context", self.tmpdir, "--background"])
+        self.assertEqual(status, 0)
+        self.assertTrue(out.startswith("Job 1 queued: build app:1"))
+        status, out = self.run_cli(["pull", "nginx", "--background", "--json"])
+        self.assertEqual((status, json.loads(out)["params"]["refs"]), (0, ["nginx"]))
+
+        self.assertEqual(self.run_cli(["jobs", "wait", "1", "--json"])[0], 0)
+        self.assertEqual(self.run_cli(["jobs", "wait", "2", "--timeout", "5"])[0], 0)
+        status, out = self.run_cli(["jobs", "list", "--json"])
+        self.assertEqual([(j["id"], j["state"]) for j in json.loads(out)], [(2, "succeeded"), (1, "succeeded")])
+        self.assertEqual(self.run_cli(["jobs", "tail", "1", "-n", "2"])[1].splitlines(), ["step 1", "step 2"])
+        self.assertIn("state: succeeded", self.run_cli(["jobs", "show", "2"])[1])
+
+        status, out = self.run_cli(["jobs", "cancel", "2", "--json"])
+        self.assertEqual((status, json.loads(out)), (1, {"error": "job 2 has already succeeded"}))
+        self.assertEqual(self.run_cli(["jobs", "show", "9"])[0], 1)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,94 @@
+# Unit Tests for typed listings: sorting, paging, columns and streamed JSON sources
+
+import io
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+import docker_engine
+import docker_inventory
+import listing
+from docker_inventory import ContainerRecord, ImageRecord
+from vm_registry import VmRecord
+
+
+def containers(count):
+    # Records created one by one, so a test can see how far the listing has read
+    for n in range(count):
+        yield ContainerRecord(f"{n:064x}", f"c{n:05d}", "nginx", created=1000 + (n * 7919) % count,
+                              state="running" if n % 2 else "exited")
+
+
+class TestListing(unittest.TestCase):
+    # select() over plain iterators; the sources are checked separately below
+
+    def testSortedPageMatchesFullSort(self):
+        # Test: a heap-picked page equals the same slice of a full sort, in both directions
+        everything = list(containers(500))
+        for reverse in (False, True):
+            page = listing.select(containers(500), "containers", sort="created", reverse=reverse, offset=10, limit=5)
+            expected = sorted(everything, key=lambda c: c.created, reverse=reverse)[10:15]
+            self.assertEqual([c.name for c in page], [c.name for c in expected])
+            self.assertEqual((page.total, page.offset), (500, 10))
+
+    def testFilterCountsAndUnsortedPage(self):
+        # Test: `where` filters before counting; an unsorted page keeps source order
+        page = listing.select(containers(100), "containers", where=lambda c: c.state == "running", limit=3)
+        self.assertEqual([c.name for c in page], ["c00001", "c00003", "c00005"])
+        self.assertEqual(page.total, 50)
+        self.assertEqual(page.footer(), "Showing 1-3 of 50")
+        self.assertIsNone(listing.select(containers(2), "containers").footer())
+
+    def testMissingValuesSortLast(self):
+        # Test: records without a value sort after the others whichever the direction
+        vms = [VmRecord("a", "/a", 1024, 1, base="b2"), VmRecord("b", "/b", 1024, 1),
+               VmRecord("c", "/c", 1024, 1, base="b1")]
+        self.assertEqual([v.name for v in listing.select(vms, "vms", sort="base")], ["c", "a", "b"])
+        self.assertEqual([v.name for v in listing.select(vms, "vms", sort="base", reverse=True)], ["a", "c", "b"])
+
+    def testColumnsForTablesAndJson(self):
+        # Test: tables show the chosen columns' text; JSON carries raw values; unknown columns are rejected
+        image = ImageRecord("sha256:" + "ab" * 32, ["nginx:1.25", "nginx:latest"], size=142000000)
+        page = listing.select([image], "images", columns="tag,size,id")
+        self.assertEqual(page.lines()[1].split(), ["1.25", "(+1)", "142MB", "abababababab"])
+        self.assertEqual(page.as_dict(), [{"tag": "1.25", "size": 142000000, "id": image.id}])
+        self.assertEqual(set(listing.select([image], "images").as_dict()[0]),
+                         {c.name for c in listing.COLUMNS["images"]})
+        with self.assertRaises(ValueError):
+            listing.select([image], "images", sort="name")
+
+
+class TestStreamedSources(unittest.TestCase):
+    # The engine's JSON arrays and the CLI's JSON lines are decoded as they arrive
+
+    def testJsonArrayAcrossChunks(self):
+        # Test: objects split across chunks (and a multi-byte character split in two) decode once complete
+        data = json.dumps([{"Id": "a", "Names": ["/wéb"]}, {"Id": "b", "Labels": {"k": "[,]"}}]).encode() + b"\n"
+        for size in (1, 3, 7, len(data)):
+            chunks = [data[i:i + size] for i in range(0, len(data), size)]
+            self.assertEqual([item["Id"] for item in docker_engine.iter_json_array(chunks)], ["a", "b"])
+        self.assertEqual(list(docker_engine.iter_json_array([b"[]"])), [])
+        with self.assertRaises(ValueError):
+            list(docker_engine.iter_json_array([b'[{"Id": "a"}, {"Id"']))
+
+    def testCliRowsAreStreamed(self):
+        # Test: `docker ps` rows become records one line at a time, and a failed command raises
+        proc = MagicMock()
+        proc.stdout = io.StringIO('{"ID": "c1", "Names": "web", "State": "running"}\n\n{"ID": "c2", "Names": "db"}\n')
+        proc.stderr = io.StringIO("")
+        proc.wait.return_value = proc.poll.return_value = 0
+        with patch('docker_inventory.subprocess.Popen', return_value=proc):
+            rows = docker_inventory.CliSource().iter_containers()
+            self.assertEqual(next(rows).name, "web")
+            self.assertEqual(proc.stdout.tell(), proc.stdout.getvalue().index("\n") + 1)
+            self.assertEqual([c.name for c in rows], ["db"])
+
+        proc.stdout, proc.stderr = io.StringIO(""), io.StringIO("Cannot connect to the Docker daemon\n")
+        proc.wait.return_value = 1
+        with patch('docker_inventory.subprocess.Popen', return_value=proc):
+            with self.assertRaises(docker_engine.EngineUnavailable):
+                list(docker_inventory.CliSource().iter_images())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
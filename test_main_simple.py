@@ -3,6 +3,8 @@ Simple Integration Tests for Main Menu
 Tests basic functionality of menu and workflows
 """
 
+import shutil
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 import docker_manager
@@ -12,12 +14,21 @@ import vm_manager
 class TestMainMenuBasic(unittest.TestCase):
     """Simple tests for menu workflows"""
 
+    def setUp(self):
+        """Pin the CLI backend so these tests never reach a real engine socket,
+        and keep VM runtime files out of the real data directory"""
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir, True)
+        env = patch.dict('os.environ', {'CMS_DOCKER_BACKEND': 'cli', 'CMS_DATA_DIR': data_dir})
+        env.start()
+        self.addCleanup(env.stop)
+
     def testDockerListImages(self):
         """Test: Docker list images option works"""
-        with patch('docker_manager.subprocess.run') as mock_run:
+        with patch('docker_inventory.CliSource._json_lines', return_value=iter([])) as mock_rows:
             with patch.object(docker_manager, 'check_docker_running', return_value=True):
                 docker_manager.list_images()
-                mock_run.assert_called_once()
+                mock_rows.assert_called_once()
 
     def testDockerSearchDockerhub(self):
         """Test: Docker search DockerHub option works"""
@@ -46,17 +57,17 @@ class TestMainMenuBasic(unittest.TestCase):
 
     def testDockerListRunningContainers(self):
         """Test: Docker list running containers option works"""
-        with patch('docker_manager.subprocess.run') as mock_run:
+        with patch('docker_inventory.CliSource._json_lines', return_value=iter([])) as mock_rows:
             with patch.object(docker_manager, 'check_docker_running', return_value=True):
                 docker_manager.list_running_containers()
-                mock_run.assert_called_once()
+                mock_rows.assert_called_once()
 
     def testDockerListAllContainers(self):
         """Test: Docker list all containers option works"""
-        with patch('docker_manager.subprocess.run') as mock_run:
+        with patch('docker_inventory.CliSource._json_lines', return_value=iter([])) as mock_rows:
             with patch.object(docker_manager, 'check_docker_running', return_value=True):
                 docker_manager.list_all_containers()
-                mock_run.assert_called_once()
+                mock_rows.assert_called_once()
 
     def testDockerCreateDockerfile(self):
         """Test: Docker create Dockerfile option works"""
@@ -70,11 +81,12 @@ class TestMainMenuBasic(unittest.TestCase):
         """Test: Docker build image option works"""
         with patch('builtins.input', side_effect=["Dockerfile", "app:1.0"]):
             with patch('os.path.exists', return_value=True):
-                with patch('docker_manager.subprocess.run') as mock_run:
+                with patch('docker_manager.subprocess.Popen') as mock_popen:
                     with patch.object(docker_manager, 'check_docker_running', return_value=True):
-                        mock_run.return_value = MagicMock(returncode=0, stdout="Built", stderr="")
+                        mock_popen.return_value = MagicMock(stdout=iter(["Built\n"]))
+                        mock_popen.return_value.wait.return_value = 0
                         docker_manager.build_image()
-                        self.assertTrue(mock_run.called)
+                        self.assertTrue(mock_popen.called)
 
     def testDockerStopContainer(self):
         """Test: Docker stop container option works"""
@@ -88,41 +100,51 @@ class TestMainMenuBasic(unittest.TestCase):
     def testDockerStartContainer(self):
         """Test: Docker start container option works"""
         with patch('builtins.input', return_value="container123"):
-            with patch('docker_manager.subprocess.run') as mock_run:
+            with patch('docker_manager.subprocess.run') as mock_run, \
+                    patch('docker_inventory.CliSource._json_lines', return_value=iter([{"ID": "container123"}])):
                 with patch.object(docker_manager, 'check_docker_running', return_value=True):
-                    mock_run.side_effect = [
-                        MagicMock(returncode=0, stdout="container123\t", stderr=""),
-                        MagicMock(returncode=0, stdout="Started", stderr="")
-                    ]
+                    mock_run.return_value = MagicMock(returncode=0, stdout="Started", stderr="")
                     docker_manager.start_container()
                     self.assertTrue(mock_run.called)
 
     def testDockerSearchLocalImages(self):
         """Test: Docker search local images option works"""
         with patch('builtins.input', return_value="nginx"):
-            with patch('docker_manager.subprocess.run') as mock_run:
+            with patch('docker_inventory.CliSource._json_lines', return_value=iter([])) as mock_rows:
                 with patch.object(docker_manager, 'check_docker_running', return_value=True):
-                    mock_run.return_value = MagicMock(returncode=0, stdout="nginx:latest\timg123\t250MB", stderr="")
                     docker_manager.search_local_images()
-                    self.assertTrue(mock_run.called)
+                    self.assertTrue(mock_rows.called)
 
     def testVmCreateInteractive(self):
         """Test: VM create interactive option works"""
         with patch('builtins.input', side_effect=["ubuntu-vm", "2048", "2", "20G"]):
             with patch('os.path.exists', return_value=False):
-                with patch('subprocess.run') as mock_run:
+                with patch('subprocess.run', return_value=MagicMock(returncode=0)) as mock_run:
                     vm_manager.create_vm()
                     self.assertEqual(mock_run.call_count, 2)
 
+    def testVmCreateDiskFailureRollsBack(self):
+        """Test: a failed or missing qemu-img leaves no VM registered and starts nothing"""
+        import vm_registry
+        for outcome in (MagicMock(returncode=1), FileNotFoundError()):
+            with patch('builtins.input', side_effect=["ubuntu-vm", "2048", "2", "20G"]):
+                with patch('os.path.exists', return_value=False):
+                    with patch('subprocess.run', side_effect=[outcome]) as mock_run:
+                        with patch('vm_runtime.launch') as launch:
+                            vm_manager.create_vm()
+            self.assertEqual(mock_run.call_count, 1)
+            launch.assert_not_called()
+            self.assertIsNone(vm_registry.VmRegistry().get("ubuntu-vm"))
+
     def testVmCreateFromConfig(self):
         """Test: VM create from config option works"""
         import json
         config = {"name": "testvm", "ram": "2048", "cpu": "2", "disk": "20G"}
         with patch('builtins.input', return_value="./config.json"):
-            with patch('os.path.exists', side_effect=[True, False]):  # file exists, disk doesn't
+            with patch('os.path.exists', side_effect=lambda path: path.endswith('.json')):  # config exists, disk doesn't
                 with patch('builtins.open', create=True) as mock_file:
                     mock_file.return_value.__enter__.return_value.read.return_value = json.dumps(config)
-                    with patch('subprocess.run') as mock_run:
+                    with patch('subprocess.run', return_value=MagicMock(returncode=0)) as mock_run:
                         vm_manager.create_vm_from_config()
                         self.assertEqual(mock_run.call_count, 2)
 
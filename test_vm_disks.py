@@ -0,0 +1,142 @@
+# Unit Tests for VM disk usage and compaction
+# Disks are qcow2 headers followed by data; `qemu-img convert` is faked by copying the header only
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+import vm_disks
+import vm_images
+import vm_manager
+import vm_registry
+from test_vm_images import write_qcow2
+
+
+def write_disk(path, data_size=0, size=10 * 2**30, backing=None):
+    write_qcow2(path, size=size, backing=backing)
+    with open(path, "ab") as f:
+        f.write(os.urandom(data_size))
+    # age the file so its mtime is trusted by the cache
+    old = time.time() - 60
+    os.utime(path, (old, old))
+
+
+def fake_convert(cmd, *args, **kwargs):
+    # the rewritten disk keeps the header (and backing file) and drops the "unused" data
+    if cmd[1] == "info":
+        return MagicMock(returncode=0, stdout='{"format": "qcow2"}', stderr="")
+    src, dst = cmd[-2], cmd[-1]
+    backing = cmd[cmd.index("-B") + 1] if "-B" in cmd else None
+    write_qcow2(dst, size=vm_images.read_header(src)["virtual_size"], backing=backing)
+    return MagicMock(returncode=0, stdout="", stderr="")
+
+
+class TestVmDisks(unittest.TestCase):
+    # Tests for the mtime-keyed usage cache, the usage report and offline compaction
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        self.addCleanup(os.chdir, cwd)
+        env = patch.dict(os.environ, {"CMS_DATA_DIR": os.path.join(self.tmpdir, "data")})
+        env.start()
+        self.addCleanup(env.stop)
+        self.registry = vm_registry.VmRegistry()
+        write_disk("base.qcow2", 200_000)
+        vm_images.BaseCatalog().add("ubuntu", "base.qcow2")
+        for name in ("web1", "web2"):
+            write_disk(f"{name}.qcow2", 100_000, backing=os.path.abspath("base.qcow2"))
+            self.registry.add(vm_registry.VmRecord(name, f"{name}.qcow2", 512, 1, base="ubuntu"))
+        write_disk("db.qcow2", 300_000, size=20 * 2**30)
+        self.registry.add(vm_registry.VmRecord("db", "db.qcow2", 1024, 2))
+
+    def testUsageIsCachedByMtime(self):
+        # Test: a second listing reads no headers; only a modified disk is read again
+        cache = vm_disks.DiskUsageCache()
+        usage = cache.usage(["web1.qcow2", "db.qcow2", "missing.qcow2"])
+        self.assertEqual(sorted(os.path.basename(p) for p in usage), ["db.qcow2", "web1.qcow2"])
+        db = usage[os.path.abspath("db.qcow2")]
+        self.assertEqual((db.format, db.virtual_size, db.backing), ("qcow2", 20 * 2**30, None))
+        self.assertGreaterEqual(db.allocated, 300_000)
+
+        with patch('vm_images.read_header', wraps=vm_images.read_header) as read_header:
+            cache = vm_disks.DiskUsageCache()
+            again = cache.usage(["web1.qcow2", "db.qcow2"])
+            self.assertEqual(read_header.call_count, 0)
+            self.assertEqual((cache.computed, cache.reused), (0, 2))
+            self.assertEqual(again[os.path.abspath("web1.qcow2")].backing, os.path.abspath("base.qcow2"))
+
+            write_disk("db.qcow2", 1000, size=30 * 2**30)
+            changed = cache.usage(["web1.qcow2", "db.qcow2"])
+            self.assertEqual((cache.computed, cache.reused), (1, 1))
+            self.assertEqual(changed[os.path.abspath("db.qcow2")].virtual_size, 30 * 2**30)
+
+    def testReportChains(self):
+        # Test: every VM gets its backing chain; a shared base is read once
+        rows = {record.name: chain for record, chain in vm_disks.report(self.registry)}
+        self.assertEqual([os.path.basename(u.path) for u in rows["web1"]], ["web1.qcow2", "base.qcow2"])
+        self.assertEqual(len(rows["db"]), 1)
+        os.remove("web2.qcow2")
+        self.assertIsNone(dict((r.name, c) for r, c in vm_disks.report(self.registry))["web2"])
+
+        with patch('builtins.input', return_value=""):
+            with patch('builtins.print') as mock_print:
+                vm_manager.disk_usage()
+        output = [str(c.args[0]) for c in mock_print.call_args_list]
+        self.assertTrue(any(line.startswith("db ") and "21.5 GB" in line for line in output))
+        self.assertTrue(any("web2" in line and "disk missing" in line for line in output))
+        self.assertIn("Total allocated", output[-1])
+
+    def testCompact(self):
+        # Test: compaction rewrites the disk in place (keeping its backing file) and reports the space reclaimed
+        with patch('subprocess.run', side_effect=fake_convert) as run:
+            before, after = vm_disks.compact("web1", compress=True)
+        cmd = run.call_args.args[0]
+        self.assertEqual(cmd[:2], ["qemu-img", "convert"])
+        self.assertIn("-c", cmd)
+        self.assertEqual(cmd[cmd.index("-B") + 1], os.path.abspath("base.qcow2"))
+        self.assertLess(after, before)
+        self.assertEqual(vm_images.backing_file("web1.qcow2"), os.path.abspath("base.qcow2"))
+        self.assertFalse(os.path.exists("web1.qcow2" + vm_disks.TMP_SUFFIX))
+
+        with patch('builtins.input', side_effect=["db, nope", "n"]):
+            with patch('subprocess.run', side_effect=fake_convert):
+                with patch('builtins.print') as mock_print:
+                    vm_manager.disk_usage()
+        output = str(mock_print.call_args_list)
+        self.assertIn("db: ", output)
+        self.assertIn("nope: VM 'nope' is not in the VM registry", output)
+        self.assertIn("Space reclaimed:", str(mock_print.call_args_list[-1]))
+
+    def testCompactRefusals(self):
+        # Test: running VMs, base images and failed conversions leave the disk untouched
+        with patch('vm_runtime.state', return_value=MagicMock(running=True)):
+            with self.assertRaises(vm_disks.DiskError):
+                vm_disks.compact("web1")
+        self.registry.add(vm_registry.VmRecord("golden", "base.qcow2", 512, 1))
+        with self.assertRaises(vm_disks.DiskError):
+            vm_disks.compact("golden")
+
+        original = open("db.qcow2", "rb").read()
+
+        def failing(cmd, *args, **kwargs):
+            if cmd[1] == "info":
+                return fake_convert(cmd)
+            open(cmd[-1], "wb").write(b"partial")
+            return MagicMock(returncode=1, stderr="qemu-img: No space left on device")
+
+        with patch('subprocess.run', side_effect=failing):
+            with self.assertRaises(vm_disks.DiskError) as ctx:
+                vm_disks.compact("db")
+        self.assertIn("No space left", str(ctx.exception))
+        self.assertEqual(open("db.qcow2", "rb").read(), original)
+        self.assertFalse(os.path.exists("db.qcow2" + vm_disks.TMP_SUFFIX))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
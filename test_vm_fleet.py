@@ -0,0 +1,166 @@
+# Unit Tests for parallel fleet provisioning
+# qemu-img writes empty disk files and vm_runtime.launch is faked, so no VM really starts
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+import vm_fleet
+import vm_manager
+import vm_registry
+import vm_runtime
+
+
+class FakeQemu:
+    # Records how many qemu-img calls overlap; names in `fail` make qemu-img fail
+
+    def __init__(self, fail=(), delay=0.05):
+        self.fail = set(fail)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.active = self.peak = 0
+        self.launched = []
+        self.stopped = []
+
+    def run(self, cmd, *args, **kwargs):
+        disk = cmd[4]
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if os.path.splitext(os.path.basename(disk))[0] in self.fail:
+            return MagicMock(returncode=1, stderr="qemu-img: Could not create file\n")
+        open(disk, "wb").close()
+        return MagicMock(returncode=0, stderr="")
+
+    def launch(self, name, ram, cpu, disk_file, kvm=None):
+        with self.lock:
+            self.launched.append(name)
+        return vm_runtime.VmState(name, 1000 + len(self.launched), True, time.time(), "tcg")
+
+    def stop(self, name, *args, **kwargs):
+        self.stopped.append(name)
+        return True
+
+
+class TestVmFleet(unittest.TestCase):
+    # Tests for manifest loading, validation, concurrency limits and rollback
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        self.addCleanup(os.chdir, cwd)
+        env = patch.dict(os.environ, {"CMS_DATA_DIR": os.path.join(self.tmpdir, "data")})
+        env.start()
+        self.addCleanup(env.stop)
+        self.registry = vm_registry.VmRegistry()
+
+    def write(self, path, data):
+        with open(path, "w") as f:
+            json.dump(data, f)
+        return path
+
+    def provision(self, specs, qemu, **kwargs):
+        with patch('subprocess.run', side_effect=qemu.run):
+            with patch('vm_runtime.launch', side_effect=qemu.launch):
+                with patch('vm_runtime.stop', side_effect=qemu.stop):
+                    return vm_fleet.provision(specs, kvm=False, **kwargs)
+
+    def testExpand(self):
+        # Test: numeric ranges (with padding), lists and several braces combine like the shell
+        self.assertEqual(vm_fleet.expand("web-{1..3}"), ["web-1", "web-2", "web-3"])
+        self.assertEqual(vm_fleet.expand("n{08..10}"), ["n08", "n09", "n10"])
+        self.assertEqual(vm_fleet.expand("{a,b}-{1..2}"), ["a-1", "a-2", "b-1", "b-2"])
+        self.assertEqual(vm_fleet.expand("plain{}"), ["plain{}"])
+
+    def testLoadManifestAndDirectory(self):
+        # Test: a manifest merges defaults into templated entries; a directory reads every config
+        manifest = self.write("fleet.json", {"defaults": {"ram": "1024", "cpu": 1, "disk": "10G"},
+                                             "vms": [{"name": "web-{1..3}"}, {"name": "db", "ram": "4G"}]})
+        specs = vm_fleet.load(manifest)
+        self.assertEqual([(s.name, s.ram, s.cpu) for s in specs],
+                         [("web-1", "1024", "1"), ("web-2", "1024", "1"), ("web-3", "1024", "1"), ("db", "4G", "1")])
+
+        os.mkdir("configs")
+        self.write("configs/a.json", {"name": "a", "ram": "512", "cpu": "1", "disk": "5G"})
+        self.write("configs/b.json", [{"name": "b-{1..2}", "ram": "512", "cpu": "1", "disk": "5G"}])
+        self.assertEqual([s.name for s in vm_fleet.load("configs")], ["a", "b-1", "b-2"])
+
+    def testValidationRejectsWholeFleet(self):
+        # Test: every problem is reported and nothing is created when any entry is invalid
+        self.registry.add(vm_registry.VmRecord("taken", "taken.qcow2", 512, 1))
+        specs = vm_fleet.load(self.write("fleet.json", [
+            {"name": "ok-{1..2}", "ram": "512", "cpu": "1", "disk": "5G"},
+            {"name": "ok-2", "ram": "512", "cpu": "1", "disk": "5G"},
+            {"name": "taken", "ram": "512", "cpu": "1", "disk": "5G"},
+            {"name": "bad", "ram": "lots", "cpu": "1", "base": "nope"},
+            {"name": "nodisk", "ram": "512", "cpu": "1"},
+        ]))
+        qemu = FakeQemu()
+        with self.assertRaises(vm_fleet.FleetError) as ctx:
+            self.provision(specs, qemu)
+        message = str(ctx.exception)
+        for expected in ("duplicate name", "already registered", "invalid RAM size", "unknown base image 'nope'",
+                         "missing required fields"):
+            self.assertIn(expected, message)
+        self.assertEqual(qemu.peak, 0)
+        self.assertEqual([r.name for r in self.registry.query()], ["taken"])
+
+    def testParallelProvisioningWithLimit(self):
+        # Test: VMs are created concurrently but never more than `concurrency` at once
+        specs = vm_fleet.load(self.write("fleet.json", {"defaults": {"ram": "512", "cpu": "1", "disk": "5G"},
+                                                        "vms": [{"name": "web-{1..8}"}]}))
+        qemu = FakeQemu()
+        started = time.perf_counter()
+        report = self.provision(specs, qemu, concurrency=3)
+        self.assertLess(time.perf_counter() - started, 8 * qemu.delay)
+        self.assertEqual(qemu.peak, 3)
+        self.assertEqual(len(report.created), 8)
+        self.assertFalse(report.rolled_back)
+        records = self.registry.query(state="running")
+        self.assertEqual(len(records), 8)
+        self.assertTrue(all(r.origin == f"fleet:{os.path.abspath('fleet.json')}" for r in records))
+        self.assertTrue(all(vm["disk_s"] >= qemu.delay for vm in report.as_dict()["vms"]))
+
+    def testFailureRollsBackEverything(self):
+        # Test: one failing disk stops the run and removes every VM, disk and registry entry it created
+        open("other.qcow2", "wb").close()
+        specs = vm_fleet.load(self.write("fleet.json", {"defaults": {"ram": "512", "cpu": "1", "disk": "5G"},
+                                                        "vms": [{"name": "web-{1..6}"}]}))
+        qemu = FakeQemu(fail={"web-3"})
+        report = self.provision(specs, qemu, concurrency=2)
+        statuses = {vm.spec.name: vm.status for vm in report.vms}
+        self.assertEqual(statuses["web-3"], "failed")
+        self.assertIn("Could not create file", report.failed[0].error)
+        self.assertTrue(report.rolled_back)
+        self.assertIn("cancelled", statuses.values())
+        self.assertEqual(sorted(qemu.stopped), sorted(qemu.launched))
+        self.assertEqual([f for f in os.listdir() if f.endswith(".qcow2")], ["other.qcow2"])
+        self.assertEqual(self.registry.query(), [])
+
+    def testMenuProvisionFleet(self):
+        # Test: the menu validates, confirms and prints the per-VM report
+        self.write("fleet.json", {"defaults": {"ram": "512", "cpu": "1", "disk": "5G"}, "vms": [{"name": "w{1..2}"}]})
+        qemu = FakeQemu(delay=0)
+        with patch('builtins.input', side_effect=["fleet.json", "2", "y"]):
+            with patch('vm_runtime.kvm_available', return_value=False):
+                with patch('subprocess.run', side_effect=qemu.run):
+                    with patch('vm_runtime.launch', side_effect=qemu.launch):
+                        with patch('builtins.print') as mock_print:
+                            vm_manager.provision_fleet()
+        printed = "\n".join(" ".join(map(str, c.args)) for c in mock_print.call_args_list)
+        self.assertIn("Fleet: 2 running, 0 failed", printed)
+        self.assertEqual(sorted(qemu.launched), ["w1", "w2"])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,142 @@
+ # Unit Tests for the base-image catalog and linked-clone VMs
+ # Disk images are minimal qcow2 headers in a temporary directory; qemu-img is faked
+
+import os
+import shutil
+import stat
+import struct
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import vm_images
+import vm_manager
+import vm_registry
+
+
+def write_qcow2(path, size=10 * 2**30, backing=None):
+    # Just the header fields read_header looks at
+    header = bytearray(104)
+    header[0:4] = vm_images.QCOW2_MAGIC
+    header[4:8] = struct.pack(">I", 3)
+    if backing:
+        header[8:20] = struct.pack(">QI", len(header), len(backing.encode()))
+    header[24:32] = struct.pack(">Q", size)
+    with open(path, "wb") as f:
+        f.write(bytes(header) + (backing.encode() if backing else b""))
+
+
+def fake_qemu(cmd, *args, **kwargs):
+    # `qemu-img create -b <base> ... <disk>` writes an overlay header; everything else just succeeds
+    if cmd[:2] == ["qemu-img", "create"] and "-b" in cmd:
+        write_qcow2(cmd[8], backing=cmd[cmd.index("-b") + 1])
+    return MagicMock(returncode=0)
+
+
+class TestVmImages(unittest.TestCase):
+    # Tests for header parsing, the catalog and the VM menu integration
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        self.addCleanup(os.chdir, cwd)
+        env = patch.dict(os.environ, {"CMS_DATA_DIR": os.path.join(self.tmpdir, "data")})
+        env.start()
+        self.addCleanup(env.stop)
+        os.makedirs("images")
+        write_qcow2("images/ubuntu.qcow2")
+        self.catalog = vm_images.BaseCatalog()
+
+    def testHeadersAndChains(self):
+        # Test: formats, sizes and relative backing names are resolved from the headers
+        with open("images/plain.img", "wb") as f:
+            f.write(b"\0" * 4096)
+        self.assertEqual(vm_images.read_header("images/plain.img"),
+                         {"format": "raw", "virtual_size": 4096, "backing_file": None})
+        write_qcow2("images/dev.qcow2", backing="ubuntu.qcow2")
+        write_qcow2("web.qcow2", backing=os.path.abspath("images/dev.qcow2"))
+        self.assertEqual(vm_images.backing_chain("web.qcow2"),
+                         [os.path.abspath(p) for p in ("web.qcow2", "images/dev.qcow2", "images/ubuntu.qcow2")])
+        self.assertEqual(vm_images.backing_chain("missing.qcow2"), [os.path.abspath("missing.qcow2")])
+
+    def testAddMakesBaseReadOnly(self):
+        # Test: registered bases are read-only and names/paths are unique
+        base = self.catalog.add("ubuntu", "images/ubuntu.qcow2")
+        self.assertEqual((base.format, base.virtual_size), ("qcow2", 10 * 2**30))
+        self.assertFalse(os.stat(base.path).st_mode & stat.S_IWUSR)
+        with self.assertRaises(vm_images.CatalogError):
+            self.catalog.add("ubuntu", "images/ubuntu.qcow2")
+        with self.assertRaises(vm_images.CatalogError):
+            self.catalog.add("other", "images/ubuntu.qcow2")
+        self.assertEqual([b.name for b in self.catalog.list()], ["ubuntu"])
+
+    def testCreateVmMakesLinkedClone(self):
+        # Test: choosing a base creates an overlay with -b/-F and records it
+        base = self.catalog.add("ubuntu", "images/ubuntu.qcow2")
+        with patch('builtins.input', side_effect=["web1", "1024", "1", "ubuntu", ""]):
+            with patch('subprocess.run', side_effect=fake_qemu) as mock_run:
+                with patch('builtins.print'):
+                    vm_manager.create_vm()
+        create, start = [c.args[0] for c in mock_run.call_args_list]
+        self.assertEqual(create, ["qemu-img", "create", "-f", "qcow2", "-b", base.path, "-F", "qcow2", "web1.qcow2"])
+        self.assertIn(f"file={os.path.abspath('web1.qcow2')},if=virtio,format=qcow2,discard=unmap", start)
+        self.assertEqual(self.catalog.dependents(base.path), [os.path.abspath("web1.qcow2")])
+
+    def testCreateVmFromConfigWithBase(self):
+        # Test: a "base" key in the config replaces the disk size requirement
+        self.catalog.add("ubuntu", "images/ubuntu.qcow2")
+        with open("vm.json", "w") as f:
+            f.write('{"name": "api", "ram": "512", "cpu": "1", "base": "ubuntu"}')
+        with patch('builtins.input', return_value="vm.json"):
+            with patch('subprocess.run', side_effect=fake_qemu):
+                with patch('builtins.print'):
+                    vm_manager.create_vm_from_config()
+        self.assertEqual(vm_images.backing_file("api.qcow2"), os.path.abspath("images/ubuntu.qcow2"))
+
+    def testBaseInUseCannotBeRemoved(self):
+        # Test: removal is refused while an overlay depends on the base, and allowed after the VM is deleted
+        base = self.catalog.add("ubuntu", "images/ubuntu.qcow2")
+        write_qcow2("web1.qcow2", backing=base.path)
+        with self.assertRaises(vm_images.BaseInUse) as ctx:
+            self.catalog.remove("ubuntu", delete_file=True)
+        self.assertEqual(ctx.exception.dependents, [os.path.abspath("web1.qcow2")])
+        self.assertTrue(os.path.exists(base.path))
+
+        with patch('builtins.input', side_effect=["web1", "y"]):
+            with patch('builtins.print') as mock_print:
+                vm_manager.delete_vm()
+        printed = " ".join(" ".join(map(str, c.args)) for c in mock_print.call_args_list)
+        self.assertIn("web1.qcow2 -> base 'ubuntu'", printed)
+        self.catalog.remove("ubuntu", delete_file=True)
+        self.assertFalse(os.path.exists(base.path))
+
+    def testDeleteVmRefusesBackingDisk(self):
+        # Test: a VM disk that another VM is layered on is not deleted
+        write_qcow2("dev.qcow2")
+        write_qcow2("feature.qcow2", backing="dev.qcow2")
+        with patch('builtins.input', side_effect=["dev", "y"]):
+            with patch('builtins.print') as mock_print:
+                vm_manager.delete_vm()
+        self.assertTrue(os.path.exists("dev.qcow2"))
+        self.assertIn("feature.qcow2", str(mock_print.call_args_list[-1]))
+
+    def testListVmsShowsChains(self):
+        # Test: overlays show their chain and backing disks show how many VMs use them
+        self.catalog.add("ubuntu", "images/ubuntu.qcow2")
+        write_qcow2("dev.qcow2", backing=os.path.abspath("images/ubuntu.qcow2"))
+        write_qcow2("feature.qcow2", backing="dev.qcow2")
+        registry = vm_registry.VmRegistry()
+        for disk in ("dev.qcow2", "feature.qcow2"):
+            vm_registry.adopt(registry, disk)
+        with patch('builtins.print') as mock_print:
+            vm_manager.list_vms()
+        lines = {str(c.args[0]).split()[1]: str(c.args[0]) for c in mock_print.call_args_list[1:]}
+        self.assertIn("-> base 'ubuntu'", lines["dev"])
+        self.assertIn("[backing 1 VM(s)]", lines["dev"])
+        self.assertIn("-> dev.qcow2 -> base 'ubuntu'", lines["feature"])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -6,17 +6,27 @@ Tests basic functionality of vm_manager.py
 import unittest
 from unittest.mock import patch, MagicMock
 import json
+import shutil
+import tempfile
 import vm_manager
 
 
 class TestVMManagerBasic(unittest.TestCase):
     """Simple tests for vm_manager functions"""
 
+    def setUp(self):
+        """Keep VM runtime files out of the real data directory"""
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir, True)
+        env = patch.dict('os.environ', {'CMS_DATA_DIR': data_dir})
+        env.start()
+        self.addCleanup(env.stop)
+
     def test_create_vm_with_valid_inputs(self):
         """Test: create_vm accepts all required inputs"""
         with patch('builtins.input', side_effect=["ubuntu-vm", "2048", "2", "20G"]):
             with patch('os.path.exists', return_value=False):
-                with patch('subprocess.run') as mock_run:
+                with patch('subprocess.run', return_value=MagicMock(returncode=0)) as mock_run:
                     vm_manager.create_vm()
                     self.assertEqual(mock_run.call_count, 2)
 
@@ -67,10 +77,10 @@ class TestVMManagerBasic(unittest.TestCase):
         """Test: create_vm_from_config reads and processes config"""
         config = {"name": "testvm", "ram": "2048", "cpu": "2", "disk": "20G"}
         with patch('builtins.input', return_value="./config.json"):
-            with patch('os.path.exists', side_effect=[True, False]):  # file exists, disk doesn't
+            with patch('os.path.exists', side_effect=lambda path: path.endswith('.json')):  # config exists, disk doesn't
                 with patch('builtins.open', create=True) as mock_file:
                     mock_file.return_value.__enter__.return_value.read.return_value = json.dumps(config)
-                    with patch('subprocess.run') as mock_run:
+                    with patch('subprocess.run', return_value=MagicMock(returncode=0)) as mock_run:
                         vm_manager.create_vm_from_config()
                         self.assertEqual(mock_run.call_count, 2)
 
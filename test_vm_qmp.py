@@ -0,0 +1,205 @@
+# Unit Tests for the QMP client and graceful VM control
+# FakeQmpServer speaks the QMP wire protocol on a unix socket from a background event loop
+
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import vm_manager
+import vm_qmp
+import vm_runtime
+
+
+class FakeQmpServer:
+    # A QEMU stand-in: greeting, capabilities negotiation, run state, stats and events
+
+    def __init__(self, path, on_powerdown=None, reply_delay=0.0):
+        self.path = path
+        self.on_powerdown = on_powerdown
+        self.reply_delay = reply_delay
+        self.status = "running"
+        self.commands = []
+        self.connections = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_unix_server(self.handle, path), self.loop).result(5)
+
+    def close(self):
+        async def shutdown():
+            self.server.close()
+            await self.server.wait_closed()
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        self.loop.close()
+
+    def send(self, writer, message):
+        writer.write(json.dumps(message).encode() + b"\r\n")
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self.send(writer, {"QMP": {"version": {"qemu": {"major": 8, "minor": 2, "micro": 0}}, "capabilities": []}})
+        negotiated = False
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            request = json.loads(line)
+            command, request_id = request["execute"], request.get("id")
+            self.commands.append(command)
+            if self.reply_delay:
+                await asyncio.sleep(self.reply_delay)
+            if command == "qmp_capabilities":
+                negotiated = True
+                self.send(writer, {"return": {}, "id": request_id})
+                continue
+            if not negotiated:
+                self.send(writer, {"error": {"class": "CommandNotFound", "desc": "Expecting capabilities negotiation"},
+                                   "id": request_id})
+                continue
+            result = self.run(command, writer, request.get("arguments", {}))
+            if isinstance(result, dict) and "error" in result:
+                self.send(writer, {**result, "id": request_id})
+            else:
+                self.send(writer, {"return": result, "id": request_id})
+            await writer.drain()
+        writer.close()
+
+    def run(self, command, writer, arguments):
+        if command == "query-status":
+            return {"running": self.status == "running", "singlestep": False, "status": self.status}
+        if command == "stop":
+            self.status = "paused"
+            self.send(writer, {"event": "STOP", "timestamp": {"seconds": 0, "microseconds": 0}})
+            return {}
+        if command == "cont":
+            self.status = "running"
+            self.send(writer, {"event": "RESUME", "timestamp": {"seconds": 0, "microseconds": 0}})
+            return {}
+        if command == "system_powerdown":
+            self.send(writer, {"event": "POWERDOWN", "timestamp": {"seconds": 0, "microseconds": 0}})
+            if self.on_powerdown:
+                self.on_powerdown()
+            return {}
+        if command == "query-blockstats":
+            return [{"device": "", "qdev": "/machine/peripheral-anon/device[0]/virtio-backend",
+                     "stats": {"rd_bytes": 5_000_000, "wr_bytes": 1_000_000, "rd_operations": 120,
+                               "wr_operations": 30}}]
+        if command == "query-cpus-fast":
+            return [{"cpu-index": 0, "thread-id": 4242, "target": "x86_64", "qom-path": "/machine/unattached/device[0]"}]
+        return {"error": {"class": "CommandNotFound", "desc": f"The command {command} has not been found"}}
+
+
+class TestVmQmp(unittest.TestCase):
+    # Tests for the client, multi-VM control on one loop and graceful shutdown
+
+    def setUp(self):
+        # short base path: unix socket paths are limited to ~100 bytes
+        self.tmpdir = tempfile.mkdtemp(dir="/tmp", prefix="qmp")
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        env = patch.dict(os.environ, {"CMS_DATA_DIR": self.tmpdir})
+        env.start()
+        self.addCleanup(env.stop)
+        vm_runtime.run_dir(create=True)
+
+    def serve(self, name, **kwargs):
+        server = FakeQmpServer(vm_runtime.qmp_socket(name), **kwargs)
+        self.addCleanup(server.close)
+        return server
+
+    def fake_vm(self, name):
+        # A process whose command line names the VM, registered like vm_runtime.launch would
+        proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)", name])
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.kill)
+        pidfile, statefile, _ = vm_runtime._paths(name)
+        with open(pidfile, "w") as f:
+            f.write(str(proc.pid))
+        with open(statefile, "w") as f:
+            json.dump({"pid": proc.pid, "started_at": time.time(), "accel": "tcg",
+                       "qmp": vm_runtime.qmp_socket(name)}, f)
+        return proc
+
+    def testLaunchCommandHasQmpSocket(self):
+        # Test: every launched VM gets a QMP server socket that does not block startup
+        qmp = vm_runtime.qmp_socket("web1")
+        cmd = vm_runtime.launch_command("web1", 512, 1, "web1.qcow2", ["-accel", "tcg"], "p", "l", qmp=qmp)
+        self.assertEqual(cmd[cmd.index("-qmp") + 1], f"unix:{qmp},server=on,wait=off")
+        with patch.dict(os.environ, {"CMS_DATA_DIR": "/" + "x" * 120}):
+            self.assertIsNone(vm_runtime.qmp_socket("web1"))
+
+    def testClientCommandsAndEvents(self):
+        # Test: capabilities are negotiated, replies are matched by id and events are collected
+        server = self.serve("web1")
+
+        async def session():
+            async with vm_qmp.QmpClient(vm_runtime.qmp_socket("web1")) as qmp:
+                self.assertEqual(qmp.greeting["QMP"]["version"]["qemu"]["major"], 8)
+                await qmp.pause()
+                paused, stats, cpus = await asyncio.gather(qmp.status(), qmp.blockstats(), qmp.cpus())
+                await qmp.resume()
+                with self.assertRaises(vm_qmp.QmpError) as ctx:
+                    await qmp.execute("no-such-command")
+                self.assertEqual(ctx.exception.error_class, "CommandNotFound")
+                return paused, stats, cpus, [e["event"] for e in qmp.events]
+
+        paused, stats, cpus, events = asyncio.run(session())
+        self.assertEqual(paused["status"], "paused")
+        self.assertEqual(vm_qmp.summarize_blockstats(stats),
+                         [("/machine/peripheral-anon/device[0]/virtio-backend", 5_000_000, 1_000_000, 120, 30)])
+        self.assertEqual(cpus[0]["thread-id"], 4242)
+        self.assertEqual(events, ["STOP", "RESUME"])
+        self.assertEqual(server.commands[0], "qmp_capabilities")
+        self.assertEqual(server.status, "running")
+
+    def testManyVmsOnOneLoop(self):
+        # Test: a command to many VMs runs concurrently; unreachable VMs are reported, not raised
+        servers = [self.serve(f"web{i}", reply_delay=0.2) for i in range(1, 6)]
+        started = time.monotonic()
+        results = vm_qmp.control([f"web{i}" for i in range(1, 7)], "pause")
+        self.assertLess(time.monotonic() - started, 1.5)  # 5 x (2 commands x 0.2s) if sequential
+        self.assertEqual([s.status for s in servers], ["paused"] * 5)
+        self.assertEqual(results["web1"], {})
+        self.assertIsInstance(results["web6"], vm_qmp.QmpError)
+        self.assertEqual(vm_qmp.statuses(["web1", "web6"]), {"web1": "paused"})
+
+    def testGracefulShutdown(self):
+        # Test: powerdown lets the guest exit by itself; without QMP the VM is terminated instead
+        proc = self.fake_vm("web1")
+        server = self.serve("web1", on_powerdown=proc.terminate)
+        self.assertEqual(vm_qmp.shutdown("web1", timeout=5, poll=0.05), "powered off")
+        self.assertIn("system_powerdown", server.commands)
+        self.assertFalse(os.path.exists(vm_runtime._paths("web1")[0]))
+        self.assertEqual(vm_runtime.states(), {})
+
+        self.fake_vm("web2")
+        self.assertEqual(vm_qmp.shutdown("web2", timeout=5), "terminated")
+        self.assertEqual(vm_qmp.shutdown("web2"), "stopped")
+
+    def testMenuControl(self):
+        # Test: the control menu pauses the selected running VMs and prints block stats
+        self.fake_vm("web1")
+        server = self.serve("web1")
+        with patch('builtins.input', side_effect=["web1", "pause"]):
+            with patch('builtins.print') as mock_print:
+                vm_manager.control_vms()
+        self.assertIn("web1: pause sent", str(mock_print.call_args_list[-1]))
+        self.assertEqual(server.status, "paused")
+        with patch('builtins.input', side_effect=["web1", "blockstats"]):
+            with patch('builtins.print') as mock_print:
+                vm_manager.control_vms()
+        self.assertIn("read        5.0 MB (120 ops)", str(mock_print.call_args_list[-1]))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
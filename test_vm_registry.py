@@ -0,0 +1,143 @@
+# Unit Tests for the SQLite VM registry
+# The registry lives in a temporary data directory; qemu-img is faked and no VM is started
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import vm_images
+import vm_manager
+import vm_registry
+from test_vm_images import write_qcow2
+
+
+def fake_qemu_img(cmd, *args, **kwargs):
+    # qemu-img writes a qcow2 header; qemu-system "fails" so nothing runs in the background
+    if cmd[0] == "qemu-img":
+        write_qcow2(cmd[8] if "-b" in cmd else cmd[4])
+        return MagicMock(returncode=0)
+    return MagicMock(returncode=1)
+
+
+class TestVmRegistry(unittest.TestCase):
+    # Tests for registry queries, the menu integration and reconcile
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        self.addCleanup(os.chdir, cwd)
+        env = patch.dict(os.environ, {"CMS_DATA_DIR": os.path.join(self.tmpdir, "data")})
+        env.start()
+        self.addCleanup(env.stop)
+        self.registry = vm_registry.VmRegistry()
+
+    def add(self, name, ram, cpus, state="stopped"):
+        return self.registry.add(vm_registry.VmRecord(name, f"{name}.qcow2", ram, cpus, "10G", state=state))
+
+    def testQueriesAndFilters(self):
+        # Test: name patterns, state and resource ranges combine; names and disks are unique
+        self.add("web-1", 1024, 1)
+        self.add("web-2", 4096, 4, state="running")
+        self.add("db", 8192, 8)
+        self.assertEqual(self.registry.get("web-1").disk, os.path.abspath("web-1.qcow2"))
+        names = lambda **kw: [r.name for r in self.registry.query(**kw)]
+        self.assertEqual(names(), ["db", "web-1", "web-2"])
+        self.assertEqual(names(name="web-*"), ["web-1", "web-2"])
+        self.assertEqual(names(state="running"), ["web-2"])
+        self.assertEqual(names(min_ram=2048, max_cpus=4), ["web-2"])
+        self.assertEqual(names(**vm_registry.parse_filter("ram>=4G cpus<=8")), ["db", "web-2"])
+        with self.assertRaises(vm_registry.RegistryError):
+            self.add("web-1", 512, 1)
+
+        conn = sqlite3.connect(self.registry.path)
+        plan = " ".join(str(row) for row in conn.execute("EXPLAIN QUERY PLAN SELECT name FROM vms WHERE ram_mb >= 2048"))
+        conn.close()
+        self.assertIn("vms_ram", plan)
+
+    def testParsing(self):
+        # Test: RAM sizes are MB with optional M/G suffix; filters reject unknown keys and states
+        self.assertEqual([vm_registry.parse_ram(v) for v in ("2048", "512M", "2G")], [2048, 512, 2048])
+        for bad in ("", "2T", "0"):
+            with self.assertRaises(ValueError):
+                vm_registry.parse_ram(bad)
+        self.assertEqual(vm_registry.parse_filter("name=web-* cpus=2"),
+                         {"name": "web-*", "min_cpus": 2, "max_cpus": 2})
+        for bad in ("colour=red", "state=paused", "name>=a"):
+            with self.assertRaises(ValueError):
+                vm_registry.parse_filter(bad)
+
+    def testCreateAndDeleteWriteTheRegistry(self):
+        # Test: create_vm registers the VM; list and delete work from any directory
+        with patch('builtins.input', side_effect=["web1", "2G", "2", "5G"]):
+            with patch('subprocess.run', side_effect=fake_qemu_img):
+                with patch('builtins.print'):
+                    vm_manager.create_vm()
+        record = self.registry.get("web1")
+        self.assertEqual((record.ram_mb, record.cpus, record.disk_size, record.origin, record.state),
+                         (2048, 2, "5G", "interactive", "stopped"))
+
+        os.mkdir("elsewhere")
+        os.chdir("elsewhere")
+        with patch('builtins.print') as mock_print:
+            vm_manager.list_vms()
+        self.assertIn("- web1  stopped  2048 MB, 2 CPU(s)", str(mock_print.call_args_list[1]))
+        with patch('builtins.input', side_effect=["web1", "y"]):
+            with patch('builtins.print'):
+                vm_manager.delete_vm()
+        self.assertFalse(os.path.exists(record.disk))
+        self.assertIsNone(self.registry.get("web1"))
+
+    def testFailedCreateLeavesNoEntry(self):
+        # Test: invalid resources are rejected and a failed overlay creation removes the reserved entry
+        with patch('builtins.input', side_effect=["web1", "lots", "2", "5G"]):
+            with patch('subprocess.run') as mock_run:
+                with patch('builtins.print'):
+                    vm_manager.create_vm()
+        mock_run.assert_not_called()
+
+        write_qcow2("base.qcow2")
+        vm_images.BaseCatalog().add("ubuntu", "base.qcow2")
+        with open("vm.json", "w") as f:
+            f.write('{"name": "api", "ram": "512", "cpu": "1", "base": "ubuntu"}')
+        with patch('builtins.input', return_value="vm.json"):
+            with patch('subprocess.run', return_value=MagicMock(returncode=1)):
+                with patch('builtins.print'):
+                    vm_manager.create_vm_from_config()
+        self.assertEqual(self.registry.query(), [])
+
+    def testReconcile(self):
+        # Test: missing disks and unregistered disks are reported, then cleaned up and imported
+        write_qcow2("kept.qcow2")
+        self.add("kept", 1024, 1)
+        self.add("gone", 1024, 1)
+        write_qcow2("stray.qcow2")
+        write_qcow2("base.qcow2")
+        vm_images.BaseCatalog().add("ubuntu", "base.qcow2")
+        report = vm_registry.reconcile(self.registry)
+        self.assertEqual([r.name for r in report.missing], ["gone"])
+        self.assertEqual(report.orphans, [os.path.abspath("stray.qcow2")])
+
+        with patch('builtins.input', side_effect=["y", "y", "2048", ""]):
+            with patch('builtins.print'):
+                vm_manager.reconcile_vms()
+        self.assertEqual([(r.name, r.ram_mb, r.origin) for r in self.registry.query()],
+                         [("kept", 1024, "interactive"), ("stray", 2048, "adopted")])
+        self.assertTrue(vm_registry.reconcile(self.registry).clean())
+
+    def testStaleRunningStateCorrected(self):
+        # Test: a VM recorded as running without a process is reported and stored as stopped
+        self.add("web1", 1024, 1, state="running")
+        with patch('builtins.input', return_value="state=running"):
+            with patch('builtins.print') as mock_print:
+                vm_manager.find_vms()
+        self.assertIn("No matching virtual machines.", str(mock_print.call_args_list[-1]))
+        self.assertEqual(self.registry.get("web1").state, "stopped")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
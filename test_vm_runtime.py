@@ -0,0 +1,158 @@
+ # Unit Tests for background VM launch and the running-VM registry
+ # A fake qemu-system binary daemonizes like the real one: it forks a process that
+ # waits for SIGTERM, writes its PID to the -pidfile and exits
+
+import os
+import shutil
+import signal
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import vm_manager
+import vm_runtime
+
+FAKE_QEMU = """\
+import os, signal, sys, time
+args = sys.argv[1:]
+with open(os.environ["FAKE_QEMU_ARGS"], "w") as f:
+    f.write("\\n".join(args))
+if "-fail" in os.environ.get("FAKE_QEMU_MODE", ""):
+    sys.stderr.write("qemu-system-x86_64: -drive file=x: Could not open 'x'\\n")
+    sys.exit(1)
+pidfile = args[args.index("-pidfile") + 1]
+pid = os.fork()
+if pid:
+    with open(pidfile, "w") as f:
+        f.write(str(pid))
+    os._exit(0)
+os.setsid()
+devnull = os.open(os.devnull, os.O_RDWR)
+for fd in (0, 1, 2):
+    os.dup2(devnull, fd)
+signal.signal(signal.SIGTERM, lambda *a: os._exit(0))
+while True:
+    time.sleep(0.1)
+"""
+
+
+class TestVmRuntime(unittest.TestCase):
+    # Tests for acceleration selection, daemonized launch, state and stop
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        qemu = os.path.join(self.tmpdir, "qemu-system-x86_64")
+        with open(qemu, "w") as f:
+            f.write(f"#!{sys.executable}\n" + FAKE_QEMU)
+        os.chmod(qemu, os.stat(qemu).st_mode | stat.S_IEXEC)
+        self.args_file = os.path.join(self.tmpdir, "args")
+        env = patch.dict(os.environ, {"CMS_DATA_DIR": os.path.join(self.tmpdir, "data"), "CMS_QEMU": qemu,
+                                      "FAKE_QEMU_ARGS": self.args_file})
+        env.start()
+        self.addCleanup(env.stop)
+        self.disk = os.path.join(self.tmpdir, "web1.qcow2")
+        open(self.disk, "wb").close()
+        self.addCleanup(self.kill_all)
+
+    def kill_all(self):
+        for vm in vm_runtime.states().values():
+            if vm.running:
+                os.kill(vm.pid, signal.SIGKILL)
+
+    def launched_args(self):
+        with open(self.args_file) as f:
+            return f.read().split("\n")
+
+    def testAccelerationSelection(self):
+        # Test: KVM with host CPU when /dev/kvm is usable, TCG otherwise
+        self.assertEqual(vm_runtime.accel_args(True), (["-accel", "kvm", "-cpu", "host"], "kvm"))
+        self.assertEqual(vm_runtime.accel_args(False), (["-accel", "tcg"], "tcg"))
+        self.assertFalse(vm_runtime.kvm_available(os.path.join(self.tmpdir, "no-kvm")))
+
+    def testLaunchDaemonizesWithVirtioDevices(self):
+        # Test: launch returns once qemu has daemonized; the VM keeps running with virtio disk/NIC
+        started = time.monotonic()
+        vm = vm_runtime.launch("web1", 512, 2, self.disk, kvm=False)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertTrue(vm_runtime.pid_alive(vm.pid, "web1"))
+        args = self.launched_args()
+        self.assertIn("-daemonize", args)
+        self.assertIn(f"file={self.disk},if=virtio,format=raw,discard=unmap", args)
+        self.assertIn("virtio-net-pci,netdev=net0", args)
+        self.assertEqual(args[args.index("-accel") + 1], "tcg")
+
+        state = vm_runtime.state("web1")
+        self.assertTrue(state.running)
+        self.assertEqual((state.pid, state.accel, state.ram, state.cpu), (vm.pid, "tcg", "512", "2"))
+        self.assertIn("running (PID", state.describe())
+        with self.assertRaises(vm_runtime.LaunchError):
+            vm_runtime.launch("web1", 512, 2, self.disk, kvm=False)
+
+    def testStopAndStalePidfiles(self):
+        # Test: stop terminates the VM; a pidfile naming another process is not reported as running
+        vm = vm_runtime.launch("web1", 512, 1, self.disk, kvm=False)
+        self.assertTrue(vm_runtime.stop("web1", timeout=5))
+        self.assertFalse(vm_runtime.pid_alive(vm.pid, "web1"))
+        self.assertEqual(vm_runtime.states(), {})
+
+        pidfile, _, _ = vm_runtime._paths("web2", create=True)
+        with open(pidfile, "w") as f:
+            f.write(str(os.getpid()))  # alive, but not a qemu for web2
+        self.assertFalse(vm_runtime.state("web2").running)
+
+    def testLaunchErrorsReported(self):
+        # Test: qemu's stderr becomes the launch error
+        with patch.dict(os.environ, {"FAKE_QEMU_MODE": "-fail"}):
+            with self.assertRaises(vm_runtime.LaunchError) as ctx:
+                vm_runtime.launch("web1", 512, 1, self.disk, kvm=False)
+        self.assertIn("Could not open", str(ctx.exception))
+
+    def testUptimeFormatting(self):
+        # Test: uptime is shown in the two most significant units
+        self.assertEqual(vm_runtime.format_uptime(75), "1m 15s")
+        self.assertEqual(vm_runtime.format_uptime(2 * 3600 + 3 * 60), "2h 03m")
+        self.assertEqual(vm_runtime.format_uptime(3 * 86400 + 5 * 3600), "3d 5h")
+
+    def testMenuLaunchListAndDelete(self):
+        # Test: create_vm starts the VM in the background, list_vms shows it and delete_vm stops it first
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        self.addCleanup(os.chdir, cwd)
+        os.remove(self.disk)
+
+        real_run = vm_runtime.subprocess.run
+
+        def run(cmd, **kwargs):
+            # qemu-img is not installed here: create the disk file; the fake qemu-system runs for real
+            if cmd[0] == "qemu-img":
+                open(cmd[-2], "wb").close()
+                return subprocess.CompletedProcess(cmd, 0)
+            return real_run(cmd, **kwargs)
+
+        with patch('subprocess.run', side_effect=run):
+            with patch('vm_runtime.kvm_available', return_value=False):
+                with patch('builtins.input', side_effect=["web1", "256", "1", "1G"]):
+                    with patch('builtins.print') as mock_print:
+                        vm_manager.create_vm()
+        printed = [" ".join(map(str, c.args)) for c in mock_print.call_args_list]
+        self.assertTrue(any("falling back to slow TCG" in line for line in printed))
+        self.assertTrue(vm_runtime.state("web1").running)
+
+        with patch('builtins.print') as mock_print:
+            vm_manager.list_vms()
+        self.assertIn("web1  running (PID", str(mock_print.call_args_list[1]))
+
+        with patch('builtins.input', side_effect=["web1", "y", "y"]):
+            with patch('builtins.print'):
+                vm_manager.delete_vm()
+        self.assertFalse(os.path.exists("web1.qcow2"))
+        self.assertEqual(vm_runtime.states(), {})
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
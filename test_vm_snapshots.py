@@ -0,0 +1,192 @@
+# Unit Tests for VM snapshots
+# qemu-img is faked: disks are qcow2 headers followed by "guest data", and internal
+# snapshots are kept in a <disk>.snaps side file. Live snapshots go through a fake QMP server.
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+import vm_images
+import vm_manager
+import vm_registry
+import vm_runtime
+import vm_snapshots
+from test_vm_images import write_qcow2
+from test_vm_qmp import FakeQmpServer
+
+
+def write_disk(path, data=b"", backing=None):
+    write_qcow2(path, backing=backing)
+    with open(path, "ab") as f:
+        f.write(data)
+
+
+def fake_qemu_img(cmd, *args, **kwargs):
+    # The qemu-img subcommands vm_snapshots uses
+    ok = MagicMock(returncode=0, stdout="", stderr="")
+    side = cmd[-1] + ".snaps"
+    snaps = json.load(open(side)) if os.path.exists(side) else {}
+    if cmd[1] == "info":
+        ok.stdout = json.dumps({"format": "qcow2", "snapshots": [
+            {"id": str(i + 1), "name": tag, "date-sec": snap["date"], "vm-state-size": 0}
+            for i, (tag, snap) in enumerate(snaps.items())]})
+        return ok
+    if cmd[1] == "create":
+        write_disk(cmd[-1], backing=cmd[cmd.index("-b") + 1])
+        return ok
+    op, tag, disk = cmd[2], cmd[3], cmd[4]
+    if op == "-c":
+        with open(disk, "rb") as f:
+            snaps[tag] = {"date": time.time(), "data": f.read().hex()}
+    elif tag not in snaps:
+        return MagicMock(returncode=1, stdout="", stderr=f"qemu-img: Could not find snapshot '{tag}'")
+    elif op == "-a":
+        with open(disk, "wb") as f:
+            f.write(bytes.fromhex(snaps[tag]["data"]))
+    elif op == "-d":
+        del snaps[tag]
+    with open(side, "w") as f:
+        json.dump(snaps, f)
+    return ok
+
+
+class SnapshottingQmpServer(FakeQmpServer):
+    # blockdev-snapshot-sync creates the overlay like QEMU does, on top of the current disk
+
+    def __init__(self, path, disk):
+        self.disk = disk
+        super().__init__(path)
+
+    def run(self, command, writer, arguments):
+        if command == "blockdev-snapshot-sync":
+            assert arguments["device"] == vm_snapshots.DRIVE_ID
+            write_disk(arguments["snapshot-file"], backing=self.disk)
+            self.disk = arguments["snapshot-file"]
+            return {}
+        return super().run(command, writer, arguments)
+
+
+class TestVmSnapshots(unittest.TestCase):
+    # Tests for offline/live snapshots, restore, delete and ephemeral launches
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(dir="/tmp", prefix="snap")
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        self.addCleanup(os.chdir, cwd)
+        env = patch.dict(os.environ, {"CMS_DATA_DIR": os.path.join(self.tmpdir, "d")})
+        env.start()
+        self.addCleanup(env.stop)
+        run = patch('subprocess.run', side_effect=fake_qemu_img)
+        run.start()
+        self.addCleanup(run.stop)
+        self.registry = vm_registry.VmRegistry()
+        write_disk("web1.qcow2", b"clean install")
+        self.registry.add(vm_registry.VmRecord("web1", "web1.qcow2", 512, 1, "5G"))
+        self.disk = os.path.abspath("web1.qcow2")
+
+    def data(self, path):
+        with open(path, "rb") as f:
+            return f.read()[104:]
+
+    def start_fake_vm(self):
+        # A process named after the VM plus a QMP server, as vm_runtime.launch would leave them
+        proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)", "web1"])
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.kill)
+        pidfile, statefile, _ = vm_runtime._paths("web1", create=True)
+        with open(pidfile, "w") as f:
+            f.write(str(proc.pid))
+        with open(statefile, "w") as f:
+            json.dump({"pid": proc.pid, "started_at": time.time(), "qmp": vm_runtime.qmp_socket("web1")}, f)
+        server = SnapshottingQmpServer(vm_runtime.qmp_socket("web1"), self.disk)
+        self.addCleanup(server.close)
+        return proc, server
+
+    def testOfflineInternalSnapshot(self):
+        # Test: a stopped VM is snapshotted with qemu-img inside its disk and restored in place
+        snap = vm_snapshots.create("web1", "clean")
+        self.assertEqual((snap.kind, snap.file), ("internal", self.disk))
+        with open("web1.qcow2", "ab") as f:
+            f.write(b" + broken experiment")
+        elapsed = vm_snapshots.restore("web1", "clean")
+        self.assertLess(elapsed, 2)
+        self.assertEqual(self.data("web1.qcow2"), b"clean install")
+        self.assertEqual([(s.tag, s.kind) for s in vm_snapshots.list_snapshots("web1")], [("clean", "internal")])
+        with self.assertRaises(vm_snapshots.SnapshotError):
+            vm_snapshots.create("web1", "clean")
+        vm_snapshots.delete("web1", "clean")
+        self.assertEqual(vm_snapshots.list_snapshots("web1"), [])
+        with self.assertRaises(vm_snapshots.SnapshotError):
+            vm_snapshots.restore("web1", "clean")
+
+    def testLiveExternalSnapshotAndRestore(self):
+        # Test: a running VM continues on a new overlay; restoring replaces the overlay with a fresh one
+        proc, server = self.start_fake_vm()
+        snap = vm_snapshots.create("web1", "pre-upgrade")
+        self.assertEqual((snap.kind, snap.file), ("external", self.disk))
+        overlay = self.registry.get("web1").disk
+        self.assertEqual(overlay, os.path.abspath("web1.1.qcow2"))
+        self.assertEqual(vm_images.backing_file(overlay), self.disk)
+
+        with self.assertRaises(vm_snapshots.SnapshotError):
+            vm_snapshots.restore("web1", "pre-upgrade")  # still running
+        proc.kill()
+        proc.wait()
+        with open(overlay, "ab") as f:
+            f.write(b"upgrade gone wrong")
+
+        vm_snapshots.restore("web1", "pre-upgrade")
+        active = self.registry.get("web1").disk
+        self.assertEqual(active, os.path.abspath("web1.2.qcow2"))
+        self.assertEqual(vm_images.backing_chain(active), [active, self.disk])
+        self.assertFalse(os.path.exists(overlay))
+        self.assertTrue(vm_registry.reconcile(self.registry).clean())
+
+        # the frozen file stays while the VM is layered on it
+        vm_snapshots.delete("web1", "pre-upgrade")
+        self.assertTrue(os.path.exists(self.disk))
+        self.assertEqual(vm_snapshots.list_snapshots("web1"), [])
+
+    def testDeleteVmRemovesSnapshotFiles(self):
+        # Test: deleting a VM deletes its active overlay and the files frozen by its snapshots
+        proc, server = self.start_fake_vm()
+        vm_snapshots.create("web1", "one")
+        vm_snapshots.create("web1", "two")
+        proc.kill()
+        proc.wait()
+        with patch('builtins.input', side_effect=["web1", "y"]):
+            with patch('builtins.print') as mock_print:
+                vm_manager.delete_vm()
+        self.assertIn("Deleted 2 snapshot file(s).", str(mock_print.call_args_list))
+        self.assertEqual([f for f in os.listdir() if f.endswith(".qcow2")], [])
+        self.assertEqual(self.registry.snapshots(), [])
+
+    def testEphemeralLaunch(self):
+        # Test: ephemeral VMs run with -snapshot and cannot take live snapshots
+        cmd = vm_runtime.launch_command("web1", 512, 1, self.disk, [], "p", "l", ephemeral=True)
+        self.assertIn("-snapshot", cmd)
+        self.assertNotIn("-snapshot", vm_runtime.launch_command("web1", 512, 1, self.disk, [], "p", "l"))
+
+        with patch('builtins.input', side_effect=["web1", "y"]):
+            with patch('vm_runtime.launch', return_value=vm_runtime.VmState("web1", 1, True, time.time(), "tcg",
+                                                                           ephemeral=True)) as launch:
+                with patch('builtins.print'):
+                    vm_manager.start_vm()
+        self.assertTrue(launch.call_args.kwargs["ephemeral"])
+        self.assertIn("ephemeral)", launch.return_value.describe())
+
+        with patch('vm_runtime.state', return_value=launch.return_value):
+            with self.assertRaises(vm_snapshots.SnapshotError):
+                vm_snapshots.create("web1", "live")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,184 @@
+# Unit Tests for warm pools
+# FakeProvisioner stands in for VM/container creation with a configurable delay
+
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+import vm_images
+import vm_registry
+import warm_pool
+from test_vm_images import write_qcow2
+
+
+class FakeProvisioner:
+    # Members are strings; creating one takes `delay` seconds and may be made to fail
+
+    kind = "container"
+
+    def __init__(self, delay=0.0, existing=()):
+        self.delay = delay
+        self.fail = False
+        self.stale = set()
+        self.created, self.activated, self.destroyed = [], [], []
+        self._existing = list(existing)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create(self, template):
+        time.sleep(self.delay)
+        if self.fail:
+            raise warm_pool.PoolError("image not found")
+        with self._lock:
+            member = f"{template.name}-{next(self._ids)}"
+            self.created.append(member)
+        return member
+
+    def activate(self, template, member):
+        if member in self.stale:
+            raise warm_pool.PoolError(f"{member} is gone")
+        self.activated.append(member)
+
+    def destroy(self, template, member):
+        self.destroyed.append(member)
+
+    def existing(self, template):
+        return self._existing
+
+
+class TestWarmPool(unittest.TestCase):
+    # Tests for allocation hits/misses, refill, resizing, failures and the provisioners
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(dir="/tmp", prefix="pool")
+        self.addCleanup(shutil.rmtree, self.tmpdir, True)
+        env = patch.dict(os.environ, {"CMS_DATA_DIR": self.tmpdir, "CMS_DOCKER_BACKEND": "cli"})
+        env.start()
+        self.addCleanup(env.stop)
+
+    def pool(self, provisioner, *templates):
+        pool = warm_pool.WarmPool(templates, {"container": provisioner}).start()
+        self.addCleanup(pool.stop)
+        return pool
+
+    def testAllocateHitAndRefill(self):
+        # Test: a ready member is handed out without waiting for creation, and the pool refills
+        fake = FakeProvisioner(delay=0.2)
+        pool = self.pool(fake, warm_pool.Template("web", "container", 2, {"image": "nginx"}))
+        self.assertTrue(pool.wait_ready(5))
+        allocation = pool.allocate("web")
+        self.assertTrue(allocation.hit)
+        self.assertLess(allocation.latency, 0.1)
+        self.assertEqual(fake.activated, [allocation.member])
+        self.assertTrue(pool.wait_ready(5))
+        self.assertEqual(len(fake.created), 3)
+        stats = pool.stats()[0]
+        self.assertEqual((stats["ready"], stats["hits"], stats["misses"], stats["hit_rate"]), (2, 1, 0, 1.0))
+        self.assertIsNotNone(stats["p95_ms"])
+
+    def testMissFallsBackToColdCreate(self):
+        # Test: an empty pool still allocates, by creating the member on the spot, and counts a miss
+        fake = FakeProvisioner(delay=0.3)
+        pool = self.pool(fake, warm_pool.Template("web", "container", 1, {"image": "nginx"}))
+        allocation = pool.allocate("web")
+        self.assertFalse(allocation.hit)
+        self.assertGreaterEqual(allocation.latency, 0.3)
+        self.assertEqual(pool.stats()[0]["misses"], 1)
+        with self.assertRaises(warm_pool.PoolError):
+            pool.allocate("nope")
+
+    def testResizeRemoveAndDrain(self):
+        # Test: shrinking a pool destroys its surplus idle members; stop(drain=True) destroys the rest
+        fake = FakeProvisioner()
+        pool = self.pool(fake, warm_pool.Template("web", "container", 3, {"image": "nginx"}))
+        self.assertTrue(pool.wait_ready(5))
+        pool.set_template(warm_pool.Template("web", "container", 1, {"image": "nginx"}))
+        self.assertEqual(len(fake.destroyed), 2)
+        pool.set_template(warm_pool.Template("db", "container", 2, {"image": "postgres"}))
+        self.assertTrue(pool.wait_ready(5))
+        self.assertEqual({r["template"]: r["ready"] for r in pool.stats()}, {"web": 1, "db": 2})
+        pool.remove_template("db")
+        self.assertEqual(len(fake.destroyed), 4)
+        pool.stop(drain=True)
+        self.assertEqual(len(fake.destroyed), 5)
+
+    def testFailuresBackOffAndStaleMembersAreSkipped(self):
+        # Test: refill errors are recorded and retried later; a member that died while idle is replaced
+        fake = FakeProvisioner()
+        fake.fail = True
+        with patch.object(warm_pool, "RETRY_BACKOFF", 0.2):
+            pool = self.pool(fake, warm_pool.Template("web", "container", 2, {"image": "nginx"}))
+            self.assertFalse(pool.wait_ready(0.1))
+            self.assertIn("image not found", pool.stats()[0]["last_error"])
+            fake.fail = False
+            self.assertTrue(pool.wait_ready(5))
+        fake.stale.add(fake.created[0])
+        allocation = pool.allocate("web")
+        self.assertTrue(allocation.hit)
+        self.assertEqual(allocation.member, fake.created[1])
+        self.assertEqual(fake.destroyed, [fake.created[0]])
+
+    def testAdoptExistingMembersAndConfig(self):
+        # Test: idle members left by an earlier run are reused; templates round-trip through warm_pools.json
+        template = warm_pool.Template("web", "container", 2, {"image": "nginx"})
+        warm_pool.save_templates([template])
+        loaded = warm_pool.load_templates()
+        self.assertEqual([t.as_dict() for t in loaded], [template.as_dict()])
+        fake = FakeProvisioner(existing=["old-1", "old-2"])
+        pool = self.pool(fake, *loaded)
+        self.assertTrue(pool.wait_ready(5))
+        self.assertEqual(fake.created, [])
+        self.assertEqual(pool.allocate("web").member, "old-1")
+        with self.assertRaises(warm_pool.PoolError):
+            warm_pool.Template.from_dict({"name": "vm1", "kind": "vm", "size": 1})
+
+    def testContainerProvisionerCli(self):
+        # Test: members are created (not started) with the pool label and started on allocation
+        template = warm_pool.Template("web", "container", 1, {"image": "nginx", "command": "sleep 60"})
+        provisioner = warm_pool.ContainerProvisioner()
+        with patch('subprocess.run', return_value=MagicMock(returncode=0, stdout="abc123\n", stderr="")) as run:
+            self.assertEqual(provisioner.create(template), "abc123")
+            self.assertEqual(run.call_args.args[0],
+                             ["docker", "create", "--label", "cms.pool=web", "nginx", "sleep", "60"])
+            provisioner.activate(template, "abc123")
+            self.assertEqual(run.call_args.args[0], ["docker", "start", "abc123"])
+
+    def testVmProvisioner(self):
+        # Test: a VM member is an overlay of the base, launched then paused; allocation resumes and relabels it
+        base_file = os.path.join(self.tmpdir, "base.qcow2")
+        write_qcow2(base_file)
+        catalog = vm_images.BaseCatalog()
+        catalog.add("ubuntu", base_file)
+        registry = vm_registry.VmRegistry()
+        template = warm_pool.Template("ci", "vm", 1, {"base": "ubuntu", "ram": "2G", "cpu": "2"})
+        provisioner = warm_pool.VmProvisioner(registry, catalog)
+
+        def qemu_img(cmd, *args, **kwargs):
+            write_qcow2(cmd[-1], backing=base_file)
+            return MagicMock(returncode=0, stderr="")
+
+        with patch('subprocess.run', side_effect=qemu_img), patch('vm_runtime.launch') as launch, \
+                patch('vm_qmp.control', side_effect=lambda names, action: {names[0]: {}}) as control:
+            name = provisioner.create(template)
+            record = registry.get(name)
+            self.assertEqual((record.origin, record.ram_mb, record.cpus, record.base), ("pool:ci", 2048, 2, "ubuntu"))
+            self.assertEqual(launch.call_args.args[:3], (name, "2G", "2"))
+            self.assertEqual(control.call_args.args, ([name], "pause"))
+            provisioner.activate(template, name)
+            self.assertEqual(control.call_args.args, ([name], "resume"))
+            self.assertEqual(registry.get(name).origin, "pool-allocated:ci")
+
+            control.side_effect = lambda names, action: {names[0]: warm_pool.PoolError("no QMP")}
+            with patch('vm_runtime.stop'):
+                with self.assertRaises(warm_pool.PoolError):
+                    provisioner.create(template)
+        self.assertEqual([r.name for r in registry.query()], [name])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,215 @@
+# VM disk usage and offline compaction.
+# Usage per disk is its virtual size and format (from the image header), the bytes
+# actually allocated on the host (st_blocks), and its backing file. Entries are
+# cached in a SQLite file in the data directory by (path, size, mtime), so listing
+# hundreds of VMs only stats their disks and re-reads the headers of the disks
+# that changed. Nothing is computed until a listing asks for it.
+#
+# qcow2 files only grow: blocks the guest frees stay allocated. compact() rewrites
+# a stopped VM's disk with `qemu-img convert` into a temporary file next to it
+# (optionally compressed with -c). Zeroed clusters are left out, and an overlay
+# keeps its backing file (-B). The result replaces the disk with an atomic
+# rename, so an interrupted run leaves the original disk untouched.
+
+import os
+import sqlite3
+import subprocess
+import time
+
+import app_paths
+import vm_images
+import vm_registry
+import vm_runtime
+import vm_snapshots
+
+# Files modified this recently may change again within the same mtime tick; they
+# are cached without an mtime so the next listing reads them again.
+RACY_SECONDS = 2.0
+TMP_SUFFIX = ".compact.tmp"
+
+
+class DiskError(Exception):
+    pass
+
+
+class DiskUsage:
+    __slots__ = ("path", "format", "virtual_size", "allocated", "backing")
+
+    def __init__(self, path, format, virtual_size, allocated, backing):
+        self.path = path
+        self.format = format
+        self.virtual_size = virtual_size
+        self.allocated = allocated
+        self.backing = backing
+
+
+def human_size(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1000:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1000
+    return f"{n:.1f} TB"
+
+
+class DiskUsageCache:
+    # Disk usage keyed by (path, size, mtime); `computed` and `reused` count the last usage() call.
+
+    def __init__(self, path=None, clock=time.time):
+        self.path = path or app_paths.data_path("disk_usage.sqlite3", create=False)
+        self.clock = clock
+        self.computed = self.reused = 0
+
+    def _connect(self, create):
+        if not create and not os.path.isfile(self.path):
+            return None
+        app_paths.ensure_dir(os.path.dirname(os.path.abspath(self.path)))
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS disks ("
+            " path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, format TEXT NOT NULL,"
+            " virtual_size INTEGER NOT NULL, allocated INTEGER NOT NULL, backing TEXT)"
+        )
+        return conn
+
+    def _known(self, paths):
+        conn = self._connect(create=False)
+        if conn is None:
+            return {}
+        known = {}
+        paths = list(paths)
+        # in batches below SQLite's bound-parameter limit
+        for i in range(0, len(paths), 500):
+            batch = paths[i:i + 500]
+            rows = conn.execute("SELECT path, size, mtime_ns, format, virtual_size, allocated, backing FROM disks"
+                                f" WHERE path IN ({','.join('?' * len(batch))})", batch)
+            known.update((row[0], row[1:]) for row in rows)
+        conn.close()
+        return known
+
+    def usage(self, paths):
+        # path -> DiskUsage for the disks that exist; only new or modified disks are read.
+        paths = sorted({os.path.abspath(p) for p in paths})
+        known = self._known(paths)
+        now = self.clock()
+        result, changed = {}, []
+        self.computed = self.reused = 0
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            cached = known.get(path)
+            if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+                result[path] = DiskUsage(path, *cached[2:])
+                self.reused += 1
+                continue
+            try:
+                header = vm_images.read_header(path)
+            except OSError:
+                continue
+            usage = DiskUsage(path, header["format"], header["virtual_size"],
+                              getattr(st, "st_blocks", 0) * 512 or st.st_size, vm_images.backing_file(path))
+            result[path] = usage
+            self.computed += 1
+            racy = now - st.st_mtime_ns / 1e9 < RACY_SECONDS
+            changed.append((path, st.st_size, 0 if racy else st.st_mtime_ns, usage.format, usage.virtual_size,
+                            usage.allocated, usage.backing))
+        if changed:
+            try:
+                conn = self._connect(create=True)
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO disks (path, size, mtime_ns, format, virtual_size,"
+                                     " allocated, backing) VALUES (?, ?, ?, ?, ?, ?, ?)", changed)
+                conn.close()
+            except (OSError, sqlite3.Error):
+                pass  # the cache is an optimisation; report what was computed
+        return result
+
+    def chains(self, paths):
+        # path -> [DiskUsage of the disk, its backing file, ...], reading each shared backing file once.
+        paths = {os.path.abspath(p) for p in paths}
+        usage = self.usage(paths)
+        missing = {u.backing for u in usage.values() if u.backing and u.backing not in usage}
+        computed, reused = self.computed, self.reused
+        while missing:
+            found = self.usage(missing)
+            computed, reused = computed + self.computed, reused + self.reused
+            usage.update(found)
+            missing = {u.backing for u in found.values() if u.backing and u.backing not in usage}
+        self.computed, self.reused = computed, reused
+        chains = {}
+        for path in paths:
+            chain, seen = [], set()
+            while path in usage and path not in seen and len(chain) < vm_images.MAX_CHAIN:
+                seen.add(path)
+                chain.append(usage[path])
+                path = usage[path].backing
+            if chain:
+                chains[chain[0].path] = chain
+        return chains
+
+
+def report(registry=None, cache=None):
+    # [(VmRecord, [DiskUsage chain] or None if the disk is missing)] for every registered VM
+    registry = registry or vm_registry.VmRegistry()
+    cache = cache or DiskUsageCache()
+    records = registry.query()
+    chains = cache.chains(r.disk for r in records)
+    return [(r, chains.get(os.path.abspath(r.disk))) for r in records]
+
+
+def compact(name, compress=False, registry=None, catalog=None):
+    # Rewrite a stopped VM's disk without its unused blocks; returns (bytes before, bytes after).
+    registry = registry or vm_registry.VmRegistry()
+    catalog = catalog or vm_images.BaseCatalog()
+    record = registry.get(name)
+    if record is None:
+        raise DiskError(f"VM '{name}' is not in the VM registry")
+    disk = os.path.abspath(record.disk)
+    if not os.path.isfile(disk):
+        raise DiskError(f"disk not found: {disk}")
+    if vm_runtime.state(name).running:
+        raise DiskError(f"VM '{name}' is running; stop it before compacting its disk")
+    if disk in catalog.by_path():
+        raise DiskError(f"{disk} is a base image; base images are read-only")
+    header = vm_images.read_header(disk)
+    try:
+        internal = vm_snapshots.internal_snapshots(disk) if header["format"] == "qcow2" else []
+    except vm_snapshots.SnapshotError as e:
+        raise DiskError(str(e))
+    if internal:
+        # convert copies only the current state
+        raise DiskError(f"VM '{name}' has {len(internal)} internal snapshot(s); delete them before compacting")
+    if compress and header["format"] != "qcow2":
+        raise DiskError("compression needs a qcow2 disk")
+
+    tmp = disk + TMP_SUFFIX
+    cmd = ["qemu-img", "convert", "-q", "-f", header["format"], "-O", header["format"]]
+    if compress:
+        cmd.append("-c")
+    backing = vm_images.backing_file(disk)
+    if backing:
+        cmd += ["-B", backing, "-F", vm_images.read_header(backing)["format"]]
+    cmd += [disk, tmp]
+
+    before = vm_images.allocated_bytes(disk)
+    try:
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        except FileNotFoundError:
+            raise DiskError("qemu-img not found. Please install QEMU.")
+        if result.returncode != 0:
+            raise DiskError((result.stderr or "").strip() or f"qemu-img convert exited with {result.returncode}")
+        if vm_images.read_header(tmp)["virtual_size"] != header["virtual_size"]:
+            raise DiskError("compacted disk has a different virtual size; keeping the original")
+        os.chmod(tmp, os.stat(disk).st_mode & 0o7777)
+        if vm_runtime.state(name).running:
+            raise DiskError(f"VM '{name}' was started during compaction; keeping the original")
+        os.replace(tmp, disk)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+    return before, vm_images.allocated_bytes(disk)
@@ -0,0 +1,300 @@
+# Fleet provisioning: many VMs from a directory of configs or one manifest.
+# Every entry is expanded (`web-{1..10}`) and validated up front, so a typo in
+# entry 27 fails before any disk exists. Disks are then created and VMs launched
+# on a bounded thread pool. If any VM fails, VMs that have not started are
+# cancelled, and everything this run created is rolled back: processes stopped,
+# disks deleted and registry entries removed. The report has per-VM timings.
+
+import glob
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import vm_images
+import vm_registry
+import vm_runtime
+
+DEFAULT_CONCURRENCY = 4
+MAX_FLEET = 500
+
+_BRACE = re.compile(r"\{([^{}]*)\}")
+_RANGE = re.compile(r"(-?\d+)\.\.(-?\d+)")
+_NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]*")
+
+
+class FleetError(Exception):
+    # Raised with every validation problem, before anything is created.
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def expand(template):
+    # Shell-style brace expansion: "web-{1..3}" -> web-1..web-3, "{01..10}" keeps the padding, "{a,b}" lists.
+    match = _BRACE.search(template)
+    if not match:
+        return [template]
+    body = match.group(1)
+    numbers = _RANGE.fullmatch(body)
+    if numbers:
+        first, last = numbers.groups()
+        step = 1 if int(last) >= int(first) else -1
+        width = len(first) if len(first) > 1 and first.startswith("0") else 0
+        values = [str(i).zfill(width) for i in range(int(first), int(last) + step, step)]
+    elif "," in body:
+        values = body.split(",")
+    else:
+        values = [match.group(0)]
+    head = template[:match.start()]
+    tails = expand(template[match.end():])
+    return [head + value + tail for value in values for tail in tails]
+
+
+class VmSpec:
+    __slots__ = ("name", "ram", "cpu", "disk", "base", "source")
+
+    def __init__(self, name, ram, cpu, disk="", base="", source=""):
+        self.name = name
+        self.ram = ram
+        self.cpu = cpu
+        self.disk = disk
+        self.base = base
+        self.source = source
+
+
+def _entries(data, path):
+    # (defaults, entries) for a single-VM config, a list of VMs or {"defaults": {...}, "vms": [...]}
+    if isinstance(data, list):
+        return {}, data
+    if isinstance(data, dict) and "vms" in data:
+        defaults = data.get("defaults", {})
+        if not isinstance(defaults, dict) or not isinstance(data["vms"], list):
+            raise FleetError([f"{path}: 'defaults' must be an object and 'vms' a list"])
+        return defaults, data["vms"]
+    return {}, [data]
+
+
+def load(source):
+    # VmSpecs from a directory of *.json configs or a single manifest file.
+    if os.path.isdir(source):
+        paths = sorted(glob.glob(os.path.join(source, "*.json")))
+        if not paths:
+            raise FleetError([f"no *.json configs in {source}"])
+    else:
+        paths = [source]
+    specs = []
+    errors = []
+    for path in paths:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            defaults, entries = _entries(data, path)
+        except (OSError, ValueError) as e:
+            errors.append(f"{path}: {e}")
+            continue
+        except FleetError as e:
+            errors.extend(e.errors)
+            continue
+        for i, entry in enumerate(entries):
+            if not isinstance(entry, dict):
+                errors.append(f"{path}: entry {i + 1} is not an object")
+                continue
+            cfg = {**defaults, **entry}
+            fields = {key: str(cfg.get(key, "")).strip() for key in ("ram", "cpu", "disk", "base")}
+            for name in expand(str(cfg.get("name", "")).strip()):
+                specs.append(VmSpec(name, source=path, **fields))
+    if errors:
+        raise FleetError(errors)
+    return specs
+
+
+def validate(specs, registry, catalog, disk_dir="."):
+    # Every problem with the fleet as a list of messages (empty when it can be provisioned).
+    errors = []
+    if not specs:
+        errors.append("no VMs to create")
+    if len(specs) > MAX_FLEET:
+        errors.append(f"{len(specs)} VMs requested; the limit is {MAX_FLEET}")
+        return errors
+    seen = {}
+    for spec in specs:
+        where = f"{spec.name or '<no name>'} ({spec.source})"
+        if not spec.name or not spec.ram or not spec.cpu or not (spec.disk or spec.base):
+            errors.append(f"{where}: missing required fields: name, ram, cpu, disk (or base)")
+            continue
+        if not _NAME.fullmatch(spec.name):
+            errors.append(f"{where}: invalid VM name")
+            continue
+        if spec.name in seen:
+            errors.append(f"{where}: duplicate name (also in {seen[spec.name]})")
+        seen[spec.name] = spec.source
+        for parse, value in ((vm_registry.parse_ram, spec.ram), (vm_registry.parse_cpus, spec.cpu)):
+            try:
+                parse(value)
+            except ValueError as e:
+                errors.append(f"{where}: {e}")
+        if spec.base and catalog.get(spec.base) is None:
+            errors.append(f"{where}: unknown base image '{spec.base}'")
+        if registry.get(spec.name) is not None:
+            errors.append(f"{where}: a VM with this name is already registered")
+        if os.path.isfile(os.path.join(disk_dir, f"{spec.name}.qcow2")):
+            errors.append(f"{where}: disk {spec.name}.qcow2 already exists")
+    return errors
+
+
+class FleetVm:
+    __slots__ = ("spec", "disk_file", "status", "error", "pid", "disk_s", "launch_s", "total_s",
+                 "registered", "disk_created", "launched")
+
+    def __init__(self, spec, disk_file):
+        self.spec = spec
+        self.disk_file = disk_file
+        self.status = "pending"
+        self.error = ""
+        self.pid = None
+        self.disk_s = self.launch_s = self.total_s = 0.0
+        self.registered = self.disk_created = self.launched = False
+
+
+class FleetReport:
+    # Outcome of one provisioning run.
+
+    def __init__(self, vms, elapsed, rolled_back):
+        self.vms = vms
+        self.elapsed = elapsed
+        self.rolled_back = rolled_back
+
+    @property
+    def created(self):
+        return [vm for vm in self.vms if vm.status == "running"]
+
+    @property
+    def failed(self):
+        return [vm for vm in self.vms if vm.status == "failed"]
+
+    def as_dict(self):
+        return {
+            "elapsed_s": round(self.elapsed, 3),
+            "created": len(self.created),
+            "failed": len(self.failed),
+            "rolled_back": self.rolled_back,
+            "vms": [
+                {"name": vm.spec.name, "status": vm.status, "error": vm.error, "pid": vm.pid,
+                 "disk_s": round(vm.disk_s, 3), "launch_s": round(vm.launch_s, 3), "total_s": round(vm.total_s, 3)}
+                for vm in self.vms
+            ],
+        }
+
+    def print(self):
+        summary = f"Fleet: {len(self.created)} running, {len(self.failed)} failed in {self.elapsed:.2f}s"
+        if self.rolled_back:
+            summary += " (rolled back)"
+        print(summary)
+        for vm in self.vms:
+            timings = f"disk {vm.disk_s:6.2f}s  launch {vm.launch_s:6.2f}s  total {vm.total_s:6.2f}s"
+            print(f"  {vm.spec.name:<24} {vm.status:<12} {timings}" + (f"  {vm.error}" if vm.error else ""))
+
+
+def _disk_command(vm, base):
+    if base is not None:
+        return vm_images.overlay_command(vm.disk_file, base, vm.spec.disk or None)
+    return ["qemu-img", "create", "-f", "qcow2", vm.disk_file, vm.spec.disk]
+
+
+def _provision_one(vm, registry, catalog, base, kvm):
+    # Register, create the disk and launch; sets vm.error on the first failing step.
+    spec = vm.spec
+    started = time.perf_counter()
+    try:
+        registry.add(vm_registry.VmRecord(spec.name, vm.disk_file, vm_registry.parse_ram(spec.ram),
+                                          vm_registry.parse_cpus(spec.cpu), spec.disk or None,
+                                          spec.base or None, f"fleet:{os.path.abspath(spec.source)}"))
+        vm.registered = True
+
+        t0 = time.perf_counter()
+        try:
+            result = subprocess.run(_disk_command(vm, base), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                    text=True)
+        except FileNotFoundError:
+            raise vm_runtime.LaunchError("qemu-img not found. Please install QEMU.")
+        vm.disk_s = time.perf_counter() - t0
+        if result.returncode != 0:
+            raise vm_runtime.LaunchError((result.stderr or "").strip() or f"qemu-img exited with {result.returncode}")
+        vm.disk_created = True
+        if base is not None:
+            catalog.record_overlay(vm.disk_file, base)
+
+        t0 = time.perf_counter()
+        state = vm_runtime.launch(spec.name, spec.ram, spec.cpu, vm.disk_file, kvm=kvm)
+        vm.launch_s = time.perf_counter() - t0
+        vm.launched = True
+        vm.pid = state.pid
+        registry.set_state(spec.name, "running")
+        vm.status = "running"
+    except (vm_registry.RegistryError, vm_runtime.LaunchError, OSError, sqlite3.Error) as e:
+        vm.status = "failed"
+        vm.error = str(e)
+    vm.total_s = time.perf_counter() - started
+    return vm
+
+
+def _roll_back(vm, registry, catalog):
+    # Undo whatever _provision_one did for this VM.
+    if vm.launched:
+        vm_runtime.stop(vm.spec.name)
+    vm_runtime.forget(vm.spec.name)
+    if vm.disk_created:
+        try:
+            os.remove(vm.disk_file)
+        except FileNotFoundError:
+            pass
+        catalog.forget_overlay(vm.disk_file)
+    if vm.registered:
+        registry.remove(vm.spec.name)
+    if vm.status != "failed":
+        vm.status = "rolled back"
+    return vm
+
+
+def provision(specs, concurrency=DEFAULT_CONCURRENCY, registry=None, catalog=None, kvm=None, disk_dir=".",
+              rollback=True, on_result=None):
+    # Validate the whole fleet, then create it with at most `concurrency` VMs in flight.
+    # Raises FleetError if validation fails; otherwise returns a FleetReport.
+    registry = registry or vm_registry.VmRegistry()
+    catalog = catalog or vm_images.BaseCatalog()
+    errors = validate(specs, registry, catalog, disk_dir)
+    if errors:
+        raise FleetError(errors)
+    if kvm is None:
+        kvm = vm_runtime.kvm_available()
+    bases = {spec.base: catalog.get(spec.base) for spec in specs if spec.base}
+    vms = [FleetVm(spec, os.path.join(disk_dir, f"{spec.name}.qcow2")) for spec in specs]
+    failed = threading.Event()
+    started = time.perf_counter()
+
+    def task(vm):
+        if failed.is_set():
+            vm.status = "cancelled"
+        else:
+            _provision_one(vm, registry, catalog, bases.get(vm.spec.base), kvm)
+            if vm.error:
+                failed.set()
+                # the failed VM's own partial work is always undone
+                _roll_back(vm, registry, catalog)
+        if on_result is not None:
+            on_result(vm)
+        return vm
+
+    rolled_back = False
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(vms)))) as pool:
+        list(pool.map(task, vms))
+        if failed.is_set() and rollback:
+            list(pool.map(lambda vm: _roll_back(vm, registry, catalog), [vm for vm in vms if vm.status == "running"]))
+            rolled_back = True
+    return FleetReport(vms, time.perf_counter() - started, rolled_back)
@@ -0,0 +1,236 @@
+# Base-image catalog and copy-on-write VM disks.
+# A base image is a registered, read-only disk (qcow2 or raw). New VMs can get a
+# qcow2 overlay backed by it (`qemu-img create -b base -F fmt`): the overlay is
+# created in milliseconds, starts out a few hundred KB, and only stores the blocks
+# the VM writes, so many VMs share the base's blocks on disk.
+#
+# Which disk is backed by which is read straight from the qcow2 headers, so chains
+# are exact even for overlays created outside this tool; overlays created here are
+# also recorded in the catalog (a SQLite file in the data directory). A base with
+# overlays still depending on it cannot be removed.
+
+import os
+import sqlite3
+import stat
+import struct
+import time
+
+import app_paths
+
+QCOW2_MAGIC = b"QFI\xfb"
+MAX_CHAIN = 16
+
+
+class CatalogError(Exception):
+    pass
+
+
+class BaseInUse(CatalogError):
+    def __init__(self, name, dependents):
+        super().__init__(f"base image '{name}' is used by {len(dependents)} disk(s): "
+                         + ", ".join(os.path.basename(d) for d in dependents))
+        self.name = name
+        self.dependents = dependents
+
+
+def read_header(path):
+    # {"format", "virtual_size", "backing_file"} for a disk image; raises OSError if unreadable.
+    with open(path, "rb") as f:
+        head = f.read(32)
+        if len(head) < 32 or head[:4] != QCOW2_MAGIC:
+            return {"format": "raw", "virtual_size": os.fstat(f.fileno()).st_size, "backing_file": None}
+        backing_offset, backing_size = struct.unpack(">QI", head[8:20])
+        virtual_size = struct.unpack(">Q", head[24:32])[0]
+        backing = None
+        if backing_offset and backing_size:
+            f.seek(backing_offset)
+            backing = f.read(backing_size).decode("utf-8", "replace")
+    return {"format": "qcow2", "virtual_size": virtual_size, "backing_file": backing}
+
+
+def backing_file(path):
+    # Absolute path of the disk `path` is backed by, or None (also when unreadable).
+    try:
+        backing = read_header(path)["backing_file"]
+    except OSError:
+        return None
+    if not backing:
+        return None
+    if not os.path.isabs(backing):
+        backing = os.path.join(os.path.dirname(os.path.abspath(path)), backing)
+    return os.path.normpath(backing)
+
+
+def backing_chain(path):
+    # [path, its backing file, that file's backing file, ...]
+    chain = [os.path.abspath(path)]
+    while len(chain) < MAX_CHAIN:
+        nxt = backing_file(chain[-1])
+        if nxt is None or nxt in chain:
+            break
+        chain.append(nxt)
+    return chain
+
+
+def allocated_bytes(path):
+    # Bytes actually stored for a (possibly sparse) file.
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    return getattr(st, "st_blocks", 0) * 512 or st.st_size
+
+
+def children(directory="."):
+    # backing path -> [disks in directory backed by it]
+    result = {}
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return result
+    for name in names:
+        if name.endswith(".qcow2"):
+            disk = os.path.abspath(os.path.join(directory, name))
+            backing = backing_file(disk)
+            if backing:
+                result.setdefault(backing, []).append(disk)
+    return result
+
+
+class BaseImage:
+    __slots__ = ("name", "path", "format", "virtual_size", "added_at")
+
+    def __init__(self, name, path, format, virtual_size, added_at):
+        self.name = name
+        self.path = path
+        self.format = format
+        self.virtual_size = virtual_size
+        self.added_at = added_at
+
+
+class BaseCatalog:
+    # Registered base images and the overlays created from them.
+
+    def __init__(self, path=None, clock=time.time):
+        self.path = path or app_paths.data_path("vm_images.sqlite3", create=False)
+        self.clock = clock
+
+    def _connect(self, create):
+        if not create and not os.path.isfile(self.path):
+            return None
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS bases ("
+            " name TEXT PRIMARY KEY, path TEXT NOT NULL UNIQUE, format TEXT NOT NULL,"
+            " virtual_size INTEGER NOT NULL, added_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS overlays ("
+            " path TEXT PRIMARY KEY, base TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        return conn
+
+    def _query(self, sql, args=()):
+        conn = self._connect(create=False)
+        if conn is None:
+            return []
+        rows = conn.execute(sql, args).fetchall()
+        conn.close()
+        return rows
+
+    def add(self, name, path):
+        # Register an existing disk image as a base; it is made read-only so overlays stay valid.
+        path = os.path.abspath(path)
+        if not os.path.isfile(path):
+            raise CatalogError(f"disk image not found: {path}")
+        if self.get(name) is not None:
+            raise CatalogError(f"base image '{name}' already exists")
+        header = read_header(path)
+        try:
+            os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) & ~0o222)
+        except OSError:
+            pass
+        base = BaseImage(name, path, header["format"], header["virtual_size"], self.clock())
+        conn = self._connect(create=True)
+        try:
+            with conn:
+                conn.execute("INSERT INTO bases (name, path, format, virtual_size, added_at) VALUES (?, ?, ?, ?, ?)",
+                             (base.name, base.path, base.format, base.virtual_size, base.added_at))
+        except sqlite3.IntegrityError:
+            raise CatalogError(f"{path} is already registered")
+        finally:
+            conn.close()
+        return base
+
+    def get(self, name):
+        rows = self._query("SELECT name, path, format, virtual_size, added_at FROM bases WHERE name = ?", (name,))
+        return BaseImage(*rows[0]) if rows else None
+
+    def list(self):
+        rows = self._query("SELECT name, path, format, virtual_size, added_at FROM bases ORDER BY name")
+        return [BaseImage(*row) for row in rows]
+
+    def by_path(self):
+        # absolute path -> BaseImage, for labelling chains
+        return {base.path: base for base in self.list()}
+
+    def record_overlay(self, disk, base):
+        conn = self._connect(create=True)
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO overlays (path, base, created_at) VALUES (?, ?, ?)",
+                         (os.path.abspath(disk), base.name, self.clock()))
+        conn.close()
+
+    def forget_overlay(self, disk):
+        conn = self._connect(create=False)
+        if conn is None:
+            return
+        with conn:
+            conn.execute("DELETE FROM overlays WHERE path = ?", (os.path.abspath(disk),))
+        conn.close()
+
+    def dependents(self, path, search_dirs=(".",), disks=()):
+        # Existing disks whose backing chain includes `path`: recorded overlays, `disks` and any found in search_dirs.
+        path = os.path.abspath(path)
+        candidates = {row[0] for row in self._query("SELECT path FROM overlays")}
+        candidates.update(os.path.abspath(d) for d in disks)
+        for directory in search_dirs:
+            for disks in children(directory).values():
+                candidates.update(disks)
+        return sorted(d for d in candidates if d != path and path in backing_chain(d)[1:])
+
+    def remove(self, name, delete_file=False, search_dirs=(".",)):
+        # Unregister a base (and optionally delete its file); refused while any disk depends on it.
+        base = self.get(name)
+        if base is None:
+            raise CatalogError(f"unknown base image '{name}'")
+        dependents = self.dependents(base.path, search_dirs)
+        if dependents:
+            raise BaseInUse(name, dependents)
+        conn = self._connect(create=True)
+        with conn:
+            conn.execute("DELETE FROM bases WHERE name = ?", (name,))
+            conn.execute("DELETE FROM overlays WHERE base = ?", (name,))
+        conn.close()
+        if delete_file and os.path.isfile(base.path):
+            os.chmod(base.path, stat.S_IMODE(os.stat(base.path).st_mode) | 0o200)
+            os.remove(base.path)
+        return base
+
+
+def overlay_command(disk, base, size=None):
+    # qemu-img command creating a qcow2 overlay of `base` (optionally grown to `size`).
+    cmd = ["qemu-img", "create", "-f", "qcow2", "-b", base.path, "-F", base.format, disk]
+    if size:
+        cmd.append(size)
+    return cmd
+
+
+def describe_chain(chain, bases):
+    # "web.qcow2 -> dev.qcow2 -> base 'ubuntu' (/images/ubuntu.qcow2)" for a backing chain
+    parts = []
+    for path in chain:
+        base = bases.get(path)
+        parts.append(f"base '{base.name}' ({path})" if base else os.path.basename(path))
+    return " -> ".join(parts)
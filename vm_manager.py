@@ -1,16 +1,99 @@
 import subprocess
 import os
 import json
+import time
 
+import instrumentation
+import job_manager
+import vm_disks
+import vm_fleet
+import vm_images
+import vm_qmp
+import vm_registry
+import vm_runtime
+import vm_snapshots
+
+def _choose_base(catalog):
+    # Offer the registered base images; returns (ok, base or None)
+    bases = catalog.list()
+    if not bases:
+        return True, None
+    print("Base images (linked clone, ready instantly):", ", ".join(b.name for b in bases))
+    choice = input("Base image (leave empty for a blank disk): ").strip()
+    if not choice:
+        return True, None
+    base = catalog.get(choice)
+    if base is None:
+        print(f"Unknown base image '{choice}'.")
+        return False, None
+    return True, base
+
+def _create_disk(disk_file, disk, base=None, catalog=None):
+    if base is None:
+        print("[+] Creating disk image...")
+        cmd = ["qemu-img", "create", "-f", "qcow2", disk_file, disk]
+    else:
+        print(f"[+] Creating linked clone of base image '{base.name}'...")
+        cmd = vm_images.overlay_command(disk_file, base, disk)
+    try:
+        result = subprocess.run(cmd)
+    except FileNotFoundError:
+        print("qemu-img not found. Please install QEMU.")
+        return False
+    if result.returncode != 0:
+        print("Failed to create the disk image." if base is None else "Failed to create the overlay disk.")
+        return False
+    if base is not None:
+        catalog.record_overlay(disk_file, base)
+    return True
+
+def _register(registry, name, ram, cpu, disk_file, disk, base, origin):
+    # Reserve the name in the VM registry before the disk is created; None if invalid or taken
+    try:
+        record = vm_registry.VmRecord(name, disk_file, vm_registry.parse_ram(ram), vm_registry.parse_cpus(cpu),
+                                      disk or None, base.name if base else None, origin)
+        return registry.add(record)
+    except (ValueError, vm_registry.RegistryError) as e:
+        print(f"Cannot create VM: {e}")
+        return None
+
+def _start_vm(name, ram, cpu, disk_file, registry=None, ephemeral=False):
+    kvm = vm_runtime.kvm_available()
+    if not kvm:
+        print(f"Warning: KVM is not available ({vm_runtime.KVM_DEVICE}); falling back to slow TCG emulation.")
+    print("[+] Starting virtual machine in the background...")
+    try:
+        vm = vm_runtime.launch(name, ram, cpu, disk_file, kvm=kvm, ephemeral=ephemeral)
+    except vm_runtime.LaunchError as e:
+        print(f"Failed to start VM: {e}")
+        return
+    if registry is not None:
+        registry.set_state(name, "running")
+    print(f"VM '{name}' is running (PID {vm.pid}, {vm.accel}); display on VNC 127.0.0.1:5900-5999.")
+
+def _background(name, ram, cpu, disk, base, origin):
+    # Create the VM as a background job when the menu's job queue is running (provisioned like a one-VM fleet)
+    spec = {"name": name, "ram": ram, "cpu": cpu, "disk": disk, "base": base.name if base else "", "source": origin}
+    return job_manager.background("vm", {"specs": [spec], "disk_dir": os.getcwd(), "concurrency": 1})
+
+@instrumentation.timed
 def create_vm():
     print("\n=== Create Virtual Machine (QEMU) ===")
 
     name = input("Enter VM name: ").strip()
     ram  = input("Enter RAM size in MB (e.g. 1024): ").strip()
     cpu  = input("Enter number of CPUs (e.g. 1): ").strip()
-    disk = input("Enter disk size (e.g. 5G): ").strip()
 
-    if not all([name, ram, cpu, disk]):
+    catalog = vm_images.BaseCatalog()
+    ok, base = _choose_base(catalog)
+    if not ok:
+        return
+    if base is None:
+        disk = input("Enter disk size (e.g. 5G): ").strip()
+    else:
+        disk = input("Enter disk size (e.g. 20G, leave empty to keep the base size): ").strip()
+
+    if not all([name, ram, cpu]) or not (disk or base):
         print("All fields are required.")
         return
 
@@ -20,20 +103,17 @@ def create_vm():
         print("Disk file already exists.")
         return
 
-    print("[+] Creating disk image...")
-    subprocess.run([
-        "qemu-img", "create",
-        "-f", "qcow2",
-        disk_file, disk
-    ])
-
-    print("[+] Starting virtual machine...")
-    subprocess.run([
-        "qemu-system-x86_64",
-        "-m", ram,
-        "-smp", cpu,
-        "-hda", disk_file
-    ])
+    if _background(name, ram, cpu, disk, base, "interactive"):
+        return
+    registry = vm_registry.VmRegistry()
+    if _register(registry, name, ram, cpu, disk_file, disk, base, "interactive") is None:
+        return
+    if not _create_disk(disk_file, disk, base, catalog):
+        registry.remove(name)
+        return
+
+    _start_vm(name, ram, cpu, disk_file, registry)
+@instrumentation.timed
 def delete_vm():
     print("\n=== Delete Virtual Machine (QEMU) ===")
 
@@ -42,32 +122,170 @@ def delete_vm():
         print("VM name cannot be empty.")
         return
 
-    disk_file = f"{name}.qcow2"
+    registry = vm_registry.VmRegistry()
+    record = registry.get(name)
+    disk_file = record.disk if record else f"{name}.qcow2"
 
     if not os.path.exists(disk_file):
         print(f"VM disk '{disk_file}' not found.")
+        if record:
+            print("Use 'Reconcile VM registry' to remove the stale entry.")
         return
 
+    catalog = vm_images.BaseCatalog()
+    bases = catalog.by_path()
+    if os.path.abspath(disk_file) in bases:
+        print(f"'{disk_file}' is registered as base image '{bases[os.path.abspath(disk_file)].name}'. "
+              "Remove it from the base image catalog instead.")
+        return
+    dependents = catalog.dependents(disk_file, disks=[r.disk for r in registry.query()])
+    if dependents:
+        print(f"Cannot delete '{disk_file}': it is the backing file of "
+              + ", ".join(os.path.basename(d) for d in dependents) + ".")
+        return
+    chain = vm_images.backing_chain(disk_file)
+    if len(chain) > 1:
+        print("Backing chain:", vm_images.describe_chain(chain, bases))
+        print("Only the overlay is deleted; its backing images are kept.")
+
+    vm = vm_runtime.state(name)
+    if vm.running:
+        answer = input(f"VM '{name}' is running (PID {vm.pid}). Shut it down first? (y/n): ").strip().lower()
+        if answer != "y":
+            print("Operation cancelled.")
+            return
+        print(f"Shutting down '{name}' (ACPI powerdown, then SIGTERM after {vm_qmp.POWERDOWN_TIMEOUT:.0f}s)...")
+        if vm_qmp.shutdown(name) == "failed":
+            print(f"VM '{name}' did not stop; not deleting.")
+            return
+
     confirm = input(f"Are you sure you want to delete '{disk_file}'? (y/n): ").lower()
     if confirm != "y":
         print("Operation cancelled.")
         return
 
     os.remove(disk_file)
+    snapshot_files = vm_snapshots.remove_all(name, registry, catalog)
+    registry.remove(name)
+    catalog.forget_overlay(disk_file)
+    if snapshot_files:
+        print(f"Deleted {len(snapshot_files)} snapshot file(s).")
+    vm_runtime.forget(name)
     print(f"VM '{name}' deleted successfully.")
 
+def _print_vms(registry, records):
+    registry.refresh_states(records)
+    bases = vm_images.BaseCatalog().by_path()
+    running = vm_runtime.states()
+    # live run state over QMP, e.g. to show paused VMs
+    live = vm_qmp.statuses([r.name for r in records if r.state == "running"])
+    usage = vm_disks.DiskUsageCache().usage(r.disk for r in records)
+    backing_of = {}
+    for u in usage.values():
+        if u.backing:
+            backing_of.setdefault(u.backing, []).append(u.path)
+
+    for record in records:
+        state = running.get(record.name) or vm_runtime.VmState(record.name)
+        line = f"- {record.name}  {state.describe()}  {record.ram_mb} MB, {record.cpus} CPU(s)"
+        if live.get(record.name, "running") != "running":
+            line += f"  [{live[record.name]}]"
+        path = record.disk
+        if not os.path.isfile(path):
+            print(line + f"  [disk missing: {path}]")
+            continue
+        disk = usage.get(os.path.abspath(path))
+        if disk is not None:
+            line += f"  {vm_disks.human_size(disk.virtual_size)} disk, {vm_disks.human_size(disk.allocated)} used"
+        if path in bases:
+            line += f"  [base image '{bases[path].name}']"
+        chain = vm_images.backing_chain(path)
+        if len(chain) > 1:
+            own = vm_images.allocated_bytes(path) / 1e6
+            line += f"  -> {vm_images.describe_chain(chain[1:], bases)} ({own:.1f} MB own data)"
+        if backing_of.get(path):
+            line += f"  [backing {len(backing_of[path])} VM(s)]"
+        print(line)
+
+@instrumentation.timed
 def list_vms():
-    vms = [f for f in os.listdir() if f.endswith(".qcow2")]
+    registry = vm_registry.VmRegistry()
+    records = registry.query()
 
-    if not vms:
+    if not records:
         print("No virtual machines found.")
+        if not registry.exists():
+            print("Disks created before the VM registry existed can be imported with 'Reconcile VM registry'.")
         return
 
     print("Available Virtual Machines:")
-    for vm in vms:
-        print("-", vm.replace(".qcow2", ""))
+    _print_vms(registry, records)
+
+@instrumentation.timed
+def find_vms():
+    print("\n=== Find Virtual Machines ===")
+    print("Filters: name=<pattern> state=running|stopped base=<name> ram>=<MB> ram<=<MB> cpus>=<n> cpus<=<n>")
+    text = input("Filter (e.g. name=web-* state=running ram>=2048): ").strip()
+    try:
+        filters = vm_registry.parse_filter(text)
+    except ValueError as e:
+        print(f"Invalid filter: {e}")
+        return
+    registry = vm_registry.VmRegistry()
+    # the stored state is what the state index filters on, so bring it up to date first
+    if "state" in filters:
+        registry.refresh_states()
+    records = registry.query(**filters)
+    if not records:
+        print("No matching virtual machines.")
+        return
+    print(f"{len(records)} matching VM(s):")
+    _print_vms(registry, records)
 
+@instrumentation.timed
+def reconcile_vms():
+    print("\n=== Reconcile VM registry ===")
+    registry = vm_registry.VmRegistry()
+    catalog = vm_images.BaseCatalog()
+    report = vm_registry.reconcile(registry, catalog=catalog)
+    for name in report.state_fixes:
+        print(f"Updated the recorded state of '{name}'.")
+    if report.clean():
+        print("Registry and disks are consistent.")
+        return
 
+    if report.missing:
+        print("Registered VMs whose disk is missing:")
+        for record in report.missing:
+            print(f"- {record.name}: {record.disk}")
+        if input(f"Remove {len(report.missing)} VM(s) from the registry? (y/n): ").strip().lower() == "y":
+            for record in report.missing:
+                vm_runtime.stop(record.name)
+                registry.remove(record.name)
+                catalog.forget_overlay(record.disk)
+            print(f"Removed {len(report.missing)} VM(s).")
+
+    if report.orphans:
+        print("Disks not in the registry:")
+        for path in report.orphans:
+            print(f"- {path}")
+        if input(f"Import {len(report.orphans)} disk(s) as VMs? (y/n): ").strip().lower() == "y":
+            try:
+                ram = vm_registry.parse_ram(input("RAM in MB for imported VMs (default 1024): ").strip() or "1024")
+                cpus = vm_registry.parse_cpus(input("CPUs for imported VMs (default 1): ").strip() or "1")
+            except ValueError as e:
+                print(f"Invalid value: {e}")
+                return
+            for path in report.orphans:
+                try:
+                    record = vm_registry.adopt(registry, path, ram, cpus, catalog)
+                except vm_registry.RegistryError as e:
+                    print(f"Skipped {path}: {e}")
+                    continue
+                print(f"Imported '{record.name}'.")
+
+
+@instrumentation.timed
 def create_vm_from_config():
     print("\n=== Create Virtual Machine from JSON config (QEMU) ===")
     path = input("Enter JSON config file path: ").strip()
@@ -86,28 +304,280 @@ def create_vm_from_config():
     ram = str(cfg.get("ram", "")).strip()
     cpu = str(cfg.get("cpu", "")).strip()
     disk = str(cfg.get("disk", "")).strip()
+    base_name = str(cfg.get("base", "")).strip()
 
-    if not all([name, ram, cpu, disk]):
-        print("Config missing required fields: name, ram, cpu, disk")
+    if not all([name, ram, cpu]) or not (disk or base_name):
+        print("Config missing required fields: name, ram, cpu, disk (or base)")
         return
 
+    catalog = base = None
+    if base_name:
+        catalog = vm_images.BaseCatalog()
+        base = catalog.get(base_name)
+        if base is None:
+            print(f"Unknown base image '{base_name}'.")
+            return
+
     disk_file = f"{name}.qcow2"
 
     if os.path.exists(disk_file):
         print("Disk file already exists.")
         return
 
-    print("[+] Creating disk image...")
-    subprocess.run([
-        "qemu-img", "create",
-        "-f", "qcow2",
-        disk_file, disk
-    ])
-
-    print("[+] Starting virtual machine...")
-    subprocess.run([
-        "qemu-system-x86_64",
-        "-m", ram,
-        "-smp", cpu,
-        "-hda", disk_file
-    ])
\ No newline at end of file
+    if _background(name, ram, cpu, disk, base, f"config:{os.path.abspath(path)}"):
+        return
+    registry = vm_registry.VmRegistry()
+    if _register(registry, name, ram, cpu, disk_file, disk, base, f"config:{os.path.abspath(path)}") is None:
+        return
+    if not _create_disk(disk_file, disk, base, catalog):
+        registry.remove(name)
+        return
+
+    _start_vm(name, ram, cpu, disk_file, registry)
+
+
+@instrumentation.timed
+def provision_fleet():
+    print("\n=== Provision VM Fleet ===")
+    print("A directory of VM configs, or a manifest: "
+          '{"defaults": {"ram": "1024", "cpu": "1", "disk": "10G"}, "vms": [{"name": "web-{1..10}"}]}')
+    source = input("Config directory or manifest path: ").strip()
+    if not source or not os.path.exists(source):
+        print("Config directory or manifest not found.")
+        return
+    concurrency = input(f"Max VMs created in parallel (default {vm_fleet.DEFAULT_CONCURRENCY}): ").strip()
+    try:
+        concurrency = int(concurrency) if concurrency else vm_fleet.DEFAULT_CONCURRENCY
+    except ValueError:
+        print("Concurrency must be a number.")
+        return
+
+    try:
+        specs = vm_fleet.load(source)
+        errors = vm_fleet.validate(specs, vm_registry.VmRegistry(), vm_images.BaseCatalog())
+    except vm_fleet.FleetError as e:
+        errors = e.errors
+    if errors:
+        print("Fleet not created; fix these problems first:")
+        for error in errors:
+            print(f"- {error}")
+        return
+
+    print(f"{len(specs)} VM(s): " + ", ".join(spec.name for spec in specs))
+    confirm = input(f"Create and start {len(specs)} VM(s)? (y/n): ").strip().lower()
+    if confirm != "y":
+        print("Operation cancelled.")
+        return
+    if not vm_runtime.kvm_available():
+        print(f"Warning: KVM is not available ({vm_runtime.KVM_DEVICE}); falling back to slow TCG emulation.")
+
+    def progress(vm):
+        print(f"  [{vm.status}] {vm.spec.name}" + (f": {vm.error}" if vm.error else ""))
+
+    try:
+        report = vm_fleet.provision(specs, concurrency=concurrency, on_result=progress)
+    except vm_fleet.FleetError as e:
+        print("Fleet not created:", e)
+        return
+    report.print()
+
+
+@instrumentation.timed
+def start_vm():
+    print("\n=== Start Virtual Machine (QEMU) ===")
+    name = input("Enter VM name to start: ").strip()
+    registry = vm_registry.VmRegistry()
+    record = registry.get(name)
+    if record is None:
+        print(f"VM '{name}' is not in the VM registry.")
+        return
+    if vm_runtime.state(name).running:
+        print(f"VM '{name}' is already running.")
+        return
+    ephemeral = input("Ephemeral run (all disk writes are discarded when it stops)? (y/n): ").strip().lower() == "y"
+    _start_vm(name, record.ram_mb, record.cpus, record.disk, registry, ephemeral)
+
+
+@instrumentation.timed
+def manage_snapshots():
+    print("\n=== VM Snapshots ===")
+    name = input("VM name: ").strip()
+    try:
+        snapshots = vm_snapshots.list_snapshots(name)
+    except vm_snapshots.SnapshotError as e:
+        print(e)
+        return
+    running = vm_runtime.state(name).running
+    if snapshots:
+        for snap in snapshots:
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snap.created_at)) if snap.created_at else "?"
+            print(f"- {snap.tag:<20} {snap.kind:<9} {when}  {snap.file}")
+    else:
+        print("No snapshots.")
+    print("1. Create snapshot" + (" (live, external)" if running else " (internal)"))
+    print("2. Restore snapshot")
+    print("3. Delete snapshot")
+    print("0. Back")
+    choice = input("Choice: ").strip()
+    if choice not in ("1", "2", "3"):
+        return
+    tag = input("Snapshot tag: ").strip()
+
+    try:
+        if choice == "1":
+            vm_snapshots.create(name, tag)
+            print(f"Snapshot '{tag}' created.")
+        elif choice == "2":
+            if running:
+                answer = input(f"VM '{name}' is running. Shut it down to restore? (y/n): ").strip().lower()
+                if answer != "y" or vm_qmp.shutdown(name) == "failed":
+                    print("Operation cancelled.")
+                    return
+            elapsed = vm_snapshots.restore(name, tag)
+            print(f"VM '{name}' restored to '{tag}' in {elapsed:.2f}s.")
+            if running and input("Start it again? (y/n): ").strip().lower() == "y":
+                registry = vm_registry.VmRegistry()
+                record = registry.get(name)
+                _start_vm(name, record.ram_mb, record.cpus, record.disk, registry)
+        else:
+            vm_snapshots.delete(name, tag)
+            print(f"Snapshot '{tag}' deleted.")
+    except (vm_snapshots.SnapshotError, vm_registry.RegistryError, OSError) as e:
+        print(f"Snapshot operation failed: {e}")
+
+
+@instrumentation.timed
+def disk_usage():
+    print("\n=== VM Disk Usage ===")
+    rows = vm_disks.report()
+    if not rows:
+        print("No virtual machines found.")
+        return
+    print(f"{'NAME':<20} {'FORMAT':<7} {'VIRTUAL':>10} {'ALLOCATED':>10}  BACKING CHAIN")
+    counted = {}
+    for record, chain in rows:
+        if chain is None:
+            print(f"{record.name:<20} [disk missing: {record.disk}]")
+            continue
+        disk = chain[0]
+        backing = " -> ".join(f"{os.path.basename(u.path)} ({vm_disks.human_size(u.allocated)})" for u in chain[1:])
+        print(f"{record.name:<20} {disk.format:<7} {vm_disks.human_size(disk.virtual_size):>10} "
+              f"{vm_disks.human_size(disk.allocated):>10}  {backing or '-'}")
+        # shared backing files count once
+        counted.update((u.path, u.allocated) for u in chain)
+    print(f"Total allocated (backing files counted once): {vm_disks.human_size(sum(counted.values()))}")
+
+    names = input("Compact which stopped VMs? (names separated by commas, blank to skip): ").strip()
+    if not names:
+        return
+    compress = input("Compress (smaller, slower guest reads)? (y/n): ").strip().lower() == "y"
+    reclaimed = 0
+    for name in (n.strip() for n in names.split(",") if n.strip()):
+        try:
+            before, after = vm_disks.compact(name, compress)
+        except (vm_disks.DiskError, OSError) as e:
+            print(f"{name}: {e}")
+            continue
+        reclaimed += before - after
+        print(f"{name}: {vm_disks.human_size(before)} -> {vm_disks.human_size(after)} "
+              f"({vm_disks.human_size(before - after)} reclaimed)")
+    print(f"Space reclaimed: {vm_disks.human_size(reclaimed)}")
+
+
+@instrumentation.timed
+def stop_vm():
+    print("\n=== Stop Virtual Machine (QEMU) ===")
+    name = input("Enter VM name to stop: ").strip()
+    if not name:
+        print("VM name cannot be empty.")
+        return
+    vm = vm_runtime.state(name)
+    if not vm.running:
+        print(f"VM '{name}' is not running.")
+        return
+    print(f"Shutting down '{name}' (ACPI powerdown, then SIGTERM after {vm_qmp.POWERDOWN_TIMEOUT:.0f}s)...")
+    result = vm_qmp.shutdown(name)
+    if result == "failed":
+        print(f"VM '{name}' did not stop.")
+        return
+    vm_registry.VmRegistry().set_state(name, "stopped")
+    print(f"VM '{name}' stopped ({result}).")
+
+
+@instrumentation.timed
+def control_vms():
+    print("\n=== VM Control (QMP) ===")
+    names = input("VM names (comma-separated) or a name pattern (e.g. web-*): ").strip()
+    if not names:
+        print("VM names cannot be empty.")
+        return
+    if any(c in names for c in "*?["):
+        targets = [r.name for r in vm_registry.VmRegistry().query(name=names)]
+    else:
+        targets = [n.strip() for n in names.split(",") if n.strip()]
+    targets = [n for n in targets if vm_runtime.state(n).running]
+    if not targets:
+        print("No running VMs matched.")
+        return
+
+    action = input(f"Action ({'/'.join(vm_qmp.ACTIONS)}): ").strip().lower()
+    if action not in vm_qmp.ACTIONS:
+        print("Invalid action.")
+        return
+    results = vm_qmp.control(targets, action)
+    for name, result in results.items():
+        if isinstance(result, Exception):
+            print(f"- {name}: FAILED: {result}")
+        elif action == "status":
+            print(f"- {name}: {result.get('status')}")
+        elif action == "blockstats":
+            print(f"- {name}:")
+            for device, rd, wr, rd_ops, wr_ops in vm_qmp.summarize_blockstats(result):
+                print(f"    {device:<12} read {rd / 1e6:10.1f} MB ({rd_ops} ops)  "
+                      f"written {wr / 1e6:10.1f} MB ({wr_ops} ops)")
+        elif action == "cpus":
+            threads = ", ".join(f"cpu{c.get('cpu-index')}: thread {c.get('thread-id')}" for c in result)
+            print(f"- {name}: {len(result)} vCPU(s)  {threads}")
+        else:
+            print(f"- {name}: {action} sent")
+
+
+@instrumentation.timed
+def manage_base_images():
+    print("\n=== Base Images (linked clones) ===")
+    catalog = vm_images.BaseCatalog()
+    bases = catalog.list()
+    if bases:
+        for base in bases:
+            users = len(catalog.dependents(base.path))
+            print(f"- {base.name}: {base.path} ({base.format}, {base.virtual_size / 2**30:.1f} GiB, "
+                  f"used by {users} VM(s))")
+    else:
+        print("No base images registered.")
+
+    print("1. Add base image")
+    print("2. Remove base image")
+    print("0. Back")
+    choice = input("Choice: ").strip()
+
+    if choice == "1":
+        name = input("Base image name: ").strip()
+        path = input("Disk image path (qcow2 or raw): ").strip()
+        if not name or not path:
+            print("Name and path are required.")
+            return
+        try:
+            base = catalog.add(name, path)
+        except (vm_images.CatalogError, OSError) as e:
+            print(f"Failed to add base image: {e}")
+            return
+        print(f"Base image '{base.name}' added ({base.format}); it is now read-only.")
+    elif choice == "2":
+        name = input("Base image name to remove: ").strip()
+        delete_file = input("Also delete the image file? (y/n): ").strip().lower() == "y"
+        try:
+            catalog.remove(name, delete_file=delete_file)
+        except vm_images.CatalogError as e:
+            print(f"Cannot remove base image: {e}")
+            return
+        print(f"Base image '{name}' removed.")
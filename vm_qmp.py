@@ -0,0 +1,221 @@
+# QMP (QEMU Machine Protocol) control of running VMs.
+# Every VM is launched with a QMP unix socket (see vm_runtime.launch). QmpClient
+# is an asyncio client for it: one reader task matches replies to commands by
+# "id" (so commands can be in flight together) and keeps asynchronous events
+# such as POWERDOWN/STOP/RESUME. run_many() sends a command to many VMs on one
+# event loop, and the sync helpers below wrap it for the menu.
+
+import asyncio
+import itertools
+import json
+import time
+
+import instrumentation
+import vm_runtime
+
+COMMAND_TIMEOUT = 5.0
+POWERDOWN_TIMEOUT = 60.0
+DEFAULT_CONCURRENCY = 32
+
+# Menu actions -> QMP commands
+ACTIONS = {
+    "status": "query-status",
+    "pause": "stop",
+    "resume": "cont",
+    "powerdown": "system_powerdown",
+    "blockstats": "query-blockstats",
+    "cpus": "query-cpus-fast",
+}
+
+
+class QmpError(Exception):
+    # An error reply from QEMU ({"error": {"class": ..., "desc": ...}}) or a broken connection.
+
+    def __init__(self, message, error_class=None):
+        super().__init__(message)
+        self.error_class = error_class
+
+
+class QmpClient:
+    # One QMP connection; use `async with QmpClient(path) as qmp: await qmp.execute("query-status")`.
+
+    def __init__(self, path, timeout=COMMAND_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.greeting = None
+        self.events = []
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._reader = self._writer = self._task = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(asyncio.open_unix_connection(self.path), self.timeout)
+        try:
+            self.greeting = await asyncio.wait_for(self._read(), self.timeout)
+            if self.greeting is None or "QMP" not in self.greeting:
+                raise QmpError(f"{self.path}: not a QMP socket")
+            self._task = asyncio.ensure_future(self._dispatch())
+            await self.execute("qmp_capabilities")
+        except BaseException:
+            await self.close()
+            raise
+        return self
+
+    async def _read(self):
+        line = await self._reader.readline()
+        if not line:
+            return None
+        return json.loads(line)
+
+    async def _dispatch(self):
+        # Route replies to the waiting execute() calls; everything else is an event.
+        error = QmpError("QMP connection closed")
+        try:
+            while True:
+                message = await self._read()
+                if message is None:
+                    break
+                if "event" in message:
+                    self.events.append(message)
+                    continue
+                future = self._pending.pop(message.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+        except (OSError, ValueError) as e:
+            error = QmpError(f"QMP connection failed: {e}")
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+
+    async def execute(self, command, arguments=None):
+        # Send one command and return its "return" value; raises QmpError on an error reply.
+        if self._task is None or self._task.done():
+            raise QmpError("QMP connection closed" if self._task else "not connected")
+        request_id = next(self._ids)
+        request = {"execute": command, "id": request_id}
+        if arguments:
+            request["arguments"] = arguments
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        with instrumentation.call("qmp", command):
+            try:
+                self._writer.write(json.dumps(request).encode() + b"\n")
+                await self._writer.drain()
+                reply = await asyncio.wait_for(future, self.timeout)
+            finally:
+                self._pending.pop(request_id, None)
+            if "error" in reply:
+                error = reply["error"]
+                raise QmpError(f"{command}: {error.get('desc', error)}", error.get("class"))
+        return reply.get("return")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+            self._writer = None
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def status(self):
+        # {"running": bool, "status": "running" | "paused" | "shutdown" | ...}
+        return await self.execute("query-status")
+
+    async def pause(self):
+        return await self.execute("stop")
+
+    async def resume(self):
+        return await self.execute("cont")
+
+    async def powerdown(self):
+        # ACPI power button: the guest OS shuts itself down
+        return await self.execute("system_powerdown")
+
+    async def blockstats(self):
+        return await self.execute("query-blockstats")
+
+    async def cpus(self):
+        return await self.execute("query-cpus-fast")
+
+
+def socket_path(name):
+    # The VM's QMP socket as recorded at launch (or the default location)
+    return vm_runtime.state(name).qmp or vm_runtime.qmp_socket(name)
+
+
+async def run_many(names, command, arguments=None, concurrency=DEFAULT_CONCURRENCY, timeout=COMMAND_TIMEOUT,
+                   paths=None):
+    # Send `command` to every VM in `names` on this event loop; returns name -> result or exception.
+    limit = asyncio.Semaphore(max(1, concurrency))
+    paths = paths or {}
+
+    async def one(name):
+        async with limit:
+            path = paths.get(name) or socket_path(name)
+            if not path:
+                return QmpError(f"VM '{name}' has no QMP socket")
+            try:
+                async with QmpClient(path, timeout) as qmp:
+                    return await qmp.execute(command, arguments)
+            except (OSError, ValueError, QmpError, asyncio.TimeoutError) as e:
+                return e if isinstance(e, QmpError) else QmpError(f"VM '{name}': {str(e) or type(e).__name__}")
+
+    results = await asyncio.gather(*(one(name) for name in names))
+    return dict(zip(names, results))
+
+
+def control(names, action, arguments=None, concurrency=DEFAULT_CONCURRENCY, timeout=COMMAND_TIMEOUT):
+    # Run a menu action (see ACTIONS) or any QMP command on many VMs with one event loop.
+    return asyncio.run(run_many(list(names), ACTIONS.get(action, action), arguments, concurrency, timeout))
+
+
+def statuses(names, timeout=1.0):
+    # name -> QMP run state ("running", "paused", ...) for the VMs that answered
+    if not names:
+        return {}
+    results = asyncio.run(run_many(list(names), "query-status", timeout=timeout))
+    return {name: r.get("status") for name, r in results.items() if isinstance(r, dict)}
+
+
+def summarize_blockstats(stats):
+    # [(device, read bytes, written bytes, read ops, write ops)] from a query-blockstats reply
+    rows = []
+    for entry in stats or []:
+        s = entry.get("stats", {})
+        device = entry.get("device") or entry.get("qdev") or entry.get("node-name") or "?"
+        rows.append((device, s.get("rd_bytes", 0), s.get("wr_bytes", 0),
+                     s.get("rd_operations", 0), s.get("wr_operations", 0)))
+    return rows
+
+
+def shutdown(name, timeout=POWERDOWN_TIMEOUT, poll=0.2):
+    # Graceful stop: ACPI powerdown over QMP, then SIGTERM if the guest ignores it or there is no QMP.
+    # Returns "stopped" (was not running), "powered off", "terminated" or "failed".
+    vm = vm_runtime.state(name)
+    if not vm.running:
+        vm_runtime.forget(name)
+        return "stopped"
+    result = control([name], "powerdown")[name]
+    if not isinstance(result, Exception):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not vm_runtime.pid_alive(vm.pid, name):
+                vm_runtime.forget(name)
+                return "powered off"
+            time.sleep(poll)
+    return "terminated" if vm_runtime.stop(name) else "failed"
@@ -0,0 +1,293 @@
+# Registry of the VMs this tool manages.
+# One SQLite database in the data directory (not the working directory) records each
+# VM's disk (absolute path), resources, base image and where it was created from.
+# create/delete write to it in transactions, list_vms reads it instead of scanning
+# the current directory for *.qcow2, and queries by name pattern, state, RAM or CPU
+# count use indexes. reconcile() compares the registry with the disks on disk.
+# External snapshots (files frozen by a live snapshot, see vm_snapshots.py) are
+# recorded here too, so they are neither orphans nor forgotten on delete.
+
+import fnmatch
+import os
+import re
+import sqlite3
+import time
+
+import app_paths
+import vm_images
+import vm_runtime
+
+STATES = ("stopped", "running")
+
+
+class RegistryError(Exception):
+    pass
+
+
+class VmRecord:
+    __slots__ = ("name", "disk", "ram_mb", "cpus", "disk_size", "base", "origin", "state", "created_at", "updated_at")
+
+    def __init__(self, name, disk, ram_mb, cpus, disk_size=None, base=None, origin="interactive",
+                 state="stopped", created_at=None, updated_at=None):
+        self.name = name
+        self.disk = disk
+        self.ram_mb = ram_mb
+        self.cpus = cpus
+        self.disk_size = disk_size
+        self.base = base
+        self.origin = origin
+        self.state = state
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+
+_COLUMNS = ", ".join(VmRecord.__slots__)
+
+
+def parse_ram(value):
+    # RAM in MB from "2048", "512M" or "2G"; raises ValueError for anything else
+    match = re.fullmatch(r"\s*(\d+)\s*([mMgG]?)[bB]?\s*", str(value))
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"invalid RAM size {value!r} (use MB, e.g. 1024, or a M/G suffix)")
+    return int(match.group(1)) * (1024 if match.group(2).lower() == "g" else 1)
+
+
+def parse_cpus(value):
+    try:
+        cpus = int(str(value).strip())
+    except ValueError:
+        cpus = 0
+    if cpus < 1:
+        raise ValueError(f"invalid CPU count {value!r}")
+    return cpus
+
+
+class VmRegistry:
+    # VMs created through the menu, keyed by name.
+
+    def __init__(self, path=None, clock=time.time):
+        self.path = path or app_paths.data_path("vms.sqlite3", create=False)
+        self.clock = clock
+
+    def _connect(self, create):
+        if not create and not os.path.isfile(self.path):
+            return None
+        app_paths.ensure_dir(os.path.dirname(os.path.abspath(self.path)))
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS vms ("
+            " name TEXT PRIMARY KEY, disk TEXT NOT NULL UNIQUE, ram_mb INTEGER NOT NULL, cpus INTEGER NOT NULL,"
+            " disk_size TEXT, base TEXT, origin TEXT NOT NULL, state TEXT NOT NULL,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS vms_state ON vms (state)")
+        conn.execute("CREATE INDEX IF NOT EXISTS vms_ram ON vms (ram_mb)")
+        conn.execute("CREATE INDEX IF NOT EXISTS vms_cpus ON vms (cpus)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            " vm TEXT NOT NULL, tag TEXT NOT NULL, file TEXT NOT NULL, created_at REAL NOT NULL,"
+            " PRIMARY KEY (vm, tag))"
+        )
+        return conn
+
+    def _select(self, where="", args=()):
+        conn = self._connect(create=False)
+        if conn is None:
+            return []
+        rows = conn.execute(f"SELECT {_COLUMNS} FROM vms {where} ORDER BY name", args).fetchall()
+        conn.close()
+        return [VmRecord(*row) for row in rows]
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def add(self, record):
+        # Insert a new VM; raises RegistryError if the name or disk is already registered.
+        now = self.clock()
+        record.disk = os.path.abspath(record.disk)
+        record.created_at = record.created_at or now
+        record.updated_at = now
+        conn = self._connect(create=True)
+        try:
+            with conn:
+                conn.execute(f"INSERT INTO vms ({_COLUMNS}) VALUES ({', '.join('?' * len(VmRecord.__slots__))})",
+                             tuple(getattr(record, slot) for slot in VmRecord.__slots__))
+        except sqlite3.IntegrityError:
+            raise RegistryError(f"VM '{record.name}' or disk {record.disk} is already registered")
+        finally:
+            conn.close()
+        return record
+
+    def get(self, name):
+        rows = self._select("WHERE name = ?", (name,))
+        return rows[0] if rows else None
+
+    def by_disk(self, disk):
+        rows = self._select("WHERE disk = ?", (os.path.abspath(disk),))
+        return rows[0] if rows else None
+
+    def remove(self, name):
+        conn = self._connect(create=False)
+        if conn is None:
+            return False
+        with conn:
+            removed = conn.execute("DELETE FROM vms WHERE name = ?", (name,)).rowcount
+            conn.execute("DELETE FROM snapshots WHERE vm = ?", (name,))
+        conn.close()
+        return bool(removed)
+
+    def set_disk(self, name, disk):
+        # Point a VM at a new active disk (after a live snapshot or a restore)
+        conn = self._connect(create=True)
+        with conn:
+            conn.execute("UPDATE vms SET disk = ?, updated_at = ? WHERE name = ?",
+                         (os.path.abspath(disk), self.clock(), name))
+        conn.close()
+
+    def set_origin(self, name, origin):
+        # Relabel where a VM came from (a warm-pool member once it is handed out)
+        conn = self._connect(create=True)
+        with conn:
+            conn.execute("UPDATE vms SET origin = ?, updated_at = ? WHERE name = ?", (origin, self.clock(), name))
+        conn.close()
+
+    def add_snapshot(self, name, tag, file):
+        conn = self._connect(create=True)
+        try:
+            with conn:
+                conn.execute("INSERT INTO snapshots (vm, tag, file, created_at) VALUES (?, ?, ?, ?)",
+                             (name, tag, os.path.abspath(file), self.clock()))
+        except sqlite3.IntegrityError:
+            raise RegistryError(f"VM '{name}' already has a snapshot '{tag}'")
+        finally:
+            conn.close()
+
+    def snapshots(self, name=None):
+        # [(vm, tag, file, created_at)] of external snapshots, oldest first
+        conn = self._connect(create=False)
+        if conn is None:
+            return []
+        sql = "SELECT vm, tag, file, created_at FROM snapshots"
+        rows = conn.execute(sql + (" WHERE vm = ?" if name else "") + " ORDER BY created_at, tag",
+                            (name,) if name else ()).fetchall()
+        conn.close()
+        return rows
+
+    def remove_snapshot(self, name, tag):
+        conn = self._connect(create=False)
+        if conn is None:
+            return
+        with conn:
+            conn.execute("DELETE FROM snapshots WHERE vm = ? AND tag = ?", (name, tag))
+        conn.close()
+
+    def set_state(self, name, state):
+        conn = self._connect(create=False)
+        if conn is None:
+            return
+        with conn:
+            conn.execute("UPDATE vms SET state = ?, updated_at = ? WHERE name = ? AND state != ?",
+                         (state, self.clock(), name, state))
+        conn.close()
+
+    def query(self, name=None, state=None, min_ram=None, max_ram=None, min_cpus=None, max_cpus=None, base=None):
+        # Registered VMs matching every given filter; `name` may be a shell-style pattern (web-*).
+        clauses, args = [], []
+        if name:
+            if any(c in name for c in "*?["):
+                # GLOB keeps the name index usable for prefix patterns
+                clauses.append("name GLOB ?")
+            else:
+                clauses.append("name = ?")
+            args.append(name)
+        for column, op, value in (("state", "=", state), ("base", "=", base),
+                                  ("ram_mb", ">=", min_ram), ("ram_mb", "<=", max_ram),
+                                  ("cpus", ">=", min_cpus), ("cpus", "<=", max_cpus)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                args.append(value)
+        return self._select("WHERE " + " AND ".join(clauses) if clauses else "", args)
+
+    def refresh_states(self, records=None):
+        # Bring the stored running/stopped state in line with the VM processes; returns the records.
+        records = self.query() if records is None else records
+        for record in records:
+            actual = "running" if vm_runtime.state(record.name).running else "stopped"
+            if actual != record.state:
+                self.set_state(record.name, actual)
+                record.state = actual
+        return records
+
+
+_FILTER = re.compile(r"(name|state|base|ram|cpus?)\s*(>=|<=|=)\s*(\S+)$")
+
+
+def parse_filter(text):
+    # "name=web-* state=running ram>=2048 cpus>=2" -> VmRegistry.query() keyword arguments
+    kwargs = {}
+    for token in text.split():
+        match = _FILTER.match(token)
+        if not match:
+            raise ValueError(f"unrecognised filter {token!r}")
+        key, op, value = match.groups()
+        if key in ("name", "state", "base"):
+            if op != "=":
+                raise ValueError(f"{key} only supports '='")
+            if key == "state" and value not in STATES:
+                raise ValueError(f"state must be one of: {', '.join(STATES)}")
+            kwargs[key] = value
+            continue
+        number = parse_ram(value) if key == "ram" else parse_cpus(value)
+        field = "ram" if key == "ram" else "cpus"
+        if op in (">=", "="):
+            kwargs[f"min_{field}"] = number
+        if op in ("<=", "="):
+            kwargs[f"max_{field}"] = number
+    return kwargs
+
+
+class ReconcileReport:
+    __slots__ = ("missing", "orphans", "state_fixes")
+
+    def __init__(self, missing, orphans, state_fixes):
+        self.missing = missing          # VmRecords whose disk no longer exists
+        self.orphans = orphans          # absolute paths of unregistered *.qcow2 disks
+        self.state_fixes = state_fixes  # names whose stored state was corrected
+
+    def clean(self):
+        return not (self.missing or self.orphans)
+
+
+def reconcile(registry, search_dirs=(".",), catalog=None):
+    # Compare the registry with the disks in search_dirs and the directories of registered disks.
+    catalog = catalog or vm_images.BaseCatalog()
+    records = registry.query()
+    before = {r.name: r.state for r in records}
+    registry.refresh_states(records)
+    state_fixes = [r.name for r in records if before[r.name] != r.state]
+
+    missing = [r for r in records if not os.path.isfile(r.disk)]
+    known = {r.disk for r in records} | set(catalog.by_path()) | {row[2] for row in registry.snapshots()}
+    for record in records:
+        known.update(vm_images.backing_chain(record.disk))
+    dirs = {os.path.abspath(d) for d in search_dirs} | {os.path.dirname(r.disk) for r in records}
+    orphans = set()
+    for directory in dirs:
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in fnmatch.filter(names, "*.qcow2"):
+            path = os.path.join(directory, name)
+            if path not in known and os.path.isfile(path):
+                orphans.add(path)
+    return ReconcileReport(missing, sorted(orphans), state_fixes)
+
+
+def adopt(registry, disk, ram_mb=1024, cpus=1, catalog=None):
+    # Register an orphaned disk under its file name (so `web.qcow2` becomes VM `web`).
+    name = os.path.splitext(os.path.basename(disk))[0]
+    backing = vm_images.backing_file(disk)
+    bases = (catalog or vm_images.BaseCatalog()).by_path()
+    base = bases[backing].name if backing in bases else None
+    return registry.add(VmRecord(name, disk, ram_mb, cpus, base=base, origin="adopted"))
@@ -0,0 +1,249 @@
+# Background VM processes.
+# VMs are launched with `-daemonize -pidfile`: qemu forks into the background once
+# the guest is set up, so the menu returns immediately and launch errors are still
+# reported. KVM is used when /dev/kvm is usable, otherwise TCG (with a warning);
+# disks and NICs are virtio. Each running VM has a pidfile and a small JSON state
+# file in <data dir>/run/, which is what list_vms reads to show running/stopped,
+# PID and uptime. A PID only counts as running if that process is still a qemu for
+# the same VM (PIDs get reused). Each VM also gets a QMP control socket
+# (<name>.qmp) that vm_qmp.py talks to.
+
+import json
+import os
+import signal
+import subprocess
+import time
+
+import app_paths
+import vm_images
+
+KVM_DEVICE = "/dev/kvm"
+STOP_TIMEOUT = 30.0
+# sun_path is 108 bytes on Linux (104 on BSD/macOS)
+MAX_SOCKET_PATH = 100
+
+
+class LaunchError(Exception):
+    pass
+
+
+def qemu_binary():
+    return os.environ.get("CMS_QEMU", "qemu-system-x86_64")
+
+
+def run_dir(create=True):
+    path = os.path.join(app_paths.data_dir(create=False), "run")
+    if create:
+        app_paths.ensure_dir(path)
+    return path
+
+
+def _paths(name, create=False):
+    base = os.path.join(run_dir(create), name)
+    return base + ".pid", base + ".json", base + ".log"
+
+
+def qmp_socket(name):
+    # QMP socket path for a VM, or None if the data directory is too deep for a unix socket path
+    path = os.path.join(run_dir(create=False), name + ".qmp")
+    return path if len(path.encode()) <= MAX_SOCKET_PATH else None
+
+
+def kvm_available(device=KVM_DEVICE):
+    return os.access(device, os.R_OK | os.W_OK)
+
+
+def accel_args(kvm=None):
+    # (qemu arguments, accelerator name)
+    if kvm is None:
+        kvm = kvm_available()
+    if kvm:
+        return ["-accel", "kvm", "-cpu", "host"], "kvm"
+    return ["-accel", "tcg"], "tcg"
+
+
+def _opt(value):
+    # qemu option values escape commas by doubling them
+    return str(value).replace(",", ",,")
+
+
+def launch_command(name, ram, cpu, disk_file, accel, pidfile, logfile, qemu=None, qmp=None, ephemeral=False):
+    try:
+        fmt = vm_images.read_header(disk_file)["format"]
+    except OSError:
+        fmt = "qcow2"
+    control = ["-qmp", f"unix:{_opt(qmp)},server=on,wait=off"] if qmp else []
+    return [
+        qemu or qemu_binary(),
+        "-name", name,
+        "-m", str(ram),
+        "-smp", str(cpu),
+        *accel,
+        "-drive", f"file={_opt(os.path.abspath(disk_file))},if=virtio,format={fmt},discard=unmap",
+        "-netdev", "user,id=net0",
+        "-device", "virtio-net-pci,netdev=net0",
+        "-display", "none",
+        "-vnc", "127.0.0.1:0,to=99",
+        "-serial", f"file:{_opt(logfile)}",
+        *control,
+        # -snapshot: writes go to a temporary overlay that is discarded when qemu exits
+        *(["-snapshot"] if ephemeral else []),
+        "-daemonize",
+        "-pidfile", pidfile,
+    ]
+
+
+class VmState:
+    __slots__ = ("name", "pid", "running", "started_at", "accel", "disk", "ram", "cpu", "qmp", "ephemeral")
+
+    def __init__(self, name, pid=None, running=False, started_at=None, accel=None, disk=None, ram=None, cpu=None,
+                 qmp=None, ephemeral=False):
+        self.name = name
+        self.pid = pid
+        self.running = running
+        self.started_at = started_at
+        self.accel = accel
+        self.disk = disk
+        self.ram = ram
+        self.cpu = cpu
+        self.qmp = qmp
+        self.ephemeral = ephemeral
+
+    def uptime(self, now=None):
+        if not self.running or self.started_at is None:
+            return None
+        return max(0.0, (now or time.time()) - self.started_at)
+
+    def describe(self, now=None):
+        if not self.running:
+            return "stopped"
+        ephemeral = ", ephemeral" if self.ephemeral else ""
+        return f"running (PID {self.pid}, up {format_uptime(self.uptime(now))}, {self.accel}{ephemeral})"
+
+
+def format_uptime(seconds):
+    seconds = int(seconds or 0)
+    days, rest = divmod(seconds, 86400)
+    hours, rest = divmod(rest, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if days:
+        return f"{days}d {hours}h"
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    return f"{minutes}m {seconds:02d}s"
+
+
+def _read_pid(pidfile):
+    try:
+        with open(pidfile) as f:
+            return int(f.read().strip() or 0) or None
+    except (OSError, ValueError):
+        return None
+
+
+def pid_alive(pid, name=None):
+    # True if pid is a live (non-zombie) process, and when /proc is available, a qemu for `name`.
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            if f.read().rsplit(")", 1)[-1].split()[0] == "Z":
+                return False
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            args = f.read().split(b"\0")
+    except OSError:
+        return True  # no /proc: trust the signal check
+    return name is None or name.encode() in args
+
+
+def launch(name, ram, cpu, disk_file, kvm=None, qemu=None, ephemeral=False):
+    # Start the VM in the background; returns its VmState or raises LaunchError.
+    # An ephemeral VM runs with -snapshot: all disk writes are thrown away when it exits.
+    pidfile, statefile, logfile = _paths(name, create=True)
+    current = state(name)
+    if current.running:
+        raise LaunchError(f"VM '{name}' is already running (PID {current.pid})")
+    qmp = qmp_socket(name)
+    for stale in (pidfile, statefile, qmp):
+        try:
+            if stale:
+                os.remove(stale)
+        except FileNotFoundError:
+            pass
+    accel, accel_name = accel_args(kvm)
+    cmd = launch_command(name, ram, cpu, disk_file, accel, pidfile, logfile, qemu, qmp, ephemeral)
+    # stderr goes to a file rather than a pipe: the daemonized child must not keep the pipe open
+    errfile = os.path.splitext(logfile)[0] + ".err"
+    try:
+        with open(errfile, "w") as err:
+            result = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=err)
+    except FileNotFoundError:
+        raise LaunchError(f"{cmd[0]} not found. Please install QEMU.")
+    if result.returncode != 0:
+        with open(errfile) as err:
+            message = err.read().strip()
+        raise LaunchError(message or f"{cmd[0]} exited with {result.returncode}")
+    pid = _read_pid(pidfile)
+    if pid is None:
+        raise LaunchError(f"{cmd[0]} did not write its pidfile")
+    vm = VmState(name, pid, True, time.time(), accel_name, os.path.abspath(disk_file), str(ram), str(cpu), qmp,
+                 ephemeral)
+    with open(statefile, "w") as f:
+        json.dump({slot: getattr(vm, slot) for slot in VmState.__slots__ if slot != "running"}, f)
+    return vm
+
+
+def state(name):
+    # Current VmState of a VM from its pidfile/state file (stopped if none or the process is gone).
+    pidfile, statefile, _ = _paths(name)
+    try:
+        with open(statefile) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    pid = _read_pid(pidfile) or data.get("pid")
+    running = bool(pid) and pid_alive(pid, name)
+    data.update(name=name, pid=pid if running else None, running=running)
+    return VmState(**{k: v for k, v in data.items() if k in VmState.__slots__})
+
+
+def states():
+    # name -> VmState for every VM with runtime files
+    try:
+        names = {f.rsplit(".", 1)[0] for f in os.listdir(run_dir(create=False)) if f.endswith((".pid", ".json"))}
+    except OSError:
+        return {}
+    return {name: state(name) for name in sorted(names)}
+
+
+def stop(name, timeout=STOP_TIMEOUT, sig=signal.SIGTERM):
+    # Terminate a running VM and wait for it to exit; returns True once it is gone.
+    vm = state(name)
+    if not vm.running:
+        forget(name)
+        return True
+    try:
+        os.kill(vm.pid, sig)
+    except ProcessLookupError:
+        pass
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not pid_alive(vm.pid, name):
+            forget(name)
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def forget(name):
+    pidfile, statefile, _ = _paths(name)
+    for path in (pidfile, statefile, qmp_socket(name)):
+        if path and os.path.lexists(path) and not os.path.isdir(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
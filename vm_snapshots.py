@@ -0,0 +1,178 @@
+# VM snapshots.
+# A stopped VM gets internal qcow2 snapshots (`qemu-img snapshot -c/-a/-d`). They
+# live inside the disk image, and restoring one only switches the image's metadata,
+# so it takes well under a second however much the guest has written. qemu-img must
+# not touch the disk of a running VM, so a live snapshot is external instead: QMP
+# `blockdev-snapshot-sync` freezes the current disk file and the VM carries on
+# writing to a new overlay on top of it. Restoring an external snapshot drops the
+# VM's current overlay and gives it a fresh empty overlay on the frozen file. Frozen
+# files are recorded in the VM registry. Both kinds share one tag namespace per VM.
+
+import json
+import os
+import re
+import subprocess
+import time
+
+import vm_images
+import vm_qmp
+import vm_registry
+import vm_runtime
+
+# QEMU names the first `-drive if=virtio` "virtio0"
+DRIVE_ID = "virtio0"
+
+_TAG = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]*")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class Snapshot:
+    __slots__ = ("tag", "kind", "file", "created_at", "vm_state_size")
+
+    def __init__(self, tag, kind, file, created_at=None, vm_state_size=0):
+        self.tag = tag
+        self.kind = kind
+        self.file = file
+        self.created_at = created_at
+        self.vm_state_size = vm_state_size
+
+
+def _qemu_img(args):
+    try:
+        result = subprocess.run(["qemu-img", *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    except FileNotFoundError:
+        raise SnapshotError("qemu-img not found. Please install QEMU.")
+    if result.returncode != 0:
+        raise SnapshotError(result.stderr.strip() or f"qemu-img {args[0]} exited with {result.returncode}")
+    return result.stdout
+
+
+def internal_snapshots(disk):
+    # Snapshots stored inside a qcow2 image; -U reads it even while a VM has it open.
+    info = json.loads(_qemu_img(["info", "--output=json", "-U", disk]) or "{}")
+    return [Snapshot(s["name"], "internal", disk, s.get("date-sec"), s.get("vm-state-size", 0))
+            for s in info.get("snapshots", [])]
+
+
+def _record(name, registry):
+    record = registry.get(name)
+    if record is None:
+        raise SnapshotError(f"VM '{name}' is not in the VM registry")
+    return record
+
+
+def list_snapshots(name, registry=None):
+    # Internal and external snapshots of a registered VM, oldest first.
+    registry = registry or vm_registry.VmRegistry()
+    record = _record(name, registry)
+    snapshots = internal_snapshots(record.disk) if os.path.isfile(record.disk) else []
+    snapshots += [Snapshot(tag, "external", file, created_at) for _, tag, file, created_at in registry.snapshots(name)]
+    return sorted(snapshots, key=lambda s: s.created_at or 0)
+
+
+def _find(name, tag, registry):
+    for snapshot in list_snapshots(name, registry):
+        if snapshot.tag == tag:
+            return snapshot
+    raise SnapshotError(f"VM '{name}' has no snapshot '{tag}'")
+
+
+def _next_overlay(record):
+    # <disk dir>/<name>.<n>.qcow2 for the first unused n
+    stem = os.path.join(os.path.dirname(record.disk), record.name)
+    n = 1
+    while os.path.lexists(f"{stem}.{n}.qcow2"):
+        n += 1
+    return f"{stem}.{n}.qcow2"
+
+
+def _discard(disk, registry, catalog):
+    # Delete a disk file unless a VM, a snapshot, a base image or another disk still uses it.
+    frozen = {row[2] for row in registry.snapshots()}
+    if disk in frozen or registry.by_disk(disk) is not None or disk in catalog.by_path():
+        return False
+    disks = [r.disk for r in registry.query()] + sorted(frozen)
+    if catalog.dependents(disk, search_dirs=(os.path.dirname(disk),), disks=disks):
+        return False
+    try:
+        os.remove(disk)
+    except FileNotFoundError:
+        pass
+    catalog.forget_overlay(disk)
+    return True
+
+
+def create(name, tag, registry=None):
+    # Snapshot a VM: internal (qemu-img) when it is stopped, external (QMP) when it is running.
+    registry = registry or vm_registry.VmRegistry()
+    record = _record(name, registry)
+    if not _TAG.fullmatch(tag):
+        raise SnapshotError(f"invalid snapshot tag '{tag}' (letters, digits, '.', '_' and '-')")
+    if any(s.tag == tag for s in list_snapshots(name, registry)):
+        raise SnapshotError(f"VM '{name}' already has a snapshot '{tag}'")
+    vm = vm_runtime.state(name)
+    if not vm.running:
+        _qemu_img(["snapshot", "-c", tag, record.disk])
+        return Snapshot(tag, "internal", record.disk, time.time())
+    if vm.ephemeral:
+        raise SnapshotError(f"VM '{name}' runs with -snapshot; its writes are discarded on exit")
+
+    overlay = _next_overlay(record)
+    result = vm_qmp.control([name], "blockdev-snapshot-sync",
+                            {"device": DRIVE_ID, "snapshot-file": overlay, "format": "qcow2"})[name]
+    if isinstance(result, Exception):
+        raise SnapshotError(f"live snapshot failed: {result}")
+    registry.add_snapshot(name, tag, record.disk)
+    registry.set_disk(name, overlay)
+    return Snapshot(tag, "external", record.disk, time.time())
+
+
+def restore(name, tag, registry=None, catalog=None):
+    # Return a stopped VM's disk to `tag`; returns the seconds it took.
+    started = time.perf_counter()
+    registry = registry or vm_registry.VmRegistry()
+    catalog = catalog or vm_images.BaseCatalog()
+    record = _record(name, registry)
+    snapshot = _find(name, tag, registry)
+    if vm_runtime.state(name).running:
+        raise SnapshotError(f"VM '{name}' is running; stop it before restoring a snapshot")
+    if snapshot.kind == "internal":
+        _qemu_img(["snapshot", "-a", tag, record.disk])
+    else:
+        overlay = _next_overlay(record)
+        fmt = vm_images.read_header(snapshot.file)["format"]
+        _qemu_img(["create", "-f", "qcow2", "-b", snapshot.file, "-F", fmt, overlay])
+        registry.set_disk(name, overlay)
+        # the writes made since the snapshot
+        _discard(record.disk, registry, catalog)
+    return time.perf_counter() - started
+
+
+def delete(name, tag, registry=None, catalog=None):
+    # Remove a snapshot; an external snapshot's file is deleted once nothing is layered on it.
+    registry = registry or vm_registry.VmRegistry()
+    catalog = catalog or vm_images.BaseCatalog()
+    record = _record(name, registry)
+    snapshot = _find(name, tag, registry)
+    if snapshot.kind == "external":
+        registry.remove_snapshot(name, tag)
+        if snapshot.file not in vm_images.backing_chain(record.disk):
+            _discard(snapshot.file, registry, catalog)
+    elif vm_runtime.state(name).running:
+        result = vm_qmp.control([name], "blockdev-snapshot-delete-internal-sync",
+                                {"device": DRIVE_ID, "name": tag})[name]
+        if isinstance(result, Exception):
+            raise SnapshotError(f"could not delete snapshot: {result}")
+    else:
+        _qemu_img(["snapshot", "-d", tag, record.disk])
+
+
+def remove_all(name, registry, catalog):
+    # Forget a VM's external snapshots and delete their files (newest first, so children go before parents).
+    files = [row[2] for row in registry.snapshots(name)]
+    for _, tag, _, _ in registry.snapshots(name):
+        registry.remove_snapshot(name, tag)
+    return [f for f in reversed(files) if _discard(f, registry, catalog)]
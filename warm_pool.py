@@ -0,0 +1,486 @@
+# Warm pools of ready-but-idle VMs and containers.
+# Each template keeps `size` members prepared ahead of time: a VM is a linked clone
+# of a base image, launched and then paused over QMP; a container is created but
+# not started. allocate() hands out a member with one resume/start call, then a
+# background thread refills the pool. If the pool is empty, the member is created
+# on the spot and counted as a miss. Idle members are labelled (container label
+# cms.pool, VM registry origin "pool:<template>"), so a restarted process adopts
+# them instead of creating new ones. Templates and sizes live in
+# <data dir>/warm_pools.json.
+
+import json
+import os
+import secrets
+import statistics
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import app_paths
+import docker_engine
+import docker_health
+import vm_images
+import vm_qmp
+import vm_registry
+import vm_runtime
+from docker_engine import EngineError, EngineUnavailable
+
+CONFIG_FILE = "warm_pools.json"
+POOL_LABEL = "cms.pool"
+KINDS = ("vm", "container")
+REFILL_WORKERS = 2
+RETRY_BACKOFF = 5.0
+# allocation latencies kept per template for the percentiles
+LATENCY_SAMPLES = 1000
+
+
+class PoolError(Exception):
+    pass
+
+
+class Template:
+    __slots__ = ("name", "kind", "size", "spec")
+
+    def __init__(self, name, kind, size, spec=None):
+        self.name = name
+        self.kind = kind
+        self.size = size
+        self.spec = spec or {}
+
+    def as_dict(self):
+        return {"name": self.name, "kind": self.kind, "size": self.size, **self.spec}
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        name, kind, size = data.pop("name", ""), data.pop("kind", ""), data.pop("size", 0)
+        if not name or kind not in KINDS:
+            raise PoolError(f"template needs a name and a kind ({'/'.join(KINDS)}): {data}")
+        if kind == "vm" and not data.get("base"):
+            raise PoolError(f"VM template '{name}' needs a base image")
+        if kind == "container" and not data.get("image"):
+            raise PoolError(f"container template '{name}' needs an image")
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            raise PoolError(f"template '{name}': size must be a number")
+        return cls(name, kind, max(0, size), data)
+
+
+def config_path():
+    return app_paths.data_path(CONFIG_FILE, create=False)
+
+
+def load_templates(path=None):
+    path = path or config_path()
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        data = json.load(f)
+    return [Template.from_dict(t) for t in data.get("templates", [])]
+
+
+def save_templates(templates, path=None):
+    path = path or app_paths.data_path(CONFIG_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"templates": [t.as_dict() for t in templates]}, f, indent=2)
+    os.replace(tmp, path)
+
+
+class VmProvisioner:
+    # Pool members are linked clones of a catalogued base, launched and paused.
+    kind = "vm"
+
+    def __init__(self, registry=None, catalog=None, disk_dir=None, kvm=None):
+        self.registry = registry or vm_registry.VmRegistry()
+        self.catalog = catalog or vm_images.BaseCatalog()
+        self.disk_dir = disk_dir
+        self.kvm = kvm
+
+    def create(self, template):
+        spec = template.spec
+        base = self.catalog.get(spec["base"])
+        if base is None:
+            raise PoolError(f"unknown base image '{spec['base']}'")
+        name = f"{template.name}-{secrets.token_hex(3)}"
+        disk_dir = self.disk_dir or app_paths.data_path("pool")
+        app_paths.ensure_dir(disk_dir)
+        disk = os.path.join(disk_dir, f"{name}.qcow2")
+        ram, cpu = spec.get("ram", "1024"), spec.get("cpu", "1")
+        try:
+            self.registry.add(vm_registry.VmRecord(name, disk, vm_registry.parse_ram(ram),
+                                                   vm_registry.parse_cpus(cpu), None, base.name,
+                                                   f"pool:{template.name}"))
+        except (vm_registry.RegistryError, ValueError) as e:
+            raise PoolError(str(e))
+        try:
+            result = subprocess.run(vm_images.overlay_command(disk, base), stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE, text=True)
+            if result.returncode != 0:
+                raise PoolError((result.stderr or "").strip() or "qemu-img failed")
+            self.catalog.record_overlay(disk, base)
+            try:
+                vm_runtime.launch(name, ram, cpu, disk, kvm=self.kvm)
+            except vm_runtime.LaunchError as e:
+                raise PoolError(str(e))
+            self.registry.set_state(name, "running")
+            # let the guest boot before it is frozen
+            time.sleep(float(spec.get("warmup", 0)))
+            paused = vm_qmp.control([name], "pause")[name]
+            if isinstance(paused, Exception):
+                raise PoolError(f"could not pause {name}: {paused}")
+        except BaseException:
+            self.destroy(template, name)
+            raise
+        return name
+
+    def activate(self, template, name):
+        resumed = vm_qmp.control([name], "resume")[name]
+        if isinstance(resumed, Exception):
+            raise PoolError(f"could not resume {name}: {resumed}")
+        self.registry.set_origin(name, f"pool-allocated:{template.name}")
+
+    def destroy(self, template, name):
+        record = self.registry.get(name)
+        vm_runtime.stop(name)
+        if record is not None:
+            try:
+                os.remove(record.disk)
+            except FileNotFoundError:
+                pass
+            self.catalog.forget_overlay(record.disk)
+        self.registry.remove(name)
+
+    def existing(self, template):
+        return [r.name for r in self.registry.query()
+                if r.origin == f"pool:{template.name}" and vm_runtime.state(r.name).running]
+
+
+class ContainerProvisioner:
+    # Pool members are created (not started) containers labelled cms.pool=<template>.
+    kind = "container"
+
+    def _cli(self, args):
+        try:
+            result = subprocess.run(["docker", *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        except FileNotFoundError:
+            raise PoolError("Docker CLI not found")
+        if result.returncode != 0:
+            raise PoolError(result.stderr.strip() or f"docker {args[0]} failed")
+        return result.stdout.strip()
+
+    def _engine(self):
+        # Engine API client when the socket backend is active, otherwise None (use the CLI)
+        return docker_engine.get_client()
+
+    def create(self, template):
+        spec = template.spec
+        command = spec.get("command") or []
+        if isinstance(command, str):
+            command = command.split()
+        env = [f"{k}={v}" for k, v in (spec.get("env") or {}).items()]
+        engine = self._engine()
+        if engine is not None:
+            config = {"Labels": {POOL_LABEL: template.name}, "Env": env}
+            if command:
+                config["Cmd"] = command
+            try:
+                try:
+                    return engine.create_container(spec["image"], None, config)["Id"]
+                except EngineError as e:
+                    if e.status != 404:
+                        raise
+                    for _ in engine.pull(spec["image"]):
+                        pass
+                    return engine.create_container(spec["image"], None, config)["Id"]
+            except EngineUnavailable:
+                docker_health.monitor().mark_down()
+            except EngineError as e:
+                raise PoolError(e.message)
+        args = ["create", "--label", f"{POOL_LABEL}={template.name}"]
+        for item in env:
+            args += ["--env", item]
+        return self._cli(args + [spec["image"], *command])
+
+    def activate(self, template, cid):
+        engine = self._engine()
+        if engine is not None:
+            try:
+                engine.start_container(cid)
+                return
+            except EngineUnavailable:
+                docker_health.monitor().mark_down()
+            except EngineError as e:
+                raise PoolError(e.message)
+        self._cli(["start", cid])
+
+    def destroy(self, template, cid):
+        engine = self._engine()
+        if engine is not None:
+            try:
+                engine.remove_container(cid, force=True)
+                return
+            except EngineUnavailable:
+                docker_health.monitor().mark_down()
+            except EngineError as e:
+                if e.status == 404:
+                    return
+                raise PoolError(e.message)
+        self._cli(["rm", "-f", cid])
+
+    def existing(self, template):
+        filters = {"label": [f"{POOL_LABEL}={template.name}"], "status": ["created"]}
+        engine = self._engine()
+        if engine is not None:
+            try:
+                return [c["Id"] for c in engine.containers(all=True, filters=filters)]
+            except EngineUnavailable:
+                docker_health.monitor().mark_down()
+            except EngineError:
+                return []
+        try:
+            out = self._cli(["ps", "-a", "--no-trunc", "--filter", f"label={POOL_LABEL}={template.name}",
+                             "--filter", "status=created", "--format", "{{.ID}}"])
+        except PoolError:
+            return []
+        return out.split()
+
+
+class Allocation:
+    __slots__ = ("template", "member", "hit", "latency")
+
+    def __init__(self, template, member, hit, latency):
+        self.template = template
+        self.member = member
+        self.hit = hit
+        self.latency = latency
+
+
+class _Counters:
+    __slots__ = ("hits", "misses", "latencies", "fills", "fill_seconds", "errors", "last_error", "retry_at")
+
+    def __init__(self):
+        self.hits = self.misses = self.fills = self.errors = 0
+        self.fill_seconds = 0.0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.last_error = ""
+        self.retry_at = 0.0
+
+
+class WarmPool:
+    # Keeps each template topped up to its size from a background thread.
+
+    def __init__(self, templates=(), provisioners=None, refill_workers=REFILL_WORKERS, clock=time.monotonic):
+        self.provisioners = provisioners or {"vm": VmProvisioner(), "container": ContainerProvisioner()}
+        self.clock = clock
+        self._templates = {}
+        self._ready = {}
+        self._inflight = {}
+        self._counters = {}
+        self._cond = threading.Condition()
+        self._workers = ThreadPoolExecutor(max_workers=max(1, refill_workers), thread_name_prefix="warm-pool")
+        self._thread = None
+        self._stopped = False
+        for template in templates:
+            self._add(template)
+
+    def _add(self, template):
+        self._templates[template.name] = template
+        self._ready.setdefault(template.name, deque())
+        self._inflight.setdefault(template.name, 0)
+        self._counters.setdefault(template.name, _Counters())
+
+    def templates(self):
+        with self._cond:
+            return list(self._templates.values())
+
+    def start(self, adopt=True):
+        # Adopt idle members left by an earlier run, then start refilling.
+        if adopt:
+            for template in self.templates():
+                try:
+                    members = self.provisioners[template.kind].existing(template)
+                except PoolError:
+                    members = []
+                with self._cond:
+                    self._ready[template.name].extend(m for m in members if m not in self._ready[template.name])
+        self._thread = threading.Thread(target=self._refill_loop, name="warm-pool", daemon=True)
+        self._thread.start()
+        return self
+
+    def _refill_loop(self):
+        with self._cond:
+            while not self._stopped:
+                now = self.clock()
+                wait = None
+                for name, template in self._templates.items():
+                    counters = self._counters[name]
+                    if counters.retry_at > now:
+                        wait = min(wait or RETRY_BACKOFF, counters.retry_at - now)
+                        continue
+                    deficit = template.size - len(self._ready[name]) - self._inflight[name]
+                    for _ in range(max(0, deficit)):
+                        self._inflight[name] += 1
+                        self._workers.submit(self._fill, template)
+                self._cond.wait(wait)
+
+    def _fill(self, template):
+        started = self.clock()
+        try:
+            member = self.provisioners[template.kind].create(template)
+        except Exception as e:
+            with self._cond:
+                self._inflight[template.name] -= 1
+                counters = self._counters[template.name]
+                counters.errors += 1
+                counters.last_error = str(e)
+                counters.retry_at = self.clock() + RETRY_BACKOFF
+                self._cond.notify_all()
+            return
+        with self._cond:
+            self._inflight[template.name] -= 1
+            counters = self._counters[template.name]
+            counters.fills += 1
+            counters.fill_seconds += self.clock() - started
+            current = self._templates.get(template.name)
+            keep = current is not None and len(self._ready[template.name]) < current.size and not self._stopped
+            if keep:
+                self._ready[template.name].append(member)
+            self._cond.notify_all()
+        if not keep:
+            # the pool shrank (or stopped) while this member was being made
+            self._destroy(template, member)
+
+    def _destroy(self, template, member):
+        try:
+            self.provisioners[template.kind].destroy(template, member)
+        except Exception:
+            pass
+
+    def allocate(self, name):
+        # Hand out a ready member (hit), or create one now (miss); the pool refills in the background.
+        started = self.clock()
+        with self._cond:
+            template = self._templates.get(name)
+            if template is None:
+                raise PoolError(f"no warm pool named '{name}'")
+        provisioner = self.provisioners[template.kind]
+        while True:
+            with self._cond:
+                member = self._ready[name].popleft() if self._ready[name] else None
+                self._cond.notify_all()
+            hit = member is not None
+            if member is None:
+                member = provisioner.create(template)
+            try:
+                provisioner.activate(template, member)
+                break
+            except PoolError:
+                # a stale member (VM died, container removed): throw it away and try the next one
+                self._destroy(template, member)
+                if not hit:
+                    raise
+        latency = self.clock() - started
+        with self._cond:
+            counters = self._counters[name]
+            if hit:
+                counters.hits += 1
+            else:
+                counters.misses += 1
+            counters.latencies.append(latency)
+        return Allocation(name, member, hit, latency)
+
+    def set_template(self, template):
+        # Add a template or change its size/spec; surplus idle members are destroyed.
+        with self._cond:
+            self._add(template)
+            surplus = []
+            while len(self._ready[template.name]) > template.size:
+                surplus.append(self._ready[template.name].pop())
+            self._cond.notify_all()
+        for member in surplus:
+            self._destroy(template, member)
+
+    def remove_template(self, name):
+        with self._cond:
+            template = self._templates.pop(name, None)
+            members = list(self._ready.pop(name, ()))
+            self._cond.notify_all()
+        if template is not None:
+            for member in members:
+                self._destroy(template, member)
+
+    def wait_ready(self, timeout=None):
+        # Block until every pool is full (True) or the timeout passes (False).
+        deadline = None if timeout is None else self.clock() + timeout
+        with self._cond:
+            while any(len(self._ready[n]) < t.size for n, t in self._templates.items()):
+                remaining = None if deadline is None else deadline - self.clock()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def stats(self):
+        # Per-template pool level, hit rate and allocation latency (ms).
+        rows = []
+        with self._cond:
+            for name, template in self._templates.items():
+                c = self._counters[name]
+                samples = sorted(c.latencies)
+                total = c.hits + c.misses
+                rows.append({
+                    "template": name, "kind": template.kind, "size": template.size,
+                    "ready": len(self._ready[name]), "filling": self._inflight[name],
+                    "hits": c.hits, "misses": c.misses, "hit_rate": c.hits / total if total else None,
+                    "p50_ms": statistics.median(samples) * 1000 if samples else None,
+                    "p95_ms": samples[max(0, int(len(samples) * 0.95) - 1)] * 1000 if samples else None,
+                    "max_ms": samples[-1] * 1000 if samples else None,
+                    "avg_fill_s": c.fill_seconds / c.fills if c.fills else None,
+                    "errors": c.errors, "last_error": c.last_error,
+                })
+        return rows
+
+    def stop(self, drain=False):
+        # Stop refilling; with drain=True the idle members are destroyed too.
+        with self._cond:
+            self._stopped = True
+            members = [(self._templates[n], m) for n, ready in self._ready.items() for m in ready] if drain else []
+            if drain:
+                for ready in self._ready.values():
+                    ready.clear()
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(5)
+        self._workers.shutdown(wait=True)
+        for template, member in members:
+            self._destroy(template, member)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared():
+    # The running process-wide pool, or None if it has not been started.
+    return _shared
+
+
+def start_shared(templates=None, provisioners=None):
+    # Start the process-wide pool from warm_pools.json (or the given templates).
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = WarmPool(load_templates() if templates is None else templates, provisioners).start()
+        return _shared
+
+
+def stop_shared(drain=False):
+    global _shared
+    with _shared_lock:
+        if _shared is not None:
+            _shared.stop(drain)
+            _shared = None